@@ -39,7 +39,7 @@ fi
 
 # 运行Python脚本
 echo "运行Python脚本..."
-python ./run_webui.py
+python ./run_server.py
 if [ $? -ne 0 ]; then
     echo "运行Python脚本失败，请检查脚本路径或代码。"
     exit 1
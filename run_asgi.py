@@ -0,0 +1,22 @@
+"""
+异步服务入口（部署在 nginx 之后）
+单个进程的事件循环处理调用 LLM 的对话接口，等待 Ollama 响应时不占用线程，可以同时保持大量流式对话；
+其余接口由 Flask 应用在线程池中处理。也可以直接使用 hypercorn 启动：hypercorn utils.webui.asgi_app:asgi_app
+"""
+import asyncio
+import os
+import sys
+
+# 添加项目根目录到 Python 路径
+project_root = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(project_root)
+from hypercorn.asyncio import serve
+from hypercorn.config import Config
+from utils.webui.asgi_app import asgi_app
+from utils.load_config import configs
+
+if __name__ == '__main__':
+    server_config = configs['webui']['server']
+    config = Config()
+    config.bind = [f"{server_config['host']}:{server_config['port']}"]
+    asyncio.run(serve(asgi_app, config))
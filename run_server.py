@@ -0,0 +1,79 @@
+"""
+生产环境服务入口（部署在 nginx 之后）
+使用 gunicorn 启动多个工作进程，每个工作进程以多线程处理请求：
+- preload 模式：主进程加载组件（默认只加载 rag：向量库段文件以 memmap 打开、CPU 上的模型权重）并与文档目录同步，
+  之后 fork 工作进程，模型权重与段文件页在进程间共享，不随工作进程数成倍占用内存
+- 非 preload 模式：每个工作进程各自加载组件（GPU 上的模型不能跨 fork 使用时），只有第一个工作进程执行启动同步
+- 工作进程通过进程间写锁共用同一向量库目录，检索前加载其他进程写入的修改；后台任务状态写入共享数据库
+Windows 或未安装 gunicorn 时退回 Flask 多线程服务器（单进程）
+"""
+import os
+import sys
+
+# 添加项目根目录到 Python 路径
+project_root = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(project_root)
+from utils.load_config import configs
+
+server_config = configs['webui']['server']
+
+try:
+    from gunicorn.app.base import BaseApplication
+except ImportError:
+    BaseApplication = None
+
+
+def _post_worker_init(worker):
+    """工作进程初始化完成后在后台预加载其余组件（preload 模式下已加载的组件不会重复加载）"""
+    from utils.webui.app import start_background_startup, startup_config
+    from utils.component_manager import warm_up
+    if not server_config.get('preload', True) and worker.age == 1:
+        start_background_startup()
+    elif startup_config.get('warmup', True):
+        warm_up(startup_config.get('components'))
+
+
+if BaseApplication is not None:
+    class StandaloneApplication(BaseApplication):
+        """以代码方式配置的 gunicorn 应用"""
+
+        def __init__(self, options):
+            self.options = options
+            super().__init__()
+
+        def load_config(self):
+            for key, value in self.options.items():
+                if key in self.cfg.settings and value is not None:
+                    self.cfg.set(key, value)
+
+        def load(self):
+            from utils.webui.app import app, preload_startup
+            # preload_app 时在主进程中执行一次，否则在每个工作进程中执行
+            if server_config.get('preload', True):
+                preload_startup(server_config.get('preload_components', ['rag']))
+            return app
+
+
+def main():
+    host, port = server_config['host'], server_config['port']
+    if BaseApplication is None or os.name == 'nt':
+        print("未安装 gunicorn 或当前平台不支持，使用 Flask 多线程服务器（单进程）")
+        from utils.webui.app import app, start_background_startup
+        start_background_startup()
+        app.run(host=host, port=port, debug=False, threaded=True)
+        return
+
+    options = {
+        'bind': f"{host}:{port}",
+        'workers': server_config.get('workers', 2),
+        'threads': server_config.get('threads', 8),
+        'worker_class': 'gthread',
+        'timeout': server_config.get('timeout', 300),
+        'preload_app': server_config.get('preload', True),
+        'post_worker_init': _post_worker_init,
+    }
+    StandaloneApplication(options).run()
+
+
+if __name__ == '__main__':
+    main()
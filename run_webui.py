@@ -4,9 +4,14 @@ import sys
 # 添加项目根目录到 Python 路径
 project_root = os.path.dirname(os.path.abspath(__file__))
 sys.path.append(project_root)
-from utils.webui.app import app
+from utils.webui.app import app, start_background_startup
 from utils.load_config import configs
 
 if __name__ == '__main__':
+    # 开发服务器（单进程）；生产环境使用 run_server.py
+    debug = configs['webui']['server']['debug']
+    # 调试模式下重载器的监控进程不处理请求，只在实际运行应用的子进程中预加载
+    if not debug or os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+        start_background_startup()
     # 启动应用
-    app.run(host=configs['webui']['server']['host'], port=configs['webui']['server']['port'], debug=configs['webui']['server']['debug'])
+    app.run(host=configs['webui']['server']['host'], port=configs['webui']['server']['port'], debug=debug)
@@ -0,0 +1,92 @@
+"""
+量化索引基准测试
+对比 flat（全精度暴力检索）与 sq8 / pq 量化索引的常驻内存、单次查询耗时和 recall@k
+（以 flat 的精确结果为基准；量化索引的全精度向量留在 memmap 段文件中，只读取候选行做精确重排）
+
+用法: python tests/bench_quantization.py --size 200000 --dim 1024 --pq-m 32,64,128 --rescore 1,8
+"""
+import argparse
+import tempfile
+import time
+import numpy as np
+from utils.rag.vector_store import VectorStore
+from utils.rag.vector_index import create_index
+
+
+def make_data(rng, size, dim, clusters=256):
+    """带聚类结构的合成向量（纯随机向量之间的相似度几乎相同，无法体现召回率差异）"""
+    centers = rng.standard_normal((clusters, dim)).astype(np.float32)
+    for start in range(0, size, 100000):
+        count = min(100000, size - start)
+        labels = rng.integers(0, clusters, count)
+        yield centers[labels] + 0.6 * rng.standard_normal((count, dim)).astype(np.float32)
+
+
+def recall_at_k(index, exact, queries, k):
+    hits = 0
+    for query, truth in zip(queries, exact):
+        ids, _ = index.search(query, k)
+        hits += len(set(ids.tolist()) & truth)
+    return hits / (len(queries) * k)
+
+
+def timeit(index, queries, k, repeat):
+    index.search(queries[0], k)  # 预热
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for query in queries:
+            index.search(query, k)
+    return (time.perf_counter() - start) / (repeat * len(queries)) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description="量化索引基准测试")
+    parser.add_argument('--size', type=int, default=200000, help="向量数量")
+    parser.add_argument('--dim', type=int, default=1024, help="向量维度")
+    parser.add_argument('--k', type=int, default=5, help="初始检索数量 initial_retrieval_k")
+    parser.add_argument('--queries', type=int, default=50, help="查询数量")
+    parser.add_argument('--repeat', type=int, default=2, help="重复次数")
+    parser.add_argument('--pq-m', default='32,64,128', help="乘积量化子空间数量，逗号分隔")
+    parser.add_argument('--rescore', default='1,8', help="重排倍数 rescore_factor，逗号分隔（1 表示几乎不重排）")
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    segment_dir = tempfile.TemporaryDirectory()
+    store = VectorStore(segment_dir.name, args.dim, metric='cosine', normalize=True, target_rows=args.size)
+    for vectors in make_data(rng, args.size, args.dim):
+        store.add(vectors)
+    store.wait_for_compaction()
+    # 查询取自数据点附近（存储中的向量已归一化，扰动的模长约为 0.5）
+    queries = store.get(rng.choice(args.size, args.queries, replace=False))
+    queries = queries + 0.5 / np.sqrt(args.dim) * rng.standard_normal(queries.shape).astype(np.float32)
+
+    flat = create_index('flat')
+    flat.build(store)
+    exact = [set(flat.search(query, args.k)[0].tolist()) for query in queries]
+    flat_bytes = args.size * args.dim * 4
+
+    print(f"{'索引':>18} | {'常驻内存 MB':>11} | {'压缩比':>6} | {'训练 s':>7} | {'ms/查询':>8} | recall@{args.k}")
+    print(f"{'flat':>18} | {flat_bytes / 2 ** 20:>11.1f} | {1:>5.0f}x | {0:>7.1f} | "
+          f"{timeit(flat, queries, args.k, args.repeat):>8.2f} | 1.000")
+
+    configs = [('sq8', {})] + [('pq', {'m': int(m)}) for m in args.pq_m.split(',')]
+    for index_type, params in configs:
+        index = create_index(index_type, params=dict(params, rescore_factor=1))
+        start = time.perf_counter()
+        index.build(store)
+        train_seconds = time.perf_counter() - start
+        memory = index.memory_bytes()
+        for factor in [int(f) for f in args.rescore.split(',')]:
+            index.rescore_factor = factor
+            name = f"{index_type}{params.get('m', '')} ×{factor}"
+            print(f"{name:>18} | {memory / 2 ** 20:>11.1f} | {flat_bytes / memory:>5.0f}x | {train_seconds:>7.1f} | "
+                  f"{timeit(index, queries, args.k, args.repeat):>8.2f} | "
+                  f"{recall_at_k(index, exact, queries, args.k):.3f}")
+        del index
+
+    del store
+    segment_dir.cleanup()
+
+
+if __name__ == '__main__':
+    main()
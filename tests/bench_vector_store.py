@@ -0,0 +1,82 @@
+"""
+向量检索微基准测试
+对比旧实现（float64 矩阵 + 每次查询计算模长 + 全量 argsort）
+与 VectorStore（归一化 float32 矩阵 + argpartition 部分选择）的单次查询耗时
+
+用法: python tests/bench_vector_store.py --sizes 100000,1000000 --dim 1024
+"""
+import argparse
+import tempfile
+import time
+import numpy as np
+from utils.rag.vector_store import VectorStore
+from utils.rag.vector_index import top_k_indices
+
+
+def old_search(query_vector, doc_vectors, k):
+    """旧版 Rag.retrieve_documents 的打分与排序方式"""
+    dot_products = np.dot(query_vector, doc_vectors.T).flatten()
+    query_norm = np.linalg.norm(query_vector)
+    doc_norms = np.linalg.norm(doc_vectors, axis=1)
+    similarities = dot_products / (query_norm * doc_norms)
+    indices = np.argsort(similarities)[::-1][:k]
+    return indices, similarities[indices]
+
+
+def new_search(query_vector, store, k):
+    scores = store.scores(query_vector)
+    indices = top_k_indices(scores, k)
+    return indices, scores[indices]
+
+
+def timeit(func, queries, repeat):
+    func(queries[0])  # 预热
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for query in queries:
+            func(query)
+    return (time.perf_counter() - start) / (repeat * len(queries)) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description="向量检索微基准测试")
+    parser.add_argument('--sizes', default='100000,1000000', help="向量数量，逗号分隔")
+    parser.add_argument('--dim', type=int, default=1024, help="向量维度")
+    parser.add_argument('--k', type=int, default=5, help="初始检索数量 initial_retrieval_k")
+    parser.add_argument('--queries', type=int, default=10, help="查询数量")
+    parser.add_argument('--repeat', type=int, default=3, help="重复次数")
+    parser.add_argument('--skip-old', action='store_true', help="跳过旧实现（其 float64 矩阵内存占用翻倍）")
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    queries = rng.standard_normal((args.queries, args.dim)).astype(np.float32)
+
+    print(f"{'向量数':>10} | {'旧实现 ms/查询':>14} | {'新实现 ms/查询':>14} | {'加速比':>6} | 结果一致")
+    for size in [int(s) for s in args.sizes.split(',')]:
+        segment_dir = tempfile.TemporaryDirectory()
+        store = VectorStore(segment_dir.name, args.dim, metric='cosine', normalize=True, target_rows=size)
+        # 分批生成，避免额外的大块临时内存
+        for start in range(0, size, 100000):
+            store.add(rng.standard_normal((min(100000, size - start), args.dim)).astype(np.float32))
+        store.wait_for_compaction()
+
+        new_ms = timeit(lambda q: new_search(q, store, args.k), queries, args.repeat)
+        if args.skip_old:
+            print(f"{size:>10} | {'-':>14} | {new_ms:>14.2f} | {'-':>6} | -")
+            del store
+            segment_dir.cleanup()
+            continue
+
+        old_vectors = store.vectors.astype(np.float64)
+        old_ms = timeit(lambda q: old_search(q.reshape(1, -1), old_vectors, args.k), queries, args.repeat)
+        same = all(
+            set(old_search(q.reshape(1, -1), old_vectors, args.k)[0]) == set(new_search(q, store, args.k)[0])
+            for q in queries
+        )
+        print(f"{size:>10} | {old_ms:>14.2f} | {new_ms:>14.2f} | {old_ms / new_ms:>5.1f}x | {same}")
+        del old_vectors, store
+        segment_dir.cleanup()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,138 @@
+"""
+pytest 公共配置（在项目根目录执行 python -m pytest tests）
+- 以基于词哈希的确定性编码器代替 FlagEmbedding 的嵌入与重排序模型，测试无需下载模型，也不需要 GPU
+- 摘要与查询增强不调用 Ollama，摘要直接取正文
+- tests/ 下的 test_rag.py、test_agent.py、test_raw.py 是需要交互输入或本地模型服务的脚本，不作为用例收集
+"""
+import copy
+import hashlib
+import sys
+import types
+from pathlib import Path
+import numpy as np
+import pytest
+
+DIMENSION = 16
+
+collect_ignore = ['test_rag.py', 'test_agent.py', 'test_raw.py']
+
+
+def embed_text(text: str) -> np.ndarray:
+    """词袋哈希向量：包含相同词的文本相似度更高（未归一化，归一化由 Rag / VectorStore 完成）"""
+    vector = np.zeros(DIMENSION, dtype=np.float32)
+    for token in str(text).lower().split():
+        digest = hashlib.md5(token.encode('utf-8')).digest()
+        vector += np.frombuffer(digest, dtype=np.uint8)[:DIMENSION].astype(np.float32) - 127.5
+    if not vector.any():
+        vector[0] = 1.0
+    return vector
+
+
+def write(directory: Path, name: str, paragraphs) -> Path:
+    """在文档目录中写入由空行分隔的段落组成的文本文件"""
+    path = directory / name
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text('\n\n'.join(paragraphs), encoding='utf-8')
+    return path
+
+
+def assert_aligned(rag) -> None:
+    """第 i 行向量由第 i 个文档块的“摘要 + 正文”编码而来，索引覆盖全部行"""
+    docs = list(rag.docs)
+    assert len(docs) == len(rag.vector_store) == rag.vector_index.ntotal
+    if not docs:
+        return
+    expected = np.stack([embed_text(rag._compose_vector_text(doc.get('chunk_summary'), doc['chunk_content']))
+                         for doc in docs])
+    expected /= np.linalg.norm(expected, axis=1, keepdims=True)
+    np.testing.assert_allclose(rag.vector_store.get(np.arange(len(docs))), expected, rtol=1e-5, atol=1e-6)
+
+
+def retrieved_files(results):
+    """检索结果来自的文件名集合"""
+    return {Path(doc['file_path']).name for doc in results}
+
+
+class StubFlagModel:
+    """FlagEmbedding.FlagModel 的替身"""
+
+    def __init__(self, *args, **kwargs):
+        self.calls = 0
+        self.encoded_texts = 0
+
+    def _encode(self, texts):
+        self.calls += 1
+        if isinstance(texts, str):
+            return embed_text(texts)
+        self.encoded_texts += len(texts)
+        return np.stack([embed_text(text) for text in texts])
+
+    def encode(self, texts, **kwargs):
+        return self._encode(texts)
+
+    def encode_corpus(self, texts, **kwargs):
+        return self._encode(texts)
+
+    def encode_queries(self, texts, **kwargs):
+        return self._encode(texts)
+
+
+class StubFlagReranker:
+    """FlagEmbedding.FlagReranker 的替身：按查询与文档共有的词数打分"""
+
+    def __init__(self, *args, **kwargs):
+        pass
+
+    def compute_score(self, pairs, **kwargs):
+        return [float(len(set(query.lower().split()) & set(doc.lower().split()))) for query, doc in pairs]
+
+
+flag_embedding = types.ModuleType('FlagEmbedding')
+flag_embedding.FlagModel = StubFlagModel
+flag_embedding.FlagReranker = StubFlagReranker
+sys.modules['FlagEmbedding'] = flag_embedding
+
+
+def _stub_language_model(prompt, system_prompt=None, *args, **kwargs):
+    """摘要请求返回正文最后一行，查询增强原样返回"""
+    lines = [line.strip() for line in str(prompt).strip().splitlines() if line.strip()]
+    return lines[-1] if lines else ''
+
+
+@pytest.fixture
+def rag_factory(tmp_path, monkeypatch):
+    """
+    在临时目录中创建 Rag 实例
+    用法: rag = rag_factory({'rag.vector_store.type': 'ivf'})，键为以点分隔的配置路径
+    """
+    import utils.rag.rag as rag_module
+
+    documents_path = tmp_path / 'documents'
+    documents_path.mkdir()
+    created = []
+
+    def factory(overrides=None):
+        config = copy.deepcopy(rag_module.configs)
+        rag_config = config['rag']
+        rag_config['document_path'] = str(documents_path)
+        rag_config['vector_store']['index_path'] = str(tmp_path / 'vector_store')
+        rag_config['embedding_model']['dimension'] = DIMENSION
+        rag_config['ingestion'] = dict(rag_config.get('ingestion') or {}, parse_workers=0)
+        rag_config['retrieval']['score_threshold'] = -1
+        rag_config['retrieval']['rerank_score_threshold'] = 0
+        for key, value in (overrides or {}).items():
+            section = config
+            *parents, name = key.split('.')
+            for parent in parents:
+                section = section.setdefault(parent, {})
+            section[name] = value
+        monkeypatch.setattr(rag_module, 'configs', config)
+        monkeypatch.setattr(rag_module, 'call_language_model', _stub_language_model)
+        rag = rag_module.Rag()
+        created.append(rag)
+        return rag
+
+    factory.documents_path = documents_path
+    yield factory
+    for rag in created:
+        rag.vector_store.wait_for_compaction()
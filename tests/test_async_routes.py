@@ -0,0 +1,217 @@
+"""
+异步接口测试（Quart 测试客户端）：与 Flask 接口相同的返回格式、Server-Sent-Events 流式事件、
+流式开关与出错时的 error 事件、等待 LLM 时并发请求不占用线程，以及 ASGI 应用按路由分发到 Quart 与 Flask
+"""
+import asyncio
+import importlib.util
+import json
+import sys
+import tempfile
+import threading
+import types
+from pathlib import Path
+import pytest
+from utils.load_config import configs
+
+# 文档预览与图片上传接口依赖的模块在导入时才需要，本测试不调用这些接口
+for _name in ('cv2', 'pandas', 'markdown2'):
+    if importlib.util.find_spec(_name) is None:
+        sys.modules[_name] = types.ModuleType(_name)
+# 接口模块导入时创建任务管理器，任务状态数据库写入临时目录
+configs['rag']['jobs'] = dict(configs['rag'].get('jobs') or {}, db_path=str(Path(tempfile.mkdtemp()) / 'jobs.db'))
+
+httpx = pytest.importorskip('httpx')
+import utils.rag.rag as rag_module
+import utils.webui.routes.async_api_routes as async_routes
+from utils.webui.asgi_app import asgi_app, quart_app
+from conftest import write
+
+
+def parse_events(body: str):
+    """解析 text/event-stream 响应体为 [(事件名, 数据)]"""
+    events = []
+    for block in body.strip().split('\n\n'):
+        lines = dict(line.split(': ', 1) for line in block.split('\n'))
+        events.append((lines['event'], json.loads(lines['data'])))
+    return events
+
+
+async def fake_stream(*deltas, error=None):
+    for delta in deltas:
+        yield delta
+    if error:
+        raise error
+
+
+@pytest.fixture
+def client():
+    return quart_app.test_client()
+
+
+def run(coroutine):
+    return asyncio.run(coroutine)
+
+
+def test_chat_completions(client, monkeypatch):
+    calls = []
+
+    async def language_model(message, **kwargs):
+        calls.append((message, kwargs))
+        return '答案 $x^2$'
+
+    monkeypatch.setattr(async_routes, 'acall_language_model', language_model)
+
+    async def request():
+        response = await client.post('/api/chat_completions', json={
+            'message': '你好', 'temperature': 0.2, 'model': 'm', 'system_prompt': 's'})
+        return response.status_code, await response.get_json()
+
+    status, data = run(request())
+    assert status == 200
+    assert data == {'status': 'success', 'response': '答案 $x^2$', 'model': 'm', 'latex': ['$', '$']}
+    assert calls == [('你好', {'system_prompt': 's', 'model': 'm', 'temperature': 0.2})]
+
+
+def test_chat_completions_stream(client, monkeypatch):
+    monkeypatch.setattr(async_routes, 'astream_language_model', lambda *args, **kwargs: fake_stream('你', '好'))
+
+    async def request(path):
+        response = await client.post(path, json={'message': 'hi'})
+        return response.status_code, response.mimetype, (await response.get_data()).decode('utf-8')
+
+    status, mimetype, body = run(request('/api/chat_completions/stream'))
+    assert status == 200 and mimetype == 'text/event-stream'
+    assert parse_events(body) == [('delta', {'content': '你'}), ('delta', {'content': '好'}),
+                                  ('done', {'status': 'success', 'response': '你好',
+                                            'model': rag_module.configs['ollama']['default_model'], 'latex': []})]
+
+    # 推送过程中出错时以 error 事件结束
+    monkeypatch.setattr(async_routes, 'astream_language_model',
+                        lambda *args, **kwargs: fake_stream('部分', error=rag_module.LLMError('LLM调用出错: 超时')))
+    _, _, body = run(request('/api/chat_completions/stream'))
+    assert parse_events(body) == [('delta', {'content': '部分'}),
+                                  ('error', {'status': 'error', 'message': 'LLM调用出错: 超时'})]
+
+    monkeypatch.setattr(async_routes, '_streaming_enabled', lambda: False)
+    status, _, _ = run(request('/api/chat_completions/stream'))
+    assert status == 403
+
+
+def test_related_questions(client, monkeypatch):
+    async def language_model(question, system_prompt=None, **kwargs):
+        assert '2个' in system_prompt
+        return '1. 第一个问题\n2. 第二个问题\n无编号的行'
+
+    monkeypatch.setattr(async_routes, 'acall_language_model', language_model)
+
+    async def request():
+        response = await client.post('/api/related_questions', json={'question': 'q', 'count': 2})
+        return await response.get_json()
+
+    assert run(request()) == {'status': 'success', 'questions': ['第一个问题', '第二个问题']}
+
+
+def test_rag_prompt_and_stream(client, rag_factory, monkeypatch):
+    write(rag_factory.documents_path, 'manual.txt', ['the pump needs oil weekly', 'unrelated text here'])
+    rag = rag_factory()
+    rag.sync_documents()
+
+    async def get_rag():
+        return rag
+
+    async def enhance(query, *args, **kwargs):
+        return query
+
+    prompts = []
+
+    def stream(message, system_prompt=None, **kwargs):
+        prompts.append(system_prompt)
+        return fake_stream('weekly')
+
+    monkeypatch.setattr(async_routes, '_get_rag', get_rag)
+    monkeypatch.setattr(rag_module, 'acall_language_model', enhance)
+    monkeypatch.setattr(async_routes, 'astream_language_model', stream)
+
+    async def request():
+        prompt = await client.post('/api/chat/rag/prompt', json={'message': 'pump oil', 'top_k': 1})
+        streamed = await client.post('/api/chat/rag/stream', json={'message': 'pump oil', 'top_k': 1})
+        invalid = await client.post('/api/chat/rag/prompt', json={'message': 'pump oil', 'filters': {'bad': 1}})
+        return await prompt.get_json(), (await streamed.get_data()).decode('utf-8'), invalid.status_code
+
+    prompt, body, invalid_status = run(request())
+    assert prompt['status'] == 'success' and 'the pump needs oil weekly' in prompt['context']
+    events = parse_events(body)
+    assert [event for event, _ in events] == ['context', 'delta', 'done']
+    assert events[0][1]['context'] == prompts[0] == prompt['context']
+    assert events[2][1] == {'status': 'success', 'response': 'weekly'}
+    assert invalid_status == 400
+
+
+def test_agent_chat(client, monkeypatch):
+    class FakeAgent:
+        async def arun(self, message):
+            return f'agent: {message}'
+
+        async def arun_stream(self, message):
+            yield {'type': 'delta', 'content': 'agent'}
+            yield {'type': 'done', 'response': 'agent done'}
+
+    monkeypatch.setattr(async_routes, 'agent', FakeAgent())
+
+    async def request():
+        response = await client.post('/api/chat/agent', json={'message': 'hi'})
+        streamed = await client.post('/api/chat/agent/stream', json={'message': 'hi'})
+        return await response.get_json(), (await streamed.get_data()).decode('utf-8')
+
+    data, body = run(request())
+    assert data == {'status': 'success', 'response': 'agent: hi'}
+    assert parse_events(body) == [('delta', {'content': 'agent'}),
+                                  ('done', {'status': 'success', 'response': 'agent done'})]
+
+
+def test_concurrent_requests_do_not_hold_threads(client, monkeypatch):
+    waiting = []
+
+    async def request():
+        gate = asyncio.Event()
+
+        async def language_model(message, **kwargs):
+            waiting.append(message)
+            await gate.wait()
+            return message
+
+        monkeypatch.setattr(async_routes, 'acall_language_model', language_model)
+        threads = threading.active_count()
+        tasks = [asyncio.create_task(client.post('/api/chat_completions', json={'message': str(i)}))
+                 for i in range(50)]
+        while len(waiting) < 50:
+            await asyncio.sleep(0.01)
+        # 50 个请求同时等待 LLM 响应，没有为此创建线程
+        assert threading.active_count() == threads
+        gate.set()
+        responses = await asyncio.gather(*tasks)
+        return [(await response.get_json())['response'] for response in responses]
+
+    assert run(request()) == [str(i) for i in range(50)]
+
+
+def test_dispatcher_routes_between_quart_and_flask(monkeypatch):
+    async def language_model(message, **kwargs):
+        return 'from quart'
+
+    monkeypatch.setattr(async_routes, 'acall_language_model', language_model)
+
+    async def request():
+        transport = httpx.ASGITransport(app=asgi_app)
+        async with httpx.AsyncClient(transport=transport, base_url='http://test') as client:
+            chat = await client.post('/api/chat_completions', json={'message': 'hi'})
+            jobs = await client.get('/api/jobs')
+            missing = await client.get('/api/chat_completions')
+        return chat, jobs, missing
+
+    chat, jobs, missing = run(request())
+    assert chat.json()['response'] == 'from quart'
+    assert chat.headers['access-control-allow-origin'] == '*'
+    # 未在 Quart 中注册的路径与方法由 Flask 应用处理
+    assert jobs.status_code == 200 and 'jobs' in jobs.json()
+    assert missing.status_code == 405
@@ -0,0 +1,90 @@
+"""
+动态微批测试：推理进行中排队的请求合并为一批、按各请求的输入数拆分结果、批大小上限、异常传递给同批请求
+"""
+import threading
+import pytest
+from utils.rag.batching import MicroBatcher, _bucket
+
+
+class GatedModel:
+    """记录每批输入；第一次调用阻塞到 release，使其余请求在此期间排队"""
+
+    def __init__(self, fail_on=None):
+        self.batches = []
+        self.started = threading.Event()
+        self.release = threading.Event()
+        self.fail_on = fail_on
+
+    def __call__(self, items):
+        self.batches.append(list(items))
+        self.started.set()
+        self.release.wait(5)
+        if self.fail_on in items:
+            raise RuntimeError('推理失败')
+        return [item * 10 for item in items]
+
+
+@pytest.fixture
+def batcher_factory():
+    batchers = []
+
+    def factory(model, **kwargs):
+        batcher = MicroBatcher(model, **kwargs)
+        batchers.append(batcher)
+        return batcher
+
+    yield factory
+    for batcher in batchers:
+        batcher.func = lambda items: items
+        batcher.shutdown()
+
+
+def test_queued_requests_are_coalesced(batcher_factory):
+    model = GatedModel()
+    batcher = batcher_factory(model, max_batch_size=8, max_wait_ms=0)
+    first = batcher.submit([1])
+    assert model.started.wait(5)
+    # 第一批推理期间提交的请求合并为一批，结果按请求拆分
+    futures = [batcher.submit([i, i + 1]) for i in (10, 20, 30)]
+    model.release.set()
+    assert first.result(timeout=5) == [10]
+    assert [future.result(timeout=5) for future in futures] == [[100, 110], [200, 210], [300, 310]]
+    assert model.batches == [[1], [10, 11, 20, 21, 30, 31]]
+
+    stats = batcher.stats()
+    assert stats['requests'] == 4 and stats['batches'] == 2 and stats['items'] == 7
+    assert stats['batch_size_histogram'] == {'1': 1, '5-8': 1}
+    assert stats['queue_depth'] == 0
+    assert batcher([]) == []
+
+
+def test_batch_size_limit(batcher_factory):
+    model = GatedModel()
+    batcher = batcher_factory(model, max_batch_size=4, max_wait_ms=0)
+    batcher.submit([0])
+    assert model.started.wait(5)
+    # 放不下的请求留到下一批；超过上限的单个请求单独成批
+    futures = [batcher.submit(items) for items in ([1, 2, 3], [4, 5], [6, 7, 8, 9, 10])]
+    model.release.set()
+    assert futures[2].result(timeout=5) == [60, 70, 80, 90, 100]
+    assert model.batches == [[0], [1, 2, 3], [4, 5], [6, 7, 8, 9, 10]]
+
+
+def test_errors_reach_every_request_in_the_batch(batcher_factory):
+    model = GatedModel(fail_on=2)
+    batcher = batcher_factory(model, max_batch_size=8, max_wait_ms=0)
+    batcher.submit([0])
+    assert model.started.wait(5)
+    futures = [batcher.submit([1]), batcher.submit([2])]
+    model.release.set()
+    for future in futures:
+        with pytest.raises(RuntimeError):
+            future.result(timeout=5)
+    # 出错后工作线程继续处理之后的请求
+    assert batcher([3], timeout=5) == [30]
+    assert batcher.stats()['errors'] == 1
+
+
+def test_bucket():
+    assert [_bucket(n) for n in (1, 2, 3, 4, 5, 8, 9, 16, 17)] == ['1', '2', '3-4', '3-4', '5-8', '5-8',
+                                                                  '9-16', '9-16', '17-32']
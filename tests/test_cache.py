@@ -0,0 +1,101 @@
+"""
+检索缓存测试：LRU 淘汰与读取时刷新顺序、TTL 过期、并发读写，以及语料版本号使依赖知识库内容的缓存失效
+"""
+import threading
+import types
+import utils.rag.cache as cache_module
+from utils.rag.cache import LRUCache, RetrievalCache
+from conftest import assert_aligned, retrieved_files, write
+
+
+def test_lru_eviction_and_ttl(monkeypatch):
+    now = [100.0]
+    monkeypatch.setattr(cache_module, 'time', types.SimpleNamespace(monotonic=lambda: now[0]))
+    cache = LRUCache(max_size=2, ttl=10)
+    cache.set('a', 1)
+    cache.set('b', 2)
+    # 读取 a 后 b 成为最久未使用的条目
+    assert cache.get('a') == 1
+    cache.set('c', 3)
+    assert cache.get('b') is None and cache.get('a') == 1 and cache.get('c') == 3
+    assert cache.stats()['evictions'] == 1
+
+    now[0] += 10
+    assert cache.get('a', 'expired') == 'expired'
+    assert len(cache) == 1 and cache.stats()['expirations'] == 1
+    # 重新写入后重新计时
+    cache.set('c', 4)
+    now[0] += 5
+    assert cache.get('c') == 4
+
+    no_ttl = LRUCache(max_size=1, ttl=0)
+    no_ttl.set('a', 1)
+    now[0] += 1e9
+    assert no_ttl.get('a') == 1
+
+
+def test_concurrent_access_stays_bounded():
+    cache = LRUCache(max_size=50, ttl=0)
+    errors = []
+
+    def worker(offset):
+        try:
+            for i in range(2000):
+                key = (offset + i) % 120
+                cache.set(key, key)
+                value = cache.get((key * 7) % 120)
+                assert value is None or value == (key * 7) % 120
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=worker, args=(n * 13,)) for n in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert not errors
+    assert len(cache) == 50
+
+
+def test_corpus_changes_invalidate_cache(rag_factory):
+    documents = rag_factory.documents_path
+    a = write(documents, 'a.txt', ['apple banana'])
+    b = write(documents, 'b.txt', ['cherry date'])
+    rag = rag_factory()
+    rag.sync_documents()
+    version = rag.cache.corpus_version
+    assert version > 0
+
+    assert retrieved_files(rag.retrieve_documents('apple banana', top_k=1)) == {'a.txt'}
+    hits = rag.cache.stats()['namespaces']['retrieval']['hits']
+    rag.retrieve_documents('apple banana', top_k=1)
+    assert rag.cache.stats()['namespaces']['retrieval']['hits'] == hits + 1
+
+    # 修改文档块：版本号递增，之前缓存的结果不再返回
+    assert rag.update_chunk(str(b), 0, 'apple banana')
+    assert rag.cache.corpus_version == version + 1
+    assert_aligned(rag)
+    assert not rag.update_chunk(str(b), 5, 'missing chunk')
+
+    rag.delete_document(str(a))
+    assert rag.cache.corpus_version == version + 2
+    assert retrieved_files(rag.retrieve_documents('apple banana', top_k=1)) == {'b.txt'}
+    assert rag.delete_document(str(a)) == 0
+    assert rag.cache.corpus_version == version + 2
+
+
+def test_retrieval_cache_versions():
+    cache = RetrievalCache({'retrieval': {'max_size': 8, 'ttl': 60},
+                            'query_enhance': {'max_size': 8, 'ttl': 60, 'versioned': False}})
+    version = cache.corpus_version
+    cache.set('retrieval', 'q', ['old'], version=version)
+    cache.set('query_enhance', 'q', 'enhanced')
+    assert cache.get('retrieval', 'q') == ['old']
+
+    assert cache.bump_corpus_version() == version + 1
+    assert cache.get('retrieval', 'q') is None
+    assert cache.get('query_enhance', 'q') == 'enhanced'
+
+    # 检索期间语料发生变化：按开始检索时的版本写入的结果不会被命中
+    cache.set('retrieval', 'q', ['stale'], version=version)
+    assert cache.get('retrieval', 'q') is None
@@ -0,0 +1,75 @@
+"""
+call_language_model 的错误处理：默认返回错误信息，raise_errors=True 时抛出 LLMError；
+摘要与查询增强据此区分错误与正常响应
+"""
+import asyncio
+import pytest
+import utils.base_func.call_model as call_model
+from utils.base_func import LLMError
+
+
+class FailingClient:
+    def __init__(self, error):
+        self.error = error
+
+    def chat(self, messages, **kwargs):
+        raise self.error
+
+
+class AsyncFailingClient(FailingClient):
+    async def chat(self, messages, **kwargs):
+        raise self.error
+
+
+class RecordingClient:
+    def __init__(self):
+        self.kwargs = None
+
+    def chat(self, messages, **kwargs):
+        self.kwargs = kwargs
+        return 'ok'
+
+
+def test_call_language_model_errors(monkeypatch):
+    monkeypatch.setattr(call_model, 'get_llm_client', lambda: FailingClient(LLMError('LLM调用失败: HTTP 500')))
+    assert call_model.call_language_model('q') == 'LLM调用失败: HTTP 500'
+    with pytest.raises(LLMError):
+        call_model.call_language_model('q', raise_errors=True)
+
+    # 其他异常同样包装为 LLMError
+    monkeypatch.setattr(call_model, 'get_llm_client', lambda: FailingClient(ValueError('bad payload')))
+    assert call_model.call_language_model('q') == 'LLM调用出错: bad payload'
+    with pytest.raises(LLMError, match='bad payload'):
+        call_model.call_language_model('q', raise_errors=True)
+
+    monkeypatch.setattr(call_model, 'get_async_llm_client', lambda: AsyncFailingClient(LLMError('LLM调用出错: 超时')))
+    assert asyncio.run(call_model.acall_language_model('q')) == 'LLM调用出错: 超时'
+    with pytest.raises(LLMError):
+        asyncio.run(call_model.acall_language_model('q', raise_errors=True))
+
+
+def test_call_language_model_passes_model_and_temperature(monkeypatch):
+    client = RecordingClient()
+    monkeypatch.setattr(call_model, 'get_llm_client', lambda: client)
+    assert call_model.call_language_model('q', model='m', temperature=0.2) == 'ok'
+    assert client.kwargs == {'model': 'm', 'temperature': 0.2}
+
+
+def test_llm_errors_are_not_saved_as_summary_or_enhanced_query(rag_factory, monkeypatch):
+    import utils.rag.rag as rag_module
+    rag = rag_factory()
+
+    def failing(*args, raise_errors=False, **kwargs):
+        if raise_errors:
+            raise LLMError('LLM调用失败: HTTP 503')
+        return 'LLM调用失败: HTTP 503'
+
+    monkeypatch.setattr(rag_module, 'call_language_model', failing)
+    with pytest.raises(LLMError):
+        rag._request_chunk_summary('some content')
+    assert rag._summarize_for_ingest('some content') == ''
+
+    # 查询增强失败时使用原始查询，且不缓存失败结果
+    query = 'solve x^2 + 2x + 1 = 0 for x please'
+    assert rag._query_enhance(query) == query
+    assert rag.cache.get('query_enhance', query) is None
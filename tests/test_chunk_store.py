@@ -0,0 +1,122 @@
+"""
+文档块存储测试：删除后 row_id 连续且与向量行号对齐，chunks.id 不随删除变化，行号版本只在行号前移时递增，旧版 metadata.json 自动导入
+"""
+import json
+import numpy as np
+import pytest
+from utils.rag.chunk_store import ChunkStore
+from utils.rag.vector_store import VectorStore
+from conftest import DIMENSION, embed_text
+
+
+def make_docs(file_path: str, count: int):
+    return [{'file_path': file_path, 'chunk_index': i, 'chunk_summary': f'summary {file_path} {i}',
+             'chunk_content': f'content {file_path} {i}', 'total_chunks': count, 'timestamp': 1.0}
+            for i in range(count)]
+
+
+@pytest.fixture
+def stores(tmp_path):
+    """内容相同的文档块存储与向量存储（第 i 行向量由第 i 个文档块的正文生成）"""
+    docs = ChunkStore(tmp_path / 'chunks.db')
+    vectors = VectorStore(tmp_path / 'segments', DIMENSION)
+    for file_path, count in (('a.txt', 5), ('b.txt', 7), ('c.txt', 4), ('d.txt', 6)):
+        chunks = make_docs(file_path, count)
+        docs.extend(chunks)
+        vectors.add(np.stack([embed_text(doc['chunk_content']) for doc in chunks]))
+    yield docs, vectors
+    vectors.wait_for_compaction()
+
+
+def assert_aligned(docs: ChunkStore, vectors: VectorStore) -> None:
+    assert len(docs) == len(vectors)
+    rows = [row[0] for row in docs._conn().execute("SELECT row_id FROM chunks ORDER BY row_id")]
+    assert rows == list(range(len(docs)))
+    expected = np.stack([embed_text(doc['chunk_content']) for doc in docs])
+    expected /= np.linalg.norm(expected, axis=1, keepdims=True)
+    np.testing.assert_allclose(vectors.get(np.arange(len(vectors))), expected, rtol=1e-5, atol=1e-6)
+
+
+def test_delete_rows_keeps_rows_contiguous(stores):
+    docs, vectors = stores
+    assert_aligned(docs, vectors)
+
+    # 不连续的多段删除，包括首行与末行
+    removed = docs.delete_rows([21, 0, 3, 4, 10, 11, 12, 3])
+    assert removed == [0, 3, 4, 10, 11, 12, 21]
+    vectors.remove(removed)
+    assert_aligned(docs, vectors)
+    assert [doc['chunk_content'] for doc in docs[:3]] == ['content a.txt 1', 'content a.txt 2', 'content b.txt 0']
+    assert docs.delete_rows([]) == []
+
+
+def test_delete_files_removes_records(stores):
+    docs, vectors = stores
+    for file_path in ('a.txt', 'b.txt', 'c.txt', 'd.txt'):
+        docs.upsert_file(file_path, 1, 1.0, file_path)
+
+    removed = docs.delete_files(['b.txt', 'd.txt'])
+    assert removed == list(range(5, 12)) + list(range(16, 22))
+    vectors.remove(removed)
+    assert_aligned(docs, vectors)
+    assert docs.file_paths() == {'a.txt', 'c.txt'}
+    assert set(docs.file_records()) == {'a.txt', 'c.txt'}
+    assert docs.find_row('c.txt', 0) == 5
+    assert [row_id for row_id, _ in docs.get_file_rows('c.txt')] == [5, 6, 7, 8]
+
+
+def test_chunk_ids_survive_row_shifts(stores):
+    docs, vectors = stores
+    chunk_ids = docs.get_file_chunk_ids('c.txt')
+    assert docs.rows_for_chunk_ids(chunk_ids) == [12, 13, 14, 15]
+
+    # 删除前面的文件后 row_id 前移，chunks.id 仍指向同一批文档块
+    vectors.remove(docs.delete_file('a.txt'))
+    assert docs.rows_for_chunk_ids(chunk_ids) == [7, 8, 9, 10]
+    assert [doc['file_path'] for doc in docs.get_rows(docs.rows_for_chunk_ids(chunk_ids))] == ['c.txt'] * 4
+
+    # 已删除的文档块不再返回
+    vectors.remove(docs.delete_rows([8, 9]))
+    assert docs.rows_for_chunk_ids(chunk_ids) == [7, 8]
+    assert_aligned(docs, vectors)
+
+
+def test_update_chunk_rehashes_content(stores):
+    docs, _ = stores
+    row_id = docs.find_row('b.txt', 2)
+    before = docs[row_id]['content_hash']
+    docs.update_chunk(row_id, chunk_content='changed content')
+    assert docs[row_id]['chunk_content'] == 'changed content'
+    assert docs[row_id]['content_hash'] != before
+    assert docs.find_by_content_hash(docs[row_id]['content_hash'])[0] == row_id
+
+
+def test_legacy_metadata_migration(tmp_path):
+    legacy = tmp_path / 'metadata.json'
+    legacy.write_text(json.dumps([
+        {'file_path': 'a.txt', 'content': 'old content 0', 'chunk_summary': 's0'},
+        {'file_path': 'a.txt', 'chunk_index': 1, 'chunk_content': 'old content 1', 'page': 3},
+    ]), encoding='utf-8')
+    docs = ChunkStore(tmp_path / 'chunks.db', legacy_path=legacy)
+
+    # 缺失字段补齐，未知字段保留，原文件改名为 .bak 且不会再次导入
+    assert [doc['chunk_content'] for doc in docs] == ['old content 0', 'old content 1']
+    assert [doc['total_chunks'] for doc in docs] == [2, 2]
+    assert docs[1]['page'] == 3
+    assert not legacy.exists() and (tmp_path / 'metadata.json.bak').exists()
+    assert len(ChunkStore(tmp_path / 'chunks.db', legacy_path=legacy)) == 2
+
+
+def test_row_epoch_changes_only_when_rows_shift(stores):
+    docs, _ = stores
+    epoch = docs.row_epoch()
+    docs.extend(make_docs('e.txt', 2))
+    docs.update_chunk(0, chunk_summary='changed')
+    docs.rename_file('a.txt', 'moved/a.txt')
+    assert docs.row_epoch() == epoch
+    assert docs.find_row('moved/a.txt', 0) == 0 and docs.find_row('a.txt', 0) is None
+
+    docs.delete_rows([1])
+    assert docs.row_epoch() == epoch + 1
+    docs.reset()
+    assert docs.row_epoch() == epoch + 2 and len(docs) == 0
@@ -0,0 +1,71 @@
+"""
+向量缓存测试：未命中的文本去重后才调用编码函数，按模型与指令区分，重启后仍可命中，超出容量时淘汰最久未访问的条目
+"""
+import types
+import numpy as np
+import utils.rag.embedding_cache as embedding_cache_module
+from utils.rag.embedding_cache import EmbeddingCache
+from conftest import embed_text
+
+
+class CountingEncoder:
+    def __init__(self):
+        self.calls = []
+
+    def __call__(self, texts):
+        self.calls.append(list(texts))
+        return np.stack([embed_text(text) for text in texts])
+
+
+def test_encode_only_misses(tmp_path):
+    cache = EmbeddingCache(tmp_path / 'cache.db', 'model-a')
+    encoder = CountingEncoder()
+
+    vectors = cache.encode(['apple', 'banana', 'apple'], encoder)
+    assert encoder.calls == [['apple', 'banana']]
+    np.testing.assert_array_equal(vectors[0], vectors[2])
+    np.testing.assert_array_equal(vectors[1], embed_text('banana'))
+
+    vectors = cache.encode(['banana', 'cherry'], encoder)
+    assert encoder.calls[-1] == ['cherry']
+    np.testing.assert_array_equal(vectors[0], embed_text('banana'))
+    assert cache.stats()['entries'] == 3
+    assert (cache.stats()['hits'], cache.stats()['misses']) == (1, 3)
+
+
+def test_keys_separate_models_and_instructions(tmp_path):
+    encoder = CountingEncoder()
+    cache = EmbeddingCache(tmp_path / 'cache.db', 'model-a')
+    cache.encode(['apple'], encoder)
+
+    # 同一文本加查询指令、换模型后都是不同的条目
+    cache.encode(['apple'], encoder, instruction='query: ')
+    EmbeddingCache(tmp_path / 'cache.db', 'model-b').encode(['apple'], encoder)
+    assert len(encoder.calls) == 3
+
+    # 重新打开后命中已持久化的条目
+    reopened = EmbeddingCache(tmp_path / 'cache.db', 'model-a')
+    reopened.encode(['apple'], encoder)
+    reopened.encode(['apple'], encoder, instruction='query: ')
+    assert len(encoder.calls) == 3
+    assert reopened.stats()['entries'] == 3
+
+
+def test_eviction_keeps_recently_used(tmp_path, monkeypatch):
+    clock = iter(range(1, 1000))
+    monkeypatch.setattr(embedding_cache_module, 'time', types.SimpleNamespace(time=lambda: float(next(clock))))
+    cache = EmbeddingCache(tmp_path / 'cache.db', 'model-a', max_entries=10)
+    encoder = CountingEncoder()
+    texts = [f'text {i}' for i in range(10)]
+    cache.encode(texts, encoder)
+    # 访问前两个条目后再写入：淘汰最久未访问的条目（一次多淘汰 10%）
+    cache.encode(texts[:2], encoder)
+    cache.encode(['new text'], encoder)
+    assert cache.stats()['entries'] == 9
+    assert set(cache.get_many([cache.key(text) for text in texts[:2] + ['new text']])) == {
+        cache.key(text) for text in texts[:2] + ['new text']}
+    assert len(cache.get_many([cache.key(text) for text in texts[2:]])) == 6
+
+    cache.clear()
+    assert cache.stats()['entries'] == 0
+    assert cache.get_many([cache.key('new text')]) == {}
@@ -0,0 +1,79 @@
+"""
+元数据过滤测试：过滤条件的解析与规范化，按语料版本缓存的行掩码，以及检索只在满足条件的文档块中进行
+"""
+from datetime import datetime
+import pytest
+from utils.rag.chunk_store import ChunkStore
+from utils.rag.filters import FilterIndex, MetadataFilter
+from conftest import retrieved_files, write
+
+
+def test_filter_parsing():
+    assert MetadataFilter.from_dict(None) is None
+    assert MetadataFilter.from_dict({'path_prefix': '', 'extensions': []}) is None
+    with pytest.raises(ValueError):
+        MetadataFilter.from_dict({'author': 'x'})
+    with pytest.raises(ValueError):
+        MetadataFilter.from_dict({'metadata': ['author']})
+    with pytest.raises(ValueError):
+        MetadataFilter.from_dict({'time_from': 'yesterday'})
+
+    # 扩展名大小写与点号、取值顺序不影响缓存键
+    first = MetadataFilter.from_dict({'extensions': ['MD', '.txt'], 'metadata': {'tags': ['b', 'a']}})
+    second = MetadataFilter.from_dict({'extensions': ['.txt', 'md'], 'metadata': {'tags': ['a', 'b']}})
+    assert first.key == second.key
+    assert first.to_dict()['extensions'] == ['.md', '.txt']
+    assert MetadataFilter(time_from='2024-01-01T00:00:00').time_from == datetime(2024, 1, 1).timestamp()
+    assert MetadataFilter(time_to='1700000000').time_to == 1700000000.0
+
+
+def test_filter_index_masks(tmp_path):
+    docs = ChunkStore(tmp_path / 'chunks.db')
+    base = tmp_path / 'documents'
+    docs.extend([
+        {'file_path': str(base / 'a.md'), 'chunk_index': 0, 'chunk_content': 'a0', 'timestamp': 100.0,
+         'metadata': {'author': '张三', 'tags': ['api', 'faq']}},
+        {'file_path': str(base / 'a.md'), 'chunk_index': 1, 'chunk_content': 'a1', 'timestamp': 100.0,
+         'metadata': {'author': '张三', 'tags': ['api', 'faq']}},
+        {'file_path': str(base / 'notes' / 'b.txt'), 'chunk_index': 0, 'chunk_content': 'b0', 'timestamp': 200.0},
+        {'file_path': str(base / 'c.txt'), 'chunk_index': 0, 'chunk_content': 'c0', 'timestamp': 300.0,
+         'metadata': {'author': '李四'}},
+    ])
+    index = FilterIndex(docs, base)
+
+    def rows(version=1, **conditions):
+        return index.mask(MetadataFilter(**conditions), version, len(docs)).nonzero()[0].tolist()
+
+    assert rows(path_prefix='notes/') == [2]
+    assert rows(path_prefix=str(base)) == [0, 1, 2, 3]
+    assert rows(extensions='txt') == [2, 3]
+    assert rows(metadata={'tags': 'faq'}) == [0, 1]
+    assert rows(metadata={'author': ['李四', '王五']}) == [3]
+    assert rows(extensions=['md', 'txt'], time_from=150, time_to=250) == [2]
+
+    # 同一语料版本的相同条件复用掩码；版本变化后按新的行号重新计算
+    mask = index.mask(MetadataFilter(extensions='txt'), 1, len(docs))
+    assert index.mask(MetadataFilter(extensions=['.txt']), 1, len(docs)) is mask
+    assert not mask.flags.writeable
+    docs.delete_rows([0])
+    assert rows(version=2, extensions='txt') == [1, 2]
+    assert rows(version=2, metadata={'tags': 'api'}) == [0]
+
+
+def test_metadata_filters(rag_factory):
+    documents = rag_factory.documents_path
+    write(documents, 'a.txt', ['apple banana'])
+    write(documents, 'notes/b.txt', ['apple cherry'])
+    write(documents, 'c.md', ['apple date'])
+    rag = rag_factory()
+    rag.sync_documents()
+
+    assert retrieved_files(rag.retrieve_documents('apple', top_k=5)) == {'a.txt', 'b.txt', 'c.md'}
+    assert retrieved_files(rag.retrieve_documents('apple', top_k=5, filters={'path_prefix': 'notes/'})) == {'b.txt'}
+    assert retrieved_files(rag.retrieve_documents('apple', top_k=5, filters={'extensions': ['md']})) == {'c.md'}
+    assert rag.retrieve_documents('apple', top_k=5, filters={'extensions': ['.pdf']}) == []
+
+    # 删除后行号前移，掩码按新的语料版本重新计算
+    rag.delete_document(str(documents / 'a.txt'))
+    assert retrieved_files(rag.retrieve_documents('apple', top_k=5, filters={'extensions': ['md']})) == {'c.md'}
+    assert retrieved_files(rag.retrieve_documents('apple', top_k=5, filters={'path_prefix': 'notes/'})) == {'b.txt'}
@@ -0,0 +1,155 @@
+"""
+后台任务队列测试：状态流转与分阶段进度、排队中/运行中任务的取消、失败任务、已结束任务的数量上限，
+以及多个工作进程通过 JobStore 共享任务状态与取消请求
+"""
+import threading
+import pytest
+from utils.rag.jobs import JobManager
+
+
+class GatedTask:
+    """上报进度后阻塞到 release；取消后在下一个安全点退出"""
+
+    def __init__(self, result='done', error=None):
+        self.started = threading.Event()
+        self.release = threading.Event()
+        self.result = result
+        self.error = error
+
+    def __call__(self, job):
+        job.advance('files_total', 2)
+        job.advance('pages', 3)
+        job.advance('custom')
+        self.started.set()
+        self.release.wait(5)
+        if job.cancelled:
+            return None
+        if self.error:
+            raise RuntimeError(self.error)
+        job.advance('files_done', 2)
+        return self.result
+
+
+@pytest.fixture
+def manager_factory(tmp_path):
+    managers = []
+
+    def factory(**kwargs):
+        manager = JobManager(**kwargs)
+        managers.append(manager)
+        return manager
+
+    yield factory
+    for manager in managers:
+        manager.shutdown()
+
+
+def test_job_lifecycle_and_progress(manager_factory):
+    manager = manager_factory()
+    task = GatedTask()
+    job = manager.submit('ingest', task, {'files': ['a.pdf']})
+    assert task.started.wait(5)
+    assert manager.get(job.id).status == 'running'
+    progress = job.progress()
+    assert progress['files'] == {'total': 2, 'done': 0, 'failed': 0}
+    assert progress['parse']['pages'] == 3 and progress['other'] == {'custom': 1}
+
+    task.release.set()
+    job.future.result(timeout=5)
+    info = job.to_dict()
+    assert info['status'] == 'completed' and info['result'] == 'done'
+    assert info['description'] == {'files': ['a.pdf']} and info['progress']['files']['done'] == 2
+    assert manager.get('missing') is None
+
+
+def test_cancel_queued_and_running_jobs(manager_factory):
+    manager = manager_factory(workers=1)
+    running_task, queued_task = GatedTask(), GatedTask()
+    running = manager.submit('ingest', running_task)
+    queued = manager.submit('ingest', queued_task)
+    assert running_task.started.wait(5)
+
+    # 排队中的任务立即取消，不会执行
+    assert manager.cancel(queued.id).status == 'cancelled'
+    # 运行中的任务置位取消事件，由任务函数退出
+    assert manager.cancel(running.id).cancelled
+    assert running.status == 'running'
+    running_task.release.set()
+    running.future.result(timeout=5)
+    assert running.status == 'cancelled' and not queued_task.started.is_set()
+    assert manager.cancel('missing') is None
+
+    # 已结束的任务不受影响
+    done = manager.submit('ingest', lambda job: 'ok')
+    done.future.result(timeout=5)
+    assert manager.cancel(done.id).status == 'completed'
+    assert manager.stats() == {'queued': 0, 'running': 0, 'completed': 1, 'failed': 0, 'cancelled': 2,
+                               'workers': 1}
+
+
+def test_failures_and_history_limit(manager_factory):
+    manager = manager_factory(max_history=2)
+    task = GatedTask(error='解析失败')
+    task.release.set()
+    failed = manager.submit('ingest', task)
+    failed.future.result(timeout=5)
+    assert failed.status == 'failed' and failed.error == '解析失败'
+
+    jobs = [manager.submit('sync', lambda job, i=i: i) for i in range(3)]
+    for job in jobs:
+        job.future.result(timeout=5)
+    manager.submit('sync', lambda job: None).future.result(timeout=5)
+    # 只保留最近的已结束任务，从新到旧排列
+    assert [job.id for job in manager.list()][1:] == [jobs[2].id, jobs[1].id]
+    assert manager.list('failed') == []
+
+
+def test_job_state_is_shared_through_the_store(manager_factory, tmp_path):
+    db_path = tmp_path / 'jobs.db'
+    owner = manager_factory(db_path=db_path, sync_interval=0)
+    other = manager_factory(db_path=db_path, sync_interval=0)
+    task = GatedTask()
+    job = owner.submit('ingest', task, {'files': ['a.pdf']})
+    assert task.started.wait(5)
+
+    # 其他工作进程查询到任务状态与进度，取消请求写入数据库
+    remote = other.get(job.id)
+    assert remote.status == 'running' and remote.progress()['files']['total'] == 2
+    assert [item.id for item in other.list()] == [job.id]
+    assert other.cancel(job.id).cancelled
+    # 执行任务的进程在下一次上报进度时读取取消请求
+    assert not job.cancelled
+    job.advance('pages')
+    assert job.cancelled
+    task.release.set()
+    job.future.result(timeout=5)
+    assert other.get(job.id).status == 'cancelled'
+
+
+def test_jobs_of_exited_processes_are_failed(manager_factory, tmp_path):
+    manager = manager_factory(db_path=tmp_path / 'jobs.db')
+    task = GatedTask()
+    job = manager.submit('ingest', task)
+    assert task.started.wait(5)
+    conn = manager.store._conn()
+    conn.execute("UPDATE jobs SET pid = ? WHERE job_id = ?", (2 ** 22 + 1, job.id))
+    conn.commit()
+    record = manager.store.load(job.id)
+    assert record['status'] == 'failed' and record['error']
+    task.release.set()
+    job.future.result(timeout=5)
+
+
+def test_sync_documents_reports_progress(rag_factory, manager_factory):
+    documents = rag_factory.documents_path
+    for name in ('a.txt', 'b.txt'):
+        (documents / name).write_text(f'{name} first\n\n{name} second', encoding='utf-8')
+    rag = rag_factory()
+    manager = manager_factory()
+    job = manager.submit('sync', lambda job: rag.sync_documents(on_stage_progress=job.advance,
+                                                                cancel_event=job.cancel_event))
+    job.future.result(timeout=30)
+    assert job.status == 'completed'
+    progress = job.progress()
+    assert progress['files']['total'] == 2 and progress['files']['done'] == 2
+    assert progress['commit']['committed'] == 4
@@ -0,0 +1,132 @@
+"""
+BM25 索引与 RRF 融合测试：增量维护的词频统计与重新统计一致，融合排序符合公式，混合检索召回向量检索遗漏的精确词匹配
+"""
+import numpy as np
+import pytest
+from utils.rag.chunk_store import ChunkStore
+from utils.rag.lexical_index import LexicalIndex, reciprocal_rank_fusion, tokenize
+from conftest import write
+
+TEXTS = [
+    'alpha beta gamma',
+    'alpha alpha delta',
+    '向量检索 与 倒排索引',
+    'model-x200 使用说明',
+    'beta epsilon',
+]
+
+
+@pytest.fixture
+def indexes(tmp_path):
+    docs = ChunkStore(tmp_path / 'chunks.db')
+    docs.extend([{'file_path': f'{i}.txt', 'chunk_index': 0, 'chunk_content': text} for i, text in enumerate(TEXTS)])
+    lexical = LexicalIndex(tmp_path / 'chunks.db')
+    return docs, lexical
+
+
+def read_stats(lexical: LexicalIndex):
+    conn = lexical._conn()
+    term_stats = dict(conn.execute("SELECT term, df FROM term_stats WHERE df > 0").fetchall())
+    corpus = conn.execute("SELECT num_docs, total_length FROM corpus_stats").fetchone()
+    return term_stats, corpus
+
+
+def assert_stats_consistent(lexical: LexicalIndex) -> None:
+    """增量维护的统计与由倒排表重新统计的结果相同"""
+    incremental = read_stats(lexical)
+    conn = lexical._conn()
+    LexicalIndex._rebuild_stats(conn)
+    conn.commit()
+    assert read_stats(lexical) == incremental
+
+
+def test_tokenize():
+    assert tokenize('Alpha BETA') == ['alpha', 'beta']
+    assert tokenize('向量检索') == ['向量', '量检', '检索']
+    assert tokenize('model-x200') == ['model-x200', 'model', 'x200']
+
+
+def test_sync_and_search(indexes):
+    docs, lexical = indexes
+    assert lexical.pending_count() == len(TEXTS)
+    assert lexical.sync() == len(TEXTS)
+    assert lexical.pending_count() == 0
+    assert lexical.sync() == 0
+
+    ids, scores = lexical.search('alpha', 5)
+    assert ids.tolist() == [1, 0]
+    assert scores[0] > scores[1] > 0
+    assert lexical.search('x200', 5)[0].tolist() == [3]
+    assert lexical.search('倒排', 5)[0].tolist() == [2]
+    assert len(lexical.search('missing', 5)[0]) == 0
+
+    mask = np.ones(len(TEXTS), dtype=bool)
+    mask[1] = False
+    assert lexical.search('alpha', 5, mask=mask)[0].tolist() == [0]
+    assert_stats_consistent(lexical)
+
+
+def test_stats_follow_delete_and_update(indexes):
+    docs, lexical = indexes
+    lexical.sync()
+    term_stats, (num_docs, _) = read_stats(lexical)
+    assert term_stats['alpha'] == 2 and num_docs == len(TEXTS)
+
+    # 删除：触发器扣减统计，row_id 前移后检索结果指向新的行号
+    docs.delete_rows([0])
+    term_stats, (num_docs, _) = read_stats(lexical)
+    assert term_stats['alpha'] == 1 and 'gamma' not in term_stats and num_docs == len(TEXTS) - 1
+    assert lexical.search('alpha', 5)[0].tolist() == [0]
+    assert lexical.search('epsilon', 5)[0].tolist() == [3]
+    assert_stats_consistent(lexical)
+
+    # 修改正文：旧倒排失效，sync 后按新正文统计
+    docs.update_chunk(0, chunk_content='zeta beta')
+    assert lexical.pending_count() == 1
+    assert len(lexical.search('alpha', 5)[0]) == 0
+    lexical.sync()
+    assert lexical.search('zeta', 5)[0].tolist() == [0]
+    assert read_stats(lexical)[0]['beta'] == 2
+    assert_stats_consistent(lexical)
+
+    lexical.reset()
+    assert read_stats(lexical) == ({}, (0, 0))
+    assert lexical.pending_count() == len(TEXTS) - 1
+
+
+def test_reciprocal_rank_fusion():
+    ids, scores = reciprocal_rank_fusion([np.array([3, 1, 2]), np.array([1, 4])], k=60)
+    expected = {
+        1: 1 / 62 + 1 / 61,
+        3: 1 / 61,
+        4: 1 / 62,
+        2: 1 / 63,
+    }
+    assert ids.tolist() == [1, 3, 4, 2]
+    np.testing.assert_allclose(scores, [expected[i] for i in ids.tolist()], rtol=1e-6)
+
+    # 权重与融合常数
+    ids, scores = reciprocal_rank_fusion([np.array([7, 8]), np.array([8, 7])], k=0, weights=[3.0, 1.0])
+    assert ids.tolist() == [7, 8]
+    np.testing.assert_allclose(scores, [3.0 + 1 / 2, 3.0 / 2 + 1.0], rtol=1e-6)
+
+    ids, scores = reciprocal_rank_fusion([np.array([], dtype=np.int64)])
+    assert len(ids) == 0 and len(scores) == 0
+
+
+def test_hybrid_retrieval_recovers_exact_token_match(rag_factory):
+    # 向量检索的前 initial_retrieval_k 个候选都是共享常见词的干扰块，型号只能由 BM25 召回
+    paragraphs = [f'common words filler{i}' for i in range(10)] + ['model-x200 manual']
+    write(rag_factory.documents_path, 'a.txt', paragraphs)
+    query = 'common words model-x200'
+
+    rag = rag_factory()
+    rag.sync_documents()
+    dense_ids, _ = rag.vector_index.search(rag._encode_queries([query])[0], rag.initial_retrieval_k)
+    assert rag.docs.find_row(str(rag_factory.documents_path / 'a.txt'), 10) not in dense_ids.tolist()
+    results = rag.retrieve_documents(query, top_k=20)
+    assert 'model-x200 manual' in [doc['chunk_content'] for doc in results]
+
+    dense_only = rag_factory({'rag.retrieval.hybrid': {'enabled': False}})
+    results = dense_only.retrieve_documents(query, top_k=20)
+    assert 'model-x200 manual' not in [doc['chunk_content'] for doc in results]
@@ -0,0 +1,180 @@
+"""
+LLM 客户端测试（本地模拟的 Ollama 服务）：可重试的状态码按退避重试、不可重试的响应直接失败、
+同一服务地址的并发上限、NDJSON 流式响应逐块产出并在读取完毕后释放并发名额，以及异步客户端的相同行为
+"""
+import asyncio
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import pytest
+from utils.base_func.llm_client import AsyncLLMClient, LLMClient, LLMError, build_messages
+
+
+class FakeOllama:
+    """
+    按顺序返回预设响应的 HTTP 服务，预设用完后返回 200；记录请求数与同时处理的最大请求数
+    :param responses: [(状态码, 响应体)]，响应体为列表时按 NDJSON 逐行返回
+    """
+
+    def __init__(self, responses=(), delay: float = 0):
+        self.responses = list(responses)
+        self.delay = delay
+        self.requests = []
+        self.active = 0
+        self.max_active = 0
+        self._lock = threading.Lock()
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                payload = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+                status, body = server._next(payload)
+                try:
+                    time.sleep(server.delay)
+                    lines = body if isinstance(body, list) else [body]
+                    data = ''.join(json.dumps(line) + '\n' for line in lines).encode('utf-8')
+                    self.send_response(status)
+                    self.send_header('Content-Type', 'application/x-ndjson')
+                    self.send_header('Content-Length', str(len(data)))
+                    self.end_headers()
+                    self.wfile.write(data)
+                finally:
+                    with server._lock:
+                        server.active -= 1
+
+            def log_message(self, *args):
+                pass
+
+        self.httpd = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.httpd.daemon_threads = True
+        self.endpoint = f'http://127.0.0.1:{self.httpd.server_address[1]}'
+        threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+
+    def _next(self, payload):
+        with self._lock:
+            self.requests.append(payload)
+            self.active += 1
+            self.max_active = max(self.max_active, self.active)
+            if self.responses:
+                return self.responses.pop(0)
+        return 200, {'message': {'content': 'ok'}, 'done': True, 'eval_count': 3}
+
+    def close(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+@pytest.fixture
+def ollama_factory():
+    servers = []
+
+    def factory(*args, **kwargs):
+        server = FakeOllama(*args, **kwargs)
+        servers.append(server)
+        return server
+
+    yield factory
+    for server in servers:
+        server.close()
+
+
+def make_client(server, **kwargs):
+    return LLMClient(server.endpoint, **dict({'retry_delay': 0, 'max_retries': 2}, **kwargs))
+
+
+def stream_lines(*deltas, error=None):
+    lines = [{'message': {'content': delta}, 'done': False} for delta in deltas]
+    if error:
+        lines.append({'error': error})
+    else:
+        lines.append({'message': {'content': ''}, 'done': True, 'prompt_eval_count': 5, 'eval_count': len(deltas)})
+    return lines
+
+
+def test_retries_retryable_status(ollama_factory):
+    server = ollama_factory([(503, {'error': 'busy'}), (429, {'error': 'slow down'})])
+    client = make_client(server)
+    assert client.chat(build_messages('hi'), stream=False) == 'ok'
+    assert len(server.requests) == 3
+    stats = client.metrics.stats()
+    assert (stats['calls'], stats['retries'], stats['errors']) == (1, 2, 0)
+    assert stats['completion_tokens'] == 3 and stats['in_flight'] == 0
+
+
+def test_gives_up_after_retries_and_on_client_errors(ollama_factory):
+    server = ollama_factory([(500, {'error': 'down'})] * 3)
+    client = make_client(server)
+    with pytest.raises(LLMError, match='HTTP 500'):
+        client.chat(build_messages('hi'), stream=False)
+    assert len(server.requests) == 3
+
+    # 4xx（429 除外）不重试
+    server = ollama_factory([(404, {'error': 'model not found'})])
+    client = make_client(server)
+    with pytest.raises(LLMError, match='HTTP 404'):
+        client.generate('hi', stream=False)
+    assert len(server.requests) == 1
+    assert client.metrics.stats()['errors'] == 1
+
+    # 连接失败按重试次数重试后失败
+    client = LLMClient('http://127.0.0.1:9', retry_delay=0, max_retries=1, connect_timeout=1)
+    with pytest.raises(LLMError, match='LLM调用出错'):
+        client.generate('hi', stream=False)
+    assert client.metrics.stats()['retries'] == 1
+
+
+def test_concurrency_is_bounded_per_endpoint(ollama_factory):
+    server = ollama_factory(delay=0.05)
+    clients = [make_client(server, max_concurrency=2) for _ in range(2)]
+    # 同一服务地址的多个客户端共用并发上限
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        results = list(executor.map(lambda i: clients[i % 2].chat(build_messages(str(i)), stream=False), range(8)))
+    assert results == ['ok'] * 8
+    assert server.max_active == 2
+
+
+def test_stream_yields_deltas_and_releases_slot(ollama_factory):
+    server = ollama_factory([(200, stream_lines('Hel', 'lo', ' world')), (200, stream_lines('a', 'b'))])
+    client = make_client(server, max_concurrency=1)
+    assert list(client.iter_chat(build_messages('hi'), model='m')) == ['Hel', 'lo', ' world']
+    assert server.requests[0]['stream'] is True and server.requests[0]['model'] == 'm'
+    stats = client.metrics.stats()
+    assert stats['streams'] == 1 and stats['completion_tokens'] == 3 and stats['in_flight'] == 0
+
+    # 提前关闭生成器同样释放并发名额（上限为 1，否则下一次调用会一直等待）
+    deltas = client.iter_generate('hi')
+    assert next(deltas) == 'a'
+    deltas.close()
+    assert client.chat(build_messages('hi'), stream=False) == 'ok'
+
+
+def test_stream_error_line_raises(ollama_factory):
+    server = ollama_factory([(200, stream_lines('partial', error='model crashed'))])
+    client = make_client(server)
+    deltas = client.iter_chat(build_messages('hi'))
+    assert next(deltas) == 'partial'
+    with pytest.raises(LLMError, match='model crashed'):
+        next(deltas)
+    assert client.metrics.stats()['errors'] == 1
+
+
+def test_async_client_retries_and_streams(ollama_factory):
+    pytest.importorskip('httpx')
+    server = ollama_factory([(502, {'error': 'bad gateway'}), (200, {'message': {'content': 'ok'}, 'done': True}),
+                             (200, stream_lines('x', 'y'))], delay=0.05)
+
+    async def run():
+        client = AsyncLLMClient(server.endpoint, retry_delay=0, max_retries=2, max_concurrency=2)
+        try:
+            assert await client.chat(build_messages('hi'), stream=False) == 'ok'
+            assert [delta async for delta in client.iter_chat(build_messages('hi'))] == ['x', 'y']
+            replies = await asyncio.gather(*[client.generate(str(i), stream=False) for i in range(6)])
+            assert replies == ['ok'] * 6
+        finally:
+            await client.close()
+
+    asyncio.run(run())
+    assert len(server.requests) == 9
+    assert server.max_active == 2
@@ -0,0 +1,72 @@
+"""
+流式输出中逐块移除 <think> 段落：标签在任意位置被拆分到相邻块时，结果与对完整文本调用 remove_think_tag 相同
+"""
+import asyncio
+import pytest
+import utils.base_func.call_model as call_model
+from utils.base_func.parse_response import ThinkTagFilter, astrip_think_stream, remove_think_tag, strip_think_stream
+
+TEXTS = [
+    '<think>\n先分析问题\n</think>\n\n答案是 42。',
+    '  前言 <think>a < b</think> 正文 <thin k> 保留 </think> 结尾  ',
+    '<think>一</think><think>二</think>只有这里\n\n和这里',
+    '比较 a<b 与 c</d，没有标签',
+    '<thi',
+    '',
+]
+
+
+def run_filter(chunks):
+    think_filter = ThinkTagFilter()
+    return ''.join(think_filter.feed(chunk) for chunk in chunks) + think_filter.flush()
+
+
+@pytest.mark.parametrize('text', TEXTS)
+def test_every_split_matches_remove_think_tag(text):
+    expected = remove_think_tag(text)
+    assert run_filter([text]) == expected
+    # 拆成两块、三块以及逐字符输入
+    for i in range(len(text) + 1):
+        assert run_filter([text[:i], text[i:]]) == expected
+        for j in range(i, len(text) + 1):
+            assert run_filter([text[:i], text[i:j], text[j:]]) == expected
+    assert run_filter(list(text)) == expected
+
+
+def test_unclosed_think_is_dropped():
+    assert run_filter(['答案', '<think>还在思考', '</thi']) == '答案'
+    # 标签前缀未凑成完整标签时按普通文本输出
+    assert run_filter(['结尾是 <thi']) == '结尾是 <thi'
+
+
+def test_output_is_incremental():
+    think_filter = ThinkTagFilter()
+    assert think_filter.feed('<think>思考') == ''
+    assert think_filter.feed('</think>\n答') == '答'
+    # 可能是标签开头的部分暂不输出，末尾空白等到后面还有内容时才输出
+    assert think_filter.feed('案 <') == '案'
+    assert think_filter.feed('b') == ' <b'
+    assert think_filter.feed('  ') == ''
+    assert think_filter.flush() == ''
+
+
+def test_stream_helpers(monkeypatch):
+    chunks = ['<thi', 'nk>想一想</th', 'ink>\n\n你', '好']
+    assert list(strip_think_stream(chunks)) == ['你', '好']
+
+    async def deltas():
+        for chunk in chunks:
+            yield chunk
+
+    async def collect():
+        return [delta async for delta in astrip_think_stream(deltas())]
+
+    assert asyncio.run(collect()) == ['你', '好']
+
+    class StreamingClient:
+        def iter_chat(self, messages, **kwargs):
+            return iter(chunks)
+
+    monkeypatch.setattr(call_model, 'get_llm_client', lambda: StreamingClient())
+    assert ''.join(call_model.stream_language_model('q')) == '你好'
+    assert ''.join(call_model.stream_language_model('q', strip_think=False)) == ''.join(chunks)
@@ -0,0 +1,95 @@
+"""
+量化索引测试：聚类数据上的召回率、返回的分数为全精度精确分数、常驻内存远小于全精度向量，
+以及 int8 量化的重建误差与数据量不足时退化为精确检索
+"""
+import numpy as np
+import pytest
+from utils.rag.quantization import ScalarQuantizer
+from utils.rag.vector_index import create_index, top_k_indices
+from utils.rag.vector_store import VectorStore
+
+DIMENSION = 32
+K = 10
+
+
+def clustered(rng, size, clusters=30):
+    centers = rng.standard_normal((clusters, DIMENSION)).astype(np.float32)
+    return centers[rng.integers(0, clusters, size)] + 0.6 * rng.standard_normal((size, DIMENSION)).astype(np.float32)
+
+
+@pytest.fixture
+def data():
+    rng = np.random.default_rng(0)
+    return clustered(rng, 3000), clustered(np.random.default_rng(1), 30)
+
+
+def make_store(tmp_path, vectors, metric='cosine'):
+    store = VectorStore(tmp_path / f'segments_{metric}', DIMENSION, metric=metric, normalize=metric == 'cosine')
+    store.add(vectors)
+    return store
+
+
+def recall(index, store, queries):
+    hits = 0
+    for query in queries:
+        ids, _ = index.search(query, K)
+        hits += len(set(ids.tolist()) & set(top_k_indices(store.scores(query), K).tolist()))
+    return hits / (K * len(queries))
+
+
+@pytest.mark.parametrize('index_type, params', [
+    ('sq8', {'rescore_factor': 4}),
+    ('pq', {'m': 8, 'rescore_factor': 16}),
+])
+@pytest.mark.parametrize('metric', ['cosine', 'l2'])
+def test_recall_and_exact_scores(tmp_path, data, index_type, params, metric):
+    vectors, queries = data
+    store = make_store(tmp_path, vectors, metric)
+    index = create_index(index_type, metric, params)
+    index.build(store)
+    assert index.codes is not None
+    assert recall(index, store, queries) >= 0.95
+
+    # 近似打分只用于选候选，返回的是全精度向量的精确分数
+    for query in queries[:5]:
+        ids, scores = index.search(query, K)
+        np.testing.assert_allclose(scores, store.scores(query, ids), rtol=1e-5, atol=1e-6)
+        assert np.all(np.diff(scores) <= 1e-6)
+
+    # 常驻内存只有量化编码：sq8 每维 1 字节，pq 每个向量 m 字节
+    assert index.memory_bytes() < vectors.nbytes / 3
+    store.wait_for_compaction()
+
+
+def test_rescoring_improves_recall(tmp_path, data):
+    vectors, queries = data
+    store = make_store(tmp_path, vectors)
+    results = []
+    for rescore_factor in (1, 16):
+        index = create_index('pq', 'cosine', {'m': 4, 'rescore_factor': rescore_factor})
+        index.build(store)
+        results.append(recall(index, store, queries))
+    assert results[0] < results[1]
+    store.wait_for_compaction()
+
+
+def test_scalar_quantizer_round_trip():
+    rng = np.random.default_rng(0)
+    vectors = rng.standard_normal((500, DIMENSION)).astype(np.float32)
+    quantizer = ScalarQuantizer()
+    quantizer.train(vectors)
+    codes = quantizer.encode(vectors)
+    assert codes.dtype == np.uint8
+    # 每个维度的误差不超过半个量化步长
+    assert np.all(np.abs(quantizer.decode(codes) - vectors) <= quantizer.scale / 2 + 1e-6)
+
+
+def test_small_store_is_searched_exactly(tmp_path, data):
+    vectors, queries = data
+    store = make_store(tmp_path, vectors[:100])
+    index = create_index('sq8', 'cosine', {})
+    index.build(store)
+    assert index.codes is None
+    for query in queries[:5]:
+        np.testing.assert_array_equal(index.search(query, K)[0], top_k_indices(store.scores(query), K))
+    store.wait_for_compaction()
@@ -1,8 +1,8 @@
-from utils.rag import Rag
+from utils.rag import get_rag
 
 query = input(">>> 请输入问题：")
 
-rag = Rag()
+rag = get_rag()
 rag.load_documents(rag.files)
 prompt = rag.generate_prompt(query=query)
 
@@ -0,0 +1,142 @@
+"""
+Rag 端到端测试（嵌入与重排序模型由 conftest 中的确定性编码器代替）：
+增量同步、删除与修改后文档块与向量对齐、索引持久化
+"""
+import os
+from pathlib import Path
+from conftest import assert_aligned, retrieved_files, write
+
+
+def test_incremental_sync(rag_factory, capsys):
+    documents = rag_factory.documents_path
+    a = write(documents, 'a.txt', ['apple banana', 'cherry date'])
+    write(documents, 'b.txt', ['elder fig', 'grape honeydew', 'kiwi lemon'])
+    rag = rag_factory()
+    model = rag.embedding_model
+
+    assert rag.sync_documents()['added'] == 2
+    assert_aligned(rag)
+    encoded = model.encoded_texts
+
+    # 未变化的文件直接跳过
+    result = rag.sync_documents()
+    assert result['unchanged'] == 2 and result['added'] == result['updated'] == 0
+    assert model.encoded_texts == encoded
+
+    # 修改文件：只有新增的文档块需要编码，其余复用已有向量
+    write(documents, 'a.txt', ['apple banana', 'cherry date', 'mango nectarine'])
+    assert rag.sync_documents()['updated'] == 1
+    assert model.encoded_texts == encoded + 1
+    assert [doc['chunk_content'] for doc in rag.docs.get_file_chunks(str(a))][-1] == 'mango nectarine'
+    assert_aligned(rag)
+
+    # 重命名：只修改路径，不重新编码
+    a.rename(documents / 'renamed.txt')
+    assert rag.sync_documents()['renamed'] == 1
+    assert model.encoded_texts == encoded + 1
+    assert {Path(fp).name for fp in rag.docs.file_paths()} == {'renamed.txt', 'b.txt'}
+
+    # 删除文件：排在其后的文档块前移，向量与索引同步删除
+    (documents / 'b.txt').unlink()
+    assert rag.sync_documents()['removed'] == 1
+    assert len(rag.docs) == 3
+    assert_aligned(rag)
+    assert retrieved_files(rag.retrieve_documents('kiwi lemon', top_k=3)) <= {'renamed.txt'}
+
+    # 重新创建实例时直接加载已保存的索引
+    capsys.readouterr()
+    restarted = rag_factory()
+    assert '正在构建' not in capsys.readouterr().out
+    assert_aligned(restarted)
+    assert restarted.sync_documents()['unchanged'] == 1
+
+
+def test_touched_file_unchanged_by_content_hash(rag_factory):
+    documents = rag_factory.documents_path
+    a = write(documents, 'a.txt', ['apple banana', 'cherry date'])
+    rag = rag_factory()
+    rag.sync_documents()
+    encoded = rag.embedding_model.encoded_texts
+    epoch = rag.docs.row_epoch()
+
+    # 只改变修改时间：按内容哈希判定未变化，不重新解析和编码，文件记录更新为新的修改时间
+    stat = a.stat()
+    os.utime(a, (stat.st_atime, stat.st_mtime + 100))
+    assert rag.sync_documents()['unchanged'] == 1
+    assert rag.embedding_model.encoded_texts == encoded
+    assert rag.docs.row_epoch() == epoch
+    assert rag.docs.file_records()[str(a)]['mtime'] == a.stat().st_mtime
+
+
+def test_modified_file_replaced_at_commit(rag_factory):
+    documents = rag_factory.documents_path
+    a = write(documents, 'a.txt', ['old apple', 'old banana'])
+    b = write(documents, 'b.txt', ['old cherry'])
+    rag = rag_factory()
+    rag.sync_documents()
+
+    write(documents, 'a.txt', ['new apple', 'new banana', 'new cherry'])
+    write(documents, 'b.txt', ['new date'])
+    commit = rag._commit_file_chunks
+    seen = {}
+
+    def commit_once(file_path, docs, vectors, **kwargs):
+        if seen:
+            raise RuntimeError('写入中断')
+        commit(file_path, docs, vectors, **kwargs)
+        # 提交后立即可见的只有新版本，旧版本已在同一写锁内删除
+        seen[file_path] = [doc['chunk_content'] for doc in rag.docs.get_file_chunks(file_path)]
+
+    rag._commit_file_chunks = commit_once
+    result = rag.load_documents([str(a), str(b)])
+    rag._commit_file_chunks = commit
+    assert result['updated'] == 1 and result['failed'] == 1
+    (committed, chunks), = seen.items()
+    assert chunks == (['new apple', 'new banana', 'new cherry'] if committed == str(a) else ['new date'])
+    assert rag.docs.find_row(committed, 0) == rag.docs.get_file_rows(committed)[0][0]
+    assert_aligned(rag)
+
+    # 写入失败的文件保留旧版本与旧文件记录，下次同步时重新入库
+    failed = str(b) if committed == str(a) else str(a)
+    assert [doc['chunk_content'] for doc in rag.docs.get_file_chunks(failed)][0].startswith('old')
+    result = rag.sync_documents()
+    assert result['updated'] == 1 and result['unchanged'] == 1
+    assert [doc['chunk_content'] for doc in rag.docs.get_file_chunks(failed)][0].startswith('new')
+    assert_aligned(rag)
+
+
+def test_retrieval_after_rows_renumbered_by_another_process(rag_factory):
+    documents = rag_factory.documents_path
+    a = write(documents, 'a.txt', ['apple banana', 'cherry date'])
+    write(documents, 'b.txt', ['elder fig', 'grape honeydew'])
+    writer = rag_factory()
+    writer.sync_documents()
+    # 共用同一目录的另一个服务进程，不按间隔检查段清单
+    reader = rag_factory({'rag.vector_store.reload_check_interval': -1})
+    assert retrieved_files(reader.retrieve_documents('grape honeydew', top_k=1)) == {'b.txt'}
+
+    # 删除使 SQLite 中的行号前移，读取方检索时发现行号版本变化，加载修改后重试
+    writer.delete_document(str(a))
+    results = reader.retrieve_documents('elder fig grape honeydew', top_k=2)
+    assert sorted(doc['chunk_content'] for doc in results) == ['elder fig', 'grape honeydew']
+    assert len(reader.vector_store) == 2
+    assert_aligned(reader)
+    assert reader._lookup_chunk('grape honeydew')[1] is not None
+
+
+def test_incremental_sync_with_ivf_index(rag_factory):
+    documents = rag_factory.documents_path
+    for i in range(8):
+        write(documents, f'file{i}.txt', [f'topic{i} word{j} shared' for j in range(12)])
+    rag = rag_factory({'rag.vector_store.type': 'ivf', 'rag.vector_store.ivf': {'nlist': 2, 'nprobe': 2}})
+    rag.sync_documents()
+    assert rag.vector_index.centroids is not None
+    assert_aligned(rag)
+
+    (documents / 'file2.txt').unlink()
+    write(documents, 'file5.txt', ['topic5 changed'])
+    result = rag.sync_documents()
+    assert result['removed'] == 1 and result['updated'] == 1
+    assert_aligned(rag)
+    results = rag.retrieve_documents('topic7 word3 shared', top_k=1)
+    assert retrieved_files(results) == {'file7.txt'}
@@ -0,0 +1,94 @@
+"""
+分片并行检索测试：多进程分片的结果（含过滤掩码、跨段分片）与单进程暴力检索一致，
+行数不足时在当前进程检索，工作进程出错时退回当前进程
+"""
+import numpy as np
+import pytest
+from utils.rag.sharded_search import ShardedFlatIndex
+from utils.rag.vector_index import FlatIndex
+from utils.rag.vector_store import VectorStore
+
+DIMENSION = 16
+K = 8
+
+
+@pytest.fixture
+def store(tmp_path):
+    rng = np.random.default_rng(0)
+    store = VectorStore(tmp_path / 'segments', DIMENSION, compaction_trigger=100)
+    # 分批写入生成多个段，使分片边界落在段中间
+    for size in (700, 500, 800):
+        store.add(rng.standard_normal((size, DIMENSION)).astype(np.float32))
+    yield store
+    store.wait_for_compaction()
+
+
+@pytest.fixture
+def index_factory(store):
+    indexes = []
+
+    def factory(**kwargs):
+        index = ShardedFlatIndex('cosine', **dict({'num_shards': 3, 'min_rows': 0}, **kwargs))
+        index.build(store)
+        indexes.append(index)
+        return index
+
+    yield factory
+    for index in indexes:
+        index.close()
+
+
+def exact(store, queries, mask=None):
+    index = FlatIndex('cosine')
+    index.build(store)
+    return index.search_batch(queries, K, mask=mask)
+
+
+def assert_same(results, expected):
+    assert len(results) == len(expected)
+    for (ids, scores), (expected_ids, expected_scores) in zip(results, expected):
+        np.testing.assert_array_equal(ids, expected_ids)
+        np.testing.assert_allclose(scores, expected_scores, rtol=1e-5, atol=1e-6)
+
+
+def test_sharded_results_match_flat(store, index_factory):
+    index = index_factory()
+    assert store.num_segments == 3
+    queries = np.random.default_rng(1).standard_normal((5, DIMENSION)).astype(np.float32)
+    assert_same(index.search_batch(queries, K), exact(store, queries))
+    ids, scores = index.search(queries[0], K)
+    assert_same([(ids, scores)], exact(store, queries[:1]))
+
+    # 每个分片只在掩码范围内取前 k 个，全部被过滤的分片不提交
+    mask = np.zeros(len(store), dtype=bool)
+    mask[650:720] = True
+    mask[1900:] = True
+    assert_same(index.search_batch(queries, K, mask=mask), exact(store, queries, mask))
+
+    stats = index.stats()
+    assert stats['sharded'] == 3 and stats['fallbacks'] == 0 and stats['workers_started']
+
+
+def test_small_searches_stay_local(store, index_factory):
+    index = index_factory(min_rows=1000)
+    queries = np.random.default_rng(2).standard_normal((2, DIMENSION)).astype(np.float32)
+    mask = np.zeros(len(store), dtype=bool)
+    mask[:100] = True
+    # 过滤后剩余行数低于 min_rows 时不启动工作进程
+    assert_same(index.search_batch(queries, K, mask=mask), exact(store, queries, mask))
+    assert index.stats()['local'] == 1 and not index.stats()['workers_started']
+
+
+def test_worker_errors_fall_back_to_local_search(store, index_factory, monkeypatch):
+    index = index_factory()
+    shards = index._plan_shards()
+    # 段文件已被合并删除时工作进程打开失败，在当前进程中用段列表快照检索
+    monkeypatch.setattr(index, '_plan_shards',
+                        lambda: [(start, end, [('missing', 1, 0, 1)]) for start, end, _ in shards])
+    queries = np.random.default_rng(3).standard_normal((2, DIMENSION)).astype(np.float32)
+    assert_same(index.search_batch(queries, K), exact(store, queries))
+    assert index.stats()['fallbacks'] == 1
+
+    monkeypatch.undo()
+    assert_same(index.search_batch(queries, K), exact(store, queries))
+    assert index.stats()['sharded'] == 1
@@ -0,0 +1,127 @@
+"""
+摘要服务测试：进行中的相同请求合并、并发上限、按 (内容哈希, 模型) 持久化缓存，
+以及 deferred 模式下后台补充摘要后按“摘要 + 正文”重新向量化
+"""
+import threading
+import time
+import numpy as np
+import pytest
+import utils.rag.rag as rag_module
+from utils.rag.summary_service import SummaryService
+from conftest import embed_text
+
+
+class SlowGenerator:
+    """记录调用次数与同时进行的最大请求数，release 之前阻塞"""
+
+    def __init__(self, fail_on: str = None):
+        self.release = threading.Event()
+        self.calls = []
+        self.active = 0
+        self.max_active = 0
+        self.fail_on = fail_on
+        self._lock = threading.Lock()
+
+    def __call__(self, content: str) -> str:
+        with self._lock:
+            self.calls.append(content)
+            self.active += 1
+            self.max_active = max(self.max_active, self.active)
+        try:
+            self.release.wait(5)
+            if self.fail_on and self.fail_on in content:
+                raise RuntimeError('LLM 不可用')
+            return f'summary of {content}'
+        finally:
+            with self._lock:
+                self.active -= 1
+
+
+@pytest.fixture
+def service_factory(tmp_path):
+    services = []
+
+    def factory(generate, model='model-a', concurrency=2):
+        service = SummaryService(generate, tmp_path / 'summaries.db', model=lambda: model, concurrency=concurrency)
+        services.append(service)
+        return service
+
+    yield factory
+    for service in services:
+        service.shutdown()
+
+
+def test_inflight_requests_are_merged(service_factory):
+    generate = SlowGenerator()
+    service = service_factory(generate)
+    first = service.submit('same content')
+    second = service.submit('same content')
+    assert first is second
+    generate.release.set()
+    assert first.result(timeout=5) == 'summary of same content'
+    assert generate.calls == ['same content']
+    assert service.stats()['deduplicated'] == 1
+
+    # 完成后命中持久化缓存，不再调用生成函数
+    assert service.summarize('same content') == 'summary of same content'
+    assert generate.calls == ['same content']
+    assert service.stats()['cache_hits'] == 1
+
+
+def test_concurrency_is_bounded(service_factory):
+    generate = SlowGenerator()
+    service = service_factory(generate, concurrency=2)
+    futures = [service.submit(f'content {i}') for i in range(6)]
+    time.sleep(0.2)
+    assert generate.max_active == 2
+    generate.release.set()
+    assert [future.result(timeout=5) for future in futures] == [f'summary of content {i}' for i in range(6)]
+    assert generate.max_active == 2 and service.stats()['inflight'] == 0
+
+
+def test_cache_is_keyed_by_model_and_skips_failures(service_factory):
+    generate = SlowGenerator(fail_on='bad')
+    generate.release.set()
+    service = service_factory(generate)
+    assert service.summarize_many(['good', 'bad']) == ['summary of good', None]
+    with pytest.raises(RuntimeError):
+        service.summarize('bad')
+    # 失败的结果不缓存，下次仍会重试
+    assert generate.calls.count('bad') == 2
+    assert service.get_cached('bad') is None
+    assert service.stats()['errors'] == 2
+
+    # 重新打开后按模型区分缓存
+    assert service_factory(generate).get_cached('good') == 'summary of good'
+    assert service_factory(generate, model='model-b').get_cached('good') is None
+
+
+def test_deferred_summaries_are_backfilled(rag_factory, monkeypatch):
+    documents = rag_factory.documents_path
+    (documents / 'a.txt').write_text('apple banana\n\ncherry date\n\nfail here', encoding='utf-8')
+    rag = rag_factory({'rag.summary': {'mode': 'deferred', 'backfill_batch_size': 2, 'index_update_batches': 1}})
+
+    def language_model(prompt, *args, **kwargs):
+        if 'fail here' in prompt:
+            raise rag_module.LLMError('LLM 不可用')
+        return 'summary ' + prompt.strip().splitlines()[-1].strip()
+
+    monkeypatch.setattr(rag_module, 'call_language_model', language_model)
+    # 入库时只查缓存，先以正文向量入库，随后由后台线程补充摘要
+    rag.sync_documents()
+    if rag._backfill_thread is not None:
+        rag._backfill_thread.join(timeout=10)
+
+    summaries = {doc['chunk_content']: doc.get('chunk_summary') for doc in rag.docs}
+    assert summaries == {'apple banana': 'summary apple banana', 'cherry date': 'summary cherry date',
+                         'fail here': None}
+    assert rag.docs.count_missing_summaries() == 1
+    for row_id, doc in enumerate(rag.docs):
+        expected = embed_text(rag._compose_vector_text(doc.get('chunk_summary'), doc['chunk_content']))
+        np.testing.assert_allclose(rag.vector_store.get([row_id])[0], expected / np.linalg.norm(expected),
+                                   rtol=1e-5, atol=1e-6)
+
+    # 失败的文档块下次补充时重试
+    monkeypatch.setattr(rag_module, 'call_language_model', lambda prompt, *args, **kwargs: 'summary retried')
+    assert rag.backfill_summaries() == 1
+    assert rag.docs.count_missing_summaries() == 0
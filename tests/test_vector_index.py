@@ -0,0 +1,183 @@
+"""
+向量索引测试：保存/加载、过滤掩码、增量 add/update/remove 后与精确检索一致
+"""
+import numpy as np
+import pytest
+from utils.rag.vector_store import VectorStore
+from utils.rag.vector_index import create_index, hnswlib, top_k_indices
+
+DIMENSION = 16
+K = 10
+
+# 近似索引取较小的参数，保证测试数据量下仍能建出聚类中心与码本
+INDEX_CONFIGS = {
+    'flat': ('flat', {}),
+    'ivf': ('ivf', {'nlist': 8, 'nprobe': 4}),
+    'hnsw': ('hnsw', {'backend': 'python', 'M': 8, 'ef_construction': 32, 'ef_search': 64}),
+    'hnswlib': ('hnsw', {'backend': 'hnswlib', 'M': 8, 'ef_construction': 64, 'ef_search': 64}),
+    'sq8': ('sq8', {'rescore_factor': 8}),
+    'pq': ('pq', {'m': 4, 'rescore_factor': 16}),
+}
+
+
+@pytest.fixture(params=list(INDEX_CONFIGS))
+def index_name(request):
+    if request.param == 'hnswlib' and hnswlib is None:
+        pytest.skip("未安装 hnswlib")
+    return request.param
+
+
+def make_index(name: str, metric: str = 'cosine'):
+    index_type, params = INDEX_CONFIGS[name]
+    return create_index(index_type, metric, params)
+
+
+@pytest.fixture
+def rng():
+    return np.random.default_rng(0)
+
+
+@pytest.fixture
+def store(tmp_path, rng):
+    vector_store = VectorStore(tmp_path / 'segments', DIMENSION)
+    vector_store.add(rng.standard_normal((600, DIMENSION)).astype(np.float32))
+    yield vector_store
+    vector_store.wait_for_compaction()
+
+
+def exact_search(store: VectorStore, query: np.ndarray, k: int, mask: np.ndarray = None) -> np.ndarray:
+    scores = store.scores(query)
+    if mask is not None:
+        scores = np.where(mask[:len(scores)], scores, -np.inf)
+        k = min(k, int(mask[:len(scores)].sum()))
+    return top_k_indices(scores, k)
+
+
+def recall(index, store: VectorStore, queries: np.ndarray, mask: np.ndarray = None) -> float:
+    hits = total = 0
+    for query in queries:
+        expected = set(exact_search(store, query, K, mask).tolist())
+        ids, _ = index.search(query, K, mask=mask)
+        hits += len(expected & set(ids.tolist()))
+        total += len(expected)
+    return hits / total
+
+
+def self_hits(index, store: VectorStore, ids) -> float:
+    """以行向量本身查询时排在第一位的比例（行号被重新映射后仍应找到对应行）"""
+    ids = list(ids)
+    found = sum(int(index.search(store.get([i])[0], 1)[0][0]) == i for i in ids)
+    return found / len(ids)
+
+
+def test_save_load_round_trip(index_name, store, rng, tmp_path):
+    index = make_index(index_name)
+    index.build(store)
+    path = tmp_path / 'vector_index.npz'
+    index.save(path)
+
+    loaded = make_index(index_name)
+    assert loaded.load(path, store)
+    assert loaded.ntotal == len(store)
+    for query in rng.standard_normal((5, DIMENSION)).astype(np.float32):
+        ids, scores = index.search(query, K)
+        loaded_ids, loaded_scores = loaded.search(query, K)
+        np.testing.assert_array_equal(ids, loaded_ids)
+        np.testing.assert_allclose(scores, loaded_scores, rtol=1e-5)
+
+
+def test_load_rejects_mismatched_index(index_name, store, rng, tmp_path):
+    index = make_index(index_name)
+    index.build(store)
+    path = tmp_path / 'vector_index.npz'
+    index.save(path)
+
+    # 度量不同、索引类型不同，或向量数量已变化时需要重建
+    assert not make_index(index_name, metric='l2').load(path, store)
+    other = 'ivf' if index_name == 'flat' else 'flat'
+    assert not make_index(other).load(path, store)
+    store.add(rng.standard_normal((3, DIMENSION)).astype(np.float32))
+    assert not make_index(index_name).load(path, store)
+    assert not make_index(index_name).load(tmp_path / 'missing.npz', store)
+
+
+def test_search_respects_mask(index_name, store, rng):
+    index = make_index(index_name)
+    index.build(store)
+    queries = rng.standard_normal((10, DIMENSION)).astype(np.float32)
+
+    mask = rng.random(len(store)) < 0.3
+    for query in queries:
+        ids, scores = index.search(query, K, mask=mask)
+        assert len(ids) == K
+        assert mask[ids].all()
+        assert np.all(np.diff(scores) <= 1e-6)
+    assert recall(index, store, queries, mask) >= 0.9
+
+    # 只剩少量行时结果精确
+    small_mask = np.zeros(len(store), dtype=bool)
+    small_mask[[3, 77, 512]] = True
+    for query in queries:
+        ids, _ = index.search(query, K, mask=small_mask)
+        np.testing.assert_array_equal(ids, exact_search(store, query, K, small_mask))
+
+    empty_ids, _ = index.search(queries[0], K, mask=np.zeros(len(store), dtype=bool))
+    assert len(empty_ids) == 0
+
+    batch = index.search_batch(queries, K, mask=mask)
+    for (ids, _), query in zip(batch, queries):
+        np.testing.assert_array_equal(ids, index.search(query, K, mask=mask)[0])
+
+
+def test_incremental_updates_match_store(index_name, store, rng):
+    index = make_index(index_name)
+    index.build(store)
+    queries = rng.standard_normal((20, DIMENSION)).astype(np.float32)
+
+    # 追加
+    store.add(rng.standard_normal((200, DIMENSION)).astype(np.float32))
+    index.add(store)
+    assert index.ntotal == len(store) == 800
+    assert self_hits(index, store, range(600, 800, 7)) >= 0.95
+
+    # 原地修改
+    updated = [5, 250, 601, 799]
+    store.update(updated, rng.standard_normal((len(updated), DIMENSION)).astype(np.float32))
+    index.update(store, updated)
+    assert self_hits(index, store, updated) == 1.0
+
+    # 删除：之后的行号依次前移
+    removed = sorted(rng.choice(len(store), 150, replace=False).tolist())
+    kept = np.setdiff1d(np.arange(len(store)), removed)
+    before = store.get(kept)
+    store.remove(removed)
+    index.remove(store, removed)
+    assert index.ntotal == len(store) == 650
+    np.testing.assert_allclose(store.get(np.arange(len(store))), before)
+    assert self_hits(index, store, range(0, len(store), 13)) >= 0.95
+
+    for query in queries:
+        ids, _ = index.search(query, K)
+        assert len(ids) == K and ids.max() < len(store)
+    # 增量维护后的召回率不低于基于当前数据重新构建的索引
+    rebuilt = make_index(index_name)
+    rebuilt.build(store)
+    assert recall(index, store, queries) >= recall(rebuilt, store, queries) - 0.05
+
+    # 删除到为空后仍可继续追加
+    store.remove(list(range(len(store))))
+    index.remove(store, list(range(650)))
+    assert index.ntotal == 0
+    assert len(index.search(queries[0], K)[0]) == 0
+    store.add(rng.standard_normal((5, DIMENSION)).astype(np.float32))
+    index.add(store)
+    assert self_hits(index, store, range(5)) == 1.0
+
+
+def test_create_index_backends():
+    # hnswlib 只在显式配置时使用，默认为 NumPy 实现
+    assert type(create_index('hnsw', 'cosine', {'M': 8})).__name__ == 'HNSWIndex'
+    with pytest.raises(ValueError):
+        create_index('hnsw', 'cosine', {'backend': 'auto'})
+    with pytest.raises(ValueError):
+        create_index('faiss')
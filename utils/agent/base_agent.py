@@ -1,12 +1,12 @@
 from utils.load_config import configs
-from utils.base_func import parse_response
+from utils.base_func import get_llm_client, get_async_llm_client, strip_think_stream, astrip_think_stream
 from abc import ABC
-from typing import Any, Dict, List, Optional, Union
+from typing import Any, AsyncIterator, Dict, Iterator, List, Optional, Union
 from .tools import Tool, ToolRegistry
+import asyncio
 import logging
 from pathlib import Path
 import time
-import requests
 import json
 import re
 import os
@@ -307,33 +307,32 @@ class BaseAgent(ABC):
         :param prompt: 提示文本
         :return: 模型响应
         """
-        data = {
-            "model": self.llm_config.get('model', 'deepseek-r1:7b'),
-            "prompt": prompt,
-            "stream": self.llm_config.get('stream', False),
-            "options": {
-                "temperature": self.llm_config.get('temperature', 0.7)
-            }
-        }
-        url = f"{self.llm_config.get('endpoint', 'http://localhost:11434')}/api/generate"
-        
+        client = get_llm_client(self.llm_config.get('endpoint', 'http://localhost:11434'))
         try:
             # self.logger.debug(f"Calling LLM with prompt: {prompt}")
-            response = requests.post(url, data=json.dumps(data))
-            
-            if response.status_code == 200:
-                result = parse_response(response, data['stream'])
-                # self.logger.debug(f"LLM response: {result}")
-                return result
-            else:
-                error_msg = f"LLM调用失败: HTTP {response.status_code} - {response.text}"
-                # self.logger.error(error_msg)
-                raise Exception(error_msg)
+            result = client.generate(
+                prompt,
+                model=self.llm_config.get('model', 'deepseek-r1:7b'),
+                temperature=self.llm_config.get('temperature', 0.7),
+                stream=self.llm_config.get('stream', False)
+            )
+            # self.logger.debug(f"LLM response: {result}")
+            return result
                 
         except Exception as e:
             # self.logger.error(f"LLM调用出错: {str(e)}")
             raise
 
+    async def _acall_llm(self, prompt: str) -> str:
+        """_call_llm 的异步版本（需在协程中调用）"""
+        client = get_async_llm_client(self.llm_config.get('endpoint', 'http://localhost:11434'))
+        return await client.generate(
+            prompt,
+            model=self.llm_config.get('model', 'deepseek-r1:7b'),
+            temperature=self.llm_config.get('temperature', 0.7),
+            stream=self.llm_config.get('stream', False)
+        )
+
     def run(self, query: str) -> str:
         """
         处理用户查询
@@ -363,6 +362,68 @@ class BaseAgent(ABC):
             # self.logger.error(error_msg)
             return error_msg
 
+    def run_stream(self, query: str) -> Iterator[Dict[str, str]]:
+        """
+        流式处理用户查询，<think> 段落在输出前移除
+        :param query: 用户输入
+        :return: 事件生成器，依次产出 {'type': 'delta', 'content': 增量文本}，
+                 最后产出 {'type': 'done', 'response': 处理工具调用后的完整回复}；LLM 调用失败时抛出异常
+        """
+        self.add_to_history(query, 'user')
+        prompt = self.generate_prompt(query)
+
+        client = get_llm_client(self.llm_config.get('endpoint', 'http://localhost:11434'))
+        deltas = client.iter_generate(
+            prompt,
+            model=self.llm_config.get('model', 'deepseek-r1:7b'),
+            temperature=self.llm_config.get('temperature', 0.7)
+        )
+        response = ''
+        for delta in strip_think_stream(deltas):
+            response += delta
+            yield {'type': 'delta', 'content': delta}
+
+        # 工具调用标记只有在完整回复中才能识别
+        processed_response = self._process_tool_calls(response)
+        self.add_to_history(processed_response, 'assistant')
+        yield {'type': 'done', 'response': processed_response}
+
+    async def arun(self, query: str) -> str:
+        """
+        run 的异步版本：等待 LLM 响应时不占用线程，工具调用（可能检索知识库）在线程池中执行
+        :param query: 用户输入
+        :return: 回复内容
+        """
+        self.add_to_history(query, 'user')
+        prompt = self.generate_prompt(query)
+        try:
+            response = await self._acall_llm(prompt)
+            processed_response = await asyncio.to_thread(self._process_tool_calls, response)
+            self.add_to_history(processed_response, 'assistant')
+            return processed_response
+        except Exception as e:
+            return f"处理查询时出错: {str(e)}"
+
+    async def arun_stream(self, query: str) -> AsyncIterator[Dict[str, str]]:
+        """run_stream 的异步版本，产出的事件相同"""
+        self.add_to_history(query, 'user')
+        prompt = self.generate_prompt(query)
+
+        client = get_async_llm_client(self.llm_config.get('endpoint', 'http://localhost:11434'))
+        deltas = client.iter_generate(
+            prompt,
+            model=self.llm_config.get('model', 'deepseek-r1:7b'),
+            temperature=self.llm_config.get('temperature', 0.7)
+        )
+        response = ''
+        async for delta in astrip_think_stream(deltas):
+            response += delta
+            yield {'type': 'delta', 'content': delta}
+
+        processed_response = await asyncio.to_thread(self._process_tool_calls, response)
+        self.add_to_history(processed_response, 'assistant')
+        yield {'type': 'done', 'response': processed_response}
+
     def _process_tool_calls(self, response: str) -> str:
         """处理响应中的工具调用"""
         # 使用更复杂的正则表达式匹配带参数的工具调用
@@ -525,4 +586,4 @@ if __name__ == "__main__":
     agent = BaseAgent()
     query = '帮我看一下我的机器的ip地址是多少？'
     response = agent.run(query=query)
-    print(response)
\ No newline at end of file
+    print(response)
\ No newline at end of file
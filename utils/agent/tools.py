@@ -1,7 +1,7 @@
 from typing import Callable, Dict, Any, List
 from dataclasses import dataclass
 import socket
-from ..rag import Rag
+from ..rag.registry import get_rag
 
 @dataclass
 class Tool:
@@ -68,9 +68,8 @@ class ToolRegistry:
 
 # 创建一些示例工具
 def search_documents(query: str, top_k: int = 3) -> List[Dict]:
-    """搜索文档的工具"""
-    rag = Rag()
-    return rag.retrieve_documents(query, top_k=top_k)
+    """搜索文档的工具（使用进程内共享的 Rag 实例）"""
+    return get_rag().retrieve_documents(query, top_k=top_k)
 
 def get_local_ip() -> Dict[str, str]:
     """获取本机IP地址的工具"""
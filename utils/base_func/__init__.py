@@ -1,2 +1,3 @@
-from .parse_response import parse_response, remove_think_tag
-from .call_model import call_language_model
\ No newline at end of file
+from .parse_response import parse_response, remove_think_tag, strip_think_stream, astrip_think_stream, ThinkTagFilter
+from .call_model import call_language_model, stream_language_model, acall_language_model, astream_language_model
+from .llm_client import LLMClient, AsyncLLMClient, LLMError, get_llm_client, get_async_llm_client, get_llm_stats
\ No newline at end of file
@@ -1,47 +1,82 @@
-from utils.load_config import configs
-from .parse_response import parse_response
-import requests
-import json
+from typing import AsyncIterator, Iterator
+from .llm_client import LLMError, build_messages, get_async_llm_client, get_llm_client
+from .parse_response import astrip_think_stream, strip_think_stream
 
-def call_language_model(prompt: str, system_prompt: str = None) -> str:
+def call_language_model(prompt: str, system_prompt: str = None, model: str = None,
+                        temperature: float = None, raise_errors: bool = False) -> str:
         """
         调用语言模型生成响应
         :param prompt: 提示文本
         :param system_prompt: 系统提示（可选）
+        :param model: 模型名称，默认使用 ollama.default_model
+        :param temperature: 生成温度，默认使用 ollama.temperature
+        :param raise_errors: 出错时抛出 LLMError；默认返回错误信息（用于直接展示给用户的场景）
         :return: 生成的响应
         """
-        ragllm_model = configs['ollama']['default_model']
-        stream = configs['ollama']['stream']
-        # 使用chat接口
-        messages = []
-        if system_prompt:
-            messages.append({"role": "system", "content": system_prompt})
-        messages.append({"role": "user", "content": prompt})
-        
-        data = {
-            "model": ragllm_model,
-            "messages": messages,
-            "stream": stream,
-            "options": {
-                "temperature": configs['ollama']['temperature']
-            },
-        }
-        
-        url = configs['ollama']['endpoint'] + '/api/chat'
-        
+        # 使用chat接口，经共享客户端发送（连接池、超时、重试与并发上限见 llm_client）
         try:
-            response = requests.post(url, data=json.dumps(data))
-            if response.status_code == 200:
-                if stream:
-                    return parse_response(response, stream)
-                else:
-                    resp_json = response.json()
-                    return resp_json.get('message', {}).get('content', '')
-            else:
-                error_msg = f"LLM调用失败: HTTP {response.status_code}"
-                print(error_msg)
-                return error_msg
+            return get_llm_client().chat(build_messages(prompt, system_prompt), model=model, temperature=temperature)
+        except LLMError as e:
+            if raise_errors:
+                raise
+            error_msg = str(e)
+            print(error_msg)
+            return error_msg
         except Exception as e:
             error_msg = f"LLM调用出错: {str(e)}"
+            if raise_errors:
+                raise LLMError(error_msg) from e
             print(error_msg)
             return error_msg
+
+
+def stream_language_model(prompt: str, system_prompt: str = None, model: str = None,
+                          temperature: float = None, strip_think: bool = True) -> Iterator[str]:
+        """
+        流式调用语言模型，逐块产出增量文本
+        :param prompt: 提示文本
+        :param system_prompt: 系统提示（可选）
+        :param model: 模型名称，默认使用 ollama.default_model
+        :param temperature: 生成温度，默认使用 ollama.temperature
+        :param strip_think: 是否在输出前移除 <think> 段落
+        :return: 增量文本生成器，调用失败时抛出 LLMError
+        """
+        deltas = get_llm_client().iter_chat(build_messages(prompt, system_prompt), model=model, temperature=temperature)
+        return strip_think_stream(deltas) if strip_think else deltas
+
+
+async def acall_language_model(prompt: str, system_prompt: str = None, model: str = None,
+                               temperature: float = None, raise_errors: bool = False) -> str:
+        """
+        call_language_model 的异步版本（经当前事件循环的共享异步客户端发送，等待响应时不占用线程）
+        :param model: 模型名称，默认使用 ollama.default_model
+        :param temperature: 生成温度，默认使用 ollama.temperature
+        :param raise_errors: 出错时抛出 LLMError；默认返回错误信息
+        :return: 生成的响应，出错时返回错误信息
+        """
+        try:
+            return await get_async_llm_client().chat(build_messages(prompt, system_prompt), model=model,
+                                                     temperature=temperature)
+        except LLMError as e:
+            if raise_errors:
+                raise
+            error_msg = str(e)
+            print(error_msg)
+            return error_msg
+        except Exception as e:
+            error_msg = f"LLM调用出错: {str(e)}"
+            if raise_errors:
+                raise LLMError(error_msg) from e
+            print(error_msg)
+            return error_msg
+
+
+def astream_language_model(prompt: str, system_prompt: str = None, model: str = None,
+                           temperature: float = None, strip_think: bool = True) -> AsyncIterator[str]:
+        """
+        stream_language_model 的异步版本（需在协程中调用）
+        :return: 异步增量文本生成器，调用失败时抛出 LLMError
+        """
+        deltas = get_async_llm_client().iter_chat(build_messages(prompt, system_prompt), model=model,
+                                                  temperature=temperature)
+        return astrip_think_stream(deltas) if strip_think else deltas
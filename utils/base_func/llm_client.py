@@ -0,0 +1,473 @@
+"""
+LLM（Ollama）HTTP 客户端
+摘要生成、查询增强、对话和 Agent 调用共用同一个客户端，而不是每次调用都新建 TCP 连接：
+- 同步客户端基于 requests.Session 连接池（keep-alive），异步客户端基于 httpx.AsyncClient（可选依赖）
+- 超时与重试读取 configs.yaml 中的 ollama.timeout / ollama.retry_policy：
+  连接失败及 429/5xx 响应按指数退避重试；读取超时（模型生成时间过长）不重试
+- 每个服务地址一个并发上限（ollama.max_concurrency），超过上限的调用排队等待，重试退避期间不占用名额
+- 按服务地址统计调用次数、失败/重试次数、延迟、流式调用的首个增量耗时以及 Ollama 返回的 token 数
+- iter_chat / iter_generate 逐行读取 NDJSON 流式响应并产出增量文本，读取期间一直占用并发名额
+"""
+import asyncio
+import json
+import os
+import threading
+import time
+import weakref
+from typing import Any, AsyncIterator, Dict, Iterator, List, Optional
+import requests
+from requests.adapters import HTTPAdapter
+from utils.load_config import configs
+from .parse_response import chunk_content, parse_response, parse_stream_line
+
+try:
+    import httpx
+except ImportError:
+    httpx = None
+
+# 需要重试的 HTTP 状态码（服务繁忙或暂时不可用）
+RETRY_STATUS = (429, 500, 502, 503, 504)
+
+
+class LLMError(Exception):
+    """LLM 调用失败（已用尽重试次数或响应不可重试）"""
+
+
+class LLMMetrics:
+    """单个服务地址的调用统计"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stats = {'calls': 0, 'errors': 0, 'retries': 0, 'in_flight': 0,
+                       'latency_seconds': 0.0, 'max_latency_seconds': 0.0,
+                       'prompt_tokens': 0, 'completion_tokens': 0, 'eval_seconds': 0.0,
+                       'streams': 0, 'first_token_seconds': 0.0}
+        self._models: Dict[str, int] = {}
+
+    def begin(self) -> None:
+        with self._lock:
+            self._stats['in_flight'] += 1
+
+    def end(self) -> None:
+        with self._lock:
+            self._stats['in_flight'] -= 1
+
+    def record(self, model: str, latency: float, usage: Dict[str, Any], first_token: float = None) -> None:
+        """
+        记录一次成功的调用
+        :param usage: Ollama 响应中的 prompt_eval_count / eval_count / eval_duration（纳秒）
+        :param first_token: 流式调用收到第一个增量文本的耗时（秒）
+        """
+        with self._lock:
+            self._stats['calls'] += 1
+            self._stats['latency_seconds'] += latency
+            self._stats['max_latency_seconds'] = max(self._stats['max_latency_seconds'], latency)
+            self._stats['prompt_tokens'] += int(usage.get('prompt_eval_count') or 0)
+            self._stats['completion_tokens'] += int(usage.get('eval_count') or 0)
+            self._stats['eval_seconds'] += (usage.get('eval_duration') or 0) / 1e9
+            self._models[model] = self._models.get(model, 0) + 1
+            if first_token is not None:
+                self._stats['streams'] += 1
+                self._stats['first_token_seconds'] += first_token
+
+    def record_retry(self) -> None:
+        with self._lock:
+            self._stats['retries'] += 1
+
+    def record_error(self) -> None:
+        with self._lock:
+            self._stats['errors'] += 1
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            stats = dict(self._stats)
+            stats['models'] = dict(self._models)
+        calls = stats['calls']
+        stats['avg_latency_ms'] = round(stats['latency_seconds'] / calls * 1000, 2) if calls else 0.0
+        stats['max_latency_ms'] = round(stats.pop('max_latency_seconds') * 1000, 2)
+        stats['latency_seconds'] = round(stats['latency_seconds'], 4)
+        first_token_seconds = stats.pop('first_token_seconds')
+        stats['avg_first_token_ms'] = round(first_token_seconds / stats['streams'] * 1000, 2) if stats['streams'] else 0.0
+        eval_seconds = stats.pop('eval_seconds')
+        stats['tokens_per_second'] = round(stats['completion_tokens'] / eval_seconds, 2) if eval_seconds else 0.0
+        return stats
+
+
+_metrics: Dict[str, LLMMetrics] = {}
+_metrics_lock = threading.Lock()
+
+
+def _get_metrics(endpoint: str) -> LLMMetrics:
+    """同一服务地址的同步/异步客户端共用统计"""
+    with _metrics_lock:
+        metrics = _metrics.get(endpoint)
+        if metrics is None:
+            metrics = _metrics[endpoint] = LLMMetrics()
+        return metrics
+
+
+def get_llm_stats() -> Dict[str, Dict[str, Any]]:
+    """全部服务地址的调用统计"""
+    with _metrics_lock:
+        items = list(_metrics.items())
+    return {endpoint: metrics.stats() for endpoint, metrics in items}
+
+
+def _extract_usage(content: bytes, stream: bool) -> Dict[str, Any]:
+    """从响应中取出 token 统计（流式响应在最后一行）"""
+    try:
+        text = content.decode('utf-8').strip()
+        if stream:
+            text = text.rsplit('\n', 1)[-1]
+        return json.loads(text) if text else {}
+    except (UnicodeDecodeError, ValueError):
+        return {}
+
+
+def build_messages(prompt: str, system_prompt: str = None) -> List[Dict[str, str]]:
+    """单轮对话的 chat 消息列表"""
+    messages = []
+    if system_prompt:
+        messages.append({"role": "system", "content": system_prompt})
+    messages.append({"role": "user", "content": prompt})
+    return messages
+
+
+class _BaseLLMClient:
+    """同步/异步客户端共用的配置与请求体构造"""
+
+    def __init__(self, endpoint: str = None, timeout: float = None, connect_timeout: float = None,
+                 max_retries: int = None, retry_delay: float = None, max_concurrency: int = None,
+                 pool_size: int = None):
+        """
+        未指定的参数读取 configs.yaml 中的 ollama 配置
+        :param endpoint: 服务地址，如 http://127.0.0.1:11434
+        :param timeout: 读取超时（秒）
+        :param connect_timeout: 连接超时（秒）
+        :param max_retries: 最大重试次数
+        :param retry_delay: 首次重试前的等待时间（秒），之后每次翻倍
+        :param max_concurrency: 同一服务地址的最大并发请求数
+        :param pool_size: 连接池大小
+        """
+        ollama_config = configs['ollama']
+        retry_policy = ollama_config.get('retry_policy') or {}
+        self.endpoint = (endpoint or ollama_config['endpoint']).rstrip('/')
+        self.timeout = timeout if timeout is not None else ollama_config.get('timeout', 300)
+        self.connect_timeout = connect_timeout if connect_timeout is not None else ollama_config.get('connect_timeout', 10)
+        self.max_retries = max_retries if max_retries is not None else retry_policy.get('max_retries', 3)
+        self.retry_delay = retry_delay if retry_delay is not None else retry_policy.get('delay', 2)
+        self.max_concurrency = max(1, max_concurrency or ollama_config.get('max_concurrency', 4))
+        self.pool_size = max(1, pool_size or ollama_config.get('pool_size', 16))
+        self.metrics = _get_metrics(self.endpoint)
+
+    def _backoff(self, attempt: int) -> float:
+        return self.retry_delay * (2 ** attempt)
+
+    @staticmethod
+    def _build_payload(model: Optional[str], temperature: Optional[float], stream: Optional[bool],
+                       options: Optional[Dict[str, Any]], **fields) -> Dict[str, Any]:
+        """未指定的模型、温度、流式参数在调用时读取配置（接口可能临时修改了 configs 中的温度）"""
+        payload = {
+            'model': model or configs['ollama']['default_model'],
+            'stream': configs['ollama']['stream'] if stream is None else bool(stream),
+            'options': dict(options or {}),
+        }
+        payload['options'].setdefault(
+            'temperature', configs['ollama']['temperature'] if temperature is None else temperature
+        )
+        payload.update(fields)
+        return payload
+
+
+class LLMClient(_BaseLLMClient):
+    """同步客户端（线程安全，多个线程共用一个连接池）"""
+
+    _semaphores: Dict[str, threading.BoundedSemaphore] = {}
+    _semaphores_lock = threading.Lock()
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_size)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        with self._semaphores_lock:
+            if self.endpoint not in self._semaphores:
+                self._semaphores[self.endpoint] = threading.BoundedSemaphore(self.max_concurrency)
+            self._semaphore = self._semaphores[self.endpoint]
+
+    def _release(self) -> None:
+        self.metrics.end()
+        self._semaphore.release()
+
+    def post(self, path: str, payload: Dict[str, Any], stream_response: bool = False) -> requests.Response:
+        """
+        发送请求，按重试策略处理连接失败和可重试的状态码
+        :param stream_response: 为 True 时不读取响应体，返回后仍占用并发名额，调用方读取完毕后需调用 _release()
+        :return: 状态码为 200 的响应（stream_response 为 False 时已读取完整响应体）
+        :raises LLMError: 重试次数用尽或响应不可重试
+        """
+        url = self.endpoint + path
+        data = json.dumps(payload)
+        stream = bool(payload.get('stream'))
+        for attempt in range(self.max_retries + 1):
+            start = time.monotonic()
+            retryable = True
+            hold = False
+            self._semaphore.acquire()
+            self.metrics.begin()
+            try:
+                response = self.session.post(url, data=data, timeout=(self.connect_timeout, self.timeout),
+                                             stream=stream_response)
+                if stream_response and response.status_code == 200:
+                    hold = True
+                    return response
+                content = response.content
+            except requests.ConnectionError as e:
+                # 包括连接超时
+                error = f"LLM调用出错: {str(e)}"
+            except requests.Timeout as e:
+                error, retryable = f"LLM调用出错: 请求超时 {str(e)}", False
+            else:
+                if response.status_code == 200:
+                    self.metrics.record(payload.get('model', ''), time.monotonic() - start,
+                                        _extract_usage(content, stream))
+                    return response
+                error = f"LLM调用失败: HTTP {response.status_code} - {response.text[:500]}"
+                retryable = response.status_code in RETRY_STATUS
+            finally:
+                if not hold:
+                    self._release()
+            if not retryable or attempt >= self.max_retries:
+                break
+            self.metrics.record_retry()
+            time.sleep(self._backoff(attempt))
+        self.metrics.record_error()
+        raise LLMError(error)
+
+    def _iter_stream(self, path: str, payload: Dict[str, Any]) -> Iterator[str]:
+        """逐行读取流式响应（NDJSON），产出增量文本；读取完毕或调用方关闭生成器时释放并发名额"""
+        start = time.monotonic()
+        response = self.post(path, payload, stream_response=True)
+        first_token, usage = None, {}
+        try:
+            for line in response.iter_lines():
+                chunk = parse_stream_line(line)
+                if chunk is None:
+                    continue
+                if chunk.get('error'):
+                    raise LLMError(f"LLM调用出错: {chunk['error']}")
+                if chunk.get('done'):
+                    usage = chunk
+                delta = chunk_content(chunk)
+                if delta:
+                    if first_token is None:
+                        first_token = time.monotonic() - start
+                    yield delta
+        except LLMError:
+            self.metrics.record_error()
+            raise
+        except requests.RequestException as e:
+            self.metrics.record_error()
+            raise LLMError(f"LLM调用出错: {str(e)}")
+        else:
+            self.metrics.record(payload.get('model', ''), time.monotonic() - start, usage, first_token)
+        finally:
+            response.close()
+            self._release()
+
+    def chat(self, messages: List[Dict[str, str]], model: str = None, temperature: float = None,
+             stream: bool = None, options: Dict[str, Any] = None) -> str:
+        """调用 /api/chat，返回回复文本（流式响应逐行读取后拼接）"""
+        payload = self._build_payload(model, temperature, stream, options, messages=messages)
+        if payload['stream']:
+            return ''.join(self._iter_stream('/api/chat', payload))
+        return parse_response(self.post('/api/chat', payload), False)
+
+    def generate(self, prompt: str, model: str = None, temperature: float = None,
+                 stream: bool = None, options: Dict[str, Any] = None) -> str:
+        """调用 /api/generate，返回生成文本（流式响应逐行读取后拼接）"""
+        payload = self._build_payload(model, temperature, stream, options, prompt=prompt)
+        if payload['stream']:
+            return ''.join(self._iter_stream('/api/generate', payload))
+        return parse_response(self.post('/api/generate', payload), False)
+
+    def iter_chat(self, messages: List[Dict[str, str]], model: str = None, temperature: float = None,
+                  options: Dict[str, Any] = None) -> Iterator[str]:
+        """流式调用 /api/chat，逐块产出增量文本"""
+        payload = self._build_payload(model, temperature, True, options, messages=messages)
+        return self._iter_stream('/api/chat', payload)
+
+    def iter_generate(self, prompt: str, model: str = None, temperature: float = None,
+                      options: Dict[str, Any] = None) -> Iterator[str]:
+        """流式调用 /api/generate，逐块产出增量文本"""
+        payload = self._build_payload(model, temperature, True, options, prompt=prompt)
+        return self._iter_stream('/api/generate', payload)
+
+    def close(self) -> None:
+        self.session.close()
+
+
+class AsyncLLMClient(_BaseLLMClient):
+    """
+    asyncio 客户端（需要安装 httpx）
+    httpx.AsyncClient 与并发信号量都绑定在创建它们的事件循环上，请通过 get_async_llm_client() 按事件循环获取
+    """
+
+    def __init__(self, *args, **kwargs):
+        if httpx is None:
+            raise ImportError("异步 LLM 客户端需要安装 httpx：pip install httpx")
+        super().__init__(*args, **kwargs)
+        self.client = httpx.AsyncClient(
+            timeout=httpx.Timeout(self.timeout, connect=self.connect_timeout),
+            limits=httpx.Limits(max_connections=self.pool_size, max_keepalive_connections=self.pool_size),
+        )
+        self._semaphore = asyncio.Semaphore(self.max_concurrency)
+
+    def _release(self) -> None:
+        self.metrics.end()
+        self._semaphore.release()
+
+    async def post(self, path: str, payload: Dict[str, Any], stream_response: bool = False) -> 'httpx.Response':
+        """异步发送请求，重试策略与 LLMClient.post 相同"""
+        url = self.endpoint + path
+        data = json.dumps(payload)
+        stream = bool(payload.get('stream'))
+        for attempt in range(self.max_retries + 1):
+            start = time.monotonic()
+            retryable = True
+            hold = False
+            await self._semaphore.acquire()
+            self.metrics.begin()
+            try:
+                request = self.client.build_request('POST', url, content=data)
+                response = await self.client.send(request, stream=stream_response)
+                if stream_response:
+                    if response.status_code == 200:
+                        hold = True
+                        return response
+                    await response.aread()
+            except (httpx.ConnectError, httpx.ConnectTimeout, httpx.RemoteProtocolError) as e:
+                error = f"LLM调用出错: {str(e)}"
+            except httpx.TimeoutException as e:
+                error, retryable = f"LLM调用出错: 请求超时 {str(e)}", False
+            except httpx.HTTPError as e:
+                error, retryable = f"LLM调用出错: {str(e)}", False
+            else:
+                if response.status_code == 200:
+                    self.metrics.record(payload.get('model', ''), time.monotonic() - start,
+                                        _extract_usage(response.content, stream))
+                    return response
+                error = f"LLM调用失败: HTTP {response.status_code} - {response.text[:500]}"
+                retryable = response.status_code in RETRY_STATUS
+            finally:
+                if not hold:
+                    self._release()
+            if not retryable or attempt >= self.max_retries:
+                break
+            self.metrics.record_retry()
+            await asyncio.sleep(self._backoff(attempt))
+        self.metrics.record_error()
+        raise LLMError(error)
+
+    async def _iter_stream(self, path: str, payload: Dict[str, Any]) -> AsyncIterator[str]:
+        """异步逐行读取流式响应，行为与 LLMClient._iter_stream 相同"""
+        start = time.monotonic()
+        response = await self.post(path, payload, stream_response=True)
+        first_token, usage = None, {}
+        try:
+            async for line in response.aiter_lines():
+                chunk = parse_stream_line(line)
+                if chunk is None:
+                    continue
+                if chunk.get('error'):
+                    raise LLMError(f"LLM调用出错: {chunk['error']}")
+                if chunk.get('done'):
+                    usage = chunk
+                delta = chunk_content(chunk)
+                if delta:
+                    if first_token is None:
+                        first_token = time.monotonic() - start
+                    yield delta
+        except LLMError:
+            self.metrics.record_error()
+            raise
+        except httpx.HTTPError as e:
+            self.metrics.record_error()
+            raise LLMError(f"LLM调用出错: {str(e)}")
+        else:
+            self.metrics.record(payload.get('model', ''), time.monotonic() - start, usage, first_token)
+        finally:
+            await response.aclose()
+            self._release()
+
+    async def chat(self, messages: List[Dict[str, str]], model: str = None, temperature: float = None,
+                   stream: bool = None, options: Dict[str, Any] = None) -> str:
+        payload = self._build_payload(model, temperature, stream, options, messages=messages)
+        if payload['stream']:
+            return ''.join([delta async for delta in self._iter_stream('/api/chat', payload)])
+        return parse_response(await self.post('/api/chat', payload), False)
+
+    async def generate(self, prompt: str, model: str = None, temperature: float = None,
+                       stream: bool = None, options: Dict[str, Any] = None) -> str:
+        payload = self._build_payload(model, temperature, stream, options, prompt=prompt)
+        if payload['stream']:
+            return ''.join([delta async for delta in self._iter_stream('/api/generate', payload)])
+        return parse_response(await self.post('/api/generate', payload), False)
+
+    def iter_chat(self, messages: List[Dict[str, str]], model: str = None, temperature: float = None,
+                  options: Dict[str, Any] = None) -> AsyncIterator[str]:
+        payload = self._build_payload(model, temperature, True, options, messages=messages)
+        return self._iter_stream('/api/chat', payload)
+
+    def iter_generate(self, prompt: str, model: str = None, temperature: float = None,
+                      options: Dict[str, Any] = None) -> AsyncIterator[str]:
+        payload = self._build_payload(model, temperature, True, options, prompt=prompt)
+        return self._iter_stream('/api/generate', payload)
+
+    async def close(self) -> None:
+        await self.client.aclose()
+
+
+_clients: Dict[str, LLMClient] = {}
+_clients_lock = threading.Lock()
+_async_clients: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, Dict[str, AsyncLLMClient]]" = weakref.WeakKeyDictionary()
+
+
+def _reset_after_fork() -> None:
+    """
+    fork 出的子进程（多进程服务的工作进程）中丢弃父进程的客户端：连接池中的套接字不能与父进程共用，
+    并发信号量与锁可能正被父进程中的其他线程持有
+    """
+    global _clients, _clients_lock, _async_clients, _metrics_lock
+    _clients = {}
+    _clients_lock = threading.Lock()
+    _async_clients = weakref.WeakKeyDictionary()
+    _metrics_lock = threading.Lock()
+    LLMClient._semaphores = {}
+    LLMClient._semaphores_lock = threading.Lock()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+def get_llm_client(endpoint: str = None) -> LLMClient:
+    """获取服务地址对应的共享同步客户端（默认为 ollama.endpoint）"""
+    endpoint = (endpoint or configs['ollama']['endpoint']).rstrip('/')
+    with _clients_lock:
+        client = _clients.get(endpoint)
+        if client is None:
+            client = _clients[endpoint] = LLMClient(endpoint)
+        return client
+
+
+def get_async_llm_client(endpoint: str = None) -> AsyncLLMClient:
+    """获取当前事件循环中服务地址对应的共享异步客户端（需在协程中调用）"""
+    endpoint = (endpoint or configs['ollama']['endpoint']).rstrip('/')
+    loop = asyncio.get_running_loop()
+    clients = _async_clients.setdefault(loop, {})
+    client = clients.get(endpoint)
+    if client is None:
+        client = clients[endpoint] = AsyncLLMClient(endpoint)
+    return client
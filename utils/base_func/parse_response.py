@@ -1,5 +1,7 @@
 import json
 import re
+from typing import Any, AsyncIterable, AsyncIterator, Dict, Iterable, Iterator, Optional
+
 def parse_response(response, stream: bool) -> str:
     """
     解析 LLM 的响应
@@ -44,4 +46,122 @@ def remove_think_tag(text: str) -> str:
     """
     移除文本中的<think>标签及其内容
     """
-    return re.sub(r'<think>.*?</think>', '', text, flags=re.DOTALL).strip()
\ No newline at end of file
+    return re.sub(r'<think>.*?</think>', '', text, flags=re.DOTALL).strip()
+
+def parse_stream_line(line) -> Optional[Dict[str, Any]]:
+    """
+    解析流式响应（NDJSON）中的一行
+    :return: 解析后的数据块，空行或无法解析时返回 None
+    """
+    if isinstance(line, bytes):
+        line = line.decode('utf-8', errors='replace')
+    if not line.strip():
+        return None
+    try:
+        return json.loads(line)
+    except json.JSONDecodeError:
+        return None
+
+
+def chunk_content(chunk: Dict[str, Any]) -> str:
+    """取出数据块中的增量文本（兼容 chat 与 generate 接口）"""
+    if 'message' in chunk:
+        return (chunk.get('message') or {}).get('content') or ''
+    return chunk.get('response') or ''
+
+
+class ThinkTagFilter:
+    """
+    流式输出中逐块移除 <think>...</think>，结果与对完整文本调用 remove_think_tag 相同
+    - 标签可能被拆分在相邻的块中，末尾可能是标签前缀的部分先保留，等下一块到达后再判断
+    - 与 strip() 一致：开头的空白不输出，末尾的空白等到后面还有内容时才输出
+    - 输出结束时仍未闭合的 <think> 段落视为思考内容丢弃
+    """
+
+    OPEN_TAG = '<think>'
+    CLOSE_TAG = '</think>'
+
+    def __init__(self):
+        self._buffer = ''
+        self._in_think = False
+        self._started = False
+        self._pending_space = ''
+
+    @staticmethod
+    def _partial_tag(text: str, tag: str) -> int:
+        """text 末尾与 tag 前缀重合的最大长度"""
+        for size in range(min(len(tag) - 1, len(text)), 0, -1):
+            if text.endswith(tag[:size]):
+                return size
+        return 0
+
+    def feed(self, text: str) -> str:
+        """
+        输入一个增量块
+        :return: 可以立即输出的文本（可能为空字符串）
+        """
+        self._buffer += text
+        output = []
+        while self._buffer:
+            if self._in_think:
+                end = self._buffer.find(self.CLOSE_TAG)
+                if end == -1:
+                    self._buffer = self._buffer[len(self._buffer) - self._partial_tag(self._buffer, self.CLOSE_TAG):]
+                    break
+                self._buffer = self._buffer[end + len(self.CLOSE_TAG):]
+                self._in_think = False
+            else:
+                start = self._buffer.find(self.OPEN_TAG)
+                if start == -1:
+                    keep = self._partial_tag(self._buffer, self.OPEN_TAG)
+                    output.append(self._buffer[:len(self._buffer) - keep])
+                    self._buffer = self._buffer[len(self._buffer) - keep:]
+                    break
+                output.append(self._buffer[:start])
+                self._buffer = self._buffer[start + len(self.OPEN_TAG):]
+                self._in_think = True
+        return self._emit(''.join(output))
+
+    def flush(self) -> str:
+        """输出结束时调用，返回剩余可输出的文本"""
+        text = '' if self._in_think else self._buffer
+        self._buffer = ''
+        self._in_think = False
+        result = self._emit(text)
+        self._pending_space = ''
+        return result
+
+    def _emit(self, text: str) -> str:
+        if not self._started:
+            text = text.lstrip()
+            if not text:
+                return ''
+            self._started = True
+        text = self._pending_space + text
+        stripped = text.rstrip()
+        self._pending_space = text[len(stripped):]
+        return stripped
+
+
+def strip_think_stream(deltas: Iterable[str]) -> Iterator[str]:
+    """对增量文本流逐块移除 <think> 段落"""
+    think_filter = ThinkTagFilter()
+    for delta in deltas:
+        text = think_filter.feed(delta)
+        if text:
+            yield text
+    text = think_filter.flush()
+    if text:
+        yield text
+
+
+async def astrip_think_stream(deltas: AsyncIterable[str]) -> AsyncIterator[str]:
+    """strip_think_stream 的异步版本"""
+    think_filter = ThinkTagFilter()
+    async for delta in deltas:
+        text = think_filter.feed(delta)
+        if text:
+            yield text
+    text = think_filter.flush()
+    if text:
+        yield text
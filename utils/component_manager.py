@@ -0,0 +1,219 @@
+"""
+组件管理模块
+模型（嵌入/重排序）、OCR 与版面分析引擎的加载耗时数十秒到数分钟，不应在导入模块时执行。
+每个重量级组件注册为 LazyComponent：
+- 第一次使用时加载，或在服务启动后由后台预热线程加载（warm_up），服务端口可以立即监听
+- 加载过程中其他线程的调用等待加载完成，可设置最长等待时间，超时抛出 ComponentUnavailable
+- 记录每个组件的状态（pending/loading/ready/failed）、加载耗时与错误信息，供健康检查接口使用
+- 加载失败后下一次使用时重试
+"""
+import os
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional
+
+
+class ComponentUnavailable(RuntimeError):
+    """组件正在加载（等待超时）或加载失败"""
+
+
+class LazyComponent:
+    """延迟加载的组件"""
+
+    def __init__(self, name: str, factory: Callable[[], Any],
+                 on_ready: Optional[Callable[[Any], None]] = None):
+        """
+        :param name: 组件名称
+        :param factory: 创建组件实例的函数
+        :param on_ready: 可选，加载成功后的回调（参数为组件实例），在加载线程中执行
+        """
+        self.name = name
+        self.factory = factory
+        self._ready_callbacks: List[Callable[[Any], None]] = [on_ready] if on_ready is not None else []
+        self.state = 'pending'
+        self.error: Optional[str] = None
+        self.started_at: Optional[float] = None
+        self.load_seconds: Optional[float] = None
+        self._instance = None
+        self._lock = threading.Lock()
+
+    @property
+    def ready(self) -> bool:
+        return self.state == 'ready'
+
+    def get(self, timeout: Optional[float] = None) -> Any:
+        """
+        获取组件实例，尚未加载时在当前线程中加载
+        :param timeout: 其他线程正在加载时的最长等待时间（秒），None 表示一直等待
+        :return: 组件实例
+        """
+        if self.state == 'ready':
+            return self._instance
+        if not self._lock.acquire(timeout=-1 if timeout is None else max(0, timeout)):
+            raise ComponentUnavailable(f"{self.name} 正在加载，请稍后重试")
+        try:
+            if self.state != 'ready':
+                self._load()
+        finally:
+            self._lock.release()
+        if self.state != 'ready':
+            raise ComponentUnavailable(f"{self.name} 加载失败: {self.error}")
+        return self._instance
+
+    def _load(self) -> None:
+        """加载组件（调用方持有锁）"""
+        self.state = 'loading'
+        self.started_at = time.time()
+        start = time.perf_counter()
+        print(f"正在加载组件 {self.name}...")
+        try:
+            instance = self.factory()
+        except Exception as e:
+            self.state = 'failed'
+            self.error = str(e)
+            self.load_seconds = round(time.perf_counter() - start, 3)
+            print(f"组件 {self.name} 加载失败: {str(e)}")
+            return
+        self._instance = instance
+        self.state = 'ready'
+        self.error = None
+        self.load_seconds = round(time.perf_counter() - start, 3)
+        print(f"组件 {self.name} 加载完成，耗时 {self.load_seconds} 秒")
+        for callback in list(self._ready_callbacks):
+            self._run_callback(callback, instance)
+
+    def _run_callback(self, callback: Callable[[Any], None], instance: Any) -> None:
+        try:
+            callback(instance)
+        except Exception as e:
+            print(f"组件 {self.name} 加载完成后的回调执行失败: {str(e)}")
+
+    def add_ready_callback(self, callback: Callable[[Any], None]) -> None:
+        """添加加载成功后的回调；组件已就绪时立即执行"""
+        with self._lock:
+            self._ready_callbacks.append(callback)
+            ready = self.state == 'ready'
+        if ready:
+            self._run_callback(callback, self._instance)
+
+    def start(self) -> Optional[threading.Thread]:
+        """在后台线程中加载组件，已加载或正在加载时返回 None"""
+        if self.state in ('ready', 'loading'):
+            return None
+
+        def load():
+            try:
+                self.get()
+            except ComponentUnavailable:
+                pass
+
+        thread = threading.Thread(target=load, name=f'warmup-{self.name}', daemon=True)
+        thread.start()
+        return thread
+
+    def set(self, instance: Any) -> None:
+        """直接指定组件实例（例如测试中注入替身），不执行 factory 与加载成功回调"""
+        with self._lock:
+            self._instance = instance
+            self.state = 'ready'
+            self.error = None
+
+    def reset(self) -> None:
+        """丢弃已加载的实例，下一次使用时重新加载"""
+        with self._lock:
+            self._instance = None
+            self.state = 'pending'
+            self.error = None
+            self.load_seconds = None
+
+    def status(self) -> Dict[str, Any]:
+        return {
+            'state': self.state,
+            'load_seconds': self.load_seconds,
+            'started_at': self.started_at,
+            'error': self.error,
+        }
+
+
+class ComponentProxy:
+    """
+    转发属性访问的组件代理：模块级变量可以在导入时定义，第一次访问属性时才加载组件
+    组件加载中时最多等待 timeout 秒，超时抛出 ComponentUnavailable
+    """
+
+    def __init__(self, component: LazyComponent, timeout: Optional[float] = None):
+        object.__setattr__(self, '_component', component)
+        object.__setattr__(self, '_timeout', timeout)
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self._component.get(self._timeout), name)
+
+    def __setattr__(self, name: str, value: Any) -> None:
+        setattr(self._component.get(self._timeout), name, value)
+
+
+# 全局组件注册表
+_components: Dict[str, LazyComponent] = {}
+_registry_lock = threading.Lock()
+
+
+def register_component(name: str, factory: Callable[[], Any],
+                       on_ready: Optional[Callable[[Any], None]] = None) -> LazyComponent:
+    """
+    注册组件，同名组件已存在时返回已有组件
+    :return: LazyComponent
+    """
+    with _registry_lock:
+        component = _components.get(name)
+        if component is None:
+            component = LazyComponent(name, factory, on_ready=on_ready)
+            _components[name] = component
+        return component
+
+
+def get_component(name: str) -> LazyComponent:
+    """获取已注册的组件，不存在时抛出 KeyError"""
+    with _registry_lock:
+        return _components[name]
+
+
+def warm_up(names: Optional[List[str]] = None) -> List[str]:
+    """
+    在后台线程中预加载组件（每个组件一个线程），立即返回
+    :param names: 组件名称列表，None 表示全部已注册组件；未注册的名称跳过
+    :return: 开始加载的组件名称
+    """
+    with _registry_lock:
+        components = list(_components.values()) if names is None else \
+            [_components[name] for name in names if name in _components]
+    started = []
+    for component in components:
+        if component.start() is not None:
+            started.append(component.name)
+    if started:
+        print(f"后台预加载组件: {', '.join(started)}")
+    return started
+
+
+def component_status() -> Dict[str, Dict[str, Any]]:
+    """全部组件的状态"""
+    with _registry_lock:
+        components = list(_components.values())
+    return {component.name: component.status() for component in components}
+
+
+def _reset_locks_after_fork() -> None:
+    """
+    子进程（例如入库流水线的解析进程）中重建锁：fork 时预热线程可能正持有加载锁，
+    该线程不会被复制到子进程，锁将永远无法释放；正在加载的组件在子进程中重新加载
+    """
+    global _registry_lock
+    _registry_lock = threading.Lock()
+    for component in _components.values():
+        component._lock = threading.Lock()
+        if component.state == 'loading':
+            component.state = 'pending'
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_locks_after_fork)
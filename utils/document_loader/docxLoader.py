@@ -24,6 +24,8 @@ class DocxLoader:
         # 使用共享的OCR引擎
         # self.ocr_engine = get_ocr_engine()
         self.ppstructure_engine = get_ppstructure_engine()
+        # 进度回调 (类型, 数量)，docx 只上报 images，由入库流水线设置
+        self.on_progress = None
 
     def load(self, file_path: str) -> List[str]:
         """
@@ -132,6 +134,8 @@ class DocxLoader:
             
             # 使用OCR进行识别
             result = self.ppstructure_engine(image_array)
+            if self.on_progress is not None:
+                self.on_progress('images', 1)
             
             # 处理识别结果
             img_content = []
@@ -16,6 +16,7 @@ class HTMLLoader:
         """
         self.chunk_size = chunk_size
         self.chunk_overlap = chunk_overlap
+        self.metadata = {}  # 页面元数据（标题、描述、meta 标签）
         
     def load(self, file_path: str) -> List[str]:
         """
@@ -37,6 +38,7 @@ class HTMLLoader:
             
         # 使用 BeautifulSoup 解析 HTML
         soup = BeautifulSoup(html_content, 'html.parser')
+        self.metadata = self._extract_metadata(soup)
         
         # 提取纯文本内容
         # 移除 script 和 style 元素
@@ -0,0 +1,86 @@
+"""
+文档解析入口（入库流水线的解析阶段）
+解析进程只导入本模块与各文档加载器，不经过 utils.rag（向量库、嵌入模型等依赖）
+"""
+import json
+import time
+from pathlib import Path
+from typing import Any, Callable, Dict
+from .csvLoader import CSVLoader
+from .mdLoader import MDLoader
+from .pdfLoader import PDFLoader
+from .txtLoader import TXTLoader
+from .docxLoader import DocxLoader
+from .htmlLoader import HTMLLoader
+
+
+def get_loader(file_path: str):
+    """根据文件扩展名选择文档加载器，不支持的格式返回 None"""
+    if file_path.endswith('.csv'):
+        return CSVLoader()
+    elif file_path.endswith('.docx'):
+        return DocxLoader()
+    elif file_path.endswith('.md'):
+        return MDLoader()
+    elif file_path.endswith('.pdf'):
+        return PDFLoader()
+    elif file_path.endswith('.html') or file_path.endswith('.htm'):
+        return HTMLLoader()
+    elif file_path.endswith('.txt') or (Path(file_path).suffix == '' and Path(file_path).is_file()):
+        return TXTLoader()
+    return None
+
+
+def is_supported(file_path: str) -> bool:
+    """判断文件格式是否支持（不实例化加载器）"""
+    suffix = Path(file_path).suffix
+    if suffix in ('.csv', '.docx', '.md', '.pdf', '.html', '.htm', '.txt'):
+        return True
+    return suffix == '' and Path(file_path).is_file()
+
+
+# 解析进程中的进度队列，由进程池初始化函数设置
+_parse_progress_queue = None
+
+
+def init_parse_worker(progress_queue) -> None:
+    """解析进程初始化：保存进度队列（队列只能在创建进程时传入）"""
+    global _parse_progress_queue
+    _parse_progress_queue = progress_queue
+
+
+def _put_parse_progress(kind: str, count: int) -> None:
+    _parse_progress_queue.put((kind, count))
+
+
+def parse_file(file_path: str, on_progress: Callable[[str, int], None] = None) -> Dict[str, Any]:
+    """
+    解析单个文件（在子进程中执行，必须是模块级函数才能被 pickle）
+    :param on_progress: 可选，解析进度回调 (类型, 数量)，类型为 pages_total / pages / images；
+                        在解析进程中未指定时写入进程池的进度队列
+    :return: {'file_path', 'chunks': [(chunk_index, 文本)], 'total_chunks', 'metadata', 'seconds'}
+    """
+    start = time.perf_counter()
+    loader = get_loader(file_path)
+    if on_progress is None and _parse_progress_queue is not None:
+        on_progress = _put_parse_progress
+    if on_progress is not None and hasattr(loader, 'on_progress'):
+        loader.on_progress = on_progress
+    chunks = loader.load(file_path) if loader is not None else []
+    # 保留原始 chunk_index，空块跳过
+    indexed_chunks = [(i, str(chunk)) for i, chunk in enumerate(chunks) if str(chunk) != '']
+    return {
+        'file_path': file_path,
+        'chunks': indexed_chunks,
+        'total_chunks': len(chunks),
+        'metadata': _clean_metadata(getattr(loader, 'metadata', None)),
+        'seconds': time.perf_counter() - start,
+    }
+
+
+def _clean_metadata(metadata: Any) -> Dict[str, Any]:
+    """加载器提取的文件元数据（Markdown Front Matter、HTML meta 标签）转换为可 JSON 序列化的字典"""
+    if not isinstance(metadata, dict) or not metadata:
+        return {}
+    # YAML 中的日期等类型转为字符串
+    return json.loads(json.dumps(metadata, ensure_ascii=False, default=str))
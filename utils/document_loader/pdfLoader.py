@@ -26,6 +26,17 @@ class PDFLoader:
         # 使用共享的 OCR 引擎而不是创建新实例
         # self.ocr_engine = get_ocr_engine()
         self.ppstructure_engine = get_ppstructure_engine()
+        # 进度回调 (类型, 数量)，类型为 pages_total / pages / images，由入库流水线设置
+        self.on_progress = None
+
+    def _report(self, kind: str, count: int = 1):
+        """上报解析进度（回调出错不影响解析）"""
+        if self.on_progress is not None:
+            try:
+                self.on_progress(kind, count)
+            except Exception as e:
+                print(f"上报解析进度失败: {str(e)}")
+
     def load(self, file_path: str) -> List[str]:
         """
         加载并分块PDF文件
@@ -69,6 +80,7 @@ class PDFLoader:
             image_array = np.array(pil_image)
             
             result = self.ppstructure_engine(image_array)
+            self._report('images')
             
             # 处理识别结果
             img_content = []
@@ -109,6 +121,7 @@ class PDFLoader:
             with fitz.open(file_path) as doc:
                 # 显示处理PDF页面的进度条
                 print(f"正在处理PDF文件: {os.path.basename(file_path)}")
+                self._report('pages_total', len(doc))
                 # 遍历每一页
                 for page_num, page in tqdm(enumerate(doc), total=len(doc), desc="处理PDF页面"):
                     # print(f"page_num: {page_num}")
@@ -194,6 +207,7 @@ class PDFLoader:
                     # 添加页面分隔符（可选）
                     if page_num < len(doc) - 1:
                         text += f"[第{page_num+1}页结束]\n\n"
+                    self._report('pages')
                     
         except Exception as e:
             print(f"处理PDF文件时出错: {str(e)}")
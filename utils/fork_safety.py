@@ -0,0 +1,32 @@
+"""
+fork 安全
+多进程服务（gunicorn 预加载后 fork 工作进程）中，子进程只复制 fork 时调用 os.fork 的线程：
+其他线程持有的锁永远不会释放，线程池和后台线程已不存在，sqlite 连接与 HTTP 连接池中的套接字与父进程共享。
+持有这类资源的对象通过 register_after_fork 登记，在子进程中调用其 _after_fork() 重建线程相关状态。
+"""
+import os
+import threading
+import weakref
+
+_objects: "weakref.WeakSet" = weakref.WeakSet()
+_objects_lock = threading.Lock()
+
+
+def register_after_fork(obj) -> None:
+    """登记对象（弱引用），fork 出的子进程中调用 obj._after_fork()"""
+    with _objects_lock:
+        _objects.add(obj)
+
+
+def _run_after_fork() -> None:
+    global _objects_lock
+    _objects_lock = threading.Lock()
+    for obj in list(_objects):
+        try:
+            obj._after_fork()
+        except Exception as e:
+            print(f"重置 {type(obj).__name__} 的进程状态失败: {str(e)}")
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_run_after_fork)
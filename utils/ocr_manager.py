@@ -1,23 +1,22 @@
 """
 OCR 引擎管理模块
+引擎在第一次使用时创建（或由启动预热线程创建），导入本模块不会加载 PaddleOCR
 """
-from paddleocr import PaddleOCR
+from utils.component_manager import register_component
 
-# 全局 OCR 引擎实例
-ocr_engine = None
+
+def _create_ocr_engine():
+    from paddleocr import PaddleOCR
+    return PaddleOCR(lang='ch',show_log=False)
+
+
+# 全局 OCR 引擎组件
+ocr_component = register_component('ocr', _create_ocr_engine)
 
 def initialize_ocr():
     """初始化 OCR 引擎"""
-    global ocr_engine
-    if ocr_engine is None:
-        print("正在初始化 OCR 引擎...")
-        ocr_engine = PaddleOCR(lang='ch',show_log=False)
-        print("OCR 引擎初始化完成")
-    return ocr_engine
+    return ocr_component.get()
 
 def get_ocr_engine():
     """获取 OCR 引擎实例"""
-    global ocr_engine
-    if ocr_engine is None:
-        return initialize_ocr()
-    return ocr_engine 
\ No newline at end of file
+    return ocr_component.get()
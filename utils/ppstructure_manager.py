@@ -1,24 +1,22 @@
 """
 PPStructure 引擎管理模块
+引擎在第一次使用时创建（或由启动预热线程创建），导入本模块不会加载 PaddleOCR
 """
-from paddleocr import PPStructure,draw_structure_result,save_structure_res
+from utils.component_manager import register_component
 
-# 全局 OCR 引擎实例
-table_engine = None
+
+def _create_ppstructure_engine():
+    from paddleocr import PPStructure
+    return PPStructure(lang='ch',show_log=False)
+
+
+# 全局 PPStructure 引擎组件
+ppstructure_component = register_component('ppstructure', _create_ppstructure_engine)
 
 def initialize_ppstructure():
     """初始化 PPStructure 引擎"""
-    global table_engine
-    if table_engine is None:
-        print("正在初始化 PPStructure 引擎...")
-        table_engine = PPStructure(lang='ch',show_log=False)
-
-        print("PPStructure 引擎初始化完成")
-    return table_engine
+    return ppstructure_component.get()
 
 def get_ppstructure_engine():
     """获取 PPStructure 引擎实例"""
-    global table_engine
-    if table_engine is None:
-        return initialize_ppstructure()
-    return table_engine 
\ No newline at end of file
+    return ppstructure_component.get()
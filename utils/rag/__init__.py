@@ -1 +1,2 @@
-from .rag import Rag
\ No newline at end of file
+from .rag import Rag
+from .registry import get_rag, set_rag, reset_rag
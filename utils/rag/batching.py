@@ -0,0 +1,191 @@
+"""
+推理请求合并（动态微批）模块
+并发的 HTTP 请求各自以批大小 1 调用共享的嵌入模型/重排序模型，模型利用率低且互相争抢设备。
+MicroBatcher 放在模型前面：
+- 调用方提交一组输入（如一个查询、一次检索的全部 (查询, 文档块) 对）后等待 Future
+- 单个工作线程收集请求，直到累计输入数达到 max_batch_size 或最早的请求已等待 max_wait_ms
+- 合并为一次批量推理，再按各请求的输入数拆分结果返回
+- 模型只在工作线程中被调用，同一模型不会被并发调用
+- 统计队列深度与批大小分布（按 2 的幂分桶）
+"""
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from typing import Any, Callable, Dict, List, Optional, Sequence
+from utils.fork_safety import register_after_fork
+
+
+def _bucket(value: int) -> str:
+    """按 2 的幂分桶：1, 2, 3-4, 5-8, 9-16 ..."""
+    if value <= 2:
+        return str(value)
+    upper = 1 << (value - 1).bit_length()
+    return f"{upper // 2 + 1}-{upper}"
+
+
+class _Request:
+    __slots__ = ('items', 'future', 'enqueued_at')
+
+    def __init__(self, items: List[Any]):
+        self.items = items
+        self.future = Future()
+        self.enqueued_at = time.monotonic()
+
+
+class MicroBatcher:
+    """合并并发的小批量推理请求"""
+
+    def __init__(self, func: Callable[[List[Any]], Sequence[Any]], max_batch_size: int = 32,
+                 max_wait_ms: float = 5, name: str = 'batcher'):
+        """
+        :param func: 批量推理函数，输入列表，返回与输入等长、支持切片的结果（列表或数组）
+        :param max_batch_size: 单次推理的最大输入数（单个请求超过该值时单独成批）
+        :param max_wait_ms: 最早的请求最多等待多久（毫秒）以凑成更大的批，0 表示只合并已在排队的请求
+        :param name: 工作线程名称
+        """
+        self.func = func
+        self.max_batch_size = max(1, int(max_batch_size))
+        self.max_wait = max(0.0, float(max_wait_ms)) / 1000
+        self.name = name
+        self._queue: "queue.Queue[Optional[_Request]]" = queue.Queue()
+        self._thread: Optional[threading.Thread] = None
+        self._start_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self._reset_stats()
+        register_after_fork(self)
+
+    def _after_fork(self) -> None:
+        # 子进程中工作线程已不存在，队列与锁可能处于被其他线程持有的状态，全部重建
+        self._queue = queue.Queue()
+        self._thread = None
+        self._start_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self._reset_stats()
+
+    def _reset_stats(self) -> None:
+        self._stats = {'requests': 0, 'items': 0, 'batches': 0, 'errors': 0,
+                       'busy_seconds': 0.0, 'wait_seconds': 0.0, 'max_queue_depth': 0}
+        self._batch_sizes: Dict[str, int] = {}
+        self._queue_depths: Dict[str, int] = {}
+        # 已提交但尚未开始推理的请求数（含正在凑批的请求）
+        self._pending = 0
+
+    def _ensure_worker(self) -> None:
+        """首次提交时才启动工作线程（多进程服务在 fork 之后才会创建线程）"""
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._start_lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._loop, name=f'{self.name}-batcher', daemon=True)
+                self._thread.start()
+
+    def submit(self, items: List[Any]) -> Future:
+        """
+        提交一组输入
+        :return: Future，结果为与 items 等长的推理结果
+        """
+        items = list(items)
+        request = _Request(items)
+        if not items:
+            request.future.set_result([])
+            return request.future
+        self._ensure_worker()
+        with self._stats_lock:
+            self._pending += 1
+            self._stats['requests'] += 1
+            self._stats['max_queue_depth'] = max(self._stats['max_queue_depth'], self._pending)
+            key = _bucket(self._pending)
+            self._queue_depths[key] = self._queue_depths.get(key, 0) + 1
+        self._queue.put(request)
+        return request.future
+
+    def __call__(self, items: List[Any], timeout: float = None) -> Sequence[Any]:
+        """同步调用：提交并等待结果"""
+        return self.submit(items).result(timeout=timeout)
+
+    def _loop(self) -> None:
+        carry: Optional[_Request] = None
+        while True:
+            first = carry if carry is not None else self._queue.get()
+            carry = None
+            if first is None:
+                return
+            batch = [first]
+            size = len(first.items)
+            stopping = False
+            deadline = first.enqueued_at + self.max_wait
+            while size < self.max_batch_size:
+                timeout = deadline - time.monotonic()
+                try:
+                    request = self._queue.get(timeout=timeout) if timeout > 0 else self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if request is None:
+                    stopping = True
+                    break
+                if size + len(request.items) > self.max_batch_size:
+                    # 放不下的请求留到下一批
+                    carry = request
+                    break
+                batch.append(request)
+                size += len(request.items)
+            self._run(batch)
+            if stopping:
+                return
+
+    def _run(self, batch: List[_Request]) -> None:
+        with self._stats_lock:
+            self._pending -= len(batch)
+        # 已被调用方取消的请求不再推理
+        batch = [request for request in batch if request.future.set_running_or_notify_cancel()]
+        if not batch:
+            return
+        items = [item for request in batch for item in request.items]
+        start = time.monotonic()
+        try:
+            outputs = self.func(items)
+        except Exception as e:
+            with self._stats_lock:
+                self._stats['errors'] += 1
+            for request in batch:
+                request.future.set_exception(e)
+            return
+        elapsed = time.monotonic() - start
+
+        with self._stats_lock:
+            self._stats['batches'] += 1
+            self._stats['items'] += len(items)
+            self._stats['busy_seconds'] += elapsed
+            self._stats['wait_seconds'] += sum(start - request.enqueued_at for request in batch)
+            key = _bucket(len(items))
+            self._batch_sizes[key] = self._batch_sizes.get(key, 0) + 1
+
+        offset = 0
+        for request in batch:
+            request.future.set_result(outputs[offset:offset + len(request.items)])
+            offset += len(request.items)
+
+    def stats(self) -> Dict[str, Any]:
+        """请求数、批数、平均批大小、平均排队时间以及队列深度/批大小分布"""
+        with self._stats_lock:
+            stats = dict(self._stats)
+            batches = stats['batches']
+            stats.update({
+                'queue_depth': self._pending,
+                'avg_batch_size': round(stats['items'] / batches, 2) if batches else 0.0,
+                'avg_wait_ms': round(stats['wait_seconds'] / stats['requests'] * 1000, 2) if stats['requests'] else 0.0,
+                'batch_size_histogram': dict(self._batch_sizes),
+                'queue_depth_histogram': dict(self._queue_depths),
+                'max_batch_size': self.max_batch_size,
+                'max_wait_ms': self.max_wait * 1000,
+            })
+        stats['busy_seconds'] = round(stats['busy_seconds'], 4)
+        stats['wait_seconds'] = round(stats['wait_seconds'], 4)
+        return stats
+
+    def shutdown(self) -> None:
+        """处理完已排队的请求后停止工作线程"""
+        if self._thread is not None and self._thread.is_alive():
+            self._queue.put(None)
+            self._thread.join()
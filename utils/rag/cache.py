@@ -0,0 +1,165 @@
+"""
+检索缓存模块
+替代 Rag.retrieval_cache 普通字典：
+- 每个命名空间独立的容量与有效期，OrderedDict 实现 O(1) LRU 淘汰
+- 写入加锁；读取不阻塞（仅在锁空闲时刷新 LRU 顺序）
+- 命中/未命中/淘汰/过期计数
+- 语料版本号：依赖知识库内容的命名空间以版本号作为键的一部分，入库、删除、修改文档块后版本号递增，旧结果自动失效
+"""
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, Optional
+
+_MISSING = object()
+
+
+class LRUCache:
+    """带 TTL 的线程安全 LRU 缓存"""
+
+    def __init__(self, max_size: int = 256, ttl: float = 3600):
+        """
+        :param max_size: 最大条目数
+        :param ttl: 有效期（秒），0 或 None 表示不过期
+        """
+        self.max_size = max(1, int(max_size))
+        self.ttl = ttl or 0
+        self._data: "OrderedDict[Hashable, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        entry = self._data.get(key, _MISSING)
+        if entry is _MISSING:
+            self.misses += 1
+            return default
+        value, expires_at = entry
+        if expires_at and time.monotonic() >= expires_at:
+            with self._lock:
+                # 删除前确认仍是同一条目（期间可能被重新写入）
+                if self._data.get(key) is entry:
+                    del self._data[key]
+                    self.expirations += 1
+            self.misses += 1
+            return default
+        # 读取路径不等待锁：锁被占用时跳过本次 LRU 顺序刷新
+        if self._lock.acquire(blocking=False):
+            try:
+                if key in self._data:
+                    self._data.move_to_end(key)
+            finally:
+                self._lock.release()
+        self.hits += 1
+        return value
+
+    def set(self, key: Hashable, value: Any) -> None:
+        expires_at = time.monotonic() + self.ttl if self.ttl else 0
+        with self._lock:
+            self._data[key] = (value, expires_at)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def pop(self, key: Hashable) -> None:
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def stats(self) -> Dict[str, Any]:
+        total = self.hits + self.misses
+        return {
+            'size': len(self._data),
+            'max_size': self.max_size,
+            'ttl': self.ttl,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': round(self.hits / total, 4) if total else 0.0,
+            'evictions': self.evictions,
+            'expirations': self.expirations,
+        }
+
+
+class RetrievalCache:
+    """
+    按命名空间管理多个 LRUCache，并维护语料版本号
+    namespaces 示例: {'retrieval': {'max_size': 256, 'ttl': 3600, 'versioned': True}}
+    """
+
+    DEFAULT_NAMESPACE = {'max_size': 256, 'ttl': 3600, 'versioned': True}
+
+    def __init__(self, namespaces: Dict[str, Dict[str, Any]] = None):
+        self._namespaces: Dict[str, LRUCache] = {}
+        self._versioned: Dict[str, bool] = {}
+        self._lock = threading.Lock()
+        self._corpus_version = 0
+        for name, options in (namespaces or {}).items():
+            self._create(name, options or {})
+
+    def _create(self, name: str, options: Dict[str, Any]) -> LRUCache:
+        options = dict(self.DEFAULT_NAMESPACE, **options)
+        cache = LRUCache(options['max_size'], options['ttl'])
+        self._versioned[name] = bool(options['versioned'])
+        self._namespaces[name] = cache
+        return cache
+
+    def namespace(self, name: str) -> LRUCache:
+        """获取命名空间，不存在时按默认参数创建"""
+        cache = self._namespaces.get(name)
+        if cache is None:
+            with self._lock:
+                cache = self._namespaces.get(name) or self._create(name, {})
+        return cache
+
+    @property
+    def corpus_version(self) -> int:
+        return self._corpus_version
+
+    def bump_corpus_version(self) -> int:
+        """知识库内容发生变化：递增版本号并清空依赖知识库内容的命名空间"""
+        with self._lock:
+            self._corpus_version += 1
+            version = self._corpus_version
+        for name, cache in list(self._namespaces.items()):
+            if self._versioned[name]:
+                cache.clear()
+        return version
+
+    def _key(self, name: str, key: Hashable, version: Optional[int]) -> Hashable:
+        if not self._versioned.get(name, True):
+            return key
+        return (self._corpus_version if version is None else version, key)
+
+    def get(self, name: str, key: Hashable, default: Any = None) -> Any:
+        cache = self.namespace(name)
+        return cache.get(self._key(name, key, None), default)
+
+    def set(self, name: str, key: Hashable, value: Any, version: Optional[int] = None) -> None:
+        """
+        写入缓存
+        :param version: 计算结果时读取到的语料版本号；结果计算期间语料发生变化时，写入的条目不会再被命中
+        """
+        cache = self.namespace(name)
+        cache.set(self._key(name, key, version), value)
+
+    def clear(self, name: str = None) -> None:
+        if name is None:
+            for cache in self._namespaces.values():
+                cache.clear()
+        else:
+            self.namespace(name).clear()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'corpus_version': self._corpus_version,
+            'namespaces': {name: cache.stats() for name, cache in self._namespaces.items()},
+        }
@@ -0,0 +1,422 @@
+"""
+文档块存储模块
+使用标准库 sqlite3 保存文档块元数据，替代整体读写的 metadata.json
+- WAL 模式，读写互不阻塞
+- row_id 与向量存储中的行号一一对应
+- 对 file_path 和 (file_path, chunk_index) 建立索引，按文件查询、单块更新不再扫描全部数据
+- 兼容原来的 list 用法：len()、下标访问、迭代、extend
+- files 表记录每个文件的 (大小, 修改时间, 内容哈希)，文档块记录内容哈希，用于增量重建索引
+- row_layout 表记录行号版本：删除使 row_id 前移时在同一事务内递增，检索据此判断行号与向量行是否仍然对应
+"""
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional, Tuple, Union
+from utils.fork_safety import register_after_fork
+
+
+def hash_text(text: str) -> str:
+    """文本内容哈希"""
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+
+def hash_file(file_path: Union[str, Path], block_size: int = 1 << 20) -> str:
+    """文件内容哈希（分块读取，避免大文件一次性读入内存）"""
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class ChunkStore:
+    """基于 SQLite 的文档块存储"""
+
+    # 独立成列的字段，其余字段以 JSON 形式存放在 extra 列中
+    COLUMNS = ('file_path', 'chunk_index', 'chunk_summary', 'chunk_content', 'total_chunks', 'timestamp',
+               'content_hash')
+
+    SCHEMA = """
+    CREATE TABLE IF NOT EXISTS chunks (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        row_id INTEGER NOT NULL,
+        file_path TEXT NOT NULL,
+        chunk_index INTEGER NOT NULL DEFAULT 0,
+        chunk_summary TEXT,
+        chunk_content TEXT,
+        total_chunks INTEGER,
+        timestamp REAL,
+        extra TEXT,
+        content_hash TEXT
+    );
+    CREATE INDEX IF NOT EXISTS idx_chunks_row_id ON chunks(row_id);
+    CREATE INDEX IF NOT EXISTS idx_chunks_file_path ON chunks(file_path);
+    CREATE INDEX IF NOT EXISTS idx_chunks_file_chunk ON chunks(file_path, chunk_index);
+    CREATE TABLE IF NOT EXISTS files (
+        file_path TEXT PRIMARY KEY,
+        size INTEGER,
+        mtime REAL,
+        content_hash TEXT,
+        indexed_at REAL
+    );
+    CREATE INDEX IF NOT EXISTS idx_files_content_hash ON files(content_hash);
+    CREATE TABLE IF NOT EXISTS row_layout (
+        id INTEGER PRIMARY KEY CHECK (id = 0),
+        epoch INTEGER NOT NULL
+    );
+    INSERT OR IGNORE INTO row_layout (id, epoch) VALUES (0, 0);
+    """
+
+    def __init__(self, db_path: Union[str, Path], legacy_path: Union[str, Path] = None):
+        """
+        :param db_path: SQLite 数据库文件路径
+        :param legacy_path: 旧版 metadata.json 路径，数据库为空时自动导入
+        """
+        self.db_path = Path(db_path)
+        self.legacy_path = Path(legacy_path) if legacy_path else None
+        self._local = threading.local()
+        self._write_lock = threading.Lock()
+        register_after_fork(self)
+
+        conn = self._conn()
+        conn.executescript(self.SCHEMA)
+        self._upgrade_schema(conn)
+        conn.commit()
+        if len(self) == 0 and self.legacy_path is not None and self.legacy_path.exists():
+            self._migrate_legacy()
+
+    # ---------- 连接与行转换 ----------
+
+    def _after_fork(self) -> None:
+        # fork 出的子进程不能继续使用父进程的 sqlite 连接
+        self._local = threading.local()
+        self._write_lock = threading.Lock()
+
+    def _conn(self) -> sqlite3.Connection:
+        """每个线程使用独立连接（Flask 多线程环境下 sqlite3 连接不能跨线程共享）"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(str(self.db_path), timeout=30)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    @staticmethod
+    def _upgrade_schema(conn: sqlite3.Connection) -> None:
+        """为旧版数据库补充 content_hash 列及其索引，并回填已有文档块的哈希"""
+        columns = {row[1] for row in conn.execute("PRAGMA table_info(chunks)")}
+        if 'content_hash' not in columns:
+            conn.execute("ALTER TABLE chunks ADD COLUMN content_hash TEXT")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_chunks_content_hash ON chunks(content_hash)")
+        conn.execute(
+            "CREATE INDEX IF NOT EXISTS idx_chunks_missing_summary ON chunks(row_id) WHERE chunk_summary IS NULL"
+        )
+        rows = conn.execute("SELECT id, chunk_content FROM chunks WHERE content_hash IS NULL").fetchall()
+        if rows:
+            conn.executemany(
+                "UPDATE chunks SET content_hash = ? WHERE id = ?",
+                [(hash_text(row[1] or ''), row[0]) for row in rows]
+            )
+
+    def _to_params(self, doc: Dict[str, Any]) -> Tuple:
+        """文档字典 -> 数据库列"""
+        extra = {k: v for k, v in doc.items() if k not in self.COLUMNS}
+        content = doc.get('chunk_content', doc.get('content', ''))
+        return (
+            doc.get('file_path', ''),
+            int(doc.get('chunk_index', 0) or 0),
+            doc.get('chunk_summary'),
+            content,
+            doc.get('total_chunks'),
+            doc.get('timestamp'),
+            json.dumps(extra, ensure_ascii=False) if extra else None,
+            doc.get('content_hash') or hash_text(content or ''),
+        )
+
+    @staticmethod
+    def _to_doc(row: sqlite3.Row) -> Dict[str, Any]:
+        """数据库行 -> 文档字典（值为 NULL 的可选字段不出现在字典中，保持与旧版元数据一致）"""
+        doc = {
+            'file_path': row['file_path'],
+            'chunk_index': row['chunk_index'],
+        }
+        for key in ('chunk_summary', 'chunk_content', 'total_chunks', 'timestamp', 'content_hash'):
+            if row[key] is not None:
+                doc[key] = row[key]
+        if row['extra']:
+            doc.update(json.loads(row['extra']))
+        return doc
+
+    # ---------- list 兼容接口 ----------
+
+    def __len__(self) -> int:
+        # row_id 连续，取最大值比 COUNT(*) 更快（走索引）
+        row = self._conn().execute("SELECT MAX(row_id) FROM chunks").fetchone()
+        return 0 if row[0] is None else row[0] + 1
+
+    def __bool__(self) -> bool:
+        return len(self) > 0
+
+    def __getitem__(self, index: Union[int, slice]) -> Union[Dict[str, Any], List[Dict[str, Any]]]:
+        total = len(self)
+        if isinstance(index, slice):
+            return self.get_rows(range(*index.indices(total)))
+        index = int(index)
+        if index < 0:
+            index += total
+        row = self._conn().execute("SELECT * FROM chunks WHERE row_id = ?", (index,)).fetchone()
+        if row is None:
+            raise IndexError("文档块下标越界")
+        return self._to_doc(row)
+
+    def __iter__(self) -> Iterator[Dict[str, Any]]:
+        cursor = self._conn().execute("SELECT * FROM chunks ORDER BY row_id")
+        while True:
+            rows = cursor.fetchmany(1000)
+            if not rows:
+                break
+            for row in rows:
+                yield self._to_doc(row)
+
+    def append(self, doc: Dict[str, Any]) -> None:
+        self.extend([doc])
+
+    def extend(self, docs: List[Dict[str, Any]]) -> None:
+        """追加文档块，row_id 从当前末尾开始连续分配"""
+        if not docs:
+            return
+        with self._write_lock:
+            conn = self._conn()
+            start = len(self)
+            conn.executemany(
+                "INSERT INTO chunks (row_id, file_path, chunk_index, chunk_summary, chunk_content, "
+                "total_chunks, timestamp, extra, content_hash) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                [(start + i, *self._to_params(doc)) for i, doc in enumerate(docs)]
+            )
+            conn.commit()
+
+    # ---------- 查询 ----------
+
+    def get_rows(self, row_ids) -> List[Dict[str, Any]]:
+        """按 row_id 批量获取文档块，返回顺序与 row_ids 一致"""
+        row_ids = [int(i) for i in row_ids]
+        if not row_ids:
+            return []
+        docs = {}
+        conn = self._conn()
+        # SQLite 默认最多 999 个绑定参数
+        for start in range(0, len(row_ids), 900):
+            batch = row_ids[start:start + 900]
+            placeholders = ','.join('?' * len(batch))
+            for row in conn.execute(f"SELECT * FROM chunks WHERE row_id IN ({placeholders})", batch):
+                docs[row['row_id']] = self._to_doc(row)
+        return [docs[i] for i in row_ids]
+
+    def row_epoch(self) -> int:
+        """行号版本：每次删除行（row_id 前移）或清空后递增"""
+        return self._conn().execute("SELECT epoch FROM row_layout").fetchone()[0]
+
+    def get_file_rows(self, file_path: str) -> List[Tuple[int, Dict[str, Any]]]:
+        """获取指定文件的全部 (row_id, 文档块)，按 chunk_index 排序"""
+        rows = self._conn().execute(
+            "SELECT * FROM chunks WHERE file_path = ? ORDER BY chunk_index", (file_path,)
+        ).fetchall()
+        return [(row['row_id'], self._to_doc(row)) for row in rows]
+
+    def get_file_chunk_ids(self, file_path: str) -> List[int]:
+        """获取指定文件全部文档块的 chunks.id（自增主键，不随其他行的删除而变化）"""
+        rows = self._conn().execute("SELECT id FROM chunks WHERE file_path = ?", (file_path,)).fetchall()
+        return [row[0] for row in rows]
+
+    def rows_for_chunk_ids(self, chunk_ids) -> List[int]:
+        """按 chunks.id 查找文档块当前的 row_id（已删除的文档块不返回），升序"""
+        chunk_ids = [int(i) for i in chunk_ids]
+        conn = self._conn()
+        row_ids = []
+        for start in range(0, len(chunk_ids), 900):
+            batch = chunk_ids[start:start + 900]
+            placeholders = ','.join('?' * len(batch))
+            row_ids.extend(row[0] for row in conn.execute(
+                f"SELECT row_id FROM chunks WHERE id IN ({placeholders})", batch))
+        return sorted(row_ids)
+
+    def get_file_chunks(self, file_path: str) -> List[Dict[str, Any]]:
+        """获取指定文件的全部文档块，按 chunk_index 排序"""
+        return [doc for _, doc in self.get_file_rows(file_path)]
+
+    def find_row(self, file_path: str, chunk_index: int) -> Optional[int]:
+        """查找指定文件指定块的 row_id（存在多个版本时取最新写入的一个）"""
+        row = self._conn().execute(
+            "SELECT row_id FROM chunks WHERE file_path = ? AND chunk_index = ? ORDER BY id DESC LIMIT 1",
+            (file_path, int(chunk_index))
+        ).fetchone()
+        return None if row is None else row[0]
+
+    def count_file_chunks(self, file_path: str) -> int:
+        row = self._conn().execute("SELECT COUNT(*) FROM chunks WHERE file_path = ?", (file_path,)).fetchone()
+        return row[0]
+
+    def file_paths(self) -> set:
+        """已入库的全部文件路径"""
+        return {row[0] for row in self._conn().execute("SELECT DISTINCT file_path FROM chunks")}
+
+    def find_by_content_hash(self, content_hash: str) -> Optional[Tuple[int, Dict[str, Any]]]:
+        """按内容哈希查找任意一个相同内容的文档块，返回 (row_id, 文档块)"""
+        row = self._conn().execute(
+            "SELECT * FROM chunks WHERE content_hash = ? LIMIT 1", (content_hash,)
+        ).fetchone()
+        return None if row is None else (row['row_id'], self._to_doc(row))
+
+    def rows_missing_summary(self, after_row: int = -1, limit: int = 100) -> List[Tuple[int, Dict[str, Any]]]:
+        """按 row_id 顺序分页获取尚未生成摘要的 (row_id, 文档块)"""
+        rows = self._conn().execute(
+            "SELECT * FROM chunks WHERE chunk_summary IS NULL AND row_id > ? ORDER BY row_id LIMIT ?",
+            (int(after_row), int(limit))
+        ).fetchall()
+        return [(row['row_id'], self._to_doc(row)) for row in rows]
+
+    def count_missing_summaries(self) -> int:
+        row = self._conn().execute("SELECT COUNT(*) FROM chunks WHERE chunk_summary IS NULL").fetchone()
+        return row[0]
+
+    def iter_filter_fields(self) -> Iterator[Tuple[int, str, Optional[float], Optional[str]]]:
+        """按 row_id 顺序返回 (row_id, file_path, timestamp, extra JSON)，用于构建元数据过滤索引"""
+        cursor = self._conn().execute("SELECT row_id, file_path, timestamp, extra FROM chunks ORDER BY row_id")
+        while True:
+            rows = cursor.fetchmany(1000)
+            if not rows:
+                break
+            for row in rows:
+                yield tuple(row)
+
+    def list_files(self) -> List[Dict[str, Any]]:
+        """已入库文件列表（按首次入库顺序），包含文件路径和入库时间"""
+        rows = self._conn().execute(
+            "SELECT file_path, MIN(timestamp) AS timestamp, MIN(row_id) AS first_row "
+            "FROM chunks GROUP BY file_path ORDER BY first_row"
+        ).fetchall()
+        return [
+            {'file_path': row['file_path'], 'timestamp': '' if row['timestamp'] is None else row['timestamp']}
+            for row in rows
+        ]
+
+    # ---------- 文件清单 ----------
+
+    def file_records(self) -> Dict[str, Dict[str, Any]]:
+        """全部文件记录 {file_path: {'size', 'mtime', 'content_hash', 'indexed_at'}}"""
+        rows = self._conn().execute("SELECT * FROM files").fetchall()
+        return {row['file_path']: {key: row[key] for key in ('size', 'mtime', 'content_hash', 'indexed_at')}
+                for row in rows}
+
+    def upsert_file(self, file_path: str, size: int, mtime: float, content_hash: str) -> None:
+        """写入或更新文件记录"""
+        with self._write_lock:
+            conn = self._conn()
+            conn.execute(
+                "INSERT OR REPLACE INTO files (file_path, size, mtime, content_hash, indexed_at) VALUES (?, ?, ?, ?, ?)",
+                (file_path, int(size), float(mtime), content_hash, time.time())
+            )
+            conn.commit()
+
+    def rename_file(self, old_path: str, new_path: str) -> None:
+        """文件重命名/移动：文档块与向量行号不变，仅修改路径"""
+        with self._write_lock:
+            conn = self._conn()
+            conn.execute("UPDATE chunks SET file_path = ? WHERE file_path = ?", (new_path, old_path))
+            conn.execute("DELETE FROM files WHERE file_path = ?", (new_path,))
+            conn.execute("UPDATE files SET file_path = ? WHERE file_path = ?", (new_path, old_path))
+            conn.commit()
+
+    # ---------- 修改 ----------
+
+    def update_chunk(self, row_id: int, **fields) -> None:
+        """更新单个文档块的字段"""
+        doc = self[row_id]
+        if 'chunk_content' in fields and 'content_hash' not in fields:
+            # 内容变化后重新计算哈希
+            doc.pop('content_hash', None)
+        doc.update(fields)
+        with self._write_lock:
+            conn = self._conn()
+            conn.execute(
+                "UPDATE chunks SET file_path = ?, chunk_index = ?, chunk_summary = ?, chunk_content = ?, "
+                "total_chunks = ?, timestamp = ?, extra = ?, content_hash = ? WHERE row_id = ?",
+                (*self._to_params(doc), int(row_id))
+            )
+            conn.commit()
+
+    def delete_rows(self, row_ids) -> List[int]:
+        """
+        删除指定行，并将之后的 row_id 前移以保持与向量行号对齐
+        :return: 被删除的 row_id（升序）
+        """
+        row_ids = sorted({int(i) for i in row_ids})
+        if not row_ids:
+            return []
+        with self._write_lock:
+            conn = self._conn()
+            # 临时表记录每个被删除行及其之前（含自身）被删除的行数，即其后的行需要前移的位数
+            conn.execute("CREATE TEMP TABLE IF NOT EXISTS deleted_rows (row_id INTEGER PRIMARY KEY, shift INTEGER)")
+            conn.execute("DELETE FROM deleted_rows")
+            conn.executemany("INSERT INTO deleted_rows (row_id, shift) VALUES (?, ?)",
+                             [(row_id, shift) for shift, row_id in enumerate(row_ids, start=1)])
+            conn.execute("DELETE FROM chunks WHERE row_id IN (SELECT row_id FROM deleted_rows)")
+            # 一条语句完成重新编号：每行前移的位数取行号之前最近一个被删除行的 shift（按主键查找）
+            conn.execute(
+                "UPDATE chunks SET row_id = row_id - (SELECT d.shift FROM deleted_rows d WHERE d.row_id < chunks.row_id "
+                "ORDER BY d.row_id DESC LIMIT 1) WHERE row_id > ?", (row_ids[0],)
+            )
+            conn.execute("DELETE FROM deleted_rows")
+            conn.execute("UPDATE row_layout SET epoch = epoch + 1")
+            conn.commit()
+        return row_ids
+
+    def delete_file(self, file_path: str) -> List[int]:
+        """删除指定文件的全部文档块，返回被删除的 row_id"""
+        return self.delete_files([file_path])
+
+    def delete_files(self, file_paths: List[str]) -> List[int]:
+        """批量删除多个文件的全部文档块及文件记录，返回被删除的 row_id（升序，均为删除前的行号）"""
+        conn = self._conn()
+        row_ids = []
+        for file_path in file_paths:
+            rows = conn.execute("SELECT row_id FROM chunks WHERE file_path = ?", (file_path,)).fetchall()
+            row_ids.extend(row[0] for row in rows)
+        with self._write_lock:
+            conn.executemany("DELETE FROM files WHERE file_path = ?", [(fp,) for fp in file_paths])
+            conn.commit()
+        return self.delete_rows(row_ids)
+
+    def reset(self) -> None:
+        """清空全部文档块"""
+        with self._write_lock:
+            conn = self._conn()
+            conn.execute("DELETE FROM chunks")
+            conn.execute("DELETE FROM files")
+            conn.execute("UPDATE row_layout SET epoch = epoch + 1")
+            conn.commit()
+
+    # ---------- 迁移 ----------
+
+    def _migrate_legacy(self) -> None:
+        """导入旧版 metadata.json，补齐缺失字段后将原文件重命名为 .bak"""
+        print(f"正在将 {self.legacy_path} 导入 SQLite 文档块存储...")
+        with open(self.legacy_path, "r", encoding="utf-8") as f:
+            docs = json.load(f)
+
+        file_counts = {}
+        for doc in docs:
+            file_counts[doc.get('file_path')] = file_counts.get(doc.get('file_path'), 0) + 1
+        for doc in docs:
+            doc.setdefault('chunk_index', 0)
+            if 'chunk_content' not in doc:
+                doc['chunk_content'] = doc.pop('content', '')
+            doc.setdefault('total_chunks', file_counts[doc.get('file_path')])
+
+        self.extend(docs)
+        self.legacy_path.replace(self.legacy_path.with_suffix('.json.bak'))
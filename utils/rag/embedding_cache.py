@@ -0,0 +1,158 @@
+"""
+向量缓存模块
+以 (模型, 指令, 文本) 的哈希为键，将嵌入向量持久化到 SQLite
+- 重复上传的文件、重建向量库、跨文件重复的文档块只需一次查询，无需再次调用嵌入模型
+- 按最近访问时间（LRU）淘汰，条目数不超过 max_entries
+"""
+import hashlib
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Callable, Dict, List, Union
+import numpy as np
+from utils.fork_safety import register_after_fork
+
+
+class EmbeddingCache:
+    """基于 SQLite 的持久化向量缓存"""
+
+    SCHEMA = """
+    CREATE TABLE IF NOT EXISTS embeddings (
+        key TEXT PRIMARY KEY,
+        dim INTEGER NOT NULL,
+        vector BLOB NOT NULL,
+        last_access REAL NOT NULL
+    );
+    CREATE INDEX IF NOT EXISTS idx_embeddings_last_access ON embeddings(last_access);
+    """
+
+    def __init__(self, db_path: Union[str, Path], namespace: str, max_entries: int = 200000):
+        """
+        :param db_path: SQLite 数据库文件路径
+        :param namespace: 模型标识（模型路径及影响输出的参数），不同模型的向量互不混用
+        :param max_entries: 最大缓存条目数
+        """
+        self.db_path = Path(db_path)
+        self.namespace = namespace
+        self.max_entries = int(max_entries)
+        self._local = threading.local()
+        self._write_lock = threading.Lock()
+        register_after_fork(self)
+        self.hits = 0
+        self.misses = 0
+
+        conn = self._conn()
+        conn.executescript(self.SCHEMA)
+        conn.commit()
+        self._count = conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+
+    def _after_fork(self) -> None:
+        # fork 出的子进程不能继续使用父进程的 sqlite 连接
+        self._local = threading.local()
+        self._write_lock = threading.Lock()
+
+    def _conn(self) -> sqlite3.Connection:
+        """每个线程使用独立连接"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(str(self.db_path), timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def key(self, text: str, instruction: str = '') -> str:
+        """缓存键：sha256(模型标识, 指令, 文本)"""
+        return hashlib.sha256(f"{self.namespace}\0{instruction}\0{text}".encode('utf-8')).hexdigest()
+
+    def get_many(self, keys: List[str]) -> Dict[str, np.ndarray]:
+        """批量查询，命中的条目同时刷新访问时间"""
+        found = {}
+        conn = self._conn()
+        unique_keys = list(dict.fromkeys(keys))
+        # SQLite 默认最多 999 个绑定参数
+        for start in range(0, len(unique_keys), 900):
+            batch = unique_keys[start:start + 900]
+            placeholders = ','.join('?' * len(batch))
+            for key, dim, blob in conn.execute(
+                    f"SELECT key, dim, vector FROM embeddings WHERE key IN ({placeholders})", batch):
+                vector = np.frombuffer(blob, dtype=np.float32)
+                if vector.shape[0] == dim:
+                    found[key] = vector
+        if found:
+            now = time.time()
+            with self._write_lock:
+                conn.executemany("UPDATE embeddings SET last_access = ? WHERE key = ?", [(now, k) for k in found])
+                conn.commit()
+        return found
+
+    def put_many(self, keys: List[str], vectors: np.ndarray) -> None:
+        """批量写入，超出容量时淘汰最久未访问的条目"""
+        if len(keys) == 0:
+            return
+        vectors = np.asarray(vectors, dtype=np.float32).reshape(len(keys), -1)
+        now = time.time()
+        rows = [(key, vectors.shape[1], vectors[i].tobytes(), now) for i, key in enumerate(keys)]
+        with self._write_lock:
+            conn = self._conn()
+            before = conn.total_changes
+            conn.executemany("INSERT OR IGNORE INTO embeddings (key, dim, vector, last_access) VALUES (?, ?, ?, ?)", rows)
+            self._count += conn.total_changes - before
+            if self._count > self.max_entries:
+                # 一次多淘汰 10%，避免每次写入都触发淘汰
+                excess = self._count - int(self.max_entries * 0.9)
+                conn.execute(
+                    "DELETE FROM embeddings WHERE key IN "
+                    "(SELECT key FROM embeddings ORDER BY last_access LIMIT ?)", (excess,)
+                )
+                self._count = conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+            conn.commit()
+
+    def encode(self, texts: List[str], encode_func: Callable[[List[str]], np.ndarray],
+               instruction: str = '') -> np.ndarray:
+        """
+        先查缓存，只对未命中的文本（去重后）调用 encode_func，并将结果写回缓存
+        :param texts: 待编码文本
+        :param encode_func: 实际的编码函数，输入文本列表，返回向量矩阵
+        :param instruction: 编码时使用的指令（如查询指令），参与缓存键计算
+        :return: float32 向量矩阵，行顺序与 texts 一致
+        """
+        if len(texts) == 0:
+            return np.zeros((0, 0), dtype=np.float32)
+        keys = [self.key(text, instruction) for text in texts]
+        found = self.get_many(keys)
+
+        missing = {}
+        for key, text in zip(keys, texts):
+            if key not in found and key not in missing:
+                missing[key] = text
+        self.hits += len(keys) - sum(1 for key in keys if key in missing)
+        self.misses += len(missing)
+
+        if missing:
+            missing_keys = list(missing)
+            encoded = np.asarray(encode_func([missing[key] for key in missing_keys]), dtype=np.float32)
+            encoded = encoded.reshape(len(missing_keys), -1)
+            self.put_many(missing_keys, encoded)
+            found.update(zip(missing_keys, encoded))
+        return np.stack([found[key] for key in keys])
+
+    def stats(self) -> Dict[str, Union[int, float]]:
+        """缓存统计信息"""
+        total = self.hits + self.misses
+        return {
+            'entries': self._count,
+            'max_entries': self.max_entries,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': round(self.hits / total, 4) if total else 0.0,
+        }
+
+    def clear(self) -> None:
+        """清空缓存"""
+        with self._write_lock:
+            conn = self._conn()
+            conn.execute("DELETE FROM embeddings")
+            conn.commit()
+            self._count = 0
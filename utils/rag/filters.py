@@ -0,0 +1,210 @@
+"""
+元数据过滤模块
+检索时按文件路径前缀、扩展名、入库时间范围以及文件元数据（Markdown Front Matter、HTML meta 标签）过滤文档块：
+- 过滤条件在打分之前求值为按行号的布尔掩码，向量检索与 BM25 检索只在掩码为 True 的行中进行
+- 每个语料版本只整理一次 行号 -> 文件 映射与入库时间数组；文件级条件逐个文件求值后，
+  通过映射一次性展开到全部行
+- 掩码按 (语料版本, 过滤条件) 缓存，相同过滤条件的检索无需重复计算
+"""
+import json
+import os
+import threading
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Dict, Hashable, List, Optional, Tuple, Union
+import numpy as np
+from .cache import LRUCache
+from .chunk_store import ChunkStore
+
+
+def _as_list(value: Any) -> List[Any]:
+    if value is None:
+        return []
+    if isinstance(value, (list, tuple, set)):
+        return list(value)
+    return [value]
+
+
+def _parse_time(value: Any) -> Optional[float]:
+    """时间戳（秒）或 ISO 格式时间字符串 -> 时间戳"""
+    if value is None or value == '':
+        return None
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return float(value)
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        pass
+    try:
+        return datetime.fromisoformat(str(value)).timestamp()
+    except ValueError:
+        raise ValueError(f"无效的时间: {value}")
+
+
+class MetadataFilter:
+    """
+    检索过滤条件：不同条件之间为"与"，同一条件的多个取值之间为"或"
+    - path_prefix: 文件路径前缀，相对路径按文档目录或当前工作目录解析
+    - extensions: 文件扩展名，如 ['.md', 'pdf']
+    - time_from / time_to: 入库时间范围（时间戳或 ISO 格式字符串，闭区间）
+    - metadata: 文件元数据键值，如 {'author': '张三', 'tags': ['api', 'faq']}，列表类型的元数据与任一取值相同即匹配
+    """
+
+    FIELDS = ('path_prefix', 'extensions', 'time_from', 'time_to', 'metadata')
+
+    def __init__(self, path_prefix: Union[str, List[str]] = None, extensions: Union[str, List[str]] = None,
+                 time_from: Any = None, time_to: Any = None, metadata: Dict[str, Any] = None):
+        if metadata is not None and not isinstance(metadata, dict):
+            raise ValueError("metadata 过滤条件必须是对象")
+        self.path_prefixes = tuple(sorted({str(prefix) for prefix in _as_list(path_prefix) if prefix}))
+        self.extensions = tuple(sorted({
+            '.' + str(ext).lower().lstrip('.') for ext in _as_list(extensions) if str(ext).strip('.')
+        }))
+        self.time_from = _parse_time(time_from)
+        self.time_to = _parse_time(time_to)
+        self.metadata = tuple(sorted(
+            (str(key), tuple(sorted({str(value) for value in _as_list(values)})))
+            for key, values in (metadata or {}).items()
+        ))
+
+    @classmethod
+    def from_dict(cls, data: Union[Dict[str, Any], 'MetadataFilter', None]) -> Optional['MetadataFilter']:
+        """
+        解析请求中的过滤条件
+        :return: 过滤条件，未指定任何条件时返回 None
+        """
+        if data is None or isinstance(data, MetadataFilter):
+            return data
+        if not isinstance(data, dict):
+            raise ValueError("filters 必须是对象")
+        unknown = set(data) - set(cls.FIELDS)
+        if unknown:
+            raise ValueError(f"不支持的过滤条件: {', '.join(sorted(unknown))}")
+        metadata_filter = cls(**data)
+        return None if metadata_filter.is_empty() else metadata_filter
+
+    def is_empty(self) -> bool:
+        return not (self.path_prefixes or self.extensions or self.metadata
+                    or self.time_from is not None or self.time_to is not None)
+
+    @property
+    def key(self) -> Hashable:
+        """规范化后的过滤条件，用作缓存键"""
+        return (self.path_prefixes, self.extensions, self.time_from, self.time_to, self.metadata)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            'path_prefix': list(self.path_prefixes),
+            'extensions': list(self.extensions),
+            'time_from': self.time_from,
+            'time_to': self.time_to,
+            'metadata': {key: list(values) for key, values in self.metadata},
+        }
+
+    def match_file(self, file_path: str, metadata: Dict[str, Any], prefixes: Tuple[str, ...]) -> bool:
+        """
+        文件级条件（路径、扩展名、元数据）
+        :param prefixes: 已解析为绝对路径的路径前缀
+        """
+        if prefixes and not file_path.startswith(prefixes):
+            return False
+        if self.extensions and Path(file_path).suffix.lower() not in self.extensions:
+            return False
+        for key, values in self.metadata:
+            if key not in metadata:
+                return False
+            if not any(str(value) in values for value in _as_list(metadata[key])):
+                return False
+        return True
+
+
+class FilterIndex:
+    """按语料版本预计算的过滤索引，将过滤条件求值为行掩码"""
+
+    def __init__(self, docs: ChunkStore, base_dir: Union[str, Path], max_masks: int = 64):
+        """
+        :param docs: 文档块存储
+        :param base_dir: 文档目录，相对路径前缀按此目录解析
+        :param max_masks: 缓存的掩码数量
+        """
+        self.docs = docs
+        self.base_dir = str(Path(base_dir).absolute())
+        self._lock = threading.Lock()
+        self._snapshot: Optional[Dict[str, Any]] = None
+        self._masks = LRUCache(max_masks, ttl=0)
+
+    def _resolve_prefixes(self, prefixes: Tuple[str, ...]) -> Tuple[str, ...]:
+        """路径前缀 -> 绝对路径前缀（相对路径同时按文档目录和当前工作目录解析）"""
+        resolved = set()
+        for prefix in prefixes:
+            bases = [''] if os.path.isabs(prefix) else [self.base_dir, os.getcwd()]
+            for base in bases:
+                path = os.path.abspath(os.path.join(base, prefix))
+                # 以分隔符结尾的前缀只匹配该目录下的文件
+                if prefix.endswith(('/', os.sep)):
+                    path = os.path.join(path, '')
+                resolved.add(path)
+        return tuple(sorted(resolved))
+
+    def _load(self, version: int, size: int) -> Dict[str, Any]:
+        """整理 行号 -> 文件 映射与入库时间数组（每个语料版本一次）"""
+        with self._lock:
+            snapshot = self._snapshot
+            if snapshot is not None and snapshot['version'] == version and snapshot['size'] == size:
+                return snapshot
+            files: List[Tuple[str, Dict[str, Any]]] = []
+            file_ids: Dict[str, int] = {}
+            row_file = np.full(size, -1, dtype=np.int32)
+            timestamps = np.full(size, np.nan, dtype=np.float64)
+            for row_id, file_path, timestamp, extra in self.docs.iter_filter_fields():
+                if row_id >= size:
+                    continue
+                file_id = file_ids.get(file_path)
+                if file_id is None:
+                    # 元数据是文件级的，只解析每个文件的第一个文档块
+                    metadata = (json.loads(extra).get('metadata') if extra else None) or {}
+                    file_id = file_ids[file_path] = len(files)
+                    files.append((file_path, metadata))
+                row_file[row_id] = file_id
+                if timestamp is not None:
+                    timestamps[row_id] = timestamp
+            snapshot = {'version': version, 'size': size, 'files': files,
+                        'row_file': row_file, 'timestamps': timestamps}
+            self._snapshot = snapshot
+            # 旧版本的掩码不会再被使用
+            self._masks.clear()
+            return snapshot
+
+    def mask(self, metadata_filter: MetadataFilter, version: int, size: int) -> np.ndarray:
+        """
+        过滤条件 -> 行掩码
+        :param metadata_filter: 过滤条件
+        :param version: 当前语料版本号
+        :param size: 向量行数
+        :return: 长度为 size 的只读布尔数组
+        """
+        key = (version, size, metadata_filter.key)
+        mask = self._masks.get(key)
+        if mask is not None:
+            return mask
+
+        snapshot = self._load(version, size)
+        prefixes = self._resolve_prefixes(metadata_filter.path_prefixes)
+        # 末尾追加的 False 对应没有文件的行（row_file 为 -1）
+        file_mask = np.array(
+            [metadata_filter.match_file(file_path, metadata, prefixes) for file_path, metadata in snapshot['files']]
+            + [False], dtype=bool
+        )
+        mask = file_mask[snapshot['row_file']]
+        # 缺少入库时间的行（NaN）不满足时间范围条件
+        if metadata_filter.time_from is not None:
+            mask &= snapshot['timestamps'] >= metadata_filter.time_from
+        if metadata_filter.time_to is not None:
+            mask &= snapshot['timestamps'] <= metadata_filter.time_to
+        mask.setflags(write=False)
+        self._masks.set(key, mask)
+        return mask
+
+    def stats(self) -> Dict[str, Any]:
+        snapshot = self._snapshot
+        return dict(self._masks.stats(), files=len(snapshot['files']) if snapshot else 0)
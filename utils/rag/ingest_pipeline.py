@@ -0,0 +1,396 @@
+"""
+文档入库流水线
+将 解析 -> 摘要 -> 向量化 -> 写入 拆分为并发执行的阶段，整体耗时取决于最慢的阶段而非各阶段之和
+- 解析阶段：进程池（PDF/Docx 的 OCR 与版面分析是 CPU 密集型）；不支持 fork 的平台上使用线程池
+- 摘要阶段：有界线程池并发调用 LLM
+- 向量化阶段：单线程，跨文件合并文档块，按目标批大小调用嵌入模型
+- 背压：正在解析的文件数、等待向量化的文档块数均有上限，慢阶段会阻塞上游
+- 每个阶段统计处理数量、耗时与吞吐量，并可实时上报进度（解析页数、OCR 图片数、摘要/向量化块数）
+"""
+import multiprocessing
+import queue
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
+from typing import Any, Callable, Dict, List, Optional, Tuple
+import numpy as np
+# 解析函数放在 utils.rag 之外，解析进程反序列化任务时只导入文档加载器
+from utils.document_loader.parsing import init_parse_worker, is_supported, parse_file
+
+
+class StageStats:
+    """单个阶段的吞吐量计数器（线程安全）"""
+
+    def __init__(self, name: str):
+        self.name = name
+        self.items = 0
+        self.busy_seconds = 0.0
+        self.errors = 0
+        self._lock = threading.Lock()
+
+    def record(self, items: int, seconds: float) -> None:
+        with self._lock:
+            self.items += items
+            self.busy_seconds += seconds
+
+    def error(self) -> None:
+        with self._lock:
+            self.errors += 1
+
+    def as_dict(self, wall_seconds: float) -> Dict[str, Any]:
+        return {
+            'items': self.items,
+            'errors': self.errors,
+            'busy_seconds': round(self.busy_seconds, 3),
+            # 每个工作单元的处理速度，以及相对整体耗时的实际吞吐量
+            'items_per_busy_second': round(self.items / self.busy_seconds, 2) if self.busy_seconds else 0.0,
+            'items_per_second': round(self.items / wall_seconds, 2) if wall_seconds else 0.0,
+        }
+
+
+class _FileState:
+    """单个文件在流水线中的中间状态，全部块向量化完成后整体提交"""
+
+    def __init__(self, file_path: str, total_chunks: int, pending: int, metadata: Dict[str, Any] = None):
+        self.file_path = file_path
+        self.total_chunks = total_chunks
+        self.metadata = metadata or {}
+        self.pending = pending
+        self.docs: Dict[int, Dict[str, Any]] = {}
+        self.vectors: Dict[int, np.ndarray] = {}
+        self.failed = False
+
+
+class IngestPipeline:
+    """
+    分阶段并发入库流水线
+    各阶段通过回调与 Rag 解耦：
+    - summarize(chunk) -> 摘要
+    - compose(summary, chunk) -> 用于向量化的文本
+    - encode(texts) -> 向量矩阵
+    - commit(file_path, docs, vectors) -> 写入文档块存储与向量存储（无有效块的文件 vectors 为 None）
+    - lookup(chunk) -> (摘要, 向量) 或 None，可选，用于复用内容未变化的文档块
+    commit 只在向量化线程中按文件调用，保证文档块与向量行号对齐，且每个文件要么完整入库要么不入库
+    """
+
+    def __init__(self,
+                 summarize: Callable[[str], str],
+                 compose: Callable[[str, str], str],
+                 encode: Callable[[List[str]], np.ndarray],
+                 commit: Callable[[str, List[Dict[str, Any]], Optional[np.ndarray]], None],
+                 lookup: Callable[[str], Optional[Tuple[str, np.ndarray]]] = None,
+                 parse_workers: int = 2,
+                 summary_workers: int = 4,
+                 embed_batch_size: int = 64,
+                 max_pending_chunks: int = 256,
+                 max_pending_files: int = None,
+                 batch_wait: float = 0.2,
+                 on_progress: Callable[[str, int], None] = None,
+                 on_stage_progress: Callable[[str, int], None] = None,
+                 cancel_event: threading.Event = None):
+        """
+        :param parse_workers: 解析进程数，0 表示在当前进程中解析；不支持 fork 的平台上为解析线程数
+        :param summary_workers: 摘要线程数
+        :param embed_batch_size: 向量化目标批大小（跨文件合并）
+        :param max_pending_chunks: 已提交摘要但尚未向量化的块数上限
+        :param max_pending_files: 同时解析的文件数上限，默认为解析进程数的 2 倍
+        :param batch_wait: 向量化批未满时等待更多块的最长时间（秒）
+        :param on_progress: 文件处理结束时的回调 (file_path, 入库块数)
+        :param on_stage_progress: 阶段进度回调 (类型, 增量)，类型为 pages_total / pages / images（解析进度）、
+                                  files_parsed / chunks_total / reused / summarised / embedded
+        :param cancel_event: 可选，外部传入的取消事件（例如后台任务），等同于调用 cancel()
+        """
+        self.summarize = summarize
+        self.compose = compose
+        self.encode = encode
+        self.commit = commit
+        self.lookup = lookup
+        self.parse_workers = max(0, int(parse_workers))
+        # spawn 方式启动的解析进程会重新导入入口模块（Web 应用、Rag、嵌入模型），只在支持 fork 时使用进程池
+        self.parse_in_threads = self.parse_workers > 0 and 'fork' not in multiprocessing.get_all_start_methods()
+        if self.parse_in_threads:
+            print("当前平台不支持 fork 方式启动进程，文档解析改用线程池")
+        self.summary_workers = max(1, int(summary_workers))
+        self.embed_batch_size = max(1, int(embed_batch_size))
+        self.max_pending_chunks = max(self.embed_batch_size, int(max_pending_chunks))
+        self.max_pending_files = max_pending_files or max(1, self.parse_workers) * 2
+        self.batch_wait = batch_wait
+        self.on_progress = on_progress
+        self.on_stage_progress = on_stage_progress
+
+        self.stats = {name: StageStats(name) for name in ('parse', 'reuse', 'summary', 'embed', 'commit')}
+        self._cancel = cancel_event or threading.Event()
+
+    def cancel(self) -> None:
+        """
+        取消流水线：不再解析新文件，尚未开始的摘要任务直接跳过（所在文件不入库），
+        正在解析的文件不再等待，已入库的文件保留
+        """
+        self._cancel.set()
+
+    @property
+    def cancelled(self) -> bool:
+        return self._cancel.is_set()
+
+    # ---------- 各阶段 ----------
+
+    def _stage_progress(self, kind: str, count: int = 1) -> None:
+        if self.on_stage_progress is not None and count:
+            try:
+                self.on_stage_progress(kind, count)
+            except Exception as e:
+                print(f"上报入库进度失败: {str(e)}")
+
+    def _drain_parse_progress(self, progress_queue) -> None:
+        """将解析进程写入进度队列的事件转发给阶段进度回调，收到 None 时结束"""
+        while True:
+            item = progress_queue.get()
+            if item is None:
+                break
+            self._stage_progress(*item)
+
+    def _iter_parsed(self, file_paths: List[str]):
+        """解析阶段：同时解析的文件数有上限，按完成顺序产出结果"""
+        if self.parse_workers == 0:
+            on_progress = self._stage_progress if self.on_stage_progress is not None else None
+            for file_path in file_paths:
+                if self.cancelled:
+                    return
+                yield file_path, self._run_parse(file_path, parse_file, file_path, on_progress)
+            return
+
+        progress_queue = drainer = None
+        parse_args = ()
+        if self.parse_in_threads:
+            # 解析线程直接调用进度回调
+            if self.on_stage_progress is not None:
+                parse_args = (self._stage_progress,)
+            executor = ThreadPoolExecutor(max_workers=self.parse_workers, thread_name_prefix='ingest-parse')
+        else:
+            context = multiprocessing.get_context('fork')
+            if self.on_stage_progress is not None:
+                progress_queue = context.Queue()
+                drainer = threading.Thread(target=self._drain_parse_progress, args=(progress_queue,), daemon=True)
+                drainer.start()
+            executor = ProcessPoolExecutor(max_workers=self.parse_workers, mp_context=context,
+                                           initializer=init_parse_worker, initargs=(progress_queue,))
+        try:
+            remaining = iter(file_paths)
+            futures = {}
+
+            def submit_next():
+                for file_path in remaining:
+                    futures[executor.submit(parse_file, file_path, *parse_args)] = file_path
+                    return True
+                return False
+
+            for _ in range(self.max_pending_files):
+                if not submit_next():
+                    break
+            while futures and not self.cancelled:
+                # 定期检查取消标志，不必等待耗时的解析（OCR）完成
+                done, _ = wait(futures, timeout=0.5, return_when=FIRST_COMPLETED)
+                for future in done:
+                    file_path = futures.pop(future)
+                    if not self.cancelled:
+                        submit_next()
+                    yield file_path, self._run_parse(file_path, future.result)
+        finally:
+            # 取消时不等待正在解析的文件，工作进程（线程）完成当前任务后退出
+            executor.shutdown(wait=not self.cancelled, cancel_futures=True)
+            if drainer is not None:
+                progress_queue.put(None)
+                drainer.join(timeout=5)
+
+    def _run_parse(self, file_path: str, func, *args) -> Optional[Dict[str, Any]]:
+        try:
+            result = func(*args)
+        except Exception as e:
+            self.stats['parse'].error()
+            print(f"解析文件 {file_path} 失败: {str(e)}")
+            return None
+        self.stats['parse'].record(1, result['seconds'])
+        self._stage_progress('files_parsed')
+        self._stage_progress('chunks_total', len(result['chunks']))
+        return result
+
+    def _summarize_chunk(self, state: _FileState, chunk_index: int, chunk: str, embed_queue: queue.Queue) -> None:
+        """摘要阶段：在线程池中执行，完成后送入向量化队列；内容未变化的块直接复用已有摘要和向量"""
+        if self.cancelled:
+            # 已取消：不再生成摘要，所在文件放弃入库
+            embed_queue.put((state, chunk_index, chunk, None, None))
+            return
+        start = time.perf_counter()
+        if self.lookup is not None:
+            try:
+                reused = self.lookup(chunk)
+            except Exception as e:
+                print(f"查找可复用文档块失败 {state.file_path}#{chunk_index}: {str(e)}")
+                reused = None
+            if reused is not None:
+                self.stats['reuse'].record(1, time.perf_counter() - start)
+                self._stage_progress('reused')
+                embed_queue.put((state, chunk_index, chunk, reused[0], reused[1]))
+                return
+        try:
+            summary = self.summarize(chunk)
+        except Exception as e:
+            self.stats['summary'].error()
+            print(f"生成摘要失败 {state.file_path}#{chunk_index}: {str(e)}")
+            summary = None
+        self.stats['summary'].record(1, time.perf_counter() - start)
+        self._stage_progress('summarised')
+        embed_queue.put((state, chunk_index, chunk, summary, None))
+
+    def _embed_loop(self, embed_queue: queue.Queue, slots: threading.Semaphore) -> None:
+        """向量化阶段：单线程消费队列，跨文件凑批后编码"""
+        finished = False
+        while not finished:
+            batch = []
+            item = embed_queue.get()
+            if item is None:
+                break
+            batch.append(item)
+            deadline = time.monotonic() + self.batch_wait
+            while len(batch) < self.embed_batch_size:
+                timeout = deadline - time.monotonic()
+                try:
+                    item = embed_queue.get(timeout=timeout) if timeout > 0 else embed_queue.get_nowait()
+                except queue.Empty:
+                    break
+                if item is None:
+                    finished = True
+                    break
+                batch.append(item)
+            self._embed_batch(batch)
+            for _ in batch:
+                slots.release()
+
+    def _embed_batch(self, batch: List[tuple]) -> None:
+        # 队列元素: (文件状态, chunk_index, 文本, 摘要, 已有向量)，chunk_index 为 None 表示无有效块的文件
+        # 摘要失败的块所在文件整体放弃，不参与编码；复用的块已有向量，无需编码
+        valid = [item for item in batch
+                 if item[1] is not None and item[3] is not None and item[4] is None and not item[0].failed]
+        vectors = None
+        if valid:
+            start = time.perf_counter()
+            try:
+                vectors = np.asarray(self.encode([self.compose(summary, chunk) for _, _, chunk, summary, _ in valid]))
+                self.stats['embed'].record(len(valid), time.perf_counter() - start)
+                self._stage_progress('embedded', len(valid))
+            except Exception as e:
+                self.stats['embed'].error()
+                print(f"向量化失败: {str(e)}")
+
+        encoded = {}
+        if vectors is not None:
+            for row, (state, chunk_index, _, _, _) in enumerate(valid):
+                encoded[(id(state), chunk_index)] = vectors[row]
+
+        for state, chunk_index, chunk, summary, vector in batch:
+            if chunk_index is None:
+                self._commit_file(state)
+                continue
+            if vector is None:
+                vector = encoded.get((id(state), chunk_index))
+            if vector is None:
+                state.failed = True
+            else:
+                state.docs[chunk_index] = {
+                    "file_path": state.file_path,
+                    "chunk_index": chunk_index,
+                    "chunk_summary": summary,
+                    "chunk_content": chunk,
+                    "total_chunks": state.total_chunks,
+                    "timestamp": time.time(),
+                }
+                if state.metadata:
+                    # 文件级元数据随每个文档块保存，供检索时按元数据过滤
+                    state.docs[chunk_index]["metadata"] = state.metadata
+                state.vectors[chunk_index] = vector
+            state.pending -= 1
+            if state.pending == 0:
+                self._commit_file(state)
+
+    def _commit_file(self, state: _FileState) -> None:
+        """写入阶段：文件的全部块就绪后按 chunk_index 顺序一次性提交"""
+        if state.failed:
+            if self.cancelled:
+                print(f"入库已取消，跳过文件 {state.file_path}")
+            else:
+                self.stats['commit'].error()
+                print(f"处理文件 {state.file_path} 失败，已跳过")
+            self._progress(state.file_path, 0)
+            return
+        start = time.perf_counter()
+        order = sorted(state.docs)
+        vectors = np.stack([state.vectors[i] for i in order]) if order else None
+        try:
+            self.commit(state.file_path, [state.docs[i] for i in order], vectors)
+        except Exception as e:
+            self.stats['commit'].error()
+            print(f"写入文件 {state.file_path} 失败: {str(e)}")
+            self._progress(state.file_path, 0)
+            return
+        self.stats['commit'].record(len(order), time.perf_counter() - start)
+        self._progress(state.file_path, len(order))
+        # 释放中间结果
+        state.docs.clear()
+        state.vectors.clear()
+
+    def _progress(self, file_path: str, num_chunks: int) -> None:
+        if self.on_progress is not None:
+            self.on_progress(file_path, num_chunks)
+
+    # ---------- 入口 ----------
+
+    def run(self, file_paths: List[str]) -> Dict[str, Any]:
+        """
+        执行流水线
+        :param file_paths: 待入库的文件路径（不支持的格式直接跳过）
+        :return: 各阶段统计信息
+        """
+        start = time.perf_counter()
+        supported = []
+        for file_path in file_paths:
+            if is_supported(file_path):
+                supported.append(file_path)
+            else:
+                print(f"跳过不支持的文件格式: {file_path}")
+                self._progress(file_path, 0)
+
+        embed_queue = queue.Queue()
+        # 背压：等待向量化的块数达到上限时，摘要任务提交被阻塞，进而停止读取解析结果
+        slots = threading.Semaphore(self.max_pending_chunks)
+        embedder = threading.Thread(target=self._embed_loop, args=(embed_queue, slots), daemon=True)
+        embedder.start()
+
+        try:
+            with ThreadPoolExecutor(max_workers=self.summary_workers) as summary_pool:
+                for file_path, result in self._iter_parsed(supported):
+                    if result is None:
+                        self._progress(file_path, 0)
+                        continue
+                    state = _FileState(file_path, result['total_chunks'], len(result['chunks']),
+                                       result.get('metadata'))
+                    if not result['chunks']:
+                        # 空文件同样经由向量化线程提交，以便记录文件清单
+                        slots.acquire()
+                        embed_queue.put((state, None, None, None, None))
+                        continue
+                    for chunk_index, chunk in result['chunks']:
+                        slots.acquire()
+                        summary_pool.submit(self._summarize_chunk, state, chunk_index, chunk, embed_queue)
+                    if self.cancelled:
+                        break
+        finally:
+            # 摘要线程池退出时已全部完成，通知向量化线程处理剩余批次后结束
+            embed_queue.put(None)
+            embedder.join()
+
+        wall_seconds = time.perf_counter() - start
+        return {
+            'files': len(file_paths),
+            'wall_seconds': round(wall_seconds, 3),
+            'stages': {name: stat.as_dict(wall_seconds) for name, stat in self.stats.items()},
+        }
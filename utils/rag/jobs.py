@@ -0,0 +1,413 @@
+"""
+后台任务队列
+上传文件后，文档入库（解析、OCR、摘要、向量化）可能持续数分钟，不应占用请求线程。
+JobManager 将任务提交到有界线程池，立即返回任务 ID，调用方通过任务 ID 查询状态、分阶段进度并取消任务。
+- 任务状态：queued -> running -> completed / failed / cancelled
+- 进度为各类计数的累加值（解析页数、OCR 图片数、摘要/向量化块数等），由任务函数通过 job.advance 上报
+- 取消：排队中的任务直接取消；运行中的任务置位取消事件，由任务函数在安全点退出
+- 只保留最近 max_history 个已结束的任务
+- 指定 db_path 时任务状态同时写入 SQLite（JobStore）：多进程服务中任务在提交它的工作进程内执行，
+  其他工作进程通过数据库查询状态与进度，取消请求写入数据库，由执行任务的进程在上报进度时读取
+"""
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Union
+from utils.fork_safety import register_after_fork
+
+# 进度计数按阶段分组展示：阶段 -> [(计数名, 展示名)]
+PROGRESS_STAGES = {
+    'files': [('files_total', 'total'), ('files_done', 'done'), ('files_failed', 'failed')],
+    'parse': [('files_parsed', 'files'), ('pages_total', 'pages_total'), ('pages', 'pages'), ('images', 'images')],
+    'summary': [('chunks_total', 'chunks_total'), ('summarised', 'summarised'), ('reused', 'reused')],
+    'embed': [('embedded', 'embedded')],
+    'commit': [('committed', 'committed')],
+}
+
+FINISHED_STATUSES = ('completed', 'failed', 'cancelled')
+
+
+class Job:
+    """单个后台任务的状态与进度（线程安全）"""
+
+    def __init__(self, kind: str, description: Dict[str, Any] = None):
+        """
+        :param kind: 任务类型，例如 ingest
+        :param description: 任务描述信息（如上传的文件列表），原样返回给调用方
+        """
+        self.id = uuid.uuid4().hex
+        self.kind = kind
+        self.description = description or {}
+        self.status = 'queued'
+        self.created_at = time.time()
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        self.result: Any = None
+        self.error: Optional[str] = None
+        self.cancel_event = threading.Event()
+        self.future: Optional[Future] = None
+        self._counters: Dict[str, int] = {}
+        self._lock = threading.Lock()
+        # 进度变化时的回调（JobManager 用于写入 JobStore）
+        self._on_progress: Optional[Callable[['Job'], None]] = None
+
+    @classmethod
+    def from_record(cls, record: Dict[str, Any]) -> 'Job':
+        """由 JobStore 中的记录还原任务（其他进程中执行的任务，只用于查询）"""
+        job = cls(record['kind'], record['description'])
+        job.id = record['job_id']
+        job.status = record['status']
+        job.created_at = record['created_at']
+        job.started_at = record['started_at']
+        job.finished_at = record['finished_at']
+        job.result = record['result']
+        job.error = record['error']
+        job._counters = record['counters']
+        if record['cancel_requested']:
+            job.cancel_event.set()
+        return job
+
+    def advance(self, key: str, count: int = 1) -> None:
+        """累加进度计数"""
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + int(count)
+        if self._on_progress is not None:
+            self._on_progress(self)
+
+    def counters(self) -> Dict[str, int]:
+        with self._lock:
+            return dict(self._counters)
+
+    @property
+    def cancelled(self) -> bool:
+        return self.cancel_event.is_set()
+
+    @property
+    def finished(self) -> bool:
+        return self.status in FINISHED_STATUSES
+
+    def progress(self) -> Dict[str, Dict[str, int]]:
+        """按阶段分组的进度计数，未归入任何阶段的计数放在 other 中"""
+        counters = self.counters()
+        progress = {}
+        for stage, keys in PROGRESS_STAGES.items():
+            progress[stage] = {name: counters.pop(key, 0) for key, name in keys}
+        if counters:
+            progress['other'] = counters
+        return progress
+
+    def to_dict(self) -> Dict[str, Any]:
+        end = self.finished_at or time.time()
+        return {
+            'job_id': self.id,
+            'kind': self.kind,
+            'status': self.status,
+            'description': self.description,
+            'created_at': self.created_at,
+            'started_at': self.started_at,
+            'finished_at': self.finished_at,
+            'elapsed_seconds': round(end - self.started_at, 3) if self.started_at else 0.0,
+            'cancel_requested': self.cancelled,
+            'progress': self.progress(),
+            'result': self.result,
+            'error': self.error,
+        }
+
+
+def _pid_alive(pid: int) -> bool:
+    """进程是否存在（Windows 上 os.kill 会结束目标进程，只能判断是否为当前进程）"""
+    if pid == os.getpid():
+        return True
+    if os.name == 'nt':
+        return False
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+class JobStore:
+    """基于 SQLite 的任务状态存储，供同一服务的多个工作进程共享"""
+
+    SCHEMA = """
+    CREATE TABLE IF NOT EXISTS jobs (
+        job_id TEXT PRIMARY KEY,
+        kind TEXT NOT NULL,
+        status TEXT NOT NULL,
+        description TEXT NOT NULL,
+        created_at REAL NOT NULL,
+        started_at REAL,
+        finished_at REAL,
+        counters TEXT NOT NULL,
+        result TEXT,
+        error TEXT,
+        cancel_requested INTEGER NOT NULL DEFAULT 0,
+        pid INTEGER NOT NULL
+    );
+    CREATE INDEX IF NOT EXISTS idx_jobs_created_at ON jobs(created_at);
+    """
+
+    COLUMNS = ('job_id', 'kind', 'status', 'description', 'created_at', 'started_at', 'finished_at',
+               'counters', 'result', 'error', 'cancel_requested', 'pid')
+
+    def __init__(self, db_path: Union[str, Path]):
+        """
+        :param db_path: SQLite 数据库文件路径
+        """
+        self.db_path = Path(db_path)
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        self._local = threading.local()
+        register_after_fork(self)
+        conn = self._conn()
+        conn.executescript(self.SCHEMA)
+        conn.commit()
+
+    def _after_fork(self) -> None:
+        # fork 出的子进程不能继续使用父进程的 sqlite 连接
+        self._local = threading.local()
+
+    def _conn(self) -> sqlite3.Connection:
+        """每个线程使用独立连接"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(str(self.db_path), timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def save(self, job: Job) -> None:
+        """写入任务的当前状态（保留其他进程写入的取消请求）"""
+        try:
+            result = json.dumps(job.result, ensure_ascii=False, default=str)
+        except (TypeError, ValueError):
+            result = json.dumps(str(job.result), ensure_ascii=False)
+        conn = self._conn()
+        conn.execute(
+            "INSERT INTO jobs (job_id, kind, status, description, created_at, started_at, finished_at, "
+            "counters, result, error, cancel_requested, pid) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?) "
+            "ON CONFLICT(job_id) DO UPDATE SET status = excluded.status, started_at = excluded.started_at, "
+            "finished_at = excluded.finished_at, counters = excluded.counters, result = excluded.result, "
+            "error = excluded.error, cancel_requested = MAX(cancel_requested, excluded.cancel_requested)",
+            (job.id, job.kind, job.status, json.dumps(job.description, ensure_ascii=False, default=str),
+             job.created_at, job.started_at, job.finished_at, json.dumps(job.counters()), result, job.error,
+             int(job.cancelled), os.getpid()))
+        conn.commit()
+
+    def _record(self, row: tuple) -> Dict[str, Any]:
+        record = dict(zip(self.COLUMNS, row))
+        record['description'] = json.loads(record['description'])
+        record['counters'] = json.loads(record['counters'])
+        record['result'] = json.loads(record['result']) if record['result'] is not None else None
+        # 执行任务的工作进程已退出（重启、崩溃），任务不会再结束
+        if record['status'] not in FINISHED_STATUSES and not _pid_alive(record['pid']):
+            record['status'] = 'failed'
+            record['error'] = record['error'] or '执行任务的进程已退出'
+            record['finished_at'] = record['finished_at'] or record['started_at'] or record['created_at']
+        return record
+
+    def load(self, job_id: str) -> Optional[Dict[str, Any]]:
+        row = self._conn().execute(
+            f"SELECT {', '.join(self.COLUMNS)} FROM jobs WHERE job_id = ?", (job_id,)).fetchone()
+        return self._record(row) if row is not None else None
+
+    def list(self, limit: int) -> List[Dict[str, Any]]:
+        """最近提交的任务（从新到旧）"""
+        rows = self._conn().execute(
+            f"SELECT {', '.join(self.COLUMNS)} FROM jobs ORDER BY created_at DESC LIMIT ?", (int(limit),))
+        return [self._record(row) for row in rows]
+
+    def request_cancel(self, job_id: str) -> None:
+        conn = self._conn()
+        conn.execute("UPDATE jobs SET cancel_requested = 1 WHERE job_id = ?", (job_id,))
+        conn.commit()
+
+    def cancel_requested(self, job_id: str) -> bool:
+        row = self._conn().execute("SELECT cancel_requested FROM jobs WHERE job_id = ?", (job_id,)).fetchone()
+        return bool(row and row[0])
+
+    def prune(self, max_history: int) -> None:
+        """已结束的任务超出上限时删除最早的"""
+        conn = self._conn()
+        conn.execute(
+            "DELETE FROM jobs WHERE job_id IN (SELECT job_id FROM jobs WHERE status IN (?, ?, ?) "
+            "ORDER BY created_at DESC LIMIT -1 OFFSET ?)", FINISHED_STATUSES + (int(max_history),))
+        conn.commit()
+
+
+class JobManager:
+    """后台任务管理器：有界线程池执行任务，按任务 ID 查询与取消"""
+
+    def __init__(self, workers: int = 1, max_history: int = 100, db_path: Union[str, Path] = None,
+                 sync_interval: float = 0.5):
+        """
+        :param workers: 同时执行的任务数（入库任务共享嵌入模型和文档存储，默认串行执行）
+        :param max_history: 保留的已结束任务数量上限
+        :param db_path: 可选，任务状态数据库路径（多进程服务的工作进程共享），None 时只保存在当前进程中
+        :param sync_interval: 运行中的任务写入进度、读取取消请求的最小间隔（秒）
+        """
+        self.workers = max(1, int(workers))
+        self.max_history = max(1, int(max_history))
+        self.sync_interval = float(sync_interval)
+        self.store = JobStore(db_path) if db_path else None
+        self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='job')
+        self._jobs: 'OrderedDict[str, Job]' = OrderedDict()
+        self._synced_at: Dict[str, float] = {}
+        self._lock = threading.Lock()
+        register_after_fork(self)
+
+    def _after_fork(self) -> None:
+        # 子进程中线程池的工作线程已不存在；父进程的任务记录保留，未结束的任务不会在子进程中继续执行
+        self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='job')
+        self._lock = threading.Lock()
+        self._synced_at = {}
+        for job in self._jobs.values():
+            if not job.finished:
+                job.status = 'failed'
+                job.error = '任务所在进程已 fork，未在当前进程中执行'
+                job.finished_at = time.time()
+
+    def _save(self, job: Job) -> None:
+        """写入 JobStore（失败时只打印，不影响任务执行）"""
+        if self.store is None:
+            return
+        try:
+            self.store.save(job)
+        except Exception as e:
+            print(f"写入任务 {job.id} 状态失败: {str(e)}")
+
+    def _sync(self, job: Job) -> None:
+        """任务上报进度时按间隔写入进度，并读取其他进程写入的取消请求"""
+        now = time.monotonic()
+        with self._lock:
+            if now - self._synced_at.get(job.id, 0.0) < self.sync_interval:
+                return
+            self._synced_at[job.id] = now
+        self._save(job)
+        try:
+            if not job.cancelled and self.store.cancel_requested(job.id):
+                print(f"后台任务 {job.kind} ({job.id}) 收到取消请求")
+                job.cancel_event.set()
+        except Exception as e:
+            print(f"读取任务 {job.id} 取消请求失败: {str(e)}")
+
+    def submit(self, kind: str, target: Callable[[Job], Any], description: Dict[str, Any] = None) -> Job:
+        """
+        提交任务
+        :param target: 任务函数，参数为 Job（通过 job.advance 上报进度，通过 job.cancel_event 响应取消），返回值保存为任务结果
+        :return: 新建的任务（状态为 queued）
+        """
+        job = Job(kind, description)
+        if self.store is not None:
+            job._on_progress = self._sync
+        with self._lock:
+            self._jobs[job.id] = job
+            self._prune()
+        self._save(job)
+        job.future = self._executor.submit(self._run, job, target)
+        return job
+
+    def _run(self, job: Job, target: Callable[[Job], Any]) -> None:
+        if self.store is not None and not job.cancelled:
+            # 排队期间其他进程写入的取消请求
+            self._sync(job)
+        if job.cancelled:
+            job.status = 'cancelled'
+            job.finished_at = time.time()
+            self._save(job)
+            return
+        job.status = 'running'
+        job.started_at = time.time()
+        self._save(job)
+        try:
+            job.result = target(job)
+            job.status = 'cancelled' if job.cancelled else 'completed'
+        except Exception as e:
+            print(f"后台任务 {job.kind} ({job.id}) 执行失败: {str(e)}")
+            job.error = str(e)
+            job.status = 'failed'
+        finally:
+            job.finished_at = time.time()
+            with self._lock:
+                self._synced_at.pop(job.id, None)
+            self._save(job)
+
+    def _prune(self) -> None:
+        """已结束的任务超出上限时删除最早的（调用方持有锁）"""
+        finished = [job_id for job_id, job in self._jobs.items() if job.finished]
+        for job_id in finished[:max(0, len(finished) - self.max_history)]:
+            del self._jobs[job_id]
+        if self.store is not None:
+            try:
+                self.store.prune(self.max_history)
+            except Exception as e:
+                print(f"清理任务记录失败: {str(e)}")
+
+    def get(self, job_id: str) -> Optional[Job]:
+        """当前进程中的任务，或（指定 db_path 时）其他进程提交的任务"""
+        with self._lock:
+            job = self._jobs.get(job_id)
+        if job is None and self.store is not None:
+            record = self.store.load(job_id)
+            job = Job.from_record(record) if record is not None else None
+        return job
+
+    def list(self, status: str = None) -> List[Job]:
+        """全部任务（按提交时间从新到旧），可按状态过滤"""
+        with self._lock:
+            jobs = list(self._jobs.values())
+        if self.store is not None:
+            # 当前进程中的任务状态最新，其余来自 JobStore
+            local = {job.id for job in jobs}
+            jobs += [Job.from_record(record) for record in self.store.list(self.max_history + self.workers * 2)
+                     if record['job_id'] not in local]
+            jobs.sort(key=lambda job: job.created_at)
+        return [job for job in reversed(jobs) if status is None or job.status == status]
+
+    def cancel(self, job_id: str) -> Optional[Job]:
+        """
+        取消任务：排队中的任务立即取消，运行中的任务在下一个安全点退出，已结束的任务不受影响
+        :return: 对应的任务，不存在时返回 None
+        """
+        with self._lock:
+            local = self._jobs.get(job_id)
+        if local is None and self.store is not None:
+            # 其他进程中的任务：写入取消请求，由执行任务的进程在下一次上报进度时读取
+            job = self.get(job_id)
+            if job is not None and not job.finished:
+                self.store.request_cancel(job_id)
+                job.cancel_event.set()
+            return job
+        job = local
+        if job is None or job.finished:
+            return job
+        job.cancel_event.set()
+        if job.future is not None and job.future.cancel():
+            job.status = 'cancelled'
+            job.finished_at = time.time()
+        self._save(job)
+        return job
+
+    def stats(self) -> Dict[str, int]:
+        """各状态的任务数量"""
+        counts = {status: 0 for status in ('queued', 'running') + FINISHED_STATUSES}
+        for job in self.list():
+            counts[job.status] += 1
+        return dict(counts, workers=self.workers)
+
+    def shutdown(self, cancel_running: bool = True) -> None:
+        """停止任务管理器，可选取消运行中的任务"""
+        if cancel_running:
+            for job in self.list():
+                if not job.finished:
+                    self.cancel(job.id)
+        self._executor.shutdown(wait=False, cancel_futures=True)
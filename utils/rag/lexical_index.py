@@ -0,0 +1,269 @@
+"""
+词法（BM25）索引模块
+与文档块存储共用同一个 SQLite 数据库，倒排表按 chunks.id（自增主键，不随删除变化）记录词频：
+- chunk_terms:   (term, chunk_id, tf) 倒排表
+- chunk_lengths: (chunk_id, length)  文档长度，同时标记该文档块已建立倒排
+- term_stats:    (term, df)          文档频率，检索时先按文档频率跳过高频词，不读取其倒排
+- corpus_stats:  文档数与总长度（单行），检索时不再对 chunk_lengths 做全表统计
+文档块被删除或正文被修改时，由触发器删除对应的倒排记录并扣减统计；sync() 只为尚未建立倒排的文档块分词入库
+并累加统计，因此索引随文档块存储增量维护，重启后无需重建。
+分词：中文按字二元组（单字词保留单字），英文/数字按词（含连字符的编号同时保留整体和各部分）。
+"""
+import math
+import re
+import sqlite3
+import threading
+from collections import Counter
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple, Union
+import numpy as np
+from utils.fork_safety import register_after_fork
+from .vector_index import top_k_indices
+
+_TOKEN_PATTERN = re.compile(r'[a-z0-9]+(?:[._\-/][a-z0-9]+)*|[\u3400-\u4dbf\u4e00-\u9fff]+')
+_CJK_PATTERN = re.compile(r'[\u3400-\u4dbf\u4e00-\u9fff]')
+_SEPARATOR_PATTERN = re.compile(r'[._\-/]')
+
+
+def tokenize(text: str) -> List[str]:
+    """中文字二元组 + 英文/数字词"""
+    tokens = []
+    for match in _TOKEN_PATTERN.finditer((text or '').lower()):
+        token = match.group()
+        if _CJK_PATTERN.match(token):
+            if len(token) == 1:
+                tokens.append(token)
+            else:
+                tokens.extend(token[i:i + 2] for i in range(len(token) - 1))
+        else:
+            tokens.append(token)
+            # 型号、编号等带分隔符的词，同时索引各组成部分
+            if _SEPARATOR_PATTERN.search(token):
+                tokens.extend(part for part in _SEPARATOR_PATTERN.split(token) if part)
+    return tokens
+
+
+class LexicalIndex:
+    """基于 SQLite 倒排表的 BM25 检索"""
+
+    SCHEMA = """
+    CREATE TABLE IF NOT EXISTS chunk_terms (
+        term TEXT NOT NULL,
+        chunk_id INTEGER NOT NULL,
+        tf INTEGER NOT NULL,
+        PRIMARY KEY (term, chunk_id)
+    ) WITHOUT ROWID;
+    CREATE INDEX IF NOT EXISTS idx_chunk_terms_chunk_id ON chunk_terms(chunk_id);
+    CREATE TABLE IF NOT EXISTS chunk_lengths (
+        chunk_id INTEGER PRIMARY KEY,
+        length INTEGER NOT NULL
+    );
+    CREATE TABLE IF NOT EXISTS term_stats (
+        term TEXT PRIMARY KEY,
+        df INTEGER NOT NULL
+    ) WITHOUT ROWID;
+    CREATE TABLE IF NOT EXISTS corpus_stats (
+        id INTEGER PRIMARY KEY CHECK (id = 0),
+        num_docs INTEGER NOT NULL,
+        total_length INTEGER NOT NULL
+    );
+    DROP TRIGGER IF EXISTS trg_chunks_lexical_delete;
+    DROP TRIGGER IF EXISTS trg_chunks_lexical_update;
+    CREATE TRIGGER IF NOT EXISTS trg_chunks_lexical_stats_delete AFTER DELETE ON chunks
+    BEGIN
+        UPDATE term_stats SET df = df - 1 WHERE term IN (SELECT term FROM chunk_terms WHERE chunk_id = old.id);
+        UPDATE corpus_stats SET num_docs = num_docs - 1,
+            total_length = total_length - (SELECT length FROM chunk_lengths WHERE chunk_id = old.id)
+            WHERE EXISTS (SELECT 1 FROM chunk_lengths WHERE chunk_id = old.id);
+        DELETE FROM chunk_terms WHERE chunk_id = old.id;
+        DELETE FROM chunk_lengths WHERE chunk_id = old.id;
+    END;
+    CREATE TRIGGER IF NOT EXISTS trg_chunks_lexical_stats_update AFTER UPDATE OF chunk_content ON chunks
+    WHEN old.chunk_content IS NOT new.chunk_content
+    BEGIN
+        UPDATE term_stats SET df = df - 1 WHERE term IN (SELECT term FROM chunk_terms WHERE chunk_id = old.id);
+        UPDATE corpus_stats SET num_docs = num_docs - 1,
+            total_length = total_length - (SELECT length FROM chunk_lengths WHERE chunk_id = old.id)
+            WHERE EXISTS (SELECT 1 FROM chunk_lengths WHERE chunk_id = old.id);
+        DELETE FROM chunk_terms WHERE chunk_id = old.id;
+        DELETE FROM chunk_lengths WHERE chunk_id = old.id;
+    END;
+    """
+
+    def __init__(self, db_path: Union[str, Path], k1: float = 1.5, b: float = 0.75, max_df: float = 0.5):
+        """
+        :param db_path: 文档块数据库路径（需已创建 chunks 表）
+        :param k1: BM25 词频饱和参数
+        :param b: BM25 长度归一化参数
+        :param max_df: 文档频率占比高于该值的词（类似停用词）不参与打分
+        """
+        self.db_path = Path(db_path)
+        self.k1 = k1
+        self.b = b
+        self.max_df = max_df
+        self._local = threading.local()
+        self._write_lock = threading.Lock()
+        register_after_fork(self)
+
+        conn = self._conn()
+        conn.executescript(self.SCHEMA)
+        # 多个服务进程可能同时初始化，在写事务中检查并补齐统计
+        conn.execute("BEGIN IMMEDIATE")
+        if conn.execute("SELECT 1 FROM corpus_stats").fetchone() is None:
+            self._rebuild_stats(conn)
+        conn.commit()
+
+    @staticmethod
+    def _rebuild_stats(conn: sqlite3.Connection) -> None:
+        """由倒排表重新统计文档频率与文档总数、总长度（旧版数据库升级或清空后调用）"""
+        conn.execute("DELETE FROM term_stats")
+        conn.execute("INSERT INTO term_stats (term, df) SELECT term, COUNT(*) FROM chunk_terms GROUP BY term")
+        conn.execute("DELETE FROM corpus_stats")
+        conn.execute(
+            "INSERT INTO corpus_stats (id, num_docs, total_length) "
+            "SELECT 0, COUNT(*), COALESCE(SUM(length), 0) FROM chunk_lengths"
+        )
+
+    def _after_fork(self) -> None:
+        # fork 出的子进程不能继续使用父进程的 sqlite 连接
+        self._local = threading.local()
+        self._write_lock = threading.Lock()
+
+    def _conn(self) -> sqlite3.Connection:
+        """每个线程使用独立连接"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(str(self.db_path), timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def pending_count(self) -> int:
+        """尚未建立倒排的文档块数量"""
+        row = self._conn().execute(
+            "SELECT COUNT(*) FROM chunks c LEFT JOIN chunk_lengths l ON l.chunk_id = c.id WHERE l.chunk_id IS NULL"
+        ).fetchone()
+        return row[0]
+
+    def sync(self, batch_size: int = 1000) -> int:
+        """
+        为尚未建立倒排的文档块（新增或正文被修改）分词并写入倒排表
+        :return: 本次建立倒排的文档块数量
+        """
+        conn = self._conn()
+        indexed = 0
+        last_id = 0
+        with self._write_lock:
+            while True:
+                # 按 id 分页，不重复扫描已处理过的文档块
+                rows = conn.execute(
+                    "SELECT c.id, c.chunk_content FROM chunks c WHERE c.id > ? "
+                    "AND NOT EXISTS (SELECT 1 FROM chunk_lengths l WHERE l.chunk_id = c.id) ORDER BY c.id LIMIT ?",
+                    (last_id, batch_size)
+                ).fetchall()
+                if not rows:
+                    break
+                last_id = rows[-1][0]
+                terms, lengths = [], []
+                df = Counter()
+                for chunk_id, content in rows:
+                    tokens = tokenize(content)
+                    lengths.append((chunk_id, len(tokens)))
+                    counts = Counter(tokens)
+                    df.update(counts.keys())
+                    terms.extend((term, chunk_id, tf) for term, tf in counts.items())
+                # 按主键顺序写入，减少 B 树页分裂
+                terms.sort()
+                conn.executemany("INSERT OR IGNORE INTO chunk_terms (term, chunk_id, tf) VALUES (?, ?, ?)", terms)
+                conn.executemany("INSERT OR IGNORE INTO chunk_lengths (chunk_id, length) VALUES (?, ?)", lengths)
+                conn.executemany(
+                    "INSERT INTO term_stats (term, df) VALUES (?, ?) ON CONFLICT(term) DO UPDATE SET df = df + excluded.df",
+                    sorted(df.items())
+                )
+                conn.execute(
+                    "UPDATE corpus_stats SET num_docs = num_docs + ?, total_length = total_length + ?",
+                    (len(lengths), sum(length for _, length in lengths))
+                )
+                conn.commit()
+                indexed += len(rows)
+        return indexed
+
+    def search(self, query: str, k: int, mask: Optional[np.ndarray] = None) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        BM25 检索
+        :param mask: 可选，按 row_id 的布尔掩码（元数据过滤结果），只返回掩码为 True 的文档块
+        :return: (文档块 row_id 数组, BM25 分数数组)，按分数降序
+        """
+        query_terms = Counter(tokenize(query))
+        empty = (np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float32))
+        if not query_terms or k <= 0:
+            return empty
+
+        conn = self._conn()
+        stats = conn.execute("SELECT num_docs, total_length FROM corpus_stats").fetchone()
+        num_docs, total_length = stats if stats else (0, 0)
+        if not num_docs:
+            return empty
+        avg_length = (total_length or 0) / num_docs or 1.0
+
+        terms = list(query_terms)
+        placeholders = ','.join('?' * len(terms))
+        dfs = dict(conn.execute(f"SELECT term, df FROM term_stats WHERE term IN ({placeholders})", terms).fetchall())
+
+        scores: Dict[int, float] = {}
+        for term, query_tf in query_terms.items():
+            df = dfs.get(term, 0)
+            # 文档数较少时不按文档频率过滤，避免小知识库中大部分词被跳过；高频词不读取倒排
+            if df <= 0 or (num_docs >= 100 and df / num_docs > self.max_df):
+                continue
+            postings = conn.execute(
+                "SELECT c.row_id, t.tf, l.length FROM chunk_terms t "
+                "JOIN chunks c ON c.id = t.chunk_id JOIN chunk_lengths l ON l.chunk_id = t.chunk_id "
+                "WHERE t.term = ?", (term,)
+            ).fetchall()
+            idf = math.log(1 + (num_docs - df + 0.5) / (df + 0.5))
+            for row_id, tf, length in postings:
+                norm = tf * (self.k1 + 1) / (tf + self.k1 * (1 - self.b + self.b * length / avg_length))
+                scores[row_id] = scores.get(row_id, 0.0) + query_tf * idf * norm
+
+        if not scores:
+            return empty
+        ids = np.fromiter(scores.keys(), dtype=np.int64, count=len(scores))
+        values = np.fromiter(scores.values(), dtype=np.float32, count=len(scores))
+        if mask is not None:
+            mask = np.asarray(mask, dtype=bool)
+            keep = ids < len(mask)
+            keep[keep] = mask[ids[keep]]
+            ids, values = ids[keep], values[keep]
+        order = top_k_indices(values, k)
+        return ids[order], values[order]
+
+    def reset(self) -> None:
+        """清空倒排表"""
+        with self._write_lock:
+            conn = self._conn()
+            conn.execute("DELETE FROM chunk_terms")
+            conn.execute("DELETE FROM chunk_lengths")
+            self._rebuild_stats(conn)
+            conn.commit()
+
+
+def reciprocal_rank_fusion(rankings: List[np.ndarray], k: int = 60,
+                           weights: Optional[List[float]] = None) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    倒数排名融合（RRF）：score(d) = Σ w_i / (k + rank_i(d))，rank 从 1 开始
+    :param rankings: 多路检索结果（按相关性降序的 row_id 数组）
+    :return: (融合后的 row_id 数组, 融合分数数组)，按分数降序
+    """
+    weights = weights or [1.0] * len(rankings)
+    fused: Dict[int, float] = {}
+    for ranking, weight in zip(rankings, weights):
+        for rank, doc_id in enumerate(ranking, start=1):
+            fused[int(doc_id)] = fused.get(int(doc_id), 0.0) + weight / (k + rank)
+    if not fused:
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float32)
+    ids = np.fromiter(fused.keys(), dtype=np.int64, count=len(fused))
+    scores = np.fromiter(fused.values(), dtype=np.float32, count=len(fused))
+    order = np.argsort(-scores, kind='stable')
+    return ids[order], scores[order]
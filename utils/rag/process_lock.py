@@ -0,0 +1,82 @@
+"""
+跨进程写锁
+多个工作进程共用同一个向量存储目录与文档块数据库时，写入（入库、删除、修改、合并段）必须串行化，
+且写入前要先加载其他进程已写入的段清单，否则会覆盖对方的修改。
+ProcessLock 在进程内是可重入锁，最外层获取时再对锁文件加 flock；
+获取回调在最外层获取后执行（用于检查并加载其他进程的修改）。
+不支持 flock 的平台（Windows）只有进程内锁（该平台上不使用多进程服务）。
+"""
+import threading
+from pathlib import Path
+from typing import Callable, List, Union
+from utils.fork_safety import register_after_fork
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+
+class ProcessLock:
+    """可重入的跨进程锁（线程间 RLock + 进程间 flock）"""
+
+    def __init__(self, path: Union[str, Path]):
+        """
+        :param path: 锁文件路径（不存在时创建）
+        """
+        self.path = Path(path)
+        self._lock = threading.RLock()
+        self._depth = 0
+        self._file = None
+        self._callbacks: List[Callable[[], None]] = []
+        register_after_fork(self)
+
+    def add_acquire_callback(self, callback: Callable[[], None]) -> None:
+        """添加最外层获取锁之后执行的回调（回调抛出异常时释放锁并向上抛出）"""
+        self._callbacks.append(callback)
+
+    def acquire(self) -> bool:
+        self._lock.acquire()
+        self._depth += 1
+        if self._depth == 1:
+            try:
+                self._lock_file()
+                for callback in list(self._callbacks):
+                    callback()
+            except BaseException:
+                self._unlock_file()
+                self._depth -= 1
+                self._lock.release()
+                raise
+        return True
+
+    def release(self) -> None:
+        self._depth -= 1
+        if self._depth == 0:
+            self._unlock_file()
+        self._lock.release()
+
+    def __enter__(self) -> 'ProcessLock':
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.release()
+
+    def _lock_file(self) -> None:
+        if fcntl is None:
+            return
+        if self._file is None:
+            self._file = open(self.path, 'a+b')
+        fcntl.flock(self._file.fileno(), fcntl.LOCK_EX)
+
+    def _unlock_file(self) -> None:
+        if fcntl is not None and self._file is not None:
+            fcntl.flock(self._file.fileno(), fcntl.LOCK_UN)
+
+    def _after_fork(self) -> None:
+        # flock 属于打开的文件描述，父子进程共享；子进程重新打开锁文件，才能与父进程互斥
+        # 父进程中持有锁的线程不在子进程中，重建进程内锁
+        self._lock = threading.RLock()
+        self._depth = 0
+        self._file = None
@@ -0,0 +1,327 @@
+"""
+量化向量索引模块
+全精度向量仍保存在 VectorStore 的 memmap 段文件中（不常驻内存），索引只在内存中保存量化编码：
+- sq8: int8 标量量化，每个维度按训练样本的 [min, max] 线性映射到 0..255，内存为 float32 的 1/4
+- pq:  乘积量化，向量切分为 m 个子空间，每个子空间用 256 个聚类中心编码，每个向量只占 m 字节
+检索分两步：先用量化编码对全部（或过滤后的）行近似打分取出 k × rescore_factor 个候选，
+再从 memmap 中读取候选的全精度向量精确打分，返回前 k 个
+"""
+from typing import Any, Callable, Dict, List, Optional, Tuple
+import numpy as np
+from .vector_index import BaseIndex, top_k_indices
+from .vector_store import VectorStore
+
+
+def _kmeans(data: np.ndarray, k: int, iters: int, rng: np.random.Generator) -> np.ndarray:
+    """欧氏距离 k-means，返回聚类中心"""
+    centroids = data[rng.choice(len(data), k, replace=False)].copy()
+    for _ in range(iters):
+        assign = _nearest(data, centroids)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assign, data)
+        counts = np.bincount(assign, minlength=k)
+        non_empty = counts > 0
+        # 空簇保留原聚类中心
+        centroids[non_empty] = sums[non_empty] / counts[non_empty, None]
+    return centroids
+
+
+def _nearest(data: np.ndarray, centroids: np.ndarray) -> np.ndarray:
+    """最近聚类中心：argmin ||x-c||² 等价于 argmax (2x·c - ||c||²)"""
+    return np.argmax(2 * data @ centroids.T - (centroids ** 2).sum(axis=1), axis=1)
+
+
+class ScalarQuantizer:
+    """int8 标量量化"""
+
+    def __init__(self):
+        self.vmin: Optional[np.ndarray] = None
+        self.scale: Optional[np.ndarray] = None
+
+    @property
+    def trained(self) -> bool:
+        return self.vmin is not None
+
+    def train(self, vectors: np.ndarray, rng: np.random.Generator = None) -> None:
+        self.vmin = vectors.min(axis=0).astype(np.float32)
+        vmax = vectors.max(axis=0).astype(np.float32)
+        self.scale = np.maximum(vmax - self.vmin, 1e-12) / 255
+
+    def encode(self, vectors: np.ndarray) -> np.ndarray:
+        codes = np.rint((vectors - self.vmin) / self.scale)
+        return np.clip(codes, 0, 255).astype(np.uint8)
+
+    def decode(self, codes: np.ndarray) -> np.ndarray:
+        return codes.astype(np.float32) * self.scale + self.vmin
+
+    def inner_product(self, query: np.ndarray) -> Callable[[np.ndarray], np.ndarray]:
+        """返回按编码计算 query·x 近似值的函数：x ≈ vmin + codes * scale"""
+        weights = (query * self.scale).astype(np.float32)
+        bias = float(query @ self.vmin)
+        return lambda codes: codes.astype(np.float32) @ weights + bias
+
+    def squared_distance(self, query: np.ndarray, sq_norms: np.ndarray) -> Callable[[np.ndarray, np.ndarray], np.ndarray]:
+        """返回按编码计算 ||q-x||² 近似值的函数：||q||² - 2q·x + ||x||²（x 的模长平方在编码时预先计算）"""
+        inner = self.inner_product(query)
+        query_sq = float(query @ query)
+        return lambda codes, ids: query_sq - 2 * inner(codes) + sq_norms[ids]
+
+    def get_state(self) -> Dict[str, np.ndarray]:
+        return {'vmin': self.vmin, 'scale': self.scale}
+
+    def set_state(self, arrays: Dict[str, np.ndarray]) -> None:
+        self.vmin = arrays['vmin']
+        self.scale = arrays['scale']
+
+
+class ProductQuantizer:
+    """乘积量化（每个子空间 256 个聚类中心，编码为 uint8）"""
+
+    def __init__(self, m: int = 64, train_iters: int = 8):
+        self.m = m
+        self.train_iters = train_iters
+        self.codebooks: Optional[np.ndarray] = None  # (m, 256, 子空间维度)
+
+    @property
+    def trained(self) -> bool:
+        return self.codebooks is not None
+
+    def _split(self, vectors: np.ndarray) -> np.ndarray:
+        """(n, d) -> (n, m, d/m)"""
+        if vectors.shape[1] % self.m != 0:
+            raise ValueError(f"乘积量化子空间数 m={self.m} 必须整除向量维度 {vectors.shape[1]}")
+        return vectors.reshape(len(vectors), self.m, -1)
+
+    def train(self, vectors: np.ndarray, rng: np.random.Generator = None) -> None:
+        rng = rng or np.random.default_rng(42)
+        sub_vectors = self._split(vectors)
+        self.codebooks = np.stack([
+            _kmeans(np.ascontiguousarray(sub_vectors[:, j]), 256, self.train_iters, rng) for j in range(self.m)
+        ]).astype(np.float32)
+
+    def encode(self, vectors: np.ndarray) -> np.ndarray:
+        sub_vectors = self._split(vectors)
+        codes = np.empty((len(vectors), self.m), dtype=np.uint8)
+        for j in range(self.m):
+            codes[:, j] = _nearest(sub_vectors[:, j], self.codebooks[j])
+        return codes
+
+    def decode(self, codes: np.ndarray) -> np.ndarray:
+        return self.codebooks[np.arange(self.m), codes].reshape(len(codes), -1)
+
+    def _lookup(self, tables: np.ndarray) -> Callable[[np.ndarray], np.ndarray]:
+        """查表求和：每个子空间的得分预先对 256 个聚类中心算好"""
+        offsets = (np.arange(self.m) * 256).astype(np.intp)
+        flat = tables.reshape(-1)
+        return lambda codes: flat[codes.astype(np.intp) + offsets].sum(axis=1)
+
+    def inner_product(self, query: np.ndarray) -> Callable[[np.ndarray], np.ndarray]:
+        sub_query = query.reshape(self.m, -1)
+        tables = np.einsum('mkd,md->mk', self.codebooks, sub_query).astype(np.float32)
+        return self._lookup(tables)
+
+    def squared_distance(self, query: np.ndarray, sq_norms: np.ndarray = None) -> Callable[[np.ndarray, np.ndarray], np.ndarray]:
+        sub_query = query.reshape(self.m, -1)
+        tables = ((self.codebooks - sub_query[:, None, :]) ** 2).sum(axis=2).astype(np.float32)
+        lookup = self._lookup(tables)
+        return lambda codes, ids: lookup(codes)
+
+    def get_state(self) -> Dict[str, np.ndarray]:
+        return {'codebooks': self.codebooks}
+
+    def set_state(self, arrays: Dict[str, np.ndarray]) -> None:
+        if arrays['codebooks'].shape[0] != self.m:
+            raise ValueError("乘积量化参数 m 与索引文件不一致")
+        self.codebooks = arrays['codebooks']
+
+
+class QuantizedIndex(BaseIndex):
+    """
+    量化索引基类
+    - 向量数量不足以训练时退化为暴力检索
+    - 追加、修改的向量直接用已有码本编码，删除的行从编码中去掉；数据量相比训练时增长 4 倍以上时重新训练
+    """
+
+    # 训练所需的最少向量数
+    MIN_TRAIN_SIZE = 256
+    # 分块打分的行数
+    BLOCK_ROWS = 65536
+
+    def __init__(self, metric: str = 'cosine', rescore_factor: int = 8, train_size: int = 65536, seed: int = 42):
+        """
+        :param rescore_factor: 近似打分后取 k × rescore_factor 个候选做全精度重排
+        :param train_size: 训练使用的最多样本数
+        """
+        super().__init__(metric)
+        self.rescore_factor = max(1, int(rescore_factor))
+        self.train_size = train_size
+        self.seed = seed
+        self.quantizer = self._make_quantizer()
+        self.codes: Optional[np.ndarray] = None
+        self.sq_norms = np.zeros(0, dtype=np.float32)
+        self.trained_ntotal = 0
+
+    def _make_quantizer(self):
+        raise NotImplementedError
+
+    def _prepare(self, vectors: np.ndarray) -> np.ndarray:
+        """余弦度量下对单位向量量化"""
+        vectors = np.asarray(vectors, dtype=np.float32).reshape(-1, self.store.dimension)
+        if self.metric == 'cosine' and not self.store.normalize:
+            norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+            vectors = vectors / np.maximum(norms, 1e-12)
+        return vectors
+
+    def _encode_rows(self, start: int, end: int) -> Tuple[np.ndarray, np.ndarray]:
+        """分块读取 [start, end) 行的全精度向量并编码，返回 (编码, 解码后向量的模长平方)"""
+        return self._encode_ids(np.arange(start, end, dtype=np.int64))
+
+    def _encode_ids(self, ids: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """分块读取指定行的全精度向量并编码，返回 (编码, 解码后向量的模长平方)"""
+        codes, sq_norms = [], []
+        for block_start in range(0, len(ids), self.BLOCK_ROWS):
+            vectors = self._prepare(self.store.get(ids[block_start:block_start + self.BLOCK_ROWS]))
+            block_codes = self.quantizer.encode(vectors)
+            decoded = self.quantizer.decode(block_codes)
+            codes.append(block_codes)
+            sq_norms.append(np.einsum('ij,ij->i', decoded, decoded).astype(np.float32))
+        return np.concatenate(codes), np.concatenate(sq_norms)
+
+    def build(self, store: Optional[VectorStore]) -> None:
+        self._attach(store)
+        self.ntotal = 0 if self.store is None else len(self.store)
+        self.quantizer = self._make_quantizer()
+        self.codes = None
+        self.sq_norms = np.zeros(0, dtype=np.float32)
+        self.trained_ntotal = 0
+        if self.ntotal < self.MIN_TRAIN_SIZE:
+            # 数据量太小，直接暴力检索
+            return
+
+        rng = np.random.default_rng(self.seed)
+        sample_ids = np.sort(rng.choice(self.ntotal, min(self.ntotal, self.train_size), replace=False))
+        self.quantizer.train(self._prepare(self.store.get(sample_ids)), rng)
+        self.codes, self.sq_norms = self._encode_rows(0, self.ntotal)
+        self.trained_ntotal = self.ntotal
+
+    def add(self, store: VectorStore) -> None:
+        start = self.ntotal
+        self._attach(store)
+        self.ntotal = 0 if self.store is None else len(self.store)
+        if self.ntotal <= start:
+            return
+        if self.codes is None or self.ntotal >= 4 * self.trained_ntotal:
+            self.build(store)
+            return
+        codes, sq_norms = self._encode_rows(start, self.ntotal)
+        self.codes = np.concatenate([self.codes, codes])
+        self.sq_norms = np.concatenate([self.sq_norms, sq_norms])
+
+    def update(self, store: VectorStore, ids: List[int]) -> None:
+        self._attach(store)
+        if self.codes is None or len(ids) == 0:
+            return
+        ids = np.unique(np.asarray(ids, dtype=np.int64))
+        self.codes[ids], self.sq_norms[ids] = self._encode_ids(ids)
+
+    def remove(self, store: VectorStore, ids: List[int]) -> None:
+        keep = self._kept_rows(ids)
+        self._attach(store)
+        total = 0 if self.store is None else len(self.store)
+        if self.codes is None or total != int(keep.sum()):
+            self.build(store)
+            return
+        # 码本不变，只去掉被删除行的编码
+        self.codes = self.codes[keep]
+        self.sq_norms = self.sq_norms[keep]
+        self.ntotal = total
+
+    def _approximate_scores(self, query: np.ndarray, ids: Optional[np.ndarray]) -> Tuple[np.ndarray, np.ndarray]:
+        """按量化编码分块近似打分，返回 (行号, 近似分数)"""
+        query = self._prepare(query).reshape(-1)
+        if self.metric == 'cosine':
+            inner = self.quantizer.inner_product(query)
+            score = lambda codes, rows: inner(codes)
+        else:
+            distance = self.quantizer.squared_distance(query, self.sq_norms)
+            score = lambda codes, rows: -distance(codes, rows)
+        rows = np.arange(self.ntotal, dtype=np.int64) if ids is None else ids
+        scores = np.empty(len(rows), dtype=np.float32)
+        for start in range(0, len(rows), self.BLOCK_ROWS):
+            block = rows[start:start + self.BLOCK_ROWS]
+            codes = self.codes[start:start + len(block)] if ids is None else self.codes[block]
+            scores[start:start + len(block)] = score(codes, block)
+        return rows, scores
+
+    def search(self, query_vector: np.ndarray, k: int,
+               mask: Optional[np.ndarray] = None) -> Tuple[np.ndarray, np.ndarray]:
+        if self.ntotal == 0:
+            return self._empty_result()
+        allowed = None if mask is None else self._allowed_ids(mask)
+        shortlist_size = k * self.rescore_factor
+        # 未训练，或候选不多于重排数量时，直接精确检索
+        if self.codes is None or (allowed is not None and len(allowed) <= shortlist_size):
+            if allowed is not None:
+                return self._search_ids(query_vector, allowed, k)
+            scores = self._scores(query_vector)
+            ids = top_k_indices(scores, k)
+            return ids, scores[ids]
+
+        rows, approximate = self._approximate_scores(query_vector, allowed)
+        shortlist = np.sort(rows[top_k_indices(approximate, shortlist_size)])
+        # 只读取候选行的全精度向量（memmap 按需加载）做精确重排
+        return self._search_ids(query_vector, shortlist, k)
+
+    def memory_bytes(self) -> int:
+        """索引常驻内存（量化编码、模长、码本）"""
+        total = self.sq_norms.nbytes + (0 if self.codes is None else self.codes.nbytes)
+        if self.quantizer.trained:
+            total += sum(array.nbytes for array in self.quantizer.get_state().values())
+        return int(total)
+
+    def _get_state(self) -> Tuple[Dict[str, Any], Dict[str, np.ndarray]]:
+        meta = {'trained_ntotal': self.trained_ntotal}
+        if self.codes is None:
+            return meta, {}
+        arrays = {'codes': self.codes, 'sq_norms': self.sq_norms}
+        arrays.update(self.quantizer.get_state())
+        return meta, arrays
+
+    def _set_state(self, meta: Dict[str, Any], arrays: Dict[str, np.ndarray]) -> None:
+        self.trained_ntotal = meta.get('trained_ntotal', 0)
+        self.quantizer = self._make_quantizer()
+        if 'codes' in arrays:
+            self.quantizer.set_state(arrays)
+            self.codes = arrays['codes']
+            self.sq_norms = arrays['sq_norms']
+        else:
+            self.codes = None
+            self.sq_norms = np.zeros(0, dtype=np.float32)
+
+
+class SQ8Index(QuantizedIndex):
+    """int8 标量量化索引"""
+
+    index_type = 'sq8'
+
+    def _make_quantizer(self) -> ScalarQuantizer:
+        return ScalarQuantizer()
+
+
+class PQIndex(QuantizedIndex):
+    """乘积量化索引"""
+
+    index_type = 'pq'
+
+    def __init__(self, metric: str = 'cosine', m: int = 64, rescore_factor: int = 16, train_size: int = 16384,
+                 train_iters: int = 8, seed: int = 42):
+        """
+        :param m: 子空间数量（需整除向量维度），每个向量编码为 m 字节
+        :param train_iters: 每个子空间 k-means 的迭代次数
+        """
+        self.m = m
+        self.train_iters = train_iters
+        super().__init__(metric, rescore_factor=rescore_factor, train_size=train_size, seed=seed)
+
+    def _make_quantizer(self) -> ProductQuantizer:
+        return ProductQuantizer(self.m, self.train_iters)
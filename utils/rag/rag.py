@@ -1,7 +1,19 @@
-from utils.document_loader import CSVLoader, MDLoader, PDFLoader, TXTLoader, DocxLoader, HTMLLoader
 from utils.load_config import configs
-from utils.base_func import call_language_model, remove_think_tag
-from typing import List, Dict, Tuple, Optional, Union, Any
+from utils.base_func import call_language_model, acall_language_model, remove_think_tag, LLMError
+from .vector_index import create_index
+from .sharded_search import ShardedFlatIndex
+from .vector_store import VectorStore
+from .chunk_store import ChunkStore, hash_file, hash_text
+from .ingest_pipeline import IngestPipeline
+from .embedding_cache import EmbeddingCache
+from .summary_service import SummaryService
+from .cache import RetrievalCache
+from .semantic_cache import SemanticQueryCache
+from .lexical_index import LexicalIndex, reciprocal_rank_fusion
+from .filters import FilterIndex, MetadataFilter
+from .batching import MicroBatcher
+from .process_lock import ProcessLock
+from typing import List, Dict, Tuple, Optional, Union, Any, Callable
 from pathlib import Path
 import numpy as np
 from tqdm import tqdm
@@ -10,8 +22,16 @@ import json
 import os
 import time
 import re
+import threading
 from io import StringIO
 
+# 查询增强（将问题中的数学表达式转为 latex）的系统提示
+QUERY_ENHANCE_SYSTEM_PROMPT = """
+            你是一个能把文本变为带有latex公式的文本的专家，你不需要解数学题，只需进行转化。
+            把下面用户提出的问题中带有数学公式的部分转化成带有latex公式的,严格转换，不要出错，并且能理解用户的语义，语义里带有数学公式的也要转换。
+            不要有多余的输出。直接给我转换后的文本，再次强调：（注意）你不需要去做这个数学题。
+            """
+
 class Rag:
     def __init__(self):
         """
@@ -27,16 +47,48 @@ class Rag:
         self.vector_store_path = Path(self.config['rag']['vector_store']['index_path'])
         self.vector_store_path.mkdir(parents=True, exist_ok=True)
         
+        self.similarity_metric = self.config['rag']['vector_store']['similarity_metric']
+        self.normalize_embeddings = self.config['rag']['embedding_model'].get('normalize_embeddings', True)
+        
+        # 串行化对文档块与向量的写入（入库提交、删除、后台补充摘要、段合并）；
+        # 多个服务进程共用同一目录时同时在进程间互斥，获取锁时先加载其他进程写入的修改
+        self._write_lock = ProcessLock(self.vector_store_path / "write.lock")
+        # 检索前检查其他进程是否修改过知识库的最短间隔（秒），负数表示不检查
+        self.reload_check_interval = self.config['rag']['vector_store'].get('reload_check_interval', 2)
+        self._last_reload_check = time.monotonic()
+        
         # 初始化时自动加载已有数据
-        self.docs = self._load_metadata()
-        self.doc_vectors = self._load_vectors()
+        self.docs = ChunkStore(self._get_chunk_db_path(), legacy_path=self._get_metadata_path())
+        segment_config = self.config['rag']['vector_store'].get('segments') or {}
+        self.vector_store = VectorStore(
+            self._get_segments_path(),
+            dimension=self.config['rag']['embedding_model']['dimension'],
+            metric=self.similarity_metric,
+            normalize=self.normalize_embeddings,
+            legacy_path=self._get_vector_path(),
+            lock=self._write_lock,
+            **segment_config
+        )
+        self.vector_store.load()
 
         self.device = self.config['rag']['embedding_model']['device']
+        self.query_instruction = "为这个句子生成表示以用于检索相关文章："
         self.embedding_model = FlagModel(self.config['rag']['embedding_model']['path'], 
-                  query_instruction_for_retrieval="为这个句子生成表示以用于检索相关文章：",
+                  query_instruction_for_retrieval=self.query_instruction,
+                  normalize_embeddings=self.normalize_embeddings,
                   use_fp16=True,devices=self.device)
         self.embedding_model.dimension = self.config['rag']['embedding_model']['dimension']
         
+        # 持久化向量缓存，相同文本不重复编码
+        cache_config = self.config['rag'].get('embedding_cache') or {}
+        self.embedding_cache = None
+        if cache_config.get('enabled', True):
+            self.embedding_cache = EmbeddingCache(
+                self._get_embedding_cache_path(),
+                namespace=f"{self.config['rag']['embedding_model']['path']}|normalize={self.normalize_embeddings}",
+                max_entries=cache_config.get('max_entries', 200000)
+            )
+        
         # 初始化重排序模型
         self.reranker_device = self.config['rag']['reranker_model']['device']
         self.reranker_model = FlagReranker(
@@ -45,27 +97,114 @@ class Rag:
             device=self.reranker_device
         )
         
+        # 动态微批：并发请求的查询编码与重排序合并为批量推理
+        batching_config = self.config['rag'].get('batching') or {}
+        self.query_batcher = None
+        self.rerank_batcher = None
+        if batching_config.get('enabled', True):
+            self.query_batcher = MicroBatcher(self._encode_queries_direct, name='embedding',
+                                              **(batching_config.get('embedding') or {}))
+            self.rerank_batcher = MicroBatcher(self._compute_rerank_scores_direct, name='reranker',
+                                               **(batching_config.get('reranker') or {}))
+        
+        # 摘要服务
+        summary_config = self.config['rag'].get('summary') or {}
+        self.summary_mode = summary_config.get('mode', 'inline')
+        self.summary_backfill_batch_size = summary_config.get('backfill_batch_size', 32)
+        self.summary_index_update_batches = summary_config.get('index_update_batches', 16)
+        self.summary_service = SummaryService(
+            self._request_chunk_summary,
+            self._get_summary_cache_path(),
+            model=lambda: self.config['ollama']['default_model'],
+            concurrency=summary_config.get('concurrency', 4)
+        )
+        self._backfill_thread = None
+        
         # 检索参数
         self.top_k = self.config['rag']['retrieval']['top_k']
         self.initial_retrieval_k = self.config['rag']['retrieval']['initial_retrieval_k']
         self.score_threshold = self.config['rag']['retrieval']['score_threshold']
         self.rerank_threshold = self.config['rag']['retrieval']['rerank_score_threshold']
-        self.similarity_metric = self.config['rag']['vector_store']['similarity_metric']
         
-        # 添加结果缓存
-        self.retrieval_cache = {}
-        self.cache_max_size = 50  # 最大缓存条目数
-        self.cache_ttl = 3600  # 缓存有效期（秒）
+        # 重排序预算：每对输入的字符上限、按长度分桶的批大小、向量检索第一名领先足够多时只重排 top_k 个候选
+        rerank_config = self.config['rag']['retrieval'].get('rerank') or {}
+        self.rerank_max_pair_chars = rerank_config.get('max_pair_chars', 800)
+        self.rerank_batch_size = rerank_config.get('batch_size', 32)
+        self.rerank_score_gap = rerank_config.get('score_gap', 0)
+        
+        # 混合检索：BM25 倒排索引与向量检索结果做 RRF 融合
+        hybrid_config = self.config['rag']['retrieval'].get('hybrid') or {}
+        self.lexical_k = hybrid_config.get('lexical_k', 5)
+        self.rrf_k = hybrid_config.get('rrf_k', 60)
+        self.lexical_index = None
+        if hybrid_config.get('enabled', True):
+            self.lexical_index = LexicalIndex(self._get_chunk_db_path(), max_df=hybrid_config.get('max_df', 0.5))
+            pending = self.lexical_index.pending_count()
+            if pending:
+                print(f"正在为 {pending} 个文档块建立 BM25 倒排索引...")
+                self.lexical_index.sync()
+        
+        # 元数据过滤（路径前缀、扩展名、入库时间、Front Matter 等），按语料版本缓存行掩码
+        filter_config = self.config['rag']['retrieval'].get('filters') or {}
+        self.filter_index = FilterIndex(self.docs, self.documents_path,
+                                        max_masks=filter_config.get('max_cached_masks', 64))
+        
+        # 初始化向量索引（flat/ivf/hnsw/sq8/pq）
+        self.vector_index = self._create_index()
+        with self._write_lock:
+            self._load_index()
+            # 内存中的向量与索引对应的行号版本（见 _search_rows），写入者修改行号期间为 None
+            self._row_epoch = self.docs.row_epoch()
+        
+        # 检索结果缓存（按命名空间限制容量和有效期，知识库变化时自动失效）
+        self.cache = RetrievalCache(self.config['rag'].get('cache') or {
+            'retrieval': {'max_size': 256, 'ttl': 3600},
+            'prompt': {'max_size': 256, 'ttl': 3600},
+            'query_enhance': {'max_size': 1024, 'ttl': 86400, 'versioned': False},
+        })
+        self.last_retrieval = None
+        
+        # 语义查询缓存（相近问题复用检索结果）
+        semantic_config = self.config['rag'].get('semantic_cache') or {}
+        self.semantic_cache = None
+        if semantic_config.get('enabled', True):
+            self.semantic_cache = SemanticQueryCache(
+                dimension=self.config['rag']['embedding_model']['dimension'],
+                threshold=semantic_config.get('threshold', 0.95),
+                max_entries=semantic_config.get('max_entries', 512),
+                ttl=semantic_config.get('ttl', 3600)
+            )
+        
+        # 之后每次获取写锁时，先加载其他服务进程对知识库的修改
+        self._write_lock.add_acquire_callback(self._reload_if_changed)
+
+    def _generate_chunk_summary(self, chunk_content: str) -> str:
+        """生成文档块的摘要（经由摘要服务：并发上限、进行中请求合并、持久化缓存），失败时抛出异常"""
+        return self.summary_service.summarize(chunk_content)
+
+    def _summarize_for_ingest(self, chunk_content: str) -> str:
+        """
+        入库时获取文档块摘要
+        deferred 模式下只查缓存；未命中或生成失败时返回空字符串，先以正文向量入库，之后由后台补充摘要
+        """
+        if self.summary_mode == 'deferred':
+            return self.summary_service.get_cached(chunk_content) or ''
+        try:
+            return self._generate_chunk_summary(chunk_content)
+        except Exception as e:
+            print(f"生成摘要失败，稍后补充: {str(e)}")
+            return ''
 
-    def _generate_chunk_summary(self, chunk_content: str, max_length: int = 150) -> str:
-        """生成文档块的摘要"""
+    def _request_chunk_summary(self, chunk_content: str, max_length: int = 150) -> str:
+        """调用 LLM 生成文档块的摘要"""
         prompt = f"""
         直接开始用中文总结以下文本内容，仅列核心要点：首先是总结出来的标题，再用符号「•」分项，最后用符号「→」总结。避免任何解释性文字。(不超过{max_length}个字符）
           
         文本内容:
         {chunk_content}
         """
-        summary = call_language_model(prompt)
+        # 出错时抛出 LLMError，错误信息不会被当作摘要保存
+        summary = call_language_model(prompt, raise_errors=True)
         summary = remove_think_tag(summary)
         return summary
     
@@ -73,341 +212,702 @@ class Rag:
         """
         对查询进行增强
         """
+        enhance_query = self._query_enhance_cached(query)
+        if enhance_query is not None:
+            return enhance_query
+        # 只有在可能包含数学公式时才调用LLM；调用失败时使用原始查询，且不缓存
+        try:
+            enhance_query = remove_think_tag(call_language_model(query, QUERY_ENHANCE_SYSTEM_PROMPT, raise_errors=True))
+        except LLMError as e:
+            print(f"查询增强失败，使用原始查询: {str(e)}")
+            return query
+        # 将增强结果存入缓存
+        self.cache.set('query_enhance', query, enhance_query)
+        return enhance_query
+
+    async def _aquery_enhance(self, query: str) -> str:
+        """_query_enhance 的异步版本（等待 LLM 响应时不占用线程）"""
+        enhance_query = self._query_enhance_cached(query)
+        if enhance_query is not None:
+            return enhance_query
+        try:
+            enhance_query = remove_think_tag(await acall_language_model(query, QUERY_ENHANCE_SYSTEM_PROMPT,
+                                                                        raise_errors=True))
+        except LLMError as e:
+            print(f"查询增强失败，使用原始查询: {str(e)}")
+            return query
+        self.cache.set('query_enhance', query, enhance_query)
+        return enhance_query
+
+    def _query_enhance_cached(self, query: str) -> Optional[str]:
+        """
+        不需要调用 LLM 的查询增强
+        :return: 增强后的查询；需要调用 LLM 时返回 None
+        """
         # 如果查询很短或不包含数学表达式，跳过增强
         if len(query) < 20 and not any(char in query for char in "+-*/^()={}[]"):
             return query
         
         # 缓存增强查询结果
-        cache_key = f"enhance_{query}"
-        if cache_key in self.retrieval_cache:
-            cache_entry = self.retrieval_cache[cache_key]
-            if time.time() - cache_entry['timestamp'] < self.cache_ttl:
-                return cache_entry['results']
-            else:
-                del self.retrieval_cache[cache_key]
+        cached = self.cache.get('query_enhance', query)
+        if cached is not None:
+            return cached
         
-        # 对查询进行增强 - 只有在可能包含数学公式时才调用LLM
         # 使用正则表达式检测可能的数学表达式
         math_pattern = r'[\+\-\*\/\^\(\)\=\{\}\[\]]|[0-9]+[a-zA-Z]+|[a-zA-Z]+[0-9]+'
         if re.search(math_pattern, query):
-            Systemprompt = """
-            你是一个能把文本变为带有latex公式的文本的专家，你不需要解数学题，只需进行转化。
-            把下面用户提出的问题中带有数学公式的部分转化成带有latex公式的,严格转换，不要出错，并且能理解用户的语义，语义里带有数学公式的也要转换。
-            不要有多余的输出。直接给我转换后的文本，再次强调：（注意）你不需要去做这个数学题。
-            """
-            enhance_query = call_language_model(query, Systemprompt)
-            enhance_query = remove_think_tag(enhance_query)
-        else:
-            # 不包含数学表达式，直接返回原始查询
-            enhance_query = query
-        
-        # 将增强结果存入缓存
-        self.retrieval_cache[cache_key] = {
-            'results': enhance_query,
-            'timestamp': time.time()
-        }
-        
-        return enhance_query
+            return None
+        # 不包含数学表达式，直接返回原始查询
+        self.cache.set('query_enhance', query, query)
+        return query
     def get_all_files_in_directory(self) -> List[str]:
         directory_path = Path(self.documents_path)  # 确保这是一个 Path 对象
         return [str(file) for file in directory_path.rglob('*') if file.is_file()]
 
     def _get_vector_path(self) -> Path:
-        """获取向量存储路径"""
+        """获取旧版单文件向量存储路径（仅用于迁移）"""
         return self.vector_store_path / "doc_vectors.npy"
 
+    def _get_segments_path(self) -> Path:
+        """获取分段向量存储目录"""
+        return self.vector_store_path / "segments"
+
     def _get_metadata_path(self) -> Path:
-        """获取元数据存储路径"""
+        """获取旧版元数据存储路径（仅用于迁移）"""
         return self.vector_store_path / "metadata.json"
 
-    def _load_vectors(self) -> np.ndarray:
-        """加载已保存的向量"""
-        vector_path = self._get_vector_path()
-        if vector_path.exists():
-            return np.load(vector_path)
-        return None
+    def _get_chunk_db_path(self) -> Path:
+        """获取文档块数据库路径"""
+        return self.vector_store_path / "chunks.db"
 
-    def _load_metadata(self) -> List[Dict]:
-        """加载已保存的元数据"""
-        metadata_path = self._get_metadata_path()
-        if metadata_path.exists():
-            with open(metadata_path, "r", encoding="utf-8") as f:
-                return json.load(f)
-        return []
+    def _get_embedding_cache_path(self) -> Path:
+        """获取向量缓存数据库路径"""
+        return self.vector_store_path / "embedding_cache.db"
 
-    def _save_data(self,vectors=True,docs=True):
-        """保存当前数据到磁盘"""
-        # 保存向量
-        if vectors and self.doc_vectors is not None:
-            np.save(self._get_vector_path(), self.doc_vectors)
-        
-        # 确保所有文档都有新的元数据格式字段
-        if docs:
-            for doc in self.docs:
-                if 'chunk_index' not in doc:
-                    doc['chunk_index'] = 0
-                if 'chunk_content' not in doc:
-                    doc['chunk_content'] = doc.get('content', '')
-                if 'total_chunks' not in doc:
-                    # 计算此文件的总块数
-                    file_path = doc.get('file_path')
-                    same_file_docs = [d for d in self.docs if d.get('file_path') == file_path]
-                    doc['total_chunks'] = len(same_file_docs)
-                if 'chunk_summary' not in doc:
-                    doc['chunk_summary'] = self._generate_chunk_summary(doc['chunk_content'])
-            # 保存元数据
-            with open(self._get_metadata_path(), "w", encoding="utf-8") as f:
-                json.dump(self.docs, f, ensure_ascii=False, indent=2)
-    
-    def _cosine_similarity(self, query_vector, doc_vectors):
+    def _get_summary_cache_path(self) -> Path:
+        """获取摘要缓存数据库路径"""
+        return self.vector_store_path / "summary_cache.db"
+
+    def _get_index_path(self) -> Path:
+        """获取向量索引存储路径"""
+        return self.vector_store_path / "vector_index.npz"
+
+    def _create_index(self):
+        """根据配置创建向量索引"""
+        vector_store_config = self.config['rag']['vector_store']
+        index_type = vector_store_config.get('type', 'flat')
+        index_params = vector_store_config.get(index_type) or {}
+        shard_config = vector_store_config.get('shards') or {}
+        num_shards = shard_config.get('num_shards', 0)
+        if num_shards and num_shards > 1:
+            if str(index_type).lower() == 'flat':
+                return ShardedFlatIndex(
+                    self.similarity_metric,
+                    num_shards=num_shards,
+                    min_rows=shard_config.get('min_rows', 200000),
+                    timeout=shard_config.get('timeout', 30)
+                )
+            print(f"分片检索仅支持 flat 索引，{index_type} 索引在当前进程中检索")
+        return create_index(index_type, self.similarity_metric, index_params)
+
+    def _load_index(self) -> None:
+        """加载已保存的向量索引，不存在或与向量不一致时重新构建"""
+        if self.vector_index.load(self._get_index_path(), self.vector_store):
+            return
+        if len(self.vector_store) > 0:
+            print(f"正在构建 {self.vector_index.index_type} 向量索引...")
+            self.vector_index.build(self.vector_store)
+            self._save_index()
+        else:
+            self.vector_index.build(None)
+
+    def _save_index(self) -> None:
+        """保存向量索引"""
+        if self.vector_index.ntotal > 0:
+            self.vector_index.save(self._get_index_path())
+        elif self._get_index_path().exists():
+            os.remove(self._get_index_path())
+
+    @property
+    def doc_vectors(self) -> Optional[np.ndarray]:
         """
-        计算余弦相似度 - 向量化计算
-        
-        余弦相似度计算公式:
-        cos(θ) = (A·B) / (|A|·|B|)
-        其中,A和B是两个向量,A·B是它们的点积,|A|和|B|是它们的模。
-        
-        参数:
-            query_vector: 查询向量，形状为 (1, embedding_dim)
-            doc_vectors: 文档向量，形状为 (num_docs, embedding_dim)
-        返回:
-            一维numpy数组，包含所有文档的相似度分数
+        全部文档向量（float32，按配置归一化），无向量时为 None
+        注意：存在多个段时会拼接成内存矩阵，检索路径请直接使用 vector_store
         """
-        # 计算点积
-        dot_products = np.dot(query_vector, doc_vectors.T).flatten()
-        
-        # 计算模
-        query_norm = np.linalg.norm(query_vector)
-        doc_norms = np.linalg.norm(doc_vectors, axis=1)
-        
-        # 计算余弦相似度
-        similarities = dot_products / (query_norm * doc_norms)
-        
-        return similarities
+        if len(self.vector_store) == 0:
+            return None
+        return self.vector_store.vectors
+
+    def _save_data(self):
+        """保存向量和索引到磁盘（文档块在写入 ChunkStore 时已持久化）"""
+        with self._write_lock:
+            self.vector_store.save()
+            self._save_index()
     
-    def _l2_similarity(self, query_vector, doc_vectors):
+    def load_documents(self, file_paths: List[str],
+                       on_stage_progress: Callable[[str, int], None] = None,
+                       cancel_event: threading.Event = None) -> Dict[str, int]:
         """
-        计算L2相似度（欧氏距离）- 向量化计算
-        
-        L2相似度计算公式:
-        d(A,B) = sqrt(sum((A_i - B_i)^2))
-        
-        参数:
-            query_vector: 查询向量，形状为 (1, embedding_dim)
-            doc_vectors: 文档向量，形状为 (num_docs, embedding_dim)
-        返回:
-            一维numpy数组，包含所有文档的相似度分数（距离越小，相似度越高）
-        """
-        # 计算欧氏距离
-        # 使用广播机制：(1, dim) - (num_docs, dim) => (num_docs, dim)
-        distances = np.linalg.norm(query_vector - doc_vectors, axis=1)
-        
-        # 由于欧氏距离越小表示越相似，为了保持与余弦相似度一致（值越大越相似）
-        # 我们可以对距离取负值或倒数，这里选择取负值
-        similarities = -distances
-        
-        return similarities
-        
-    def load_documents(self, file_paths: List[str]) -> None:
-        """
-        加载多种格式的文档
+        加载多种格式的文档（增量）
+        - 大小与修改时间未变的文件直接跳过；内容哈希未变的文件只更新文件记录
+        - 重命名/移动的文件（内容哈希与某个已不存在的文件相同）只修改路径
+        - 新增或修改的文件通过入库流水线并发执行解析、摘要与向量化，内容未变的文档块复用已有摘要和向量
+        :param file_paths: 文件路径列表
+        :param on_stage_progress: 可选，进度回调 (类型, 增量)，除入库流水线的阶段进度外，
+                                  还包括 files_total / files_done / files_failed / committed
+        :param cancel_event: 可选，置位后取消入库（已入库的文件保留，未完成的文件计为 failed）
+        :return: 各类文件数量 {'added', 'updated', 'renamed', 'unchanged', 'failed'}
         """
         # 转换所有路径为绝对路径
-        abs_paths = [str(Path(fp).absolute()) for fp in file_paths]
+        abs_paths = list(dict.fromkeys(str(Path(fp).absolute()) for fp in file_paths))
+        result = {'added': 0, 'updated': 0, 'renamed': 0, 'unchanged': 0, 'failed': 0}
         
-        # 过滤已加载文件（使用集合提高查询效率）
-        existing_files = {doc["file_path"] for doc in self.docs}
-        new_files = [fp for fp in abs_paths if fp not in existing_files]
+        records = self.docs.file_records()
+        existing_files = self.docs.file_paths()
+        # 内容哈希 -> 已不存在的旧文件路径，用于识别重命名
+        missing_by_hash = {
+            record['content_hash']: path for path, record in records.items()
+            if record['content_hash'] and not Path(path).exists()
+        }
+        
+        new_files = []
+        file_infos = {}
+        stale_chunks = {}  # 修改过的文件 -> 旧文档块的 chunks.id（不随删除变化），提交新版本时在同一写锁内删除
+        for fp in abs_paths:
+            if not Path(fp).is_file():
+                continue
+            stat = os.stat(fp)
+            record = records.get(fp)
+            if record and record['size'] == stat.st_size and record['mtime'] == stat.st_mtime:
+                result['unchanged'] += 1
+                continue
+            
+            file_hash = hash_file(fp)
+            file_infos[fp] = (stat.st_size, stat.st_mtime, file_hash)
+            if (record and record['content_hash'] == file_hash) or (not record and fp in existing_files):
+                # 内容未变（仅修改时间变化），或旧版本入库的文件尚无记录：补记文件信息即可
+                self.docs.upsert_file(fp, *file_infos[fp])
+                result['unchanged'] += 1
+            elif fp not in existing_files and file_hash in missing_by_hash:
+                old_path = missing_by_hash.pop(file_hash)
+                self.docs.rename_file(old_path, fp)
+                self.docs.upsert_file(fp, *file_infos[fp])
+                if hasattr(self, '_file_chunks_count') and old_path in self._file_chunks_count:
+                    self._file_chunks_count[fp] = self._file_chunks_count.pop(old_path)
+                print(f"检测到文件重命名: {old_path} -> {fp}")
+                result['renamed'] += 1
+                # 路径变化影响检索结果中的 file_path 与按路径过滤
+                self._corpus_changed()
+            else:
+                if fp in existing_files:
+                    stale_chunks[fp] = self.docs.get_file_chunk_ids(fp)
+                new_files.append(fp)
         
         if not new_files:
-            print("所有文件均已加载过")
-            return
+            print(f"没有需要重新加载的文件（未变化 {result['unchanged']}，重命名 {result['renamed']}）")
+            return result
 
-        try:
-            # 将numpy数组转为列表便于追加
-            if self.doc_vectors is not None:
-                vectors = self.doc_vectors.tolist()
-            else:
-                vectors = []
+        committed_files = set()
 
-            # 创建批处理任务
-            batch_size = 5  # 每批处理的文件数量
-            batches = [new_files[i:i + batch_size] for i in range(0, len(new_files), batch_size)]
-            
-            all_new_docs = []
-            all_new_vectors = []
-            
+        def report(kind: str, count: int = 1) -> None:
+            if on_stage_progress is not None:
+                on_stage_progress(kind, count)
+
+        report('files_total', len(new_files))
+
+        def commit(file_path: str, docs: List[Dict], vectors: Optional[np.ndarray]) -> None:
+            self._commit_file_chunks(file_path, docs, vectors, replaced_chunk_ids=stale_chunks.get(file_path),
+                                     file_info=file_infos[file_path])
+            committed_files.add(file_path)
+
+        ingestion_config = self.config['rag'].get('ingestion') or {}
+        try:
             with tqdm(total=len(new_files), desc="📁 总体进度") as global_pbar:
-                for batch in batches:
-                    batch_docs = []
-                    batch_vectors = []
-                    
-                    for file_path in batch:
-                        try:
-                            # 获取文件加载器
-                            if file_path.endswith('.csv'):
-                                loader = CSVLoader()
-                            elif file_path.endswith('.docx'):
-                                loader = DocxLoader()
-                            elif file_path.endswith('.md'):
-                                loader = MDLoader()
-                            elif file_path.endswith('.pdf'):
-                                loader = PDFLoader()
-                            elif file_path.endswith('.html') or file_path.endswith('.htm'):
-                                loader = HTMLLoader()
-                            elif (file_path.endswith('.txt') or (Path(file_path).suffix == '' and Path(file_path).is_file())):
-                                loader = TXTLoader()
-                            else:
-                                global_pbar.update(1)
-                                print(f"跳过不支持的文件格式: {file_path}")
-                                continue
-
-                            # 加载文档内容
-                            chunks = loader.load(file_path)
-                            total_chunks = len(chunks)
-                            
-                            # 优化：预先计算并存储文件块数量
-                            if not hasattr(self, '_file_chunks_count'):
-                                self._file_chunks_count = {}
-                            self._file_chunks_count[file_path] = total_chunks
-                            
-                            # 处理文档块
-                            file_docs = []
-                            file_contents = []
-                            
-                            # 收集块内容，准备批量编码
-                            for i, chunk in enumerate(chunks):
-                                chunk = str(chunk)
-                                if chunk == '':
-                                    continue
-                                # 优化：并行生成摘要
-                                chunk_summary = self._generate_chunk_summary(chunk)
-                                
-                                # 存储元数据
-                                file_docs.append({
-                                    "file_path": file_path,
-                                    "chunk_index": i,
-                                    "chunk_summary": chunk_summary,
-                                    "chunk_content": chunk,
-                                    "total_chunks": total_chunks,
-                                    "timestamp": time.time(),
-                                })
-                                
-                                # 优化：预处理向量内容
-                                content_for_vector = f"{chunk_summary}\n{chunk_summary}\n{chunk}"
-                                file_contents.append(content_for_vector)
-                            
-                            # 批量编码文件内容
-                            if file_contents:
-                                # 优化：使用批量编码而不是逐个编码
-                                file_vectors = self.embedding_model.encode_corpus(file_contents)
-                                batch_vectors.extend(file_vectors)
-                                batch_docs.extend(file_docs)
-                            
-                            global_pbar.update(1)
-                            global_pbar.set_postfix_str(f'处理完成: {Path(file_path).name}')
-                            
-                        except Exception as e:
-                            global_pbar.update(1)
-                            print(f"处理文件 {file_path} 失败: {str(e)}")
-                            continue
-                    
-                    # 追加新批次的文档和向量
-                    all_new_docs.extend(batch_docs)
-                    all_new_vectors.extend(batch_vectors)
-                
-                # 将所有新数据追加到现有数据中
-                self.docs.extend(all_new_docs)
-                vectors.extend(all_new_vectors)
+                def on_progress(file_path: str, num_chunks: int) -> None:
+                    global_pbar.update(1)
+                    global_pbar.set_postfix_str(f'处理完成: {Path(file_path).name}')
+                    if file_path in committed_files:
+                        report('files_done')
+                        report('committed', num_chunks)
+                    else:
+                        report('files_failed')
 
-                # 统一转换为numpy数组
-                self.doc_vectors = np.array(vectors)
-                
-            print(f"加载完成，新增 {len(all_new_docs)} 个文档块")
+                pipeline = IngestPipeline(
+                    summarize=self._summarize_for_ingest,
+                    compose=self._compose_vector_text,
+                    encode=self._encode_corpus,
+                    commit=commit,
+                    lookup=self._lookup_chunk,
+                    on_progress=on_progress,
+                    on_stage_progress=on_stage_progress,
+                    cancel_event=cancel_event,
+                    **ingestion_config
+                )
+                stats = pipeline.run(new_files)
+
+            self.last_ingest_stats = stats
+            print(f"加载完成，新增 {stats['stages']['commit']['items']} 个文档块"
+                  f"（复用 {stats['stages']['reuse']['items']} 个），耗时 {stats['wall_seconds']} 秒")
+            for name, stage in stats['stages'].items():
+                print(f"  {name}: {stage}")
+            
+            for fp in new_files:
+                if fp not in committed_files:
+                    result['failed'] += 1
+                elif fp in stale_chunks:
+                    result['updated'] += 1
+                else:
+                    result['added'] += 1
+            return result
             
         finally:
             # 最终保存数据
             self._save_data()
+            # 缺少摘要的文档块（deferred 模式或摘要生成失败）在后台补充
+            self.start_summary_backfill()
+
+    def sync_documents(self, on_stage_progress: Callable[[str, int], None] = None,
+                       cancel_event: threading.Event = None) -> Dict[str, int]:
+        """
+        将知识库与文档目录同步：增量加载新增/修改的文件，并删除磁盘上已不存在的文件
+        :param on_stage_progress: 可选，入库进度回调，见 load_documents
+        :param cancel_event: 可选，取消事件，见 load_documents
+        :return: 各类文件数量 {'added', 'updated', 'renamed', 'unchanged', 'failed', 'removed'}
+        """
+        self.files = self.get_all_files_in_directory()
+        result = self.load_documents(self.files, on_stage_progress=on_stage_progress, cancel_event=cancel_event)
+        
+        # 重命名检测已在 load_documents 中完成，剩余不存在的文件即为已删除
+        missing = [fp for fp in self.docs.file_paths() | set(self.docs.file_records()) if not Path(fp).exists()]
+        result['removed'] = len(missing)
+        if missing:
+            print(f"{len(missing)} 个文件已不存在，从知识库中删除")
+            with self._write_lock:
+                if self._remove_rows(file_paths=missing):
+                    self._corpus_changed()
+            for fp in missing:
+                if hasattr(self, '_file_chunks_count'):
+                    self._file_chunks_count.pop(fp, None)
+            self._save_data()
+        print(f"知识库同步完成: {result}")
+        return result
+
+    def _encode_corpus(self, texts: List[str]) -> np.ndarray:
+        """编码文档文本（优先查询向量缓存）"""
+        if self.embedding_cache is None:
+            return np.asarray(self.embedding_model.encode_corpus(texts), dtype=np.float32)
+        return self.embedding_cache.encode(texts, self.embedding_model.encode_corpus)
+
+    def _encode_queries(self, queries: List[str]) -> np.ndarray:
+        """编码查询文本（带检索指令，优先查询向量缓存，未命中的查询经微批调度编码）"""
+        if self.embedding_cache is None:
+            return self._encode_queries_batched(queries)
+        return self.embedding_cache.encode(queries, self._encode_queries_batched,
+                                           instruction=self.query_instruction)
+
+    def _encode_queries_batched(self, queries: List[str]) -> np.ndarray:
+        if self.query_batcher is None:
+            return self._encode_queries_direct(queries)
+        return self.query_batcher(queries)
+
+    def _encode_queries_direct(self, queries: List[str]) -> np.ndarray:
+        """直接调用嵌入模型编码查询"""
+        return np.asarray(self.embedding_model.encode_queries(queries), dtype=np.float32).reshape(len(queries), -1)
+
+    def _compute_rerank_scores(self, pairs: List[Tuple[str, str]]) -> np.ndarray:
+        """计算 (查询, 文档) 对的重排序原始分数（经微批调度）"""
+        if self.rerank_batcher is None:
+            return self._compute_rerank_scores_direct(pairs)
+        return self.rerank_batcher(pairs)
+
+    def _compute_rerank_scores_direct(self, pairs: List[Tuple[str, str]]) -> np.ndarray:
+        """
+        直接调用重排序模型
+        按输入长度排序后分批调用，每批内长度相近，减少填充带来的无效计算；结果按原顺序返回
+        （只有一对时 compute_score 返回标量，统一为一维数组）
+        """
+        scores = np.zeros(len(pairs), dtype=np.float64)
+        order = sorted(range(len(pairs)), key=lambda i: len(pairs[i][0]) + len(pairs[i][1]))
+        batch_size = max(1, int(self.rerank_batch_size or len(pairs) or 1))
+        for start in range(0, len(order), batch_size):
+            bucket = order[start:start + batch_size]
+            bucket_scores = self.reranker_model.compute_score([pairs[i] for i in bucket])
+            scores[bucket] = np.asarray(bucket_scores, dtype=np.float64).reshape(-1)
+        return scores
+
+    @staticmethod
+    def _compose_vector_text(chunk_summary: str, chunk_content: str) -> str:
+        """拼接用于向量化的文本（摘要重复两次以提高其权重；尚无摘要时只使用正文）"""
+        if not chunk_summary:
+            return chunk_content
+        return f"{chunk_summary}\n{chunk_summary}\n{chunk_content}"
+
+    def _compose_rerank_text(self, query: str, chunk_summary: str, chunk_content: str) -> str:
+        """
+        拼接重排序输入的文档部分：摘要只出现一次，且按每对输入的字符预算截断（预算包含查询本身）
+        超出预算时优先截断正文，摘要最多占用一半预算
+        """
+        if not self.rerank_max_pair_chars:
+            return f"{chunk_summary}\n{chunk_content}" if chunk_summary else chunk_content
+        budget = max(64, self.rerank_max_pair_chars - len(query))
+        if not chunk_summary:
+            return chunk_content[:budget]
+        return f"{chunk_summary[:budget // 2]}\n{chunk_content}"[:budget]
+
+    def _lookup_chunk(self, chunk_content: str) -> Optional[Tuple[str, np.ndarray]]:
+        """按内容哈希查找已入库的相同文档块，返回 (摘要, 向量)"""
+        epoch = self._row_epoch
+        if epoch is None:
+            return None
+        found = self.docs.find_by_content_hash(hash_text(chunk_content))
+        if found is None:
+            return None
+        row_id, doc = found
+        try:
+            vector = self.vector_store.get(row_id) if row_id < len(self.vector_store) else None
+        except Exception:
+            vector = None
+        # 查找期间行号发生前移时，取到的可能是其他文档块的向量，按未命中处理（重新编码）
+        if vector is None or not self._row_layout_unchanged(epoch):
+            return None
+        return doc.get('chunk_summary') or '', vector
+
+    def _commit_file_chunks(self, file_path: str, docs: List[Dict], vectors: Optional[np.ndarray],
+                            replaced_chunk_ids: List[int] = None, file_info: Tuple = None) -> None:
+        """
+        将单个文件的文档块及向量写入存储（由入库流水线的向量化线程调用）
+        :param file_path: 文件路径
+        :param docs: 文档块元数据，与 vectors 按行对应
+        :param vectors: 文档块向量，文件没有有效文档块时为 None
+        :param replaced_chunk_ids: 可选，被新版本替换的旧文档块 chunks.id，与新文档块在同一次写锁内删除
+        :param file_info: 可选，文件记录 (size, mtime, content_hash)，替换完成后写入
+        """
+        for doc in docs:
+            doc['content_hash'] = hash_text(doc['chunk_content'])
+            if not doc.get('chunk_summary'):
+                # 摘要为空记为 NULL，由后台补充
+                doc.pop('chunk_summary', None)
+        with self._write_lock:
+            # 先删除旧版本再写入新版本：检索不会同时看到两个版本；文件记录最后更新，
+            # 中途退出或取消时下次同步仍会按修改过的文件重新入库
+            changed = False
+            if replaced_chunk_ids:
+                # 入库期间其他删除可能使行号前移，在锁内按 chunks.id 取旧文档块当前的行号
+                changed = bool(self._remove_rows(self.docs.rows_for_chunk_ids(replaced_chunk_ids)))
+            if docs:
+                self.docs.extend(docs)
+                # 只追加新增部分，无需重建整个向量矩阵
+                self.vector_store.add(vectors)
+                # 将新增向量加入索引
+                self.vector_index.add(self.vector_store)
+                self._sync_lexical_index()
+                changed = True
+            if file_info is not None:
+                self.docs.upsert_file(file_path, *file_info)
+            if changed:
+                self._corpus_changed()
+        if not docs:
+            return
+        if not hasattr(self, '_file_chunks_count'):
+            self._file_chunks_count = {}
+        self._file_chunks_count[file_path] = docs[0]['total_chunks']
+
+    def _remove_rows(self, row_ids: List[int] = None, file_paths: List[str] = None) -> List[int]:
+        """
+        删除指定行（或指定文件的全部行及文件记录）的文档块及其向量（调用方持有写锁），
+        索引只摘除被删除的行，其后的行号随之前移
+        :return: 被删除的行号（删除前的行号，升序）
+        """
+        # 行号版本置空直到向量与索引完成同样的前移，期间的检索等待写锁后重试
+        self._row_epoch = None
+        if file_paths is not None:
+            removed = self.docs.delete_files(file_paths)
+        else:
+            removed = self.docs.delete_rows(row_ids)
+        if removed:
+            self.vector_store.remove(removed)
+            self.vector_index.remove(self.vector_store, removed)
+        self._row_epoch = self.docs.row_epoch()
+        return removed
 
     def reset(self):
         """重置所有存储数据"""
-        self.doc_vectors = None
-        self.docs = []
-        if self._get_vector_path().exists():
-            os.remove(self._get_vector_path())
-        if self._get_metadata_path().exists():
-            os.remove(self._get_metadata_path())
+        with self._write_lock:
+            self._row_epoch = None
+            self.docs.reset()
+            self.vector_store.reset()
+            self.vector_index.build(None)
+            if self._get_index_path().exists():
+                os.remove(self._get_index_path())
+            self._row_epoch = self.docs.row_epoch()
+            self._corpus_changed()
+
+    def delete_document(self, file_path: str) -> int:
+        """
+        删除指定文件在知识库中的全部文档块及其向量
+        :param file_path: 文件路径
+        :return: 删除的文档块数量
+        """
+        file_path = os.path.abspath(file_path)
+        with self._write_lock:
+            removed_rows = self._remove_rows(file_paths=[file_path])
+            if not removed_rows:
+                return 0
+            
+            if hasattr(self, '_file_chunks_count'):
+                self._file_chunks_count.pop(file_path, None)
+            self._corpus_changed()
+        self._save_data()
+        return len(removed_rows)
     
-    def rebuild_vector_db(self, file_path=None, chunk_indices=None):
+    def update_chunk(self, file_path: str, chunk_index: int, chunk_content: str) -> bool:
+        """
+        修改单个文档块的正文：重新生成摘要（失败时留空，由后台补充），只重建该块的向量
+        :param file_path: 文件路径
+        :param chunk_index: 分块序号
+        :param chunk_content: 新的正文
+        :return: 是否找到该文档块
+        """
+        file_path = os.path.abspath(file_path)
+        chunk_index = int(chunk_index)
+        if self.docs.find_row(file_path, chunk_index) is None:
+            return False
+        # 调用 LLM 生成摘要期间不持有写锁
+        summary = self._summarize_for_ingest(chunk_content) or None
+        with self._write_lock:
+            # 生成摘要期间行号可能因删除而变化，在锁内重新定位
+            row_id = self.docs.find_row(file_path, chunk_index)
+            if row_id is None:
+                return False
+            self.docs.update_chunk(row_id, chunk_content=chunk_content, chunk_summary=summary)
+            self.rebuild_vector_db(file_path=file_path, chunk_indices=[chunk_index])
+        self.start_summary_backfill()
+        return True
+
+    def start_summary_backfill(self) -> Optional[threading.Thread]:
+        """在后台线程中为缺少摘要的文档块补充摘要（已在运行或无需补充时不重复启动）"""
+        if self._backfill_thread is not None and self._backfill_thread.is_alive():
+            return self._backfill_thread
+        if self.docs.count_missing_summaries() == 0:
+            return None
+        self._backfill_thread = threading.Thread(target=self.backfill_summaries, name='summary-backfill', daemon=True)
+        self._backfill_thread.start()
+        return self._backfill_thread
+
+    def backfill_summaries(self) -> int:
+        """
+        为缺少摘要的文档块生成摘要，并用“摘要 + 正文”重新向量化
+        按批并发生成摘要，单批失败的文档块保持原样，下次调用时重试
+        :return: 补充摘要的文档块数量
+        """
+        batch_size = max(1, int(self.summary_backfill_batch_size))
+        total = self.docs.count_missing_summaries()
+        if total == 0:
+            return 0
+        print(f"开始为 {total} 个文档块补充摘要...")
+        
+        filled = 0
+        last_row = -1
+        # 已写回向量、尚未更新到向量索引的文档块 (file_path, chunk_index)，每 index_update_batches 批更新一次索引
+        pending = []
+        update_every = max(1, int(self.summary_index_update_batches))
+
+        def update_index() -> None:
+            # 调用方持有写锁；期间的删除可能使行号前移，按 (file_path, chunk_index) 重新定位
+            row_ids = [row_id for row_id in (self.docs.find_row(fp, index) for fp, index in pending)
+                       if row_id is not None]
+            if row_ids:
+                self.vector_index.update(self.vector_store, row_ids)
+            pending.clear()
+
+        batch_no = 0
+        try:
+            while True:
+                rows = self.docs.rows_missing_summary(after_row=last_row, limit=batch_size)
+                if not rows:
+                    break
+                last_row = rows[-1][0]
+                batch_no += 1
+                
+                summaries = self.summary_service.summarize_many([doc['chunk_content'] for _, doc in rows])
+                ready = [(doc, summary) for (_, doc), summary in zip(rows, summaries) if summary]
+                if not ready:
+                    continue
+                vectors = self._encode_corpus([self._compose_vector_text(summary, doc['chunk_content'])
+                                               for doc, summary in ready])
+                
+                with self._write_lock:
+                    # 生成摘要期间行号可能因删除而变化，按 (file_path, chunk_index) 重新定位并确认内容未变
+                    row_ids, row_vectors = [], []
+                    for (doc, summary), vector in zip(ready, vectors):
+                        row_id = self.docs.find_row(doc['file_path'], doc['chunk_index'])
+                        if row_id is None:
+                            continue
+                        current = self.docs[row_id]
+                        if current.get('chunk_summary') or current.get('content_hash') != doc.get('content_hash'):
+                            continue
+                        self.docs.update_chunk(row_id, chunk_summary=summary)
+                        row_ids.append(row_id)
+                        row_vectors.append(vector)
+                        pending.append((doc['file_path'], doc['chunk_index']))
+                    if row_ids:
+                        self.vector_store.update(row_ids, np.stack(row_vectors))
+                        self._corpus_changed()
+                        filled += len(row_ids)
+                    if pending and batch_no % update_every == 0:
+                        update_index()
+        finally:
+            with self._write_lock:
+                update_index()
+                self._save_data()
+        print(f"摘要补充完成，共 {filled}/{total} 个文档块")
+        return filled
+
+    def rebuild_vector_db(self, file_path=None, chunk_indices=None, resume: bool = True):
         """
         重建向量数据库
         在修改了元数据中的文档内容后调用此方法来更新向量
+        - 收集全部待重建的文档块，按文本长度排序后分批编码（减少 padding），结果直接写回向量存储
+        - 每处理若干批写一次断点，中断后再次调用（参数相同）会从断点继续
         
         参数:
             file_path: 可选，指定要重建的文件路径
             chunk_indices: 可选，指定要重建的chunk索引列表(当file_path提供时有效)
+            resume: 是否从上次中断的断点继续
         """
+        # 重建期间持有写锁，避免并发的入库、删除使待重建的行号失效
+        with self._write_lock:
+            self._rebuild_vector_db(file_path, chunk_indices, resume)
+
+    def _rebuild_vector_db(self, file_path, chunk_indices, resume: bool) -> None:
+        """rebuild_vector_db 的实现（调用方持有写锁）"""
         if not self.docs:
             print("无可用文档，无法重建向量库")
             return
         
+        rebuild_config = self.config['rag'].get('rebuild') or {}
+        batch_size = max(1, int(rebuild_config.get('batch_size', 64)))
+        checkpoint_every = max(1, int(rebuild_config.get('checkpoint_every', 10)))
+        
         try:
-            # 如果已有向量存储，加载它
-            if self.doc_vectors is not None:
-                vectors = self.doc_vectors.tolist()
-            else:
-                vectors = [None] * len(self.docs)
+            # 向量数量少于文档数量时（如向量文件丢失），先补齐占位向量以保持行号对齐
+            missing = len(self.docs) - len(self.vector_store)
+            if missing > 0:
+                self.vector_store.add(np.zeros((missing, self.vector_store.dimension), dtype=np.float32))
             
-            # 确定需要重建的文档索引
-            rebuild_indices = []
             if file_path is not None:
-                # 只重建指定文件的指定块
                 file_path = os.path.abspath(file_path)
-                for i, doc in enumerate(self.docs):
-                    if doc.get('file_path') == file_path:
-                        if chunk_indices is None or int(doc.get('chunk_index', 0)) in chunk_indices:
-                            rebuild_indices.append(i)
-                print(f"将重建文件 {file_path} 的 {len(rebuild_indices)} 个分块向量")
+            target = {
+                'file_path': file_path,
+                'chunk_indices': sorted(int(i) for i in chunk_indices) if chunk_indices is not None else None,
+                'total_rows': len(self.docs),
+            }
+            
+            checkpoint = self._load_rebuild_checkpoint(target) if resume else None
+            if checkpoint is not None:
+                order, done = checkpoint['order'], checkpoint['done']
+                print(f"从断点继续重建向量：已完成 {done}/{len(order)}")
             else:
-                # 重建所有文档
-                rebuild_indices = list(range(len(self.docs)))
-                print(f"将重建所有 {len(rebuild_indices)} 个分块向量")
+                order, done = self._plan_rebuild(file_path, chunk_indices), 0
             
-            if not rebuild_indices:
+            if not order:
                 print("没有找到需要重建的文档")
                 return
-                
-            print("正在重建向量数据库...")
             
-            with tqdm(rebuild_indices, desc="📁 重建向量进度") as pbar:
-                for i in pbar:
-                    doc = self.docs[i]
-                    chunk_content = doc.get('chunk_content', '')
-                    chunk_summary = doc.get('chunk_summary', '')
-                    # chunk_summary = self._generate_chunk_summary(chunk_content)
-                    chunk = f"{chunk_summary}\n{chunk_summary}\n{chunk_content}"
-                    if chunk_content:
-                        # 生成新的向量
-                        vector = self.embedding_model.encode(chunk)
-                        vectors[i] = vector
-                    else:
-                        print(f"警告: 文档 {doc.get('file_path')} 没有内容，跳过")
-                        # 添加一个空向量以保持索引对齐
-                        vectors[i] = np.zeros(self.embedding_model.dimension)
+            print("正在重建向量数据库...")
+            batches = [order[i:i + batch_size] for i in range(done, len(order), batch_size)]
+            with tqdm(total=len(order), initial=done, desc="📁 重建向量进度") as pbar:
+                for batch_no, batch_ids in enumerate(batches, start=1):
+                    docs = self.docs.get_rows(batch_ids)
+                    vectors = np.zeros((len(batch_ids), self.vector_store.dimension), dtype=np.float32)
+                    texts, text_rows = [], []
+                    for row, doc in enumerate(docs):
+                        if doc.get('chunk_content', ''):
+                            texts.append(self._compose_vector_text(doc.get('chunk_summary', ''), doc['chunk_content']))
+                            text_rows.append(row)
+                        else:
+                            # 没有内容的文档块写入空向量以保持索引对齐
+                            print(f"警告: 文档 {doc.get('file_path')} 没有内容，跳过")
+                    if texts:
+                        vectors[text_rows] = self._encode_corpus(texts)
+                    self.vector_store.update(batch_ids, vectors)
+                    
+                    done += len(batch_ids)
+                    pbar.update(len(batch_ids))
+                    if batch_no % checkpoint_every == 0 and done < len(order):
+                        self._save_rebuild_checkpoint(target, order, done)
             
-            # 更新向量存储
-            self.doc_vectors = np.array(vectors)
+            # 更新索引中被修改的向量
+            if file_path is not None:
+                self.vector_index.update(self.vector_store, order)
+            else:
+                self.vector_index.build(self.vector_store)
+            # 正文被修改的文档块重新建立倒排
+            self._sync_lexical_index()
+            self._corpus_changed()
             
             # 保存到磁盘
             self._save_data()
+            self._clear_rebuild_checkpoint()
             
-            print(f"向量数据库重建完成，更新了 {len(rebuild_indices)} 个文档向量")
+            print(f"向量数据库重建完成，更新了 {len(order)} 个文档向量")
         
-        except Exception as e:
+        except BaseException as e:
+            # 包括 KeyboardInterrupt：记录断点，下次调用时继续
+            if 'order' in locals() and 0 < done < len(order):
+                self._save_rebuild_checkpoint(target, order, done)
+                print(f"重建中断，已保存断点（{done}/{len(order)}）")
             print(f"重建向量数据库失败: {str(e)}")
             raise
+
+    def _plan_rebuild(self, file_path: Optional[str], chunk_indices) -> List[int]:
+        """确定需要重建的 row_id，并按文本长度降序排列，使同一批内长度相近"""
+        if file_path is not None:
+            # 只重建指定文件的指定块（按 file_path 索引查询）
+            rows = [(i, doc) for i, doc in self.docs.get_file_rows(file_path)
+                    if chunk_indices is None or int(doc.get('chunk_index', 0)) in chunk_indices]
+            print(f"将重建文件 {file_path} 的 {len(rows)} 个分块向量")
+        else:
+            # 重建所有文档
+            rows = list(enumerate(self.docs))
+            print(f"将重建所有 {len(rows)} 个分块向量")
+        lengths = {i: len(doc.get('chunk_summary') or '') * 2 + len(doc.get('chunk_content') or '') for i, doc in rows}
+        return sorted(lengths, key=lambda i: (-lengths[i], i))
+
+    def _get_rebuild_checkpoint_path(self) -> Path:
+        """获取向量重建断点文件路径"""
+        return self.vector_store_path / "rebuild_checkpoint.json"
+
+    def _load_rebuild_checkpoint(self, target: Dict) -> Optional[Dict]:
+        """读取与本次重建目标一致的断点"""
+        path = self._get_rebuild_checkpoint_path()
+        if not path.exists():
+            return None
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                checkpoint = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if checkpoint.get('target') != target:
+            print("断点与本次重建目标不一致，重新开始")
+            return None
+        return checkpoint
+
+    def _save_rebuild_checkpoint(self, target: Dict, order: List[int], done: int) -> None:
+        """写入断点（先写临时文件再替换，避免中断时写出不完整的断点）"""
+        self.vector_store.save()
+        path = self._get_rebuild_checkpoint_path()
+        tmp_path = path.with_suffix('.json.tmp')
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({'target': target, 'order': [int(i) for i in order], 'done': int(done)}, f)
+        os.replace(tmp_path, path)
+
+    def _clear_rebuild_checkpoint(self) -> None:
+        if self._get_rebuild_checkpoint_path().exists():
+            os.remove(self._get_rebuild_checkpoint_path())
     
-    def retrieve_documents(self, query: str, top_k: int = None, threshold: float = None, rerank_threshold: float = None) -> List[Dict]:
+    def retrieve_documents(self, query: str, top_k: int = None, threshold: float = None, rerank_threshold: float = None,
+                           cache_label: str = 'default', filters: Union[Dict, MetadataFilter] = None) -> List[Dict]:
         """
         检索与增强查询最相关的文档，先使用embedding模型检索，再使用reranker模型重排序
         
@@ -416,6 +916,8 @@ class Rag:
             top_k: 返回的文档数量，如果为None则使用配置值
             threshold: 相似度阈值，低于此值的文档将被过滤
             rerank_threshold: 重排序分数阈值，低于此值的文档将被过滤
+            cache_label: 语义缓存命中率统计所用的调用方标识（如接口路径）
+            filters: 元数据过滤条件（见 MetadataFilter），只在满足条件的文档块中检索
         返回:
             相关文档列表，按相似度降序排序
         """
@@ -428,59 +930,244 @@ class Rag:
         if rerank_threshold is None:
             rerank_threshold = self.rerank_threshold
         
-        # 生成缓存键
-        cache_key = f"{query}_{top_k}_{threshold}_{rerank_threshold}"
+        metadata_filter = MetadataFilter.from_dict(filters)
+        filter_key = None if metadata_filter is None else metadata_filter.key
+        # 记录开始检索时的语料版本，检索期间知识库变化时结果不会被后续复用
+        corpus_version = self.cache.corpus_version
+        
+        final_results = self._retrieve_many([query], top_k, threshold, rerank_threshold, metadata_filter, cache_label)[0]
         
-        # 检查缓存
-        if cache_key in self.retrieval_cache:
-            cache_entry = self.retrieval_cache[cache_key]
-            # 检查是否仍然有效
-            if time.time() - cache_entry['timestamp'] < self.cache_ttl:
+        # 存储最后一次检索的结果，便于前端获取
+        self.last_retrieval = {
+            'query': query,
+            'top_k': top_k,
+            'filters': filter_key,
+            'results': final_results,
+            'cache_key': (query, top_k, threshold, rerank_threshold, filter_key),
+            'corpus_version': corpus_version
+        }
+        
+        return final_results
+    
+    def retrieve_documents_batch(self, queries: List[str], top_k: int = None, threshold: float = None,
+                                 rerank_threshold: float = None, cache_label: str = 'batch',
+                                 filters: Union[Dict, MetadataFilter] = None) -> List[List[Dict]]:
+        """
+        批量检索（离线评测、Agent 多跳检索）
+        全部查询一次编码、一次矩阵-矩阵打分、全部 (查询, 文档块) 对一次重排序
+        
+        参数:
+            queries: 查询列表
+            其余参数与 retrieve_documents 相同
+        返回:
+            与 queries 一一对应的文档列表
+        """
+        if top_k is None:
+            top_k = self.top_k
+        if threshold is None:
+            threshold = self.score_threshold
+        if rerank_threshold is None:
+            rerank_threshold = self.rerank_threshold
+        metadata_filter = MetadataFilter.from_dict(filters)
+        return self._retrieve_many(list(queries), top_k, threshold, rerank_threshold, metadata_filter, cache_label)
+    
+    def _retrieve_many(self, queries: List[str], top_k: int, threshold: float, rerank_threshold: float,
+                       metadata_filter: Optional[MetadataFilter], cache_label: str) -> List[List[Dict]]:
+        """
+        单条与批量检索共用的检索流程：缓存 -> 编码 -> 语义缓存 -> 向量/BM25 检索 -> 重排序
+        :return: 与 queries 一一对应的文档列表
+        """
+        # 多进程服务：其他进程入库或删除文档后，先加载修改再检索
+        self.refresh()
+        filter_key = None if metadata_filter is None else metadata_filter.key
+        corpus_version = self.cache.corpus_version
+        results: List[Optional[List[Dict]]] = [None] * len(queries)
+        
+        # 检查缓存；相同查询只检索一次
+        pending: Dict[str, List[int]] = {}
+        for i, query in enumerate(queries):
+            cached = self.cache.get('retrieval', (query, top_k, threshold, rerank_threshold, filter_key))
+            if cached is not None:
                 print(f"从缓存中获取检索结果，查询: {query[:30]}...")
-                return cache_entry['results']
+                results[i] = cached
             else:
-                # 缓存已过期，删除
-                del self.retrieval_cache[cache_key]
-                
-        if not self.docs or self.doc_vectors is None:
+                pending.setdefault(query, []).append(i)
+        if not pending:
+            return results
+        
+        def finish(query: str, final_results: List[Dict]) -> None:
+            for i in pending[query]:
+                results[i] = final_results
+        
+        if not self.docs or len(self.vector_store) == 0:
             print("无可用文档")
-            return []
+            return [r if r is not None else [] for r in results]
         
-        # 优化步骤1: 使用batch操作生成查询向量
-        # 生成查询向量
-        query_vector = self.embedding_model.encode_queries([query]).reshape(1, -1)
+        # 过滤条件在打分前求值为行掩码，向量检索与 BM25 只在满足条件的行中进行
+        row_mask = None
+        if metadata_filter is not None:
+            row_mask = self.filter_index.mask(metadata_filter, corpus_version, len(self.vector_store))
+            if not row_mask.any():
+                print("没有满足过滤条件的文档")
+                return [r if r is not None else [] for r in results]
         
-        # 计算相似度得分
-        if self.similarity_metric == 'cosine':
-            similarities = self._cosine_similarity(query_vector, self.doc_vectors)
-        elif self.similarity_metric == 'l2':
-            similarities = self._l2_similarity(query_vector, self.doc_vectors)
-        else:
-            raise ValueError(f"不支持的相似度度量：{self.similarity_metric}")
-
-        # 优化步骤2: 使用向量化操作查找topk，避免循环
-        # 找到相似度得分最高的initial_retrieval_k个文档
-        initial_k = self.initial_retrieval_k
-        indices = np.argsort(similarities)[::-1][:initial_k]
+        # 优化步骤1: 全部查询一次编码
+        unique_queries = list(pending)
+        query_vectors = self._encode_queries(unique_queries).reshape(len(unique_queries), -1)
         
-        # 优化步骤3: 初始过滤使用向量化操作
-        # 过滤低于阈值的索引
-        mask = similarities[indices] >= threshold
-        filtered_indices = indices[mask]
+        # 语义缓存：与历史查询足够相似且参数、语料版本一致时直接复用其重排序结果
+        params = (top_k, threshold, rerank_threshold, filter_key)
+        todo = []
+        for query, query_vector in zip(unique_queries, query_vectors):
+            if self.semantic_cache is not None:
+                semantic_hit = self.semantic_cache.lookup(query_vector, params, corpus_version, label=cache_label)
+                if semantic_hit is not None:
+                    similar_query, final_results = semantic_hit
+                    print(f"语义缓存命中，查询: {query[:30]}... ≈ {similar_query[:30]}...")
+                    self.cache.set('retrieval', (query,) + params, final_results, version=corpus_version)
+                    finish(query, final_results)
+                    continue
+            todo.append((query, query_vector))
+        if not todo:
+            return results
         
-        if len(filtered_indices) == 0:
-            print("初步检索未找到相关文档")
-            return []
+        # 优化步骤2-4: 向量检索、BM25 召回与融合，按行号取回候选文档块
+        candidates, docs_by_row = self._search_rows(todo, top_k, threshold, metadata_filter)
+        for (query, _), (filtered_indices, _) in zip(todo, candidates):
+            if len(filtered_indices) == 0:
+                print(f"初步检索未找到相关文档，查询: {query[:30]}...")
+                finish(query, [])
         
-        # 优化步骤4: 批量处理文档
-        # 收集初步检索结果 
         initial_results = []
         pairs = []  # 为reranker准备的对
+        for (query, _), (filtered_indices, filtered_scores) in zip(todo, candidates):
+            query_docs = []
+            for row_id, initial_score in zip(filtered_indices.tolist(), filtered_scores):
+                # 复制文档，同一文档块可能是多个查询的候选
+                doc = dict(docs_by_row[row_id])
+                doc['initial_score'] = float(initial_score)  # 保存初始得分
+                query_docs.append(doc)
+                # 准备 reranker 输入
+                pairs.append((query, self._compose_rerank_text(query, doc['chunk_summary'], doc['chunk_content'])))
+            initial_results.append(query_docs)
+        
+        if not pairs:
+            return results
+        
+        # 优化步骤5: 全部 (查询, 文档块) 对批量调用reranker一次
+        rerank_scores = self._compute_rerank_scores(pairs)
         
-        for idx in filtered_indices:
-            doc = dict(self.docs[idx])  # 创建副本避免修改原数据
-            doc['initial_score'] = float(similarities[idx])  # 保存初始得分
+        # 将reranker分数归一化到0-1范围内（使用sigmoid函数）
+        def sigmoid(x):
+            return 1 / (1 + np.exp(-x))
+        
+        # 优化步骤6: 使用numpy向量化操作处理分数
+        # 批量应用sigmoid
+        normalized_scores = sigmoid(rerank_scores)
+        
+        offset = 0
+        for (query, query_vector), query_docs in zip(todo, initial_results):
+            if not query_docs:
+                continue
+            query_scores = normalized_scores[offset:offset + len(query_docs)]
+            offset += len(query_docs)
+            
+            # 为文档添加重排序分数（归一化后的）
+            reranked_results = []
+            for doc, score in zip(query_docs, query_scores):
+                doc['score'] = float(score)
+                if doc['score'] >= rerank_threshold:
+                    reranked_results.append(doc)
+            
+            # 按重排序分数降序排序，返回top_k个文档
+            final_results = sorted(reranked_results, key=lambda x: x['score'], reverse=True)[:top_k]
             
+            # 将结果存入缓存（容量与有效期由缓存组件管理）
+            self.cache.set('retrieval', (query,) + params, final_results, version=corpus_version)
+            if self.semantic_cache is not None:
+                self.semantic_cache.store(query_vector, query, params, corpus_version, final_results)
+            finish(query, final_results)
+        
+        return results
+    
+    def _search_rows(self, todo: List[Tuple[str, np.ndarray]], top_k: int, threshold: float,
+                     metadata_filter: Optional[MetadataFilter]) -> Tuple[List[Tuple[np.ndarray, np.ndarray]], Dict[int, Dict]]:
+        """
+        检索的行号阶段：过滤掩码、向量检索、BM25 召回与 RRF 融合，并按行号取回候选文档块
+        检索不持有写锁，而删除会使其后的行号前移。只有行号版本在检索前后未变、且内存中的向量已对应该版本时
+        才采用结果；否则（本进程正在删除，或其他进程已删除而本进程尚未加载）等待写入完成并加载修改后重试
+        :param todo: [(查询, 查询向量)]
+        :return: (与 todo 对应的 (候选行号, 初始得分) 列表, {行号: 文档块})
+        """
+        for _ in range(3):
+            epoch = self._row_epoch
+            if epoch is not None:
+                try:
+                    found = self._search_rows_once(todo, top_k, threshold, metadata_filter)
+                except Exception:
+                    # 行号变化期间可能取不到文档块或读到正在修改的索引，重试；否则是真正的错误
+                    if self._row_layout_unchanged(epoch):
+                        raise
+                else:
+                    if self._row_layout_unchanged(epoch):
+                        return found
+            # 获取写锁时等待正在进行的写入完成，并加载其他进程的修改
+            with self._write_lock:
+                pass
+        # 写入频繁时在写锁内完成最后一次检索
+        with self._write_lock:
+            return self._search_rows_once(todo, top_k, threshold, metadata_filter)
+
+    def _search_rows_once(self, todo: List[Tuple[str, np.ndarray]], top_k: int, threshold: float,
+                          metadata_filter: Optional[MetadataFilter]) -> Tuple[List[Tuple[np.ndarray, np.ndarray]], Dict[int, Dict]]:
+        """_search_rows 的一次尝试（不检查行号版本）"""
+        # 优化步骤2: 通过向量索引查找相似度得分最高的initial_retrieval_k个文档（多个查询一次矩阵乘法）
+        initial_k = self.initial_retrieval_k
+        row_mask = None
+        if metadata_filter is not None:
+            row_mask = self.filter_index.mask(metadata_filter, self.cache.corpus_version, len(self.vector_store))
+        searched = self.vector_index.search_batch(np.stack([vector for _, vector in todo]), initial_k, mask=row_mask)
+        
+        candidates = []
+        for (query, query_vector), (indices, scores) in zip(todo, searched):
+            # 优化步骤3: 初始过滤使用向量化操作
+            # 过滤低于阈值的索引
+            mask = scores >= threshold
+            filtered_indices = indices[mask]
+            filtered_scores = scores[mask]
+            
+            # 提前结束：向量检索第一名明显领先时，跳过 BM25 召回，只对前 top_k 个候选重排序
+            dominant = (self.rerank_score_gap and len(filtered_scores) >= 2
+                        and filtered_scores[0] - filtered_scores[1] >= self.rerank_score_gap)
+            if dominant:
+                filtered_indices = filtered_indices[:top_k]
+                filtered_scores = filtered_scores[:top_k]
+            
+            # 混合检索：BM25 候选不受向量相似度阈值限制，与向量候选按 RRF 融合后一起进入重排序
+            if self.lexical_index is not None and not dominant:
+                lexical_ids, _ = self.lexical_index.search(query, self.lexical_k, mask=row_mask)
+                lexical_ids = lexical_ids[lexical_ids < len(self.vector_store)]
+                if len(lexical_ids) > 0:
+                    fused_ids, _ = reciprocal_rank_fusion([filtered_indices, lexical_ids], k=self.rrf_k)
+                    filtered_indices = fused_ids[:initial_k + self.lexical_k]
+                    # 记录每个候选的向量相似度作为初始得分
+                    filtered_scores = self.vector_store.scores(query_vector, filtered_indices)
+            
+            candidates.append((filtered_indices, filtered_scores))
+        
+        # 优化步骤4: 批量处理文档
+        # 一次查询取回全部查询的候选文档块
+        all_ids = np.unique(np.concatenate([ids for ids, _ in candidates]))
+        return candidates, dict(zip(all_ids.tolist(), self._prepare_candidate_docs(all_ids)))
+
+    def _row_layout_unchanged(self, epoch: int) -> bool:
+        """读取开始时的行号版本仍是数据库中的当前版本，且内存中的向量与索引已对应该版本"""
+        return epoch == self._row_epoch == self.docs.row_epoch()
+
+    def _prepare_candidate_docs(self, row_ids: np.ndarray) -> List[Dict]:
+        """取回候选文档块并补齐检索所需的字段（返回的是新字典，不会修改存储中的数据）"""
+        candidate_docs = self.docs.get_rows(row_ids)
+        for doc in candidate_docs:
             # 确保文档具有所需的字段（向后兼容）
             if 'chunk_index' not in doc:
                 doc['chunk_index'] = 0
@@ -491,88 +1178,19 @@ class Rag:
                 if 'file_path' in doc and hasattr(self, '_file_chunks_count') and doc['file_path'] in self._file_chunks_count:
                     doc['total_chunks'] = self._file_chunks_count[doc['file_path']]
                 else:
-                    same_file_docs = [d for d in self.docs if d.get('file_path') == doc.get('file_path')]
-                    doc['total_chunks'] = len(same_file_docs)
+                    doc['total_chunks'] = self.docs.count_file_chunks(doc.get('file_path'))
                     # 缓存结果供未来使用
                     if not hasattr(self, '_file_chunks_count'):
                         self._file_chunks_count = {}
                     self._file_chunks_count[doc['file_path']] = doc['total_chunks']
             
             if 'chunk_summary' not in doc:
-                # 优化: 如果没有摘要，创建摘要但尝试重用之前的结果
-                cache_key_summary = f"summary_{doc.get('file_path')}_{doc.get('chunk_index')}"
-                if cache_key_summary in self.retrieval_cache:
-                    doc['chunk_summary'] = self.retrieval_cache[cache_key_summary]['results']
-                else:
-                    doc['chunk_summary'] = self._generate_chunk_summary(doc['chunk_content'])
-                    # 缓存摘要
-                    self.retrieval_cache[cache_key_summary] = {
-                        'results': doc['chunk_summary'],
-                        'timestamp': time.time()
-                    }
-            
-            initial_results.append(doc)
-            
-            # 准备 reranker 输入
-            chunk_content = f"{doc['chunk_summary']}\n{doc['chunk_summary']}\n{doc['chunk_content']}"
-            pairs.append((query, chunk_content))
-        
-        # 优化步骤5: 批量调用reranker一次，而不是在循环中逐个调用
-        # 调用reranker模型获取重排序分数 - 批量处理更高效
-        rerank_scores = self.reranker_model.compute_score(pairs)
-        
-        # 将reranker分数归一化到0-1范围内（使用sigmoid函数）
-        def sigmoid(x):
-            return 1 / (1 + np.exp(-x))
-        
-        # 优化步骤6: 使用numpy向量化操作处理分数
-        # 批量应用sigmoid
-        normalized_scores = sigmoid(np.array(rerank_scores))
-        
-        # 为文档添加重排序分数（归一化后的）
-        reranked_results = []
-        for i, doc in enumerate(initial_results):
-            # 复制文档以保留所有原始字段
-            reranked_doc = dict(doc)
-            # 使用预计算的归一化分数
-            reranked_doc['score'] = float(normalized_scores[i])
-            if reranked_doc['score'] >= rerank_threshold:
-                reranked_results.append(reranked_doc)
-        
-        # 按重排序分数降序排序
-        reranked_results = sorted(reranked_results, key=lambda x: x['score'], reverse=True)
-        
-        # 返回top_k个文档
-        final_results = reranked_results[:top_k]
-        
-        # 将结果存入缓存
-        self.retrieval_cache[cache_key] = {
-            'results': final_results,
-            'timestamp': time.time()
-        }
-        
-        # 清理缓存
-        if len(self.retrieval_cache) > self.cache_max_size:
-            # 优化步骤7: 更高效的缓存清理
-            # 找出最旧的几个条目而不是每次只删除一个
-            cache_items = sorted(self.retrieval_cache.items(), key=lambda x: x[1]['timestamp'])
-            # 删除10%的旧条目
-            items_to_remove = max(1, int(self.cache_max_size * 0.1))
-            for i in range(items_to_remove):
-                if i < len(cache_items):
-                    del self.retrieval_cache[cache_items[i][0]]
-        
-        # 存储最后一次检索的结果，便于前端获取
-        self.last_retrieval = {
-            'query': query,
-            'top_k': top_k,
-            'results': final_results,
-            'cache_key': cache_key
-        }
-        
-        return final_results
+                # 摘要尚未生成（由后台补充），检索路径上不调用 LLM，只查摘要缓存
+                doc['chunk_summary'] = self.summary_service.get_cached(doc['chunk_content']) or ''
+        return candidate_docs
     
-    def generate_prompt(self, query: str, top_k: int = None, threshold: float = None, rerank_threshold: float = None, is_image: bool = False) -> str:
+    def generate_prompt(self, query: str, top_k: int = None, threshold: float = None, rerank_threshold: float = None, is_image: bool = False,
+                        cache_label: str = 'default', filters: Union[Dict, MetadataFilter] = None) -> str:
         """
         生成 RAG 提示
         :param query: 用户查询
@@ -580,6 +1198,8 @@ class Rag:
         :param threshold: 相似度阈值，低于此值的文档将被过滤
         :param rerank_threshold: 重排序分数阈值，低于此值的文档将被过滤
         :param is_image: 是否为图片查询
+        :param cache_label: 语义缓存命中率统计所用的调用方标识（如接口路径）
+        :param filters: 元数据过滤条件（见 MetadataFilter）
         :return: 生成的提示文本
         """
         if top_k is None:
@@ -589,24 +1209,26 @@ class Rag:
         if rerank_threshold is None:
             rerank_threshold = self.rerank_threshold
             
+        metadata_filter = MetadataFilter.from_dict(filters)
+        filter_key = None if metadata_filter is None else metadata_filter.key
+        
         # 生成最新查询的缓存键
-        cache_key = f"prompt_{query}_{top_k}_{threshold}_{rerank_threshold}_{is_image}"
+        cache_key = (query, top_k, threshold, rerank_threshold, is_image, filter_key)
+        corpus_version = self.cache.corpus_version
         
         # 检查缓存中是否已有此提示
-        if cache_key in self.retrieval_cache:
-            cache_entry = self.retrieval_cache[cache_key]
-            if time.time() - cache_entry['timestamp'] < self.cache_ttl:
-                print(f"从缓存中获取提示，查询: {query[:30]}...")
-                return cache_entry['results']
-            else:
-                del self.retrieval_cache[cache_key]
+        cached = self.cache.get('prompt', cache_key)
+        if cached is not None:
+            print(f"从缓存中获取提示，查询: {query[:30]}...")
+            return cached
         
         # 优化：检查是否可以重用上次检索的结果
-        if hasattr(self, 'last_retrieval') and self.last_retrieval and self.last_retrieval.get('query') == query and self.last_retrieval.get('top_k') >= top_k:
-            relevant_docs = self.last_retrieval.get('results', [])[:top_k]
+        relevant_docs = self.get_recent_retrieval(query, top_k, metadata_filter)
+        if relevant_docs is not None:
             print(f"重用上次检索结果，查询: {query[:30]}...")
         else:
-            relevant_docs = self.retrieve_documents(query, top_k, threshold, rerank_threshold)
+            relevant_docs = self.retrieve_documents(query, top_k, threshold, rerank_threshold, cache_label=cache_label,
+                                                    filters=metadata_filter)
         
         # 构建提示模板 - 使用 StringIO 或 StringBuilder 模式更高效
         prompt_builder = StringIO()
@@ -651,10 +1273,7 @@ class Rag:
         prompt = prompt_builder.getvalue()
         
         # 缓存生成的提示
-        self.retrieval_cache[cache_key] = {
-            'results': prompt,
-            'timestamp': time.time()
-        }
+        self.cache.set('prompt', cache_key, prompt, version=corpus_version)
         
         return prompt
     
@@ -662,11 +1281,63 @@ class Rag:
         """
         获取上次检索的文档 (兼容旧版API)
         """
-        if hasattr(self, 'last_retrieval') and self.last_retrieval:
+        if self.last_retrieval:
             return self.last_retrieval.get('results', [])
-        # 旧版本兼容性
-        if hasattr(self, 'last_query') and self.last_query:
-            cache_key = self.last_query.get('cache_key')
-            if cache_key in self.retrieval_cache:
-                return self.retrieval_cache[cache_key]['results']
-        return []
\ No newline at end of file
+        return []
+
+    def get_recent_retrieval(self, query: str, top_k: int,
+                             filters: Union[Dict, MetadataFilter] = None) -> Optional[List[Dict]]:
+        """
+        若最近一次检索是同一查询、同一过滤条件、top_k 不小于本次且期间知识库未变化，返回其结果，否则返回 None
+        """
+        metadata_filter = MetadataFilter.from_dict(filters)
+        filter_key = None if metadata_filter is None else metadata_filter.key
+        last = self.last_retrieval
+        if (last and last.get('query') == query and last.get('top_k') >= top_k
+                and last.get('filters') == filter_key
+                and last.get('corpus_version') == self.cache.corpus_version):
+            return last.get('results', [])[:top_k]
+        return None
+
+    def _sync_lexical_index(self) -> None:
+        """为新增或正文被修改的文档块建立 BM25 倒排（删除由数据库触发器处理）"""
+        if self.lexical_index is not None:
+            self.lexical_index.sync()
+
+    def _reload_if_changed(self) -> None:
+        """
+        获取写锁时调用：其他进程修改过向量存储时，重新打开段清单并更新向量索引，使依赖知识库的缓存失效
+        （文档块、BM25 倒排在 SQLite 中，各进程直接读取最新数据）；之后内存中的向量与数据库中的行号一致
+        """
+        if self.vector_store.changed_on_disk():
+            change = self.vector_store.reload()
+            if change == 'appended':
+                self.vector_index.add(self.vector_store)
+            else:
+                # 删除、合并或原地修改：加载其他进程保存的索引，不一致时重新构建
+                self._load_index()
+            self._corpus_changed()
+            print(f"已加载其他进程对知识库的修改（{change}），当前共 {len(self.vector_store)} 个向量")
+        self._row_epoch = self.docs.row_epoch()
+
+    def refresh(self, force: bool = False) -> None:
+        """
+        多进程服务中检索前调用：间隔 reload_check_interval 秒检查一次段清单，其他进程修改过时加载修改
+        :param force: 忽略检查间隔
+        """
+        if self.reload_check_interval is None or self.reload_check_interval < 0:
+            return
+        now = time.monotonic()
+        if not force and now - self._last_reload_check < self.reload_check_interval:
+            return
+        self._last_reload_check = now
+        if self.vector_store.changed_on_disk():
+            # 获取写锁时执行 _reload_if_changed，同时等待其他进程正在进行的写入完成
+            with self._write_lock:
+                pass
+
+    def _corpus_changed(self) -> None:
+        """知识库内容变化（入库、删除、修改文档块、重建向量）后使依赖知识库的缓存失效"""
+        self.cache.bump_corpus_version()
+        if self.semantic_cache is not None:
+            self.semantic_cache.clear()
\ No newline at end of file
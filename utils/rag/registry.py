@@ -0,0 +1,30 @@
+"""
+Rag 实例注册表
+进程内共享同一个 Rag 实例，嵌入与重排序模型只加载一次：Web 接口、Agent 工具与测试脚本都通过 get_rag() 获取。
+- 实例在第一次调用 get_rag() 时创建，或由服务启动时的预热线程创建（组件名 rag）
+- 测试中可通过 set_rag() 注入已创建的实例或替身，reset_rag() 丢弃当前实例
+"""
+from typing import Optional
+from utils.component_manager import LazyComponent, register_component
+from .rag import Rag
+
+rag_component: LazyComponent = register_component('rag', Rag)
+
+
+def get_rag(timeout: Optional[float] = None) -> Rag:
+    """
+    获取共享的 Rag 实例，尚未创建时在当前线程中创建
+    :param timeout: 其他线程正在创建实例时的最长等待时间（秒），None 表示一直等待，超时抛出 ComponentUnavailable
+    :return: Rag 实例
+    """
+    return rag_component.get(timeout)
+
+
+def set_rag(instance: Rag) -> None:
+    """指定共享的 Rag 实例（依赖注入），之后的 get_rag() 均返回该实例"""
+    rag_component.set(instance)
+
+
+def reset_rag() -> None:
+    """丢弃共享的 Rag 实例，下一次 get_rag() 时重新创建"""
+    rag_component.reset()
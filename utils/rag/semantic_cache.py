@@ -0,0 +1,137 @@
+"""
+语义查询缓存
+精确缓存以查询字符串为键，"X 是什么？" 与 "X是什么" 互相无法命中。
+本模块保存历史查询的向量，新查询与某个历史查询的余弦相似度超过阈值、
+且检索参数和语料版本一致时，直接返回该历史查询的重排序结果，省去检索与重排序。
+- 查询向量保存在固定容量的内存缓冲区中，通过 FlatIndex 检索（与文档检索共用同一套索引接口）
+- 容量满后替换最久未命中的条目
+- 按调用方（接口）分别统计命中率
+"""
+import threading
+import time
+from typing import Any, Dict, Hashable, List, Optional, Tuple
+import numpy as np
+from .vector_index import FlatIndex
+from .vector_store import cosine_similarity
+
+
+class _QueryVectorBuffer:
+    """固定容量的内存向量缓冲区，提供 FlatIndex 所需的 len() 与 scores() 接口"""
+
+    def __init__(self, capacity: int, dimension: int):
+        self.capacity = capacity
+        self.dimension = dimension
+        self.vectors = np.zeros((capacity, dimension), dtype=np.float32)
+        self.size = 0
+
+    def __len__(self) -> int:
+        return self.size
+
+    def put(self, slot: int, vector: np.ndarray) -> None:
+        self.vectors[slot] = vector
+        self.size = max(self.size, slot + 1)
+
+    def scores(self, query_vector: np.ndarray, ids: Optional[np.ndarray] = None) -> np.ndarray:
+        vectors = self.vectors[:self.size] if ids is None else self.vectors[ids]
+        # 写入时已归一化
+        return cosine_similarity(query_vector, vectors)
+
+
+class SemanticQueryCache:
+    """按查询向量相似度命中的检索结果缓存"""
+
+    def __init__(self, dimension: int, threshold: float = 0.95, max_entries: int = 512,
+                 ttl: float = 3600, candidates: int = 4):
+        """
+        :param dimension: 查询向量维度
+        :param threshold: 余弦相似度阈值，不低于该值视为同一问题
+        :param max_entries: 最大缓存查询数
+        :param ttl: 有效期（秒），0 表示不过期
+        :param candidates: 每次查找检查的最相似历史查询数量（相似但参数不同的查询会被跳过）
+        """
+        self.threshold = float(threshold)
+        self.max_entries = max(1, int(max_entries))
+        self.ttl = ttl or 0
+        self.candidates = max(1, int(candidates))
+        self._buffer = _QueryVectorBuffer(self.max_entries, dimension)
+        self._index = FlatIndex('cosine')
+        # 槽位 -> {'params', 'version', 'query', 'value', 'expires_at', 'last_used'}
+        self._entries: List[Optional[Dict[str, Any]]] = [None] * self.max_entries
+        self._lock = threading.Lock()
+        self._stats: Dict[str, Dict[str, int]] = {}
+
+    @staticmethod
+    def _normalize(vector: np.ndarray) -> np.ndarray:
+        vector = np.asarray(vector, dtype=np.float32).reshape(-1)
+        return vector / max(float(np.linalg.norm(vector)), 1e-12)
+
+    def _record(self, label: str, hit: bool) -> None:
+        stats = self._stats.setdefault(label, {'hits': 0, 'misses': 0})
+        stats['hits' if hit else 'misses'] += 1
+
+    def lookup(self, query_vector: np.ndarray, params: Hashable, version: int,
+               label: str = 'default') -> Optional[Tuple[str, Any]]:
+        """
+        查找语义相近的历史查询
+        :param query_vector: 查询向量
+        :param params: 检索参数（top_k、阈值等），必须完全一致
+        :param version: 当前语料版本号
+        :param label: 统计用的调用方标识（如接口路径）
+        :return: (命中的历史查询, 缓存结果)，未命中返回 None
+        """
+        query = self._normalize(query_vector)
+        now = time.monotonic()
+        with self._lock:
+            slots, scores = self._index.search(query, self.candidates)
+            for slot, score in zip(slots, scores):
+                if score < self.threshold:
+                    break
+                entry = self._entries[slot]
+                if entry is None or entry['params'] != params or entry['version'] != version:
+                    continue
+                if entry['expires_at'] and now >= entry['expires_at']:
+                    self._entries[slot] = None
+                    continue
+                entry['last_used'] = now
+                self._record(label, True)
+                return entry['query'], entry['value']
+            self._record(label, False)
+        return None
+
+    def store(self, query_vector: np.ndarray, query: str, params: Hashable, version: int, value: Any) -> None:
+        """写入缓存：优先使用空槽位，否则替换最久未命中的条目"""
+        vector = self._normalize(query_vector)
+        now = time.monotonic()
+        with self._lock:
+            if self._buffer.size < self.max_entries:
+                slot = self._buffer.size
+            else:
+                free = [i for i, entry in enumerate(self._entries) if entry is None]
+                slot = free[0] if free else min(range(self.max_entries), key=lambda i: self._entries[i]['last_used'])
+            self._buffer.put(slot, vector)
+            self._entries[slot] = {
+                'params': params,
+                'version': version,
+                'query': query,
+                'value': value,
+                'expires_at': now + self.ttl if self.ttl else 0,
+                'last_used': now,
+            }
+            self._index.add(self._buffer)
+
+    def clear(self) -> None:
+        """清空全部条目（知识库变化时调用）"""
+        with self._lock:
+            self._entries = [None] * self.max_entries
+            self._buffer.size = 0
+            self._index.build(None)
+
+    def stats(self) -> Dict[str, Any]:
+        """按调用方统计的命中率"""
+        with self._lock:
+            size = sum(1 for entry in self._entries if entry is not None)
+            labels = {}
+            for label, stats in self._stats.items():
+                total = stats['hits'] + stats['misses']
+                labels[label] = dict(stats, hit_rate=round(stats['hits'] / total, 4) if total else 0.0)
+        return {'size': size, 'max_entries': self.max_entries, 'threshold': self.threshold, 'endpoints': labels}
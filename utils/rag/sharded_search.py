@@ -0,0 +1,229 @@
+"""
+分片并行检索模块
+暴力检索（flat）在请求线程中对全部向量做一次矩阵运算，大规模语料时只能用到一个核心。
+ShardedFlatIndex 将向量存储的逻辑行号切分为 num_shards 个连续分片，由工作进程并行打分：
+- 工作进程按段文件名以 memmap 只读方式打开同一批段文件，向量通过操作系统页缓存共享，不复制也不经管道传输
+- 每次检索只向工作进程发送 (段名, 段内起止行, 全局起始行) 布局和查询向量，各分片返回本分片的前 k 个结果，
+  主进程合并为全局前 k 个（scatter-gather）
+- 工作进程池在第一次分片检索时才创建（多进程服务在 fork 之后才会创建进程和线程）
+- 工作进程以 fork 方式启动，直接继承已导入的模块；spawn 方式会在每个工作进程中重新执行主模块（即重新加载模型），
+  因此不支持 fork 的平台（Windows）上不分片
+- 向量数低于 min_rows、过滤后剩余行较少或工作进程异常时，退回当前进程检索，结果一致
+"""
+import multiprocessing
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Dict, List, Optional, Tuple
+import numpy as np
+from .vector_index import FlatIndex, top_k_indices_2d
+from .vector_store import VectorStore, _Segment
+from utils.fork_safety import register_after_fork
+
+# ---------- 工作进程 ----------
+
+_worker_store: Optional[VectorStore] = None
+_worker_segments: Dict[Tuple[str, int], _Segment] = {}
+
+
+def _init_worker(path: str, dimension: int, metric: str, normalize: bool) -> None:
+    """工作进程初始化：创建不加载段清单的向量存储，仅用于打分"""
+    global _worker_store
+    _worker_store = VectorStore(path, dimension, metric=metric, normalize=normalize)
+
+
+def _open_segment(name: str, rows: int) -> _Segment:
+    """以只读 memmap 方式打开段文件（按 (段名, 行数) 缓存，段文件写入后不会改名，remove 会生成新段）"""
+    key = (name, rows)
+    segment = _worker_segments.get(key)
+    if segment is None:
+        vector_file, norm_file = _worker_store._segment_files(name)
+        segment = _Segment(name, np.load(vector_file, mmap_mode='r'), np.load(norm_file, mmap_mode='r'))
+        if len(segment) != rows:
+            raise RuntimeError(f"段文件 {name} 行数不一致")
+        _worker_segments[key] = segment
+    return segment
+
+
+def _search_shard(layout: List[Tuple[str, int, int, int]], start: int, query_vectors: np.ndarray, k: int,
+                  mask: Optional[np.ndarray]) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    在一个分片内检索（工作进程中执行）
+    :param layout: [(段名, 段总行数, 段内起始行, 段内结束行)]
+    :param start: 分片第一行的全局行号
+    :param mask: 可选，分片范围内的行掩码
+    :return: (行号矩阵, 分数矩阵)，形状均为 (查询数, ≤k)，行号为全局行号
+    """
+    segments = []
+    for name, rows, lo, hi in layout:
+        segment = _open_segment(name, rows)
+        segments.append(_Segment(name, segment.vectors[lo:hi], segment.norms[lo:hi]))
+    # 不再使用的段（已被合并或删除）释放映射
+    live = {(name, rows) for name, rows, _, _ in layout}
+    for key in [key for key in _worker_segments if key not in live]:
+        del _worker_segments[key]
+
+    _worker_store._set_segments(segments)
+    index = FlatIndex(_worker_store.metric)
+    index.build(_worker_store)
+    results = index.search_batch(query_vectors, k, mask=mask)
+    width = max((len(ids) for ids, _ in results), default=0)
+    ids = np.full((len(results), width), -1, dtype=np.int64)
+    scores = np.full((len(results), width), -np.inf, dtype=np.float32)
+    for i, (row_ids, row_scores) in enumerate(results):
+        ids[i, :len(row_ids)] = row_ids + start
+        scores[i, :len(row_scores)] = row_scores
+    return ids, scores
+
+
+# ---------- 主进程 ----------
+
+class ShardedFlatIndex(FlatIndex):
+    """
+    分片并行的暴力检索索引，结果与 FlatIndex 相同
+    索引本身没有需要持久化的结构，index_type 仍为 flat，与单进程 flat 索引可以互相切换
+    """
+
+    def __init__(self, metric: str = 'cosine', num_shards: int = 4, min_rows: int = 200000,
+                 timeout: float = 30):
+        """
+        :param num_shards: 分片数量（即工作进程数量）
+        :param min_rows: 参与检索的行数低于该值时在当前进程中检索（进程间通信的开销高于并行收益）
+        :param timeout: 等待分片结果的超时时间（秒），超时后退回当前进程检索
+        """
+        super().__init__(metric)
+        self.num_shards = max(1, int(num_shards))
+        if self.num_shards > 1 and 'fork' not in multiprocessing.get_all_start_methods():
+            print("当前平台不支持 fork 方式启动进程，分片检索已关闭")
+            self.num_shards = 1
+        self.min_rows = max(0, int(min_rows))
+        self.timeout = timeout
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._executor_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self._stats = {'sharded': 0, 'local': 0, 'fallbacks': 0}
+        register_after_fork(self)
+
+    def _after_fork(self) -> None:
+        # 进程池属于父进程（子进程中管理线程已不存在），子进程首次分片检索时创建自己的进程池
+        self._executor = None
+        self._executor_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+
+    def _count(self, key: str) -> None:
+        with self._stats_lock:
+            self._stats[key] += 1
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        """首次分片检索时才启动工作进程"""
+        with self._executor_lock:
+            if self._executor is None:
+                store = self.store
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.num_shards,
+                    mp_context=multiprocessing.get_context('fork'),
+                    initializer=_init_worker,
+                    initargs=(str(store.path), store.dimension, store.metric, store.normalize),
+                )
+            return self._executor
+
+    def _reset_executor(self) -> None:
+        """工作进程异常退出后丢弃进程池，下次检索时重新创建"""
+        with self._executor_lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    def _plan_shards(self) -> List[Tuple[int, int, List[Tuple[str, int, int, int]]]]:
+        """
+        基于当前段列表快照，将行号 [0, ntotal) 切分为连续分片
+        :return: [(分片起始行, 分片结束行, [(段名, 段总行数, 段内起始行, 段内结束行)])]
+        """
+        segments, offsets = self.store._layout
+        total = min(self.ntotal, int(offsets[-1]))
+        bounds = np.linspace(0, total, self.num_shards + 1).astype(np.int64)
+        shards = []
+        for start, end in zip(bounds[:-1], bounds[1:]):
+            if start == end:
+                continue
+            layout = []
+            for segment, offset in zip(segments, offsets):
+                lo, hi = max(int(start), int(offset)), min(int(end), int(offset) + len(segment))
+                if lo < hi:
+                    layout.append((segment.name, len(segment), lo - int(offset), hi - int(offset)))
+            shards.append((int(start), int(end), layout))
+        return shards
+
+    def _use_shards(self, mask: Optional[np.ndarray]) -> bool:
+        if self.num_shards <= 1 or self.store is None:
+            return False
+        rows = self.ntotal if mask is None else int(np.count_nonzero(np.asarray(mask, dtype=bool)[:self.ntotal]))
+        return rows >= max(self.min_rows, 1)
+
+    def _search_sharded(self, query_vectors: np.ndarray, k: int,
+                        mask: Optional[np.ndarray]) -> List[Tuple[np.ndarray, np.ndarray]]:
+        """scatter-gather：各分片返回前 k 个结果，合并为全局前 k 个"""
+        executor = self._get_executor()
+        futures = []
+        for start, end, layout in self._plan_shards():
+            shard_mask = None
+            if mask is not None:
+                shard_mask = np.asarray(mask, dtype=bool)[start:end]
+                if not shard_mask.any():
+                    continue
+            futures.append(executor.submit(_search_shard, layout, start, query_vectors, k, shard_mask))
+        parts = [future.result(timeout=self.timeout) for future in futures]
+
+        num_queries = len(query_vectors)
+        if not parts:
+            return [self._empty_result() for _ in range(num_queries)]
+        ids = np.concatenate([part[0] for part in parts], axis=1)
+        scores = np.concatenate([part[1] for part in parts], axis=1)
+        keep = top_k_indices_2d(scores, k)
+        ids = np.take_along_axis(ids, keep, axis=1)
+        scores = np.take_along_axis(scores, keep, axis=1)
+        results = []
+        for row_ids, row_scores in zip(ids, scores):
+            # 去掉分片结果不足 k 个时的占位
+            valid = row_ids >= 0
+            results.append((row_ids[valid], row_scores[valid]))
+        return results
+
+    def search(self, query_vector: np.ndarray, k: int,
+               mask: Optional[np.ndarray] = None) -> Tuple[np.ndarray, np.ndarray]:
+        if self.ntotal == 0 or not self._use_shards(mask):
+            self._count('local')
+            return super().search(query_vector, k, mask=mask)
+        query_vector = np.asarray(query_vector, dtype=np.float32).reshape(1, -1)
+        return self.search_batch(query_vector, k, mask=mask)[0]
+
+    def search_batch(self, query_vectors: np.ndarray, k: int,
+                     mask: Optional[np.ndarray] = None) -> List[Tuple[np.ndarray, np.ndarray]]:
+        query_vectors = np.asarray(query_vectors, dtype=np.float32)
+        query_vectors = query_vectors.reshape(len(query_vectors), -1)
+        if self.ntotal == 0 or len(query_vectors) == 0 or not self._use_shards(mask):
+            self._count('local')
+            return super().search_batch(query_vectors, k, mask=mask)
+        try:
+            results = self._search_sharded(query_vectors, k, mask)
+            self._count('sharded')
+            return results
+        except BrokenProcessPool as e:
+            print(f"分片检索工作进程异常退出，改为在当前进程中检索: {str(e)}")
+            self._reset_executor()
+        except Exception as e:
+            # 段文件在检索期间被合并/删除、超时等，退回当前进程检索（当前进程持有段列表快照）
+            print(f"分片检索失败，改为在当前进程中检索: {str(e)}")
+        self._count('fallbacks')
+        return super().search_batch(query_vectors, k, mask=mask)
+
+    def stats(self) -> Dict[str, int]:
+        """分片检索、本地检索与回退次数"""
+        with self._stats_lock:
+            stats = dict(self._stats)
+        return dict(stats, num_shards=self.num_shards, min_rows=self.min_rows,
+                    workers_started=self._executor is not None)
+
+    def close(self) -> None:
+        """停止工作进程"""
+        self._reset_executor()
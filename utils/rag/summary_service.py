@@ -0,0 +1,153 @@
+"""
+文档块摘要服务
+- 有界线程池并发调用 LLM，全局并发数可配置（入库、后台补充摘要、修改文档块共用同一个上限）
+- 相同内容的摘要请求在进行中时合并为一次调用
+- 摘要按 (文档块内容哈希, 模型) 持久化到 SQLite，重复内容、重新入库不再调用 LLM
+"""
+import sqlite3
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Union
+from .chunk_store import hash_text
+from utils.fork_safety import register_after_fork
+
+
+class SummaryService:
+    """并发、去重、带持久化缓存的摘要生成服务"""
+
+    SCHEMA = """
+    CREATE TABLE IF NOT EXISTS summaries (
+        content_hash TEXT NOT NULL,
+        model TEXT NOT NULL,
+        summary TEXT NOT NULL,
+        created_at REAL,
+        PRIMARY KEY (content_hash, model)
+    );
+    """
+
+    def __init__(self, generate: Callable[[str], str], db_path: Union[str, Path],
+                 model: Callable[[], str], concurrency: int = 4):
+        """
+        :param generate: 实际生成摘要的函数，失败时抛出异常
+        :param db_path: 摘要缓存数据库路径
+        :param model: 返回当前 LLM 模型名称的函数（模型可在运行时切换，不同模型的摘要分开缓存）
+        :param concurrency: 同时进行的摘要请求数
+        """
+        self.generate = generate
+        self.db_path = Path(db_path)
+        self.model = model
+        self.concurrency = max(1, int(concurrency))
+        self._executor = ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix='summary')
+        self._inflight: Dict[tuple, Future] = {}
+        self._inflight_lock = threading.Lock()
+        self._local = threading.local()
+        self._write_lock = threading.Lock()
+        register_after_fork(self)
+        self._stats = {'cache_hits': 0, 'deduplicated': 0, 'generated': 0, 'errors': 0}
+
+        conn = self._conn()
+        conn.executescript(self.SCHEMA)
+        conn.commit()
+
+    def _after_fork(self) -> None:
+        # 子进程中线程池的工作线程已不存在，sqlite 连接不能继续使用
+        self._executor = ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix='summary')
+        self._inflight = {}
+        self._inflight_lock = threading.Lock()
+        self._local = threading.local()
+        self._write_lock = threading.Lock()
+
+    def _conn(self) -> sqlite3.Connection:
+        """每个线程使用独立连接"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(str(self.db_path), timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def get_cached(self, content: str) -> Optional[str]:
+        """只查缓存，不调用 LLM"""
+        row = self._conn().execute(
+            "SELECT summary FROM summaries WHERE content_hash = ? AND model = ?", (hash_text(content), self.model())
+        ).fetchone()
+        return None if row is None else row[0]
+
+    def _put(self, content_hash: str, model: str, summary: str) -> None:
+        with self._write_lock:
+            conn = self._conn()
+            conn.execute(
+                "INSERT OR REPLACE INTO summaries (content_hash, model, summary, created_at) VALUES (?, ?, ?, ?)",
+                (content_hash, model, summary, time.time())
+            )
+            conn.commit()
+
+    def submit(self, content: str) -> Future:
+        """
+        异步生成摘要
+        :return: Future，结果为摘要文本；生成失败时 Future 中为异常
+        """
+        model = self.model()
+        key = (hash_text(content), model)
+        with self._inflight_lock:
+            future = self._inflight.get(key)
+            if future is not None:
+                self._stats['deduplicated'] += 1
+                return future
+
+        cached = self.get_cached(content)
+        if cached is not None:
+            self._stats['cache_hits'] += 1
+            future = Future()
+            future.set_result(cached)
+            return future
+
+        with self._inflight_lock:
+            # 查缓存期间可能已有相同请求提交
+            future = self._inflight.get(key)
+            if future is not None:
+                self._stats['deduplicated'] += 1
+                return future
+            future = self._executor.submit(self._run, key, content)
+            self._inflight[key] = future
+        return future
+
+    def _run(self, key: tuple, content: str) -> str:
+        try:
+            summary = self.generate(content)
+            self._put(key[0], key[1], summary)
+            self._stats['generated'] += 1
+            return summary
+        except Exception:
+            self._stats['errors'] += 1
+            raise
+        finally:
+            with self._inflight_lock:
+                self._inflight.pop(key, None)
+
+    def summarize(self, content: str, timeout: float = None) -> str:
+        """同步生成摘要（受全局并发上限约束），失败时抛出异常"""
+        return self.submit(content).result(timeout=timeout)
+
+    def summarize_many(self, contents: List[str]) -> List[Optional[str]]:
+        """并发生成多个摘要，失败的位置为 None"""
+        futures = [self.submit(content) for content in contents]
+        results = []
+        for future in futures:
+            try:
+                results.append(future.result())
+            except Exception:
+                results.append(None)
+        return results
+
+    def stats(self) -> Dict[str, int]:
+        """摘要服务统计信息"""
+        with self._inflight_lock:
+            inflight = len(self._inflight)
+        return dict(self._stats, inflight=inflight, concurrency=self.concurrency)
+
+    def shutdown(self, wait: bool = True) -> None:
+        self._executor.shutdown(wait=wait, cancel_futures=not wait)
@@ -0,0 +1,1123 @@
+"""
+向量索引模块
+提供可插拔的向量检索后端，由 configs.yaml 中的 rag.vector_store.type 选择：
+- flat: 暴力检索（精确结果）
+- ivf:  倒排文件索引（k-means 粗聚类 + 探测最近的若干个簇）
+- hnsw: 分层可导航小世界图（默认为 NumPy 实现，配置 backend: hnswlib 时使用 hnswlib 的 C++ 实现）
+- sq8/pq: int8 标量量化 / 乘积量化编码近似打分 + 全精度向量精确重排（见 quantization.py）
+索引文件只保存结构信息（聚类中心、倒排表、图结构），向量本身及相似度计算由 VectorStore 提供
+search 支持传入行掩码（元数据过滤结果），只在允许的行中检索
+"""
+import json
+import os
+import threading
+import numpy as np
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple, Union
+from utils.fork_safety import register_after_fork
+from .vector_store import VectorStore
+
+try:
+    import hnswlib
+except ImportError:
+    hnswlib = None
+
+
+def top_k_indices(scores: np.ndarray, k: int) -> np.ndarray:
+    """
+    返回分数最高的 k 个位置（按分数降序）
+    先用 argpartition 做 O(n) 的部分选择，再只对选出的 k 个元素排序
+    """
+    n = len(scores)
+    k = min(k, n)
+    if k <= 0:
+        return np.zeros(0, dtype=np.int64)
+    if k < n:
+        candidates = np.argpartition(scores, n - k)[n - k:]
+    else:
+        candidates = np.arange(n)
+    return candidates[np.argsort(scores[candidates])[::-1]]
+
+
+def top_k_indices_2d(scores: np.ndarray, k: int) -> np.ndarray:
+    """逐行返回分数最高的 k 个位置（按分数降序），scores 形状为 (查询数, 候选数)"""
+    n = scores.shape[1]
+    k = min(k, n)
+    if k <= 0:
+        return np.zeros((scores.shape[0], 0), dtype=np.int64)
+    if k < n:
+        candidates = np.argpartition(scores, n - k, axis=1)[:, n - k:]
+    else:
+        candidates = np.tile(np.arange(n), (scores.shape[0], 1))
+    order = np.argsort(-np.take_along_axis(scores, candidates, axis=1), axis=1, kind='stable')
+    return np.take_along_axis(candidates, order, axis=1)
+
+
+class BaseIndex:
+    """
+    向量索引基类
+    - build: 基于向量存储中的全部向量构建索引
+    - add: 向量存储追加新行后，将新增的行加入索引
+    - update: 指定行的向量被修改后更新索引
+    - remove: 向量存储删除若干行（其后的行号前移）后更新索引
+    - search: 返回 (文档下标数组, 分数数组)，分数越大越相似；mask 为布尔行掩码时只返回掩码为 True 的行
+    - search_batch: 多个查询一起检索，默认逐个调用 search
+    """
+
+    index_type = 'base'
+
+    def __init__(self, metric: str = 'cosine'):
+        if metric not in ('cosine', 'l2'):
+            raise ValueError(f"不支持的相似度度量：{metric}")
+        self.metric = metric
+        self.store: Optional[VectorStore] = None
+        self.ntotal = 0
+
+    def _attach(self, store: Optional[VectorStore]) -> None:
+        """绑定向量存储（不复制数据）"""
+        self.store = store if store is not None and len(store) > 0 else None
+
+    def _scores(self, query: np.ndarray, ids: Optional[np.ndarray] = None) -> np.ndarray:
+        """计算查询向量与指定文档（默认全部文档）的相似度"""
+        return self.store.scores(query, ids)
+
+    @staticmethod
+    def _empty_result() -> Tuple[np.ndarray, np.ndarray]:
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float32)
+
+    def _allowed_ids(self, mask: np.ndarray) -> np.ndarray:
+        """掩码 -> 允许检索的行号"""
+        return np.flatnonzero(np.asarray(mask, dtype=bool)[:self.ntotal])
+
+    def _search_ids(self, query_vector: np.ndarray, ids: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+        """只对指定行做精确检索（过滤后剩余行较少时比近似检索更快且无召回损失）"""
+        if len(ids) == 0:
+            return self._empty_result()
+        scores = self._scores(query_vector, ids)
+        order = top_k_indices(scores, k)
+        return ids[order], scores[order]
+
+    def build(self, store: Optional[VectorStore]) -> None:
+        raise NotImplementedError
+
+    def add(self, store: VectorStore) -> None:
+        """
+        追加向量
+        :param store: 追加新行之后的向量存储，行号 [ntotal, len(store)) 为新增部分
+        """
+        raise NotImplementedError
+
+    def update(self, store: VectorStore, ids: List[int]) -> None:
+        """
+        指定行的向量被修改后更新索引，默认整体重建
+        :param store: 修改后的向量存储
+        :param ids: 被修改的行下标
+        """
+        self.build(store)
+
+    def remove(self, store: VectorStore, ids: List[int]) -> None:
+        """
+        向量存储删除若干行后更新索引，默认整体重建
+        :param store: 删除后的向量存储
+        :param ids: 被删除的行下标（删除前的行号），其后的行号依次前移
+        """
+        self.build(store)
+
+    def _kept_rows(self, ids: List[int]) -> np.ndarray:
+        """删除前的行号 -> 是否保留的布尔数组"""
+        keep = np.ones(self.ntotal, dtype=bool)
+        ids = np.asarray(ids, dtype=np.int64)
+        keep[ids[(ids >= 0) & (ids < self.ntotal)]] = False
+        return keep
+
+    def search(self, query_vector: np.ndarray, k: int,
+               mask: Optional[np.ndarray] = None) -> Tuple[np.ndarray, np.ndarray]:
+        raise NotImplementedError
+
+    def search_batch(self, query_vectors: np.ndarray, k: int,
+                     mask: Optional[np.ndarray] = None) -> List[Tuple[np.ndarray, np.ndarray]]:
+        """
+        批量检索
+        :param query_vectors: 形状为 (查询数, 维度) 的查询矩阵
+        :return: 每个查询的 (文档下标数组, 分数数组)
+        """
+        query_vectors = np.asarray(query_vectors, dtype=np.float32)
+        query_vectors = query_vectors.reshape(len(query_vectors), -1)
+        return [self.search(query, k, mask=mask) for query in query_vectors]
+
+    def _get_state(self) -> Tuple[Dict[str, Any], Dict[str, np.ndarray]]:
+        """返回 (元信息, 数组) 用于持久化"""
+        return {}, {}
+
+    def _set_state(self, meta: Dict[str, Any], arrays: Dict[str, np.ndarray]) -> None:
+        pass
+
+    def save(self, path: Union[str, Path]) -> None:
+        """保存索引结构到 .npz 文件"""
+        meta, arrays = self._get_state()
+        meta.update({'index_type': self.index_type, 'metric': self.metric, 'ntotal': self.ntotal})
+        with open(path, 'wb') as f:
+            np.savez(f, meta=np.array(json.dumps(meta)), **arrays)
+
+    def load(self, path: Union[str, Path], store: Optional[VectorStore]) -> bool:
+        """
+        从 .npz 文件加载索引结构
+        :param path: 索引文件路径
+        :param store: 对应的向量存储
+        :return: 是否加载成功（类型、度量或向量数量不一致时返回 False，需要重建）
+        """
+        path = Path(path)
+        if not path.exists():
+            return False
+        try:
+            with np.load(path, allow_pickle=False) as data:
+                meta = json.loads(str(data['meta']))
+                arrays = {key: data[key] for key in data.files if key != 'meta'}
+        except Exception as e:
+            print(f"加载向量索引失败: {str(e)}")
+            return False
+
+        total = 0 if store is None else len(store)
+        if meta.get('index_type') != self.index_type or meta.get('metric') != self.metric or meta.get('ntotal') != total:
+            return False
+
+        self._attach(store)
+        try:
+            self._set_state(meta, arrays)
+        except (ValueError, RuntimeError) as e:
+            print(f"向量索引与当前配置不一致: {str(e)}")
+            return False
+        self.ntotal = total
+        return True
+
+
+class FlatIndex(BaseIndex):
+    """暴力检索索引：对全部向量计算相似度，结果精确"""
+
+    index_type = 'flat'
+
+    def build(self, store: Optional[VectorStore]) -> None:
+        self._attach(store)
+        self.ntotal = 0 if self.store is None else len(self.store)
+
+    def add(self, store: VectorStore) -> None:
+        self.build(store)
+
+    def update(self, store: VectorStore, ids: List[int]) -> None:
+        self.build(store)
+
+    def remove(self, store: VectorStore, ids: List[int]) -> None:
+        self.build(store)
+
+    def search(self, query_vector: np.ndarray, k: int,
+               mask: Optional[np.ndarray] = None) -> Tuple[np.ndarray, np.ndarray]:
+        if self.ntotal == 0:
+            return self._empty_result()
+        if mask is not None:
+            return self._search_ids(query_vector, self._allowed_ids(mask), k)
+        scores = self._scores(query_vector)
+        ids = top_k_indices(scores, k)
+        return ids, scores[ids]
+
+    def search_batch(self, query_vectors: np.ndarray, k: int,
+                     mask: Optional[np.ndarray] = None) -> List[Tuple[np.ndarray, np.ndarray]]:
+        """多个查询按块做矩阵-矩阵乘法，每块只保留各查询的前 k 个结果后合并"""
+        query_vectors = np.asarray(query_vectors, dtype=np.float32)
+        num_queries = len(query_vectors)
+        if self.ntotal == 0 or num_queries == 0:
+            return [self._empty_result() for _ in range(num_queries)]
+        ids = None if mask is None else self._allowed_ids(mask)
+        best_ids = np.zeros((num_queries, 0), dtype=np.int64)
+        best_scores = np.zeros((num_queries, 0), dtype=np.float32)
+        for rows, scores in self.store.iter_score_blocks(query_vectors, ids):
+            local = top_k_indices_2d(scores, k)
+            best_ids = np.concatenate([best_ids, rows[local]], axis=1)
+            best_scores = np.concatenate([best_scores, np.take_along_axis(scores, local, axis=1)], axis=1)
+            # 合并后再截断为前 k 个
+            keep = top_k_indices_2d(best_scores, k)
+            best_ids = np.take_along_axis(best_ids, keep, axis=1)
+            best_scores = np.take_along_axis(best_scores, keep, axis=1)
+        return [(best_ids[i], best_scores[i]) for i in range(num_queries)]
+
+
+class IVFIndex(BaseIndex):
+    """
+    倒排文件索引
+    - 使用 k-means 将向量划分到 nlist 个簇
+    - 查询时只扫描与查询最接近的 nprobe 个簇
+    - 向量数量不足以训练聚类时退化为暴力检索
+    - 追加、修改的行按已有聚类中心分配，删除的行从倒排表中移除，只在数据量增长 4 倍以上时重新训练
+    """
+
+    index_type = 'ivf'
+    # 每个聚类中心至少需要的训练样本数
+    MIN_POINTS_PER_CENTROID = 39
+    # 每个聚类中心最多使用的训练样本数
+    MAX_POINTS_PER_CENTROID = 256
+
+    def __init__(self, metric: str = 'cosine', nlist: int = 1024, nprobe: int = 16,
+                 train_iters: int = 10, seed: int = 42):
+        super().__init__(metric)
+        self.nlist = nlist
+        self.nprobe = nprobe
+        self.train_iters = train_iters
+        self.seed = seed
+        self.centroids = None
+        self.assignments = np.zeros(0, dtype=np.int32)
+        self.lists: List[np.ndarray] = []
+        self.trained_ntotal = 0
+
+    def _prepare(self, vectors: np.ndarray) -> np.ndarray:
+        """余弦度量下在单位球面上聚类"""
+        vectors = np.asarray(vectors, dtype=np.float32)
+        if self.metric == 'cosine' and not (self.store is not None and self.store.normalize):
+            norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+            vectors = vectors / np.maximum(norms, 1e-12)
+        return vectors
+
+    def _assign(self, vectors: np.ndarray, batch_size: int = 65536) -> np.ndarray:
+        """将向量分配到最近的聚类中心"""
+        assignments = np.empty(len(vectors), dtype=np.int32)
+        centroid_sq = (self.centroids ** 2).sum(axis=1)
+        for start in range(0, len(vectors), batch_size):
+            batch = self._prepare(vectors[start:start + batch_size])
+            if self.metric == 'cosine':
+                scores = batch @ self.centroids.T
+            else:
+                # argmin ||x-c||² 等价于 argmax (2x·c - ||c||²)
+                scores = 2 * batch @ self.centroids.T - centroid_sq
+            assignments[start:start + batch_size] = np.argmax(scores, axis=1)
+        return assignments
+
+    def _assign_all(self) -> np.ndarray:
+        """逐段分配全部向量，避免把所有段拼接到内存中"""
+        parts = [self._assign(vectors) for _, vectors, _ in self.store.iter_segments()]
+        return np.concatenate(parts) if parts else np.zeros(0, dtype=np.int32)
+
+    def _train(self, nlist: int) -> None:
+        """在采样的训练集上运行 k-means"""
+        rng = np.random.default_rng(self.seed)
+        n = len(self.store)
+        sample_size = min(n, nlist * self.MAX_POINTS_PER_CENTROID)
+        sample_ids = np.sort(rng.choice(n, sample_size, replace=False))
+        data = self._prepare(self.store.get(sample_ids))
+
+        self.centroids = data[rng.choice(sample_size, nlist, replace=False)].copy()
+        for _ in range(self.train_iters):
+            assign = self._assign(data)
+            sums = np.zeros_like(self.centroids)
+            np.add.at(sums, assign, data)
+            counts = np.bincount(assign, minlength=nlist)
+            non_empty = counts > 0
+            # 空簇保留原聚类中心
+            self.centroids[non_empty] = sums[non_empty] / counts[non_empty, None]
+            if self.metric == 'cosine':
+                centroid_norms = np.linalg.norm(self.centroids, axis=1, keepdims=True)
+                self.centroids = self.centroids / np.maximum(centroid_norms, 1e-12)
+
+    def _rebuild_lists(self) -> None:
+        """根据分配结果重建倒排表"""
+        nlist = len(self.centroids)
+        order = np.argsort(self.assignments, kind='stable')
+        counts = np.bincount(self.assignments, minlength=nlist)
+        self.lists = np.split(order.astype(np.int64), np.cumsum(counts)[:-1])
+
+    def build(self, store: Optional[VectorStore]) -> None:
+        self._attach(store)
+        self.ntotal = 0 if self.store is None else len(self.store)
+        self.centroids = None
+        self.assignments = np.zeros(0, dtype=np.int32)
+        self.lists = []
+        self.trained_ntotal = 0
+
+        nlist = min(self.nlist, self.ntotal // self.MIN_POINTS_PER_CENTROID)
+        if nlist <= 1:
+            # 数据量太小，直接暴力检索
+            return
+
+        self._train(nlist)
+        self.assignments = self._assign_all()
+        self._rebuild_lists()
+        self.trained_ntotal = self.ntotal
+
+    def add(self, store: VectorStore) -> None:
+        start = self.ntotal
+        self._attach(store)
+        self.ntotal = 0 if self.store is None else len(self.store)
+        if self.ntotal <= start:
+            return
+
+        # 未训练且数据量已足够，或数据量相比训练时增长过多，重新训练
+        if self.centroids is None or (len(self.centroids) < self.nlist and self.ntotal >= 4 * self.trained_ntotal):
+            self.build(store)
+            return
+
+        new_assignments = self._assign(self.store.get(np.arange(start, self.ntotal)))
+        self.assignments = np.concatenate([self.assignments, new_assignments])
+        self._rebuild_lists()
+
+    def update(self, store: VectorStore, ids: List[int]) -> None:
+        self._attach(store)
+        if self.centroids is None or len(ids) == 0:
+            return
+        ids = np.asarray(ids, dtype=np.int64)
+        self.assignments[ids] = self._assign(self.store.get(ids))
+        self._rebuild_lists()
+
+    def remove(self, store: VectorStore, ids: List[int]) -> None:
+        keep = self._kept_rows(ids)
+        self._attach(store)
+        total = 0 if self.store is None else len(self.store)
+        if self.centroids is None or total != int(keep.sum()):
+            # 未训练（暴力检索）或行数与索引不一致
+            self.build(store)
+            return
+        # 保留聚类中心，只去掉被删除行的分配结果
+        self.assignments = self.assignments[keep]
+        self.ntotal = total
+        self._rebuild_lists()
+
+    def search(self, query_vector: np.ndarray, k: int,
+               mask: Optional[np.ndarray] = None) -> Tuple[np.ndarray, np.ndarray]:
+        if self.ntotal == 0:
+            return self._empty_result()
+        allowed = None if mask is None else self._allowed_ids(mask)
+        # 未训练，或过滤后剩余行数不超过一次探测需要扫描的行数时，直接对剩余行精确检索
+        if self.centroids is None or (allowed is not None and
+                                      len(allowed) <= self.nprobe * self.ntotal / len(self.centroids)):
+            if allowed is not None:
+                return self._search_ids(query_vector, allowed, k)
+            scores = self._scores(query_vector)
+            ids = top_k_indices(scores, k)
+            return ids, scores[ids]
+
+        query = self._prepare(np.asarray(query_vector).reshape(1, -1))
+        if self.metric == 'cosine':
+            centroid_scores = (query @ self.centroids.T).reshape(-1)
+        else:
+            centroid_scores = -np.linalg.norm(self.centroids - query, axis=1)
+        probe = top_k_indices(centroid_scores, self.nprobe)
+        candidate_ids = np.concatenate([self.lists[p] for p in probe])
+        if mask is not None:
+            candidate_ids = candidate_ids[np.asarray(mask, dtype=bool)[candidate_ids]]
+            if len(candidate_ids) < k:
+                # 探测的簇中满足过滤条件的行不足 k 个
+                return self._search_ids(query_vector, allowed, k)
+        if len(candidate_ids) == 0:
+            return self._empty_result()
+
+        scores = self._scores(query_vector, candidate_ids)
+        order = top_k_indices(scores, k)
+        return candidate_ids[order], scores[order]
+
+    def _get_state(self) -> Tuple[Dict[str, Any], Dict[str, np.ndarray]]:
+        meta = {'nlist': self.nlist, 'trained_ntotal': self.trained_ntotal}
+        if self.centroids is None:
+            return meta, {}
+        return meta, {'centroids': self.centroids, 'assignments': self.assignments}
+
+    def _set_state(self, meta: Dict[str, Any], arrays: Dict[str, np.ndarray]) -> None:
+        self.trained_ntotal = meta.get('trained_ntotal', 0)
+        if 'centroids' in arrays:
+            self.centroids = arrays['centroids']
+            self.assignments = arrays['assignments']
+            self._rebuild_lists()
+        else:
+            self.centroids = None
+            self.assignments = np.zeros(0, dtype=np.int32)
+            self.lists = []
+
+
+class HNSWIndex(BaseIndex):
+    """
+    分层可导航小世界图索引（HNSW，NumPy 实现，默认使用）
+    - 每个节点随机分配层级，高层图稀疏用于快速定位，第 0 层包含全部节点
+    - 各层邻接表保存为定长的 int32 矩阵（空位为 -1），第 0 层按行号索引，高层经 行号 -> 槽位 映射索引
+    - 束搜索对多个查询同步进行：每一步取出各查询待扩展节点的全部邻居，一次收集向量、一次运算打分，
+      Python 层的循环次数只与扩展步数有关
+    - 追加的行按批插入：批内各行同时在已有图中搜索候选，并与同批行之间的精确近邻合并；
+      反向连接按目标节点分组后一次裁剪
+    - 邻居按启发式选择（优先保留方向不同的近邻），聚簇数据上的召回率不受批大小影响
+    - 修改过的行重新搜索并连接邻居；删除的行从图中摘除，其原邻居之间互相补连，其余节点按新行号重新编号，不重建整个图
+    """
+
+    index_type = 'hnsw'
+    # 每批插入的行数上限：批越大 Python 开销分摊越充分，批内节点之间按精确近邻连接
+    INSERT_BATCH = 256
+    # 启发式选择邻居时考察的候选数为保留邻居数的倍数
+    SELECT_FACTOR = 4
+    # 束搜索“已访问”位图等临时矩阵的元素数上限，超过时按查询分块
+    VISITED_BUDGET = 1 << 25
+
+    def __init__(self, metric: str = 'cosine', M: int = 16, ef_construction: int = 200,
+                 ef_search: int = 64, seed: int = 42):
+        super().__init__(metric)
+        self.M = M
+        self.M0 = 2 * M
+        self.ef_construction = ef_construction
+        self.ef_search = ef_search
+        self.seed = seed
+        self.level_mult = 1 / np.log(max(M, 2))
+        self._reset_graph()
+
+    def _reset_graph(self) -> None:
+        self.rng = np.random.default_rng(self.seed)
+        self.levels = np.zeros(0, dtype=np.int8)
+        # links[l]: 第 l 层的邻接矩阵，第 0 层的行即节点行号，高层的行为槽位
+        self.links: List[np.ndarray] = [np.full((0, self.M0), -1, dtype=np.int32)]
+        # slots[l]: 节点行号 -> 第 l 层的槽位（不在该层为 -1）；layer_nodes[l]: 槽位 -> 节点行号（第 0 层为 None）
+        self.slots: List[Optional[np.ndarray]] = [None]
+        self.layer_nodes: List[Optional[np.ndarray]] = [None]
+        self.layer_sizes: List[int] = [0]
+        self.entry_point = -1
+        self.max_level = -1
+
+    # ---------- 图结构 ----------
+
+    def _m_max(self, level: int) -> int:
+        return self.M0 if level == 0 else self.M
+
+    def _neighbors(self, level: int, nodes: np.ndarray) -> np.ndarray:
+        """节点在第 level 层的邻居矩阵 (节点数, m_max)，空位为 -1"""
+        if level == 0:
+            return self.links[0][nodes]
+        # 先取槽位映射再取邻接矩阵：并发检索时看到的新节点在两者中都已写入
+        slots = self.slots[level][nodes]
+        return self.links[level][slots]
+
+    def _set_neighbors(self, level: int, nodes: np.ndarray, neighbors: np.ndarray) -> None:
+        rows = nodes if level == 0 else self.slots[level][nodes]
+        block = np.full((len(rows), self._m_max(level)), -1, dtype=np.int32)
+        block[:, :neighbors.shape[1]] = neighbors
+        self.links[level][rows] = block
+
+    @staticmethod
+    def _grown(array: np.ndarray, size: int, fill: int = -1) -> np.ndarray:
+        """返回容量不小于 size 的数组（按倍数扩容，新增部分填充 fill）"""
+        if len(array) >= size:
+            return array
+        grown = np.full((max(size, 2 * len(array), 1024),) + array.shape[1:], fill, dtype=array.dtype)
+        grown[:len(array)] = array
+        return grown
+
+    def _reserve(self, total: int) -> None:
+        """为行号小于 total 的节点预留第 0 层邻接矩阵、层级与各层槽位映射的空间"""
+        self.links[0] = self._grown(self.links[0], total)
+        self.levels = self._grown(self.levels, total, fill=0)
+        for level in range(1, len(self.links)):
+            self.slots[level] = self._grown(self.slots[level], len(self.links[0]))
+
+    def _add_to_layer(self, level: int, nodes: np.ndarray) -> None:
+        """将节点加入第 level 层（level ≥ 1），邻居为空"""
+        while len(self.links) <= level:
+            self.links.append(np.full((0, self.M), -1, dtype=np.int32))
+            self.slots.append(np.full(len(self.links[0]), -1, dtype=np.int32))
+            self.layer_nodes.append(np.zeros(0, dtype=np.int64))
+            self.layer_sizes.append(0)
+        size = self.layer_sizes[level]
+        end = size + len(nodes)
+        self.links[level] = self._grown(self.links[level], end)
+        self.layer_nodes[level] = self._grown(self.layer_nodes[level], end)
+        self.layer_nodes[level][size:end] = nodes
+        self.slots[level][nodes] = np.arange(size, end, dtype=np.int32)
+        self.layer_sizes[level] = end
+
+    # ---------- 打分与候选集 ----------
+
+    def _pair_scores(self, queries: np.ndarray, ids: np.ndarray) -> np.ndarray:
+        """queries 的第 i 行与 ids 第 i 行中各节点的相似度，ids 中的 -1 得分为 -inf"""
+        scores = np.full(ids.shape, -np.inf, dtype=np.float32)
+        rows, cols = np.nonzero(ids >= 0)
+        if len(rows):
+            scores[rows, cols] = self.store.pair_scores(queries, rows, ids[rows, cols])
+        return scores
+
+    @staticmethod
+    def _drop_duplicates(ids: np.ndarray) -> np.ndarray:
+        """每行中重复出现的节点只保留第一次，其余置为 -1"""
+        order = np.argsort(ids, axis=1, kind='stable')
+        ordered = np.take_along_axis(ids, order, axis=1)
+        repeated = np.zeros(ids.shape, dtype=bool)
+        repeated[:, 1:] = ordered[:, 1:] == ordered[:, :-1]
+        duplicate = np.empty_like(repeated)
+        np.put_along_axis(duplicate, order, repeated, axis=1)
+        return np.where(duplicate, -1, ids)
+
+    @staticmethod
+    def _top(ids: np.ndarray, scores: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+        """每行取分数最高的 k 个，按分数降序"""
+        if ids.shape[1] > k:
+            part = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+            ids, scores = np.take_along_axis(ids, part, 1), np.take_along_axis(scores, part, 1)
+        order = np.argsort(-scores, axis=1, kind='stable')
+        return np.take_along_axis(ids, order, 1), np.take_along_axis(scores, order, 1)
+
+    def _select_neighbors(self, ids: np.ndarray, scores: np.ndarray, m: int) -> np.ndarray:
+        """
+        启发式选择邻居（HNSW 论文中的算法 4）：按与目标节点的相似度从高到低考察候选，
+        只保留与目标节点比与所有已选邻居都更相似的候选，使邻居分布在不同方向上，聚簇数据上仍能跨簇导航
+        :param ids: (目标数, 候选数) 候选节点，-1 为空位
+        :param scores: 候选与目标节点的相似度
+        :param m: 每个目标最多保留的邻居数
+        :return: (目标数, m) 选中的邻居，按相似度降序，空位为 -1
+        """
+        ids, scores = self._top(ids, scores, min(ids.shape[1], self.SELECT_FACTOR * m))
+        result = np.full((len(ids), m), -1, dtype=np.int64)
+        block = max(1, self.VISITED_BUDGET // max(ids.shape[1] ** 2, 1))
+        for start in range(0, len(ids), block):
+            part_ids, part_scores = ids[start:start + block], scores[start:start + block]
+            valid = part_scores > -np.inf
+            between = self.store.group_scores(np.maximum(part_ids, 0))
+            selected = np.zeros(part_ids.shape, dtype=bool)
+            count = np.zeros(len(part_ids), dtype=np.int64)
+            for column in range(part_ids.shape[1]):
+                # 与某个已选邻居比与目标节点更相似的候选被舍弃
+                dominated = (selected & (between[:, column, :] > part_scores[:, column:column + 1])).any(axis=1)
+                take = valid[:, column] & ~dominated & (count < m)
+                selected[:, column] = take
+                count += take
+            compact = np.argsort(~selected, axis=1, kind='stable')[:, :m]
+            chosen = np.take_along_axis(np.where(selected, part_ids, -1), compact, 1)
+            result[start:start + block, :chosen.shape[1]] = chosen
+        return result
+
+    def _search_layer(self, queries: np.ndarray, entry_points: np.ndarray, ef: int,
+                      level: int) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        在第 level 层对多个查询同步做束搜索
+        候选集只保留当前最好的 ef 个节点，每一步扩展各查询候选集中分数最高的若干个未扩展节点，
+        全部已扩展时结束（与逐个弹出候选、最好的候选不如结果集中最差者时停止的做法等价）
+        :param queries: (查询数, 维度)
+        :param entry_points: (查询数, 入口数) 入口节点，-1 为空位
+        :return: (节点, 分数)，形状均为 (查询数, ef)，按分数降序，不足 ef 个时以 -1 / -inf 补齐
+        """
+        entry_points = np.asarray(entry_points, dtype=np.int64).reshape(len(queries), -1)
+        capacity = len(self.links[0])
+        block = max(1, self.VISITED_BUDGET // max(capacity, 1))
+        if len(queries) > block:
+            parts = [self._search_layer(queries[i:i + block], entry_points[i:i + block], ef, level)
+                     for i in range(0, len(queries), block)]
+            return np.concatenate([p[0] for p in parts]), np.concatenate([p[1] for p in parts])
+
+        num = len(queries)
+        # 候选集较大时每步扩展多个节点，减少步数（扩展的节点都在候选集内，不降低召回）
+        width = max(1, min(16, ef // 8))
+        ids = np.full((num, ef), -1, dtype=np.int64)
+        scores = np.full((num, ef), -np.inf, dtype=np.float32)
+        expanded = np.ones((num, ef), dtype=bool)
+        visited = np.zeros((num, capacity), dtype=bool)
+        self._merge_candidates(queries, ids, scores, expanded, visited, np.arange(num), entry_points, ef)
+        while True:
+            pending = np.where(expanded, -np.inf, scores)
+            if width == 1:
+                best = pending.argmax(axis=1)[:, None]
+            else:
+                best = np.argpartition(-pending, width - 1, axis=1)[:, :width]
+            picked = np.take_along_axis(pending, best, 1) > -np.inf
+            rows = np.flatnonzero(picked.any(axis=1))
+            if len(rows) == 0:
+                break
+            best, picked = best[rows], picked[rows]
+            expanded[rows[:, None], best] |= picked
+            nodes = ids[rows[:, None], best]
+            neighbors = self._neighbors(level, np.maximum(nodes, 0).reshape(-1)).reshape(len(rows), -1)
+            neighbors = np.where(np.repeat(picked, neighbors.shape[1] // width, axis=1), neighbors, -1)
+            self._merge_candidates(queries, ids, scores, expanded, visited, rows, neighbors.astype(np.int64), ef)
+        return self._top(ids, scores, ef)
+
+    def _merge_candidates(self, queries: np.ndarray, ids: np.ndarray, scores: np.ndarray, expanded: np.ndarray,
+                          visited: np.ndarray, rows: np.ndarray, candidates: np.ndarray, ef: int) -> None:
+        """将未访问过的节点打分后并入指定查询的候选集，只保留最好的 ef 个"""
+        # 展平为 (查询, 节点) 对，去掉空位、已访问的节点与同一查询中重复的节点
+        owners = np.repeat(rows, candidates.shape[1])
+        nodes = candidates.reshape(-1)
+        keep = np.flatnonzero(nodes >= 0)
+        keep = keep[~visited[owners[keep], nodes[keep]]]
+        if len(keep) == 0:
+            return
+        keys = owners[keep] * visited.shape[1] + nodes[keep]
+        keep = keep[np.unique(keys, return_index=True)[1]]
+        owners, nodes = owners[keep], nodes[keep]
+        visited[owners, nodes] = True
+        node_scores = self.store.pair_scores(queries, owners, nodes).astype(np.float32)
+        # 不优于候选集中最差者的节点不会进入候选集
+        better = node_scores > scores[owners].min(axis=1)
+        if not better.any():
+            return
+        owners, nodes, node_scores = owners[better], nodes[better], node_scores[better]
+
+        # 按查询排成矩阵（keys 已按查询排序），与原候选集合并后保留最好的 ef 个
+        rows, starts, counts = np.unique(owners, return_index=True, return_counts=True)
+        positions = np.arange(len(owners)) - np.repeat(starts, counts)
+        group = np.repeat(np.arange(len(rows)), counts)
+        width = int(counts.max())
+        new_ids = np.full((len(rows), width), -1, dtype=np.int64)
+        new_scores = np.full((len(rows), width), -np.inf, dtype=np.float32)
+        new_ids[group, positions] = nodes
+        new_scores[group, positions] = node_scores
+        merged_ids = np.concatenate([ids[rows], new_ids], axis=1)
+        merged_scores = np.concatenate([scores[rows], new_scores], axis=1)
+        merged_expanded = np.concatenate([expanded[rows], new_ids < 0], axis=1)
+        part = np.argpartition(-merged_scores, ef - 1, axis=1)[:, :ef]
+        index = np.arange(len(rows))[:, None]
+        ids[rows] = merged_ids[index, part]
+        scores[rows] = merged_scores[index, part]
+        expanded[rows] = merged_expanded[index, part]
+
+    def _search_graph(self, queries: np.ndarray, ef: int) -> Tuple[np.ndarray, np.ndarray]:
+        """自顶向下贪心定位，在第 0 层以 ef 大小的候选集束搜索"""
+        max_level = self.max_level
+        entry = np.full((len(queries), 1), self.entry_point, dtype=np.int64)
+        for level in range(max_level, 0, -1):
+            entry = self._search_layer(queries, entry, 1, level)[0]
+        return self._search_layer(queries, entry, ef, 0)
+
+    # ---------- 插入与连接 ----------
+
+    def _add_links(self, level: int, targets: np.ndarray, sources: np.ndarray) -> None:
+        """
+        为 targets[i] 增加指向 sources[i] 的边（已存在的边跳过），
+        邻居数超过上限时按启发式重新选择 m_max 个
+        """
+        keep = (targets >= 0) & (sources >= 0) & (targets != sources)
+        targets, sources = targets[keep], sources[keep]
+        if len(targets) == 0:
+            return
+        m_max = self._m_max(level)
+        order = np.argsort(targets, kind='stable')
+        targets, sources = targets[order], sources[order]
+        nodes, starts, counts = np.unique(targets, return_index=True, return_counts=True)
+        incoming = np.full((len(nodes), counts.max()), -1, dtype=np.int64)
+        incoming[np.repeat(np.arange(len(nodes)), counts), np.arange(len(targets)) - np.repeat(starts, counts)] = sources
+        merged = self._drop_duplicates(np.concatenate([self._neighbors(level, nodes).astype(np.int64), incoming], axis=1))
+
+        # 未超限的行去掉空位后左对齐；超限的行按与目标节点的相似度保留 m_max 个
+        over = (merged >= 0).sum(axis=1) > m_max
+        compact = np.argsort(merged < 0, axis=1, kind='stable')[:, :m_max]
+        result = np.take_along_axis(merged, compact, 1)
+        if over.any():
+            rows = np.flatnonzero(over)
+            scores = self._pair_scores(self.store.get(nodes[rows]), merged[rows])
+            result[rows] = self._select_neighbors(merged[rows], scores, m_max)
+        self._set_neighbors(level, nodes, result)
+
+    def _connect(self, nodes: np.ndarray, levels: np.ndarray) -> None:
+        """
+        为一批节点在其所在的各层搜索近邻并双向连接（节点已在图中时替换其邻居）
+        :param nodes: 节点行号
+        :param levels: 各节点的层级
+        """
+        queries = self.store.get(nodes)
+        # 同批节点之间的精确相似度：新插入的节点在图中还找不到彼此
+        peer_scores = self.store.scores_batch(queries, nodes).astype(np.float32)
+        np.fill_diagonal(peer_scores, -np.inf)
+        entry_point, max_level = self.entry_point, self.max_level
+        entry = np.full((len(nodes), 1), entry_point, dtype=np.int64)
+        ef = self.ef_construction + 1
+        for level in range(max(max_level, int(levels.max())), -1, -1):
+            rows = np.flatnonzero(levels >= level)
+            found_ids = np.zeros((len(rows), 0), dtype=np.int64)
+            found_scores = np.zeros((len(rows), 0), dtype=np.float32)
+            if entry_point >= 0 and level <= max_level:
+                descend = np.flatnonzero(levels < level)
+                if len(descend):
+                    entry[descend] = self._search_layer(queries[descend], entry[descend], 1, level)[0]
+                if len(rows):
+                    found_ids, found_scores = self._search_layer(queries[rows], entry[rows], ef, level)
+                    entry[rows] = found_ids[:, :1]
+            if len(rows) == 0:
+                continue
+            # 合并图中搜索到的候选与同层的同批节点，排除节点自身
+            peers = nodes[rows]
+            candidate_ids = np.concatenate([found_ids, np.broadcast_to(peers, (len(rows), len(rows)))], axis=1)
+            candidate_ids = self._drop_duplicates(np.where(candidate_ids == peers[:, None], -1, candidate_ids))
+            candidate_scores = np.concatenate([found_scores, peer_scores[rows][:, rows]], axis=1)
+            candidate_scores = np.where(candidate_ids >= 0, candidate_scores, -np.inf)
+            neighbors = self._select_neighbors(candidate_ids, candidate_scores, self.M)
+            self._set_neighbors(level, peers, neighbors)
+            self._add_links(level, neighbors.reshape(-1), np.repeat(peers, neighbors.shape[1]))
+
+    def _insert(self, nodes: np.ndarray) -> None:
+        """插入一批新节点（行号连续且大于已有节点）"""
+        levels = np.minimum(-np.log(np.maximum(self.rng.random(len(nodes)), 1e-12)) * self.level_mult, 127).astype(np.int64)
+        self.levels[nodes] = levels
+        for level in range(1, int(levels.max()) + 1):
+            self._add_to_layer(level, nodes[levels >= level])
+        self._connect(nodes, levels)
+        top = int(levels.argmax())
+        if levels[top] > self.max_level:
+            # 先更新入口节点再更新层数：并发检索读到新层数时入口节点已在该层
+            self.entry_point = int(nodes[top])
+            self.max_level = int(levels[top])
+
+    def build(self, store: Optional[VectorStore]) -> None:
+        self._reset_graph()
+        self._attach(store)
+        self.ntotal = 0
+        self.add(store)
+
+    def add(self, store: VectorStore) -> None:
+        start = self.ntotal
+        self._attach(store)
+        total = 0 if self.store is None else len(self.store)
+        self._reserve(total)
+        node = start
+        while node < total:
+            # 图中节点较少时批内节点主要靠精确近邻互连，批大小随已有节点数增长
+            size = min(self.INSERT_BATCH, total - node, max(node, 1))
+            self._insert(np.arange(node, node + size))
+            node += size
+            self.ntotal = node
+        self.ntotal = max(total, start)
+
+    def update(self, store: VectorStore, ids: List[int]) -> None:
+        self._attach(store)
+        if self.entry_point < 0:
+            return
+        # 向量变化的节点按新向量重新搜索近邻并连接，指向它的旧边保留用于导航
+        nodes = np.unique(np.asarray(ids, dtype=np.int64))
+        nodes = nodes[(nodes >= 0) & (nodes < self.ntotal)]
+        for start in range(0, len(nodes), self.INSERT_BATCH):
+            batch = nodes[start:start + self.INSERT_BATCH]
+            self._connect(batch, self.levels[batch].astype(np.int64))
+
+    def remove(self, store: VectorStore, ids: List[int]) -> None:
+        keep = self._kept_rows(ids)
+        self._attach(store)
+        total = 0 if self.store is None else len(self.store)
+        if self.entry_point < 0 or total == 0 or total != int(keep.sum()):
+            self.build(store)
+            return
+        # 旧节点号 -> 新节点号，被删除的节点为 -1（末尾多一个 -1，使空位 -1 映射为 -1）
+        remap = np.append(np.where(keep, np.cumsum(keep) - 1, -1), -1)
+        links, slots, layer_nodes, layer_sizes, repairs = [], [], [], [], []
+        for level in range(len(self.links)):
+            if level == 0:
+                nodes = np.arange(self.ntotal)
+            else:
+                nodes = self.layer_nodes[level][:self.layer_sizes[level]]
+            neighbors = remap[self.links[level][:len(nodes)]]
+            alive = keep[nodes]
+            if not alive.any():
+                break
+            # 被删除节点的各个邻居之间互相补连，避免图在删除处断开
+            dead = neighbors[~alive]
+            for start in range(0, len(dead), 4096):
+                block = dead[start:start + 4096]
+                targets = np.repeat(block, block.shape[1], axis=1).reshape(-1)
+                sources = np.tile(block, (1, block.shape[1])).reshape(-1)
+                repairs.append((level, targets, sources))
+            neighbors = neighbors[alive]
+            compact = np.argsort(neighbors < 0, axis=1, kind='stable')
+            links.append(np.take_along_axis(neighbors, compact, 1).astype(np.int32))
+            if level == 0:
+                slots.append(None)
+                layer_nodes.append(None)
+            else:
+                kept_nodes = remap[nodes[alive]]
+                level_slots = np.full(total, -1, dtype=np.int32)
+                level_slots[kept_nodes] = np.arange(len(kept_nodes), dtype=np.int32)
+                slots.append(level_slots)
+                layer_nodes.append(kept_nodes)
+            layer_sizes.append(int(alive.sum()))
+
+        levels = self.levels[:self.ntotal][keep]
+        entry_point = int(remap[self.entry_point])
+        if entry_point < 0:
+            entry_point = int(np.argmax(levels))
+        self.links, self.slots, self.layer_nodes, self.layer_sizes = links, slots, layer_nodes, layer_sizes
+        self.levels = levels
+        self.entry_point = entry_point
+        self.max_level = len(links) - 1
+        self.ntotal = total
+        for level, targets, sources in repairs:
+            self._add_links(level, targets, sources)
+
+    # ---------- 检索 ----------
+
+    def search(self, query_vector: np.ndarray, k: int,
+               mask: Optional[np.ndarray] = None) -> Tuple[np.ndarray, np.ndarray]:
+        return self.search_batch(np.asarray(query_vector, dtype=np.float32).reshape(1, -1), k, mask=mask)[0]
+
+    def search_batch(self, query_vectors: np.ndarray, k: int,
+                     mask: Optional[np.ndarray] = None) -> List[Tuple[np.ndarray, np.ndarray]]:
+        queries = np.asarray(query_vectors, dtype=np.float32)
+        queries = queries.reshape(len(queries), -1)
+        if self.ntotal == 0:
+            return [self._empty_result() for _ in queries]
+        ef = max(self.ef_search, k)
+        allowed_rows = None
+        if mask is not None:
+            allowed = self._allowed_ids(mask)
+            # 过滤后剩余行较少时图搜索的候选大多被过滤掉，直接精确检索
+            if len(allowed) <= max(ef * 4, self.ntotal // 10):
+                return [self._search_ids(query, allowed, k) for query in queries]
+            # 按过滤比例放大候选集，再只保留满足条件的节点
+            ef = min(self.ntotal, int(ef * self.ntotal / len(allowed)) + 1)
+            allowed_rows = np.zeros(self.ntotal, dtype=bool)
+            allowed_rows[allowed] = True
+        ids, scores = self._search_graph(queries, ef)
+        results = []
+        for query, row_ids, row_scores in zip(queries, ids, scores):
+            keep = row_ids >= 0
+            if allowed_rows is not None:
+                keep &= allowed_rows[np.maximum(row_ids, 0)]
+            row_ids, row_scores = row_ids[keep], row_scores[keep]
+            if allowed_rows is not None and len(row_ids) < k:
+                results.append(self._search_ids(query, allowed, k))
+                continue
+            results.append((row_ids[:k], row_scores[:k]))
+        return results
+
+    # ---------- 持久化 ----------
+
+    def _get_state(self) -> Tuple[Dict[str, Any], Dict[str, np.ndarray]]:
+        meta = {
+            'M': self.M,
+            'entry_point': int(self.entry_point),
+            'max_level': int(self.max_level),
+            'num_layers': len(self.links) if self.ntotal else 0,
+        }
+        arrays = {'node_levels': self.levels[:self.ntotal].astype(np.int8)}
+        for level in range(meta['num_layers']):
+            if level == 0:
+                nodes = np.arange(self.ntotal, dtype=np.int64)
+            else:
+                nodes = self.layer_nodes[level][:self.layer_sizes[level]].astype(np.int64)
+            arrays[f'layer{level}_nodes'] = nodes
+            arrays[f'layer{level}_neighbors'] = self.links[level][:len(nodes)].astype(np.int64)
+        return meta, arrays
+
+    def _set_state(self, meta: Dict[str, Any], arrays: Dict[str, np.ndarray]) -> None:
+        self._reset_graph()
+        if meta.get('M', self.M) != self.M:
+            raise ValueError("HNSW 参数 M 与索引文件不一致")
+        total = len(arrays['node_levels'])
+        self.levels = arrays['node_levels'].astype(np.int8)
+        self.links[0] = np.full((total, self.M0), -1, dtype=np.int32)
+        for level in range(meta['num_layers']):
+            nodes = arrays[f'layer{level}_nodes'].astype(np.int64)
+            neighbors = arrays[f'layer{level}_neighbors']
+            if level > 0:
+                self._add_to_layer(level, nodes)
+            self._set_neighbors(level, nodes, neighbors[:, :self._m_max(level)])
+        self.entry_point = meta['entry_point']
+        self.max_level = meta['max_level']
+        # 保证后续插入的随机层级序列可复现
+        self.rng = np.random.default_rng(self.seed + total)
+
+
+class HnswlibIndex(BaseIndex):
+    """
+    基于 hnswlib（C++ 实现）的 HNSW 图索引，hnsw 类型配置 backend: hnswlib 时使用
+    - 图中节点以标签标识，row_labels 记录每行对应的标签：删除的行只在图中标记删除（墓碑），
+      其后的行号前移时只更新映射，不修改图；标记删除的位置由之后插入的节点复用
+    - 修改过的向量按原标签原地更新，追加的行直接插入
+    - 图扩容时不能并发查询，对图的读写在锁内进行；候选结果用向量存储中的全精度向量重新打分
+    """
+
+    index_type = 'hnswlib'
+    # 每次写入图的最多行数
+    BLOCK_ROWS = 65536
+
+    def __init__(self, metric: str = 'cosine', M: int = 16, ef_construction: int = 200,
+                 ef_search: int = 64, seed: int = 42):
+        if hnswlib is None:
+            raise ImportError("hnswlib 索引需要安装 hnswlib：pip install hnswlib")
+        super().__init__(metric)
+        self.M = M
+        self.ef_construction = ef_construction
+        self.ef_search = ef_search
+        self.seed = seed
+        self._lock = threading.Lock()
+        self._graph_path: Optional[Path] = None
+        self._reset_graph()
+        register_after_fork(self)
+
+    def _after_fork(self) -> None:
+        self._lock = threading.Lock()
+
+    def _reset_graph(self) -> None:
+        self.graph = None
+        # 行号 -> 标签，标签 -> 行号（已删除为 -1）
+        self.row_labels = np.zeros(0, dtype=np.int64)
+        self.label_rows = np.zeros(0, dtype=np.int64)
+
+    def _space(self) -> str:
+        if self.metric == 'l2':
+            return 'l2'
+        # 向量存储已归一化时余弦相似度即内积
+        return 'ip' if self.store.normalize else 'cosine'
+
+    def _new_graph(self, capacity: int):
+        graph = hnswlib.Index(space=self._space(), dim=self.store.dimension)
+        graph.init_index(max_elements=max(int(capacity), 1024), ef_construction=self.ef_construction, M=self.M,
+                         random_seed=self.seed, allow_replace_deleted=True)
+        graph.set_ef(self.ef_search)
+        return graph
+
+    def _insert_rows(self, rows: np.ndarray) -> np.ndarray:
+        """将指定行以新标签插入图（容量不足时按倍数扩容），返回分配的标签"""
+        if self.graph is None:
+            self.graph = self._new_graph(len(rows))
+        needed = self.graph.get_current_count() + len(rows)
+        if needed > self.graph.get_max_elements():
+            self.graph.resize_index(max(needed, 2 * self.graph.get_max_elements()))
+        labels = np.arange(len(self.label_rows), len(self.label_rows) + len(rows), dtype=np.int64)
+        for start in range(0, len(rows), self.BLOCK_ROWS):
+            block = slice(start, start + self.BLOCK_ROWS)
+            self.graph.add_items(self.store.get(rows[block]), labels[block], replace_deleted=True)
+        self.label_rows = np.concatenate([self.label_rows, rows])
+        return labels
+
+    def _build(self, store: Optional[VectorStore]) -> None:
+        self._attach(store)
+        self._reset_graph()
+        self.ntotal = 0 if self.store is None else len(self.store)
+        if self.ntotal > 0:
+            self.row_labels = self._insert_rows(np.arange(self.ntotal, dtype=np.int64))
+
+    def build(self, store: Optional[VectorStore]) -> None:
+        with self._lock:
+            self._build(store)
+
+    def add(self, store: VectorStore) -> None:
+        with self._lock:
+            start = self.ntotal
+            self._attach(store)
+            total = 0 if self.store is None else len(self.store)
+            if total <= start:
+                return
+            labels = self._insert_rows(np.arange(start, total, dtype=np.int64))
+            self.row_labels = np.concatenate([self.row_labels, labels])
+            self.ntotal = total
+
+    def update(self, store: VectorStore, ids: List[int]) -> None:
+        with self._lock:
+            self._attach(store)
+            ids = np.unique(np.asarray(ids, dtype=np.int64))
+            ids = ids[(ids >= 0) & (ids < self.ntotal)]
+            if self.graph is None or len(ids) == 0:
+                return
+            # 已存在的标签再次写入时，hnswlib 原地更新向量并重新连接邻居
+            for start in range(0, len(ids), self.BLOCK_ROWS):
+                block = ids[start:start + self.BLOCK_ROWS]
+                self.graph.add_items(self.store.get(block), self.row_labels[block])
+
+    def remove(self, store: VectorStore, ids: List[int]) -> None:
+        with self._lock:
+            keep = self._kept_rows(ids)
+            self._attach(store)
+            total = 0 if self.store is None else len(self.store)
+            if self.graph is None or total == 0 or total != int(keep.sum()):
+                self._build(store)
+                return
+            removed = self.row_labels[~keep]
+            for label in removed.tolist():
+                self.graph.mark_deleted(label)
+            self.label_rows[removed] = -1
+            self.row_labels = self.row_labels[keep]
+            self.label_rows[self.row_labels] = np.arange(total, dtype=np.int64)
+            self.ntotal = total
+
+    def search(self, query_vector: np.ndarray, k: int,
+               mask: Optional[np.ndarray] = None) -> Tuple[np.ndarray, np.ndarray]:
+        if self.ntotal == 0:
+            return self._empty_result()
+        ef = max(self.ef_search, k)
+        allowed = None
+        if mask is not None:
+            allowed = self._allowed_ids(mask)
+            # 过滤后剩余行较少时图搜索的候选大多被过滤掉，直接精确检索
+            if len(allowed) <= max(ef * 4, self.ntotal // 10):
+                return self._search_ids(query_vector, allowed, k)
+            # 按过滤比例放大候选集，再只保留满足条件的节点
+            ef = int(ef * self.ntotal / len(allowed)) + 1
+        query = np.asarray(query_vector, dtype=np.float32).reshape(1, -1)
+        try:
+            with self._lock:
+                # 取回的结果数大于 ef_search 时 hnswlib 以结果数作为候选集大小
+                labels, _ = self.graph.knn_query(query, k=min(ef, self.ntotal), num_threads=1)
+                rows = self.label_rows[labels[0].astype(np.int64)]
+        except RuntimeError:
+            # 大量删除后图中可达的节点偶尔不足，退回精确检索
+            rows = np.arange(self.ntotal, dtype=np.int64) if allowed is None else allowed
+        rows = rows[rows >= 0]
+        if mask is not None:
+            rows = rows[np.asarray(mask, dtype=bool)[rows]]
+            if len(rows) < k:
+                return self._search_ids(query_vector, allowed, k)
+        # 用全精度向量重新打分，分数与其他索引一致
+        return self._search_ids(query_vector, rows, k)
+
+    @staticmethod
+    def _graph_file(path: Union[str, Path]) -> Path:
+        """图结构保存在索引文件旁的 .hnswlib 文件中"""
+        return Path(path).with_suffix('.hnswlib')
+
+    def save(self, path: Union[str, Path]) -> None:
+        with self._lock:
+            super().save(path)
+            if self.graph is not None:
+                graph_file = self._graph_file(path)
+                tmp_file = graph_file.with_suffix('.hnswlib.tmp')
+                self.graph.save_index(str(tmp_file))
+                os.replace(tmp_file, graph_file)
+
+    def load(self, path: Union[str, Path], store: Optional[VectorStore]) -> bool:
+        self._graph_path = self._graph_file(path)
+        if not self._graph_path.exists():
+            return False
+        with self._lock:
+            return super().load(path, store)
+
+    def _get_state(self) -> Tuple[Dict[str, Any], Dict[str, np.ndarray]]:
+        meta = {'M': self.M, 'space': self._space()}
+        return meta, {'row_labels': self.row_labels, 'label_rows': self.label_rows}
+
+    def _set_state(self, meta: Dict[str, Any], arrays: Dict[str, np.ndarray]) -> None:
+        if meta.get('M') != self.M or meta.get('space') != self._space():
+            raise ValueError("HNSW 参数 M 或相似度空间与索引文件不一致")
+        graph = hnswlib.Index(space=meta['space'], dim=self.store.dimension)
+        graph.load_index(str(self._graph_path), allow_replace_deleted=True)
+        graph.set_ef(self.ef_search)
+        self.graph = graph
+        self.row_labels = arrays['row_labels']
+        self.label_rows = arrays['label_rows']
+
+
+# 索引类型注册表
+INDEX_TYPES = {
+    'flat': FlatIndex,
+    'ivf': IVFIndex,
+    'hnsw': HNSWIndex,
+    'hnswlib': HnswlibIndex,
+}
+
+# 量化索引依赖 BaseIndex，在其定义之后导入并注册
+from .quantization import PQIndex, SQ8Index  # noqa: E402
+
+INDEX_TYPES.update({'sq8': SQ8Index, 'pq': PQIndex})
+
+
+def create_index(index_type: str, metric: str = 'cosine', params: Dict[str, Any] = None) -> BaseIndex:
+    """
+    根据配置创建向量索引
+    :param index_type: 索引类型（flat/ivf/hnsw/sq8/pq）
+    :param metric: 相似度度量（cosine/l2）
+    :param params: 索引参数，如 ivf 的 nlist/nprobe，hnsw 的 M/ef_construction/ef_search/backend，pq 的 m/rescore_factor
+    :return: 索引实例
+    """
+    index_type = str(index_type).lower()
+    params = dict(params or {})
+    if index_type == 'hnsw':
+        # backend: python 为 NumPy 实现（默认），hnswlib 需显式配置并安装 hnswlib
+        backend = str(params.pop('backend', 'python')).lower()
+        if backend == 'hnswlib':
+            index_type = 'hnswlib'
+        elif backend != 'python':
+            raise ValueError(f"不支持的 HNSW 实现：{backend}（可选 python/hnswlib）")
+    index_cls = INDEX_TYPES.get(index_type)
+    if index_cls is None:
+        raise ValueError(f"不支持的向量索引类型：{index_type}")
+    return index_cls(metric=metric, **params)
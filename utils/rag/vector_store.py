@@ -0,0 +1,601 @@
+"""
+向量存储模块
+- 向量以 float32 保存在只追加的段文件（.npy）中，通过 np.memmap 打开，启动时无需把全部向量读入内存
+- manifest.json 记录段列表，新增文档只写一个新段，代价与新增块数成正比
+- 小段数量过多时在后台线程中合并（compaction）
+- normalize=True 时写入前归一化为单位向量，余弦相似度退化为一次矩阵向量乘法
+- 每个段同时保存向量模长，查询时不再重复计算
+- 多进程共用同一目录时，写入由调用方传入的跨进程锁串行化；通过段清单的文件状态判断其他进程是否写入过，
+  reload() 重新打开段清单（已打开的段复用原映射）
+"""
+import json
+import os
+import threading
+import time
+import uuid
+import numpy as np
+from pathlib import Path
+from typing import Iterator, List, Optional, Tuple, Union
+from utils.fork_safety import register_after_fork
+
+
+def cosine_similarity(query_vector: np.ndarray, doc_vectors: np.ndarray, doc_norms: np.ndarray = None) -> np.ndarray:
+    """
+    计算余弦相似度 - 向量化计算
+
+    余弦相似度计算公式:
+    cos(θ) = (A·B) / (|A|·|B|)
+    其中,A和B是两个向量,A·B是它们的点积,|A|和|B|是它们的模。
+
+    参数:
+        query_vector: 查询向量，形状为 (embedding_dim,) 或 (1, embedding_dim)
+        doc_vectors: 文档向量，形状为 (num_docs, embedding_dim)
+        doc_norms: 文档向量的模长，为 None 时表示文档向量已归一化
+    返回:
+        一维numpy数组，包含所有文档的相似度分数
+    """
+    query_vector = np.asarray(query_vector, dtype=np.float32).reshape(-1)
+    query_vector = query_vector / max(float(np.linalg.norm(query_vector)), 1e-12)
+    similarities = doc_vectors @ query_vector
+    if doc_norms is not None:
+        similarities = similarities / np.maximum(doc_norms, 1e-12)
+    return similarities
+
+
+def l2_similarity(query_vector: np.ndarray, doc_vectors: np.ndarray, doc_sq_norms: np.ndarray = None) -> np.ndarray:
+    """
+    计算L2相似度（欧氏距离）- 向量化计算
+
+    L2相似度计算公式:
+    d(A,B) = sqrt(|A|² - 2A·B + |B|²)
+
+    由于欧氏距离越小表示越相似，为了保持与余弦相似度一致（值越大越相似），这里对距离取负值
+
+    参数:
+        query_vector: 查询向量，形状为 (embedding_dim,) 或 (1, embedding_dim)
+        doc_vectors: 文档向量，形状为 (num_docs, embedding_dim)
+        doc_sq_norms: 可选，文档向量模长的平方
+    返回:
+        一维numpy数组，包含所有文档的相似度分数（值越大越相似）
+    """
+    query_vector = np.asarray(query_vector, dtype=np.float32).reshape(-1)
+    if doc_sq_norms is None:
+        doc_sq_norms = np.einsum('ij,ij->i', doc_vectors, doc_vectors)
+    sq_distances = doc_sq_norms - 2 * (doc_vectors @ query_vector) + float(query_vector @ query_vector)
+    return -np.sqrt(np.maximum(sq_distances, 0))
+
+
+class _Segment:
+    """一个只读追加的向量段：向量与模长均以 memmap 方式打开"""
+
+    __slots__ = ('name', 'vectors', 'norms')
+
+    def __init__(self, name: str, vectors: np.ndarray, norms: np.ndarray):
+        self.name = name
+        self.vectors = vectors
+        self.norms = norms
+
+    def __len__(self) -> int:
+        return len(self.norms)
+
+
+class VectorStore:
+    """
+    分段文档向量存储
+    - 逻辑行号为各段按顺序拼接后的行号，第 i 行向量对应 Rag.docs 中的第 i 个文档块
+    - add 写入新段；update 原地写入 memmap；remove 只重写受影响的段
+    - 查询通过 (段列表, 偏移量) 快照进行，读取时无需加锁
+    """
+
+    MANIFEST_NAME = 'manifest.json'
+    # 清理孤立段文件时跳过最近写入的文件（可能是其他进程正在合并、尚未写入段清单的段）
+    ORPHAN_GRACE_SECONDS = 600
+
+    def __init__(self, path: Union[str, Path], dimension: int, metric: str = 'cosine', normalize: bool = True,
+                 legacy_path: Union[str, Path] = None, target_rows: int = 65536, compaction_trigger: int = 8,
+                 lock=None):
+        """
+        :param path: 段文件目录
+        :param dimension: 向量维度
+        :param metric: 相似度度量（cosine/l2）
+        :param normalize: 是否将向量归一化为单位向量
+        :param legacy_path: 旧版单文件向量（doc_vectors.npy）路径，首次加载时自动迁移
+        :param target_rows: 合并后单个段的目标行数
+        :param compaction_trigger: 小段数量达到该值时触发后台合并
+        :param lock: 可选，写入使用的锁（多进程共用目录时传入跨进程锁 ProcessLock），默认为进程内可重入锁
+        """
+        if metric not in ('cosine', 'l2'):
+            raise ValueError(f"不支持的相似度度量：{metric}")
+        self.path = Path(path)
+        self.path.mkdir(parents=True, exist_ok=True)
+        self.legacy_path = Path(legacy_path) if legacy_path else None
+        self.dimension = dimension
+        self.metric = metric
+        self.normalize = normalize
+        self.target_rows = target_rows
+        self.compaction_trigger = compaction_trigger
+
+        self._owns_lock = lock is None
+        self._lock = threading.RLock() if lock is None else lock
+        self._compaction_thread: Optional[threading.Thread] = None
+        self._next_segment_id = 0
+        # update/remove 的次数，用于判断后台合并期间数据是否被修改
+        self._version = 0
+        # 本进程最后一次读写段清单时的文件状态
+        self._manifest_stamp = None
+        self._set_segments([])
+        register_after_fork(self)
+
+    def _after_fork(self) -> None:
+        # 后台合并线程不在子进程中
+        self._compaction_thread = None
+        if self._owns_lock:
+            self._lock = threading.RLock()
+
+    # ---------- 段布局 ----------
+
+    def _set_segments(self, segments: List[_Segment]) -> None:
+        """原子替换段列表及其起始偏移量"""
+        offsets = np.zeros(len(segments) + 1, dtype=np.int64)
+        if segments:
+            offsets[1:] = np.cumsum([len(seg) for seg in segments])
+        self._segments = segments
+        self._layout = (segments, offsets)
+
+    def __len__(self) -> int:
+        return int(self._layout[1][-1])
+
+    @property
+    def num_segments(self) -> int:
+        return len(self._segments)
+
+    def iter_segments(self) -> Iterator[Tuple[int, np.ndarray, np.ndarray]]:
+        """按顺序遍历 (起始行号, 向量, 模长)"""
+        segments, offsets = self._layout
+        for segment, offset in zip(segments, offsets):
+            yield int(offset), segment.vectors, segment.norms
+
+    @property
+    def vectors(self) -> np.ndarray:
+        """全部向量（多段时会拼接成一个新的内存矩阵，大规模数据请使用 iter_segments/get）"""
+        segments = self._layout[0]
+        if not segments:
+            return np.zeros((0, self.dimension), dtype=np.float32)
+        if len(segments) == 1:
+            return segments[0].vectors
+        return np.concatenate([seg.vectors for seg in segments])
+
+    @property
+    def norms(self) -> np.ndarray:
+        """缓存的向量模长（归一化之前的原始模长）"""
+        segments = self._layout[0]
+        if not segments:
+            return np.zeros(0, dtype=np.float32)
+        return np.concatenate([seg.norms for seg in segments])
+
+    def _locate(self, ids: np.ndarray, layout) -> np.ndarray:
+        """计算每个行号所在的段下标"""
+        offsets = layout[1]
+        if len(ids) and (ids.min() < 0 or ids.max() >= offsets[-1]):
+            raise IndexError("向量行号越界")
+        return np.searchsorted(offsets, ids, side='right') - 1
+
+    def _gather(self, ids: np.ndarray, layout=None) -> Tuple[np.ndarray, np.ndarray]:
+        """按行号收集向量与模长"""
+        layout = layout or self._layout
+        segments, offsets = layout
+        seg_ids = self._locate(ids, layout)
+        vectors = np.empty((len(ids), self.dimension), dtype=np.float32)
+        norms = np.empty(len(ids), dtype=np.float32)
+        for s in np.unique(seg_ids):
+            mask = seg_ids == s
+            local = ids[mask] - offsets[s]
+            vectors[mask] = segments[s].vectors[local]
+            norms[mask] = segments[s].norms[local]
+        return vectors, norms
+
+    def get(self, ids) -> np.ndarray:
+        """按行号获取向量，ids 为整数时返回一维向量"""
+        if np.isscalar(ids):
+            return self._gather(np.asarray([ids], dtype=np.int64))[0][0]
+        return self._gather(np.asarray(ids, dtype=np.int64).reshape(-1))[0]
+
+    # ---------- 相似度计算 ----------
+
+    def _score_block(self, query_vector: np.ndarray, vectors: np.ndarray, norms: np.ndarray) -> np.ndarray:
+        if self.metric == 'cosine':
+            return cosine_similarity(query_vector, vectors, None if self.normalize else norms)
+        sq_norms = np.ones(len(vectors), dtype=np.float32) if self.normalize else norms ** 2
+        return l2_similarity(query_vector, vectors, sq_norms)
+
+    def scores(self, query_vector: np.ndarray, ids: Optional[np.ndarray] = None) -> np.ndarray:
+        """
+        计算查询向量与指定行（默认全部）的相似度，值越大越相似
+        :param query_vector: 查询向量
+        :param ids: 可选，行号数组
+        """
+        if ids is None:
+            segments = self._layout[0]
+            if not segments:
+                return np.zeros(0, dtype=np.float32)
+            return np.concatenate([self._score_block(query_vector, seg.vectors, seg.norms) for seg in segments])
+        vectors, norms = self._gather(np.asarray(ids, dtype=np.int64).reshape(-1))
+        return self._score_block(query_vector, vectors, norms)
+
+    def _score_block_batch(self, query_vectors: np.ndarray, vectors: np.ndarray, norms: np.ndarray) -> np.ndarray:
+        """多个查询与一段向量的相似度矩阵 (查询数, 行数)，一次矩阵乘法完成"""
+        queries = np.asarray(query_vectors, dtype=np.float32).reshape(-1, self.dimension)
+        query_sq = np.einsum('ij,ij->i', queries, queries)
+        return self._finish_scores(queries @ vectors.T, query_sq[:, None], norms[None, :])
+
+    def _finish_scores(self, products: np.ndarray, query_sq: np.ndarray, norms: np.ndarray) -> np.ndarray:
+        """
+        点积 -> 相似度
+        :param products: 查询向量与文档向量的点积
+        :param query_sq: 查询向量模长的平方，形状可与 products 广播
+        :param norms: 文档向量的原始模长，形状可与 products 广播
+        """
+        if self.metric == 'cosine':
+            products = products / np.sqrt(np.maximum(query_sq, 1e-24))
+            if not self.normalize:
+                products = products / np.maximum(norms, 1e-12)
+            return products
+        sq_norms = 1.0 if self.normalize else norms ** 2
+        return -np.sqrt(np.maximum(sq_norms - 2 * products + query_sq, 0))
+
+    def pair_scores(self, query_vectors: np.ndarray, query_index: np.ndarray, ids: np.ndarray) -> np.ndarray:
+        """
+        逐对计算相似度：第 i 对为 query_vectors[query_index[i]] 与第 ids[i] 行（图索引同时扩展多个查询的邻居时使用）
+        :return: 与 ids 等长的相似度数组
+        """
+        queries = np.asarray(query_vectors, dtype=np.float32).reshape(-1, self.dimension)[query_index]
+        vectors, norms = self._gather(np.asarray(ids, dtype=np.int64).reshape(-1))
+        products = np.einsum('ij,ij->i', queries, vectors)
+        return self._finish_scores(products, np.einsum('ij,ij->i', queries, queries), norms)
+
+    def group_scores(self, ids: np.ndarray) -> np.ndarray:
+        """
+        每组行之间两两的相似度（图索引按启发式选择邻居时使用）
+        :param ids: 形状为 (组数, 每组行数) 的行号
+        :return: 形状为 (组数, 每组行数, 每组行数) 的矩阵
+        """
+        ids = np.asarray(ids, dtype=np.int64)
+        vectors, norms = self._gather(ids.reshape(-1))
+        vectors = vectors.reshape(ids.shape + (self.dimension,))
+        norms = norms.reshape(ids.shape)
+        products = np.matmul(vectors, vectors.transpose(0, 2, 1))
+        query_sq = np.einsum('gid,gid->gi', vectors, vectors)
+        return self._finish_scores(products, query_sq[:, :, None], norms[:, None, :])
+
+    def scores_batch(self, query_vectors: np.ndarray, ids: Optional[np.ndarray] = None) -> np.ndarray:
+        """
+        计算多个查询向量与指定行（默认全部）的相似度
+        :return: 形状为 (查询数, 行数) 的矩阵
+        """
+        num_queries = np.asarray(query_vectors).reshape(-1, self.dimension).shape[0]
+        if ids is None:
+            segments = self._layout[0]
+            if not segments:
+                return np.zeros((num_queries, 0), dtype=np.float32)
+            return np.concatenate([self._score_block_batch(query_vectors, seg.vectors, seg.norms)
+                                   for seg in segments], axis=1)
+        vectors, norms = self._gather(np.asarray(ids, dtype=np.int64).reshape(-1))
+        return self._score_block_batch(query_vectors, vectors, norms)
+
+    def iter_score_blocks(self, query_vectors: np.ndarray, ids: Optional[np.ndarray] = None,
+                          block_rows: int = 65536) -> Iterator[Tuple[np.ndarray, np.ndarray]]:
+        """
+        分块计算多个查询的相似度，避免一次生成 (查询数, 总行数) 的大矩阵
+        :param ids: 可选，只计算这些行
+        :return: 逐块产出 (行号数组, 相似度矩阵)
+        """
+        if ids is None:
+            for offset, vectors, norms in self.iter_segments():
+                for start in range(0, len(norms), block_rows):
+                    block = slice(start, start + block_rows)
+                    rows = np.arange(offset + start, offset + start + len(norms[block]), dtype=np.int64)
+                    yield rows, self._score_block_batch(query_vectors, vectors[block], norms[block])
+            return
+        ids = np.asarray(ids, dtype=np.int64).reshape(-1)
+        for start in range(0, len(ids), block_rows):
+            rows = ids[start:start + block_rows]
+            yield rows, self.scores_batch(query_vectors, rows)
+
+    # ---------- 写入 ----------
+
+    def _prepare(self, vectors) -> Tuple[np.ndarray, np.ndarray]:
+        """转换为 float32 二维矩阵，按需归一化，返回 (向量, 原始模长)"""
+        vectors = np.ascontiguousarray(vectors, dtype=np.float32).reshape(-1, self.dimension)
+        norms = np.linalg.norm(vectors, axis=1).astype(np.float32)
+        if self.normalize:
+            vectors = vectors / np.maximum(norms, 1e-12)[:, None]
+        return vectors, norms
+
+    def _segment_files(self, name: str) -> Tuple[Path, Path]:
+        return self.path / f"{name}.npy", self.path / f"{name}.norms.npy"
+
+    def _open_segment(self, name: str) -> _Segment:
+        vector_file, norm_file = self._segment_files(name)
+        return _Segment(name, np.load(vector_file, mmap_mode='r+'), np.load(norm_file, mmap_mode='r+'))
+
+    def _write_segment(self, vectors: np.ndarray, norms: np.ndarray) -> _Segment:
+        """写入一个新段文件并以 memmap 方式打开"""
+        with self._lock:
+            # 随机后缀：其他进程可能在本进程写入段清单之前分配了相同的序号
+            name = f"seg_{self._next_segment_id:06d}_{uuid.uuid4().hex[:8]}"
+            self._next_segment_id += 1
+        vector_file, norm_file = self._segment_files(name)
+        np.save(vector_file, np.ascontiguousarray(vectors, dtype=np.float32))
+        np.save(norm_file, np.ascontiguousarray(norms, dtype=np.float32))
+        return self._open_segment(name)
+
+    def _delete_segment_files(self, name: str) -> None:
+        for file in self._segment_files(name):
+            try:
+                file.unlink()
+            except OSError:
+                # Windows 下仍被映射的文件无法删除，下次加载时作为孤立文件清理
+                pass
+
+    def _read_manifest_stamp(self) -> Optional[Tuple[int, int, int]]:
+        try:
+            stat = (self.path / self.MANIFEST_NAME).stat()
+        except FileNotFoundError:
+            return None
+        return stat.st_ino, stat.st_mtime_ns, stat.st_size
+
+    def changed_on_disk(self) -> bool:
+        """段清单是否在本进程最后一次读写之后被其他进程修改过"""
+        return self._read_manifest_stamp() != self._manifest_stamp
+
+    def _write_manifest(self) -> None:
+        """原子写入段清单"""
+        manifest = {
+            'dimension': self.dimension,
+            'metric': self.metric,
+            'normalize': self.normalize,
+            'next_segment_id': self._next_segment_id,
+            'segments': [{'name': seg.name, 'rows': len(seg)} for seg in self._segments],
+        }
+        manifest_path = self.path / self.MANIFEST_NAME
+        tmp_path = manifest_path.with_suffix('.tmp')
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(manifest, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, manifest_path)
+        self._manifest_stamp = self._read_manifest_stamp()
+
+    def add(self, vectors) -> np.ndarray:
+        """
+        追加向量（写入一个新段）
+        :param vectors: 形状为 (m, dim) 的向量
+        :return: 新向量的行号
+        """
+        vectors, norms = self._prepare(vectors)
+        if len(vectors) == 0:
+            return np.zeros(0, dtype=np.int64)
+        segment = self._write_segment(vectors, norms)
+        with self._lock:
+            start = len(self)
+            self._set_segments(self._segments + [segment])
+            self._write_manifest()
+        self.maybe_compact()
+        return np.arange(start, start + len(vectors))
+
+    def update(self, ids: List[int], vectors) -> None:
+        """原地覆盖指定行的向量"""
+        vectors, norms = self._prepare(vectors)
+        ids = np.asarray(ids, dtype=np.int64).reshape(-1)
+        with self._lock:
+            segments, offsets = self._layout
+            seg_ids = self._locate(ids, self._layout)
+            for s in np.unique(seg_ids):
+                mask = seg_ids == s
+                local = ids[mask] - offsets[s]
+                segments[s].vectors[local] = vectors[mask]
+                segments[s].norms[local] = norms[mask]
+                segments[s].vectors.flush()
+                segments[s].norms.flush()
+            self._version += 1
+
+    def remove(self, ids: List[int]) -> None:
+        """删除指定行，之后的行号依次前移；只重写包含被删除行的段"""
+        ids = np.unique(np.asarray(ids, dtype=np.int64).reshape(-1))
+        if len(ids) == 0:
+            return
+        with self._lock:
+            segments, offsets = self._layout
+            seg_ids = self._locate(ids, self._layout)
+            new_segments = list(segments)
+            removed = []
+            for s in np.unique(seg_ids):
+                segment = segments[s]
+                keep = np.ones(len(segment), dtype=bool)
+                keep[ids[seg_ids == s] - offsets[s]] = False
+                new_segments[s] = self._write_segment(segment.vectors[keep], segment.norms[keep]) if keep.any() else None
+                removed.append(segment.name)
+            self._set_segments([seg for seg in new_segments if seg is not None])
+            self._write_manifest()
+            self._version += 1
+        for name in removed:
+            self._delete_segment_files(name)
+        self.maybe_compact()
+
+    # ---------- 后台合并 ----------
+
+    def _plan_compaction(self, segments: List[_Segment]) -> List[Tuple[int, int]]:
+        """将相邻的小段分组，每组合并后不超过 target_rows，返回 [(起始段下标, 结束段下标)]"""
+        groups = []
+        start, rows = None, 0
+        for i, segment in enumerate(segments + [None]):
+            small = segment is not None and len(segment) < self.target_rows
+            if small and start is not None and rows + len(segment) <= self.target_rows:
+                rows += len(segment)
+                continue
+            if start is not None and i - start >= 2:
+                groups.append((start, i))
+            start, rows = (i, len(segment)) if small else (None, 0)
+        return groups
+
+    def maybe_compact(self) -> None:
+        """小段数量达到阈值时启动后台合并线程"""
+        small = sum(1 for seg in self._segments if len(seg) < self.target_rows)
+        if small < self.compaction_trigger:
+            return
+        with self._lock:
+            if self._compaction_thread is not None and self._compaction_thread.is_alive():
+                return
+            self._compaction_thread = threading.Thread(target=self._compact_in_background, daemon=True)
+            self._compaction_thread.start()
+
+    def _compact_in_background(self) -> None:
+        try:
+            self.compact()
+        except Exception as e:
+            print(f"向量段合并失败: {str(e)}")
+
+    def compact(self) -> bool:
+        """
+        合并相邻的小段
+        合并期间新增的段不受影响；若合并期间发生了 update/remove，则放弃本次合并
+        :return: 是否完成了合并
+        """
+        with self._lock:
+            snapshot = list(self._segments)
+            version = self._version
+        groups = self._plan_compaction(snapshot)
+        if not groups:
+            return False
+
+        merged = []
+        for start, end in groups:
+            parts = snapshot[start:end]
+            merged.append(self._write_segment(
+                np.concatenate([seg.vectors for seg in parts]),
+                np.concatenate([seg.norms for seg in parts])
+            ))
+
+        with self._lock:
+            unchanged = self._version == version and self._segments[:len(snapshot)] == snapshot
+            if unchanged:
+                new_segments, cursor = [], 0
+                for (start, end), segment in zip(groups, merged):
+                    new_segments.extend(snapshot[cursor:start])
+                    new_segments.append(segment)
+                    cursor = end
+                new_segments.extend(self._segments[cursor:])
+                self._set_segments(new_segments)
+                self._write_manifest()
+
+        obsolete = [seg.name for start, end in groups for seg in snapshot[start:end]] if unchanged else [seg.name for seg in merged]
+        for name in obsolete:
+            self._delete_segment_files(name)
+        return unchanged
+
+    def wait_for_compaction(self) -> None:
+        """等待正在进行的后台合并结束"""
+        thread = self._compaction_thread
+        if thread is not None:
+            thread.join()
+
+    # ---------- 持久化 ----------
+
+    def load(self) -> None:
+        """打开段清单中的全部段；首次使用时从旧版 doc_vectors.npy 迁移"""
+        manifest_path = self.path / self.MANIFEST_NAME
+        with self._lock:
+            if not manifest_path.exists():
+                self._set_segments([])
+                self._next_segment_id = 0
+                if self.legacy_path is not None and self.legacy_path.exists():
+                    self._migrate_legacy()
+                return
+
+            with open(manifest_path, 'r', encoding='utf-8') as f:
+                manifest = json.load(f)
+            self.dimension = manifest.get('dimension', self.dimension)
+            self._next_segment_id = manifest.get('next_segment_id', 0)
+            self._set_segments([self._open_segment(seg['name']) for seg in manifest.get('segments', [])])
+            if self.normalize and not manifest.get('normalize', False):
+                self._normalize_segments()
+            self.normalize = self.normalize or manifest.get('normalize', False)
+            self._write_manifest()
+            self._remove_orphans()
+
+    def reload(self) -> str:
+        """
+        重新读取段清单（其他进程写入后调用），已打开的段复用原有映射，不做迁移、归一化和孤立文件清理
+        :return: 'unchanged'（段列表未变，可能有原地修改）、'appended'（只追加了新段）或 'changed'（删除/合并）
+        """
+        manifest_path = self.path / self.MANIFEST_NAME
+        with self._lock:
+            stamp = self._read_manifest_stamp()
+            if stamp is None:
+                return 'unchanged'
+            with open(manifest_path, 'r', encoding='utf-8') as f:
+                manifest = json.load(f)
+            opened = {seg.name: seg for seg in self._segments}
+            old_names = [seg.name for seg in self._segments]
+            names = [seg['name'] for seg in manifest.get('segments', [])]
+            self._next_segment_id = max(self._next_segment_id, manifest.get('next_segment_id', 0))
+            self._manifest_stamp = stamp
+            if names == old_names:
+                return 'unchanged'
+            self._set_segments([opened.get(name) or self._open_segment(name) for name in names])
+            if names[:len(old_names)] == old_names:
+                return 'appended'
+            self._version += 1
+            return 'changed'
+
+    def _migrate_legacy(self) -> None:
+        """将旧版单文件向量按 target_rows 切分为段"""
+        legacy = np.load(self.legacy_path, mmap_mode='r')
+        if legacy.ndim == 2 and len(legacy) > 0:
+            print(f"正在将 {self.legacy_path} 迁移为分段向量存储...")
+            self.dimension = legacy.shape[1]
+            segments = []
+            for start in range(0, len(legacy), self.target_rows):
+                segments.append(self._write_segment(*self._prepare(legacy[start:start + self.target_rows])))
+            self._set_segments(segments)
+        self._write_manifest()
+        del legacy
+        try:
+            self.legacy_path.unlink()
+        except OSError:
+            pass
+
+    def _normalize_segments(self) -> None:
+        """旧数据未归一化而当前配置要求归一化时，原地归一化"""
+        for segment in self._segments:
+            segment.vectors[:] = segment.vectors / np.maximum(np.linalg.norm(segment.vectors, axis=1), 1e-12)[:, None]
+            segment.vectors.flush()
+
+    def _remove_orphans(self) -> None:
+        """删除不在段清单中的残留段文件（如中断的合并）"""
+        live = {seg.name for seg in self._segments}
+        cutoff = time.time() - self.ORPHAN_GRACE_SECONDS
+        for file in self.path.glob('seg_*.npy'):
+            if file.name.split('.')[0] not in live:
+                try:
+                    if file.stat().st_mtime < cutoff:
+                        file.unlink()
+                except OSError:
+                    pass
+
+    def save(self) -> None:
+        """将 memmap 中的修改刷新到磁盘并写入段清单"""
+        with self._lock:
+            for segment in self._segments:
+                segment.vectors.flush()
+                segment.norms.flush()
+            self._write_manifest()
+
+    def reset(self) -> None:
+        """清空向量并删除全部段文件"""
+        self.wait_for_compaction()
+        with self._lock:
+            names = [seg.name for seg in self._segments]
+            self._set_segments([])
+            self._write_manifest()
+            self._version += 1
+        for name in names:
+            self._delete_segment_files(name)
@@ -1,22 +1,54 @@
 from flask import Flask, render_template, send_from_directory
 from flask_cors import CORS
-from .routes.api_routes import api, rag
+from .routes.api_routes import api, startup_config, schedule_startup_sync, run_startup_sync
 from .routes.chat_routes import chat
 from utils.load_config import configs
-from utils.ocr_manager import initialize_ocr
-from utils.ppstructure_manager import initialize_ppstructure
+from utils.component_manager import get_component, warm_up
+from utils.rag.registry import rag_component
 import os
+import sys
 
 app = Flask(__name__)
 CORS(app)
 
-# 初始化 OCR 引擎
-initialize_ocr()
-initialize_ppstructure()
 # 注册蓝图
 app.register_blueprint(api, url_prefix='/api')
 app.register_blueprint(chat, url_prefix='/chat')
 
+
+def start_background_startup():
+    """
+    在当前进程中开始后台启动：rag 加载完成后提交知识库同步任务，模型与 OCR 引擎在后台线程中预加载，
+    不阻塞服务启动；关闭预热时在第一次使用时加载
+    （导入模块时不启动线程：多进程服务的主进程在 fork 之前不能留下后台线程）
+    """
+    rag_component.add_ready_callback(schedule_startup_sync)
+    if startup_config.get('warmup', True):
+        warm_up(startup_config.get('components'))
+
+
+def preload_startup(names):
+    """
+    多进程服务的主进程在 fork 工作进程之前调用：同步加载组件并与文档目录同步，
+    工作进程继承已加载的模型权重与 memmap 段文件（写时复制，不重复占用内存）
+    :param names: 预加载的组件名称
+    """
+    for name in names:
+        try:
+            get_component(name).get()
+        except KeyError:
+            print(f"未注册的组件 {name}，跳过预加载")
+        except Exception as e:
+            print(f"组件 {name} 预加载失败，将在工作进程中重新加载: {str(e)}")
+    if rag_component.ready:
+        run_startup_sync(rag_component.get())
+    # CUDA 上下文不能跨 fork 使用，工作进程中调用模型会出错
+    torch = sys.modules.get('torch')
+    if torch is not None and torch.cuda.is_available() and torch.cuda.is_initialized():
+        raise RuntimeError("主进程预加载组件时初始化了 CUDA，工作进程无法继续使用 GPU 上的模型。"
+                           "请将 webui.server.preload 设为 False（每个工作进程各自加载模型），"
+                           "或将预加载组件的 device 设为 cpu")
+
 # 添加静态路由以提供data/documents目录中的文件
 @app.route('/data/documents/<path:filename>')
 def serve_document(filename):
@@ -0,0 +1,59 @@
+"""
+ASGI 应用
+调用 LLM 的对话接口由 Quart 应用以协程处理（见 routes/async_api_routes.py），其余请求（页面、上传、文档管理等）
+转给原有的 Flask 应用，在线程池中执行；两者使用相同的接口路径，前端无需修改
+"""
+from hypercorn.middleware import AsyncioWSGIMiddleware
+from quart import Quart
+from werkzeug.exceptions import HTTPException
+from .app import app as flask_app, start_background_startup
+from .routes.async_api_routes import async_api, asgi_config
+
+quart_app = Quart(__name__, static_folder=None)
+# 流式对话可能持续数分钟，不限制响应时间
+quart_app.config['RESPONSE_TIMEOUT'] = None
+quart_app.register_blueprint(async_api, url_prefix='/api')
+
+
+@quart_app.before_serving
+async def _start_background_startup():
+    start_background_startup()
+
+
+@quart_app.after_request
+async def _add_cors_header(response):
+    # 与 Flask 应用的 CORS(app) 默认配置一致（预检请求由 Flask 应用处理）
+    response.headers.setdefault('Access-Control-Allow-Origin', '*')
+    return response
+
+
+class RouteDispatcher:
+    """按路由分发请求：Quart 应用中注册的路径与方法由 Quart 处理，其余 HTTP 请求转给 WSGI 应用"""
+
+    def __init__(self, asgi_app: Quart, wsgi_app, max_body_size: int):
+        """
+        :param asgi_app: Quart 应用（同时处理生命周期事件）
+        :param wsgi_app: Flask 应用
+        :param max_body_size: 转给 WSGI 应用的请求体上限（字节）
+        """
+        self.asgi_app = asgi_app
+        self.wsgi_app = AsyncioWSGIMiddleware(wsgi_app, max_body_size=max_body_size)
+        self._adapter = asgi_app.url_map.bind('')
+
+    def _is_async_route(self, scope) -> bool:
+        if scope['method'] == 'OPTIONS':
+            return False
+        try:
+            self._adapter.match(scope['path'], method=scope['method'])
+        except HTTPException:
+            return False
+        return True
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'http' and not self._is_async_route(scope):
+            await self.wsgi_app(scope, receive, send)
+        else:
+            await self.asgi_app(scope, receive, send)
+
+
+asgi_app = RouteDispatcher(quart_app, flask_app, asgi_config.get('max_body_size', 50 * 1024 * 1024))
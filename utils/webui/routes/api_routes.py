@@ -1,5 +1,7 @@
-from flask import Blueprint, request, jsonify, send_file
-from utils.rag import Rag
+from flask import Blueprint, Response, request, jsonify, send_file
+from utils.rag.registry import rag_component
+from utils.rag.filters import MetadataFilter
+from utils.rag.jobs import JobManager
 from utils.agent.base_agent import BaseAgent
 from utils.agent.tools import *
 from utils.load_config import configs
@@ -7,6 +9,7 @@ from werkzeug.utils import secure_filename
 from utils.documents_preview import *
 from utils.ocr_manager import get_ocr_engine
 from utils.ppstructure_manager import get_ppstructure_engine
+from utils.component_manager import ComponentProxy, ComponentUnavailable, component_status
 from utils.base_func import *
 import os
 import re
@@ -18,9 +21,34 @@ import numpy as np
 import time
 api = Blueprint('api', __name__)
 
-# 直接初始化 Rag & Agent 实例
-rag = Rag()
-rag.load_documents(rag.files)
+startup_config = configs['webui'].get('startup') or {}
+# 上传文件的入库任务在后台线程池中执行
+job_manager = JobManager(**(configs['rag'].get('jobs') or {}))
+# 启动时的知识库同步任务
+startup_jobs = {}
+
+def schedule_startup_sync(instance):
+    """Rag 加载完成后的回调：在后台任务中与文档目录增量同步（只处理新增、修改、重命名和删除的文件）"""
+    if not startup_config.get('sync_documents', True):
+        return
+    def sync(job):
+        return instance.sync_documents(on_stage_progress=job.advance, cancel_event=job.cancel_event)
+    startup_jobs['sync_documents'] = job_manager.submit('sync', sync).id
+
+def run_startup_sync(instance):
+    """在当前线程中与文档目录同步（多进程服务的主进程在 fork 工作进程之前调用）"""
+    if not startup_config.get('sync_documents', True):
+        return
+    try:
+        result = instance.sync_documents()
+        print(f"启动时知识库同步完成: {result}")
+    except Exception as e:
+        print(f"启动时知识库同步失败: {str(e)}")
+
+# 进程内共享的 Rag 实例（与 Agent 工具共用），在第一次使用时或由启动预热线程加载嵌入与重排序模型，
+# 加载中的请求最多等待 wait_timeout 秒；启动同步的时机由服务入口决定（见 utils/webui/app.py）
+rag = ComponentProxy(rag_component, timeout=startup_config.get('wait_timeout', 120))
+
 
 agent = BaseAgent()
 
@@ -66,6 +94,93 @@ def secure_filename_with_chinese(filename):
         
     return name + ext
 
+def _sse(event: str, data: dict) -> str:
+    """格式化一条 Server-Sent-Events 消息"""
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+def _streaming_enabled() -> bool:
+    return configs['webui'].get('features', {}).get('enable_streaming', True)
+
+def _streaming_disabled():
+    """webui.features.enable_streaming 关闭时，流式接口返回错误响应"""
+    if _streaming_enabled():
+        return None
+    return jsonify({
+        'status': 'error',
+        'message': '流式响应未启用'
+    }), 403
+
+def _sse_response(events) -> Response:
+    """
+    以 text/event-stream 返回事件流：delta 事件推送增量文本，done 事件推送完整结果，出错时推送 error 事件
+    客户端断开时生成器被关闭，正在读取的 LLM 流式响应随之关闭并释放并发名额
+    """
+    def guarded():
+        try:
+            yield from events
+        except Exception as e:
+            yield _sse('error', {'status': 'error', 'message': str(e)})
+    return Response(guarded(), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'  # 关闭 nginx 代理缓冲
+    })
+
+def _latex_marks(response: str) -> list:
+    """公式检测：回复中的 latex 标记"""
+    return re.findall(r'\\(?:begin|end)\{[a-z]*\}|\\.|[{}]|\$', response)
+
+def _related_questions_prompt(count: int) -> str:
+    """生成相关问题的系统提示"""
+    return f"""
+        请基于以下问题，生成{count}个相关的、用户可能会感兴趣的后续问题。
+        问题应该多样化，覆盖不同的角度和相关主题。
+        只返回问题列表，每个问题一行，前面加上数字编号。
+        问题内容要简洁，不要超过20个字。
+        """
+
+def _parse_related_questions(response: str) -> list:
+    """从模型回复中解析出单独的问题"""
+    questions = []
+    for line in response.strip().split('\n'):
+        line = line.strip()
+        # 匹配形如 "1. 问题内容" 的格式
+        match = re.match(r'^\d+\.?\s+(.+)$', line)
+        if match and match.group(1):
+            questions.append(match.group(1))
+    return questions
+
+@api.errorhandler(ComponentUnavailable)
+def handle_component_unavailable(e):
+    """
+    组件加载中或加载失败时返回 503，客户端可稍后重试
+    （ComponentUnavailable 是 RuntimeError 的子类，路由中的 except Exception 之前需先将其重新抛出）
+    """
+    return jsonify({
+        'status': 'error',
+        'message': str(e)
+    }), 503
+
+@api.route('/health', methods=['GET'])
+def health():
+    """
+    健康检查：服务进程存活即返回；各组件（rag、ocr、ppstructure）的状态与加载耗时，以及启动同步任务
+    启动预热的组件（webui.startup.components）全部就绪时 ready 为 True、状态码 200，否则状态码 503（用于就绪探针）
+    """
+    components = component_status()
+    required = startup_config.get('components') or list(components)
+    ready = all(components.get(name, {}).get('state') == 'ready' for name in required)
+    jobs = {}
+    for name, job_id in startup_jobs.items():
+        job = job_manager.get(job_id)
+        if job is not None:
+            jobs[name] = {'job_id': job_id, 'status': job.status}
+    return jsonify({
+        'status': 'success',
+        'ready': ready,
+        'components': components,
+        'startup_jobs': jobs
+    }), 200 if ready else 503
+
 @api.route('/config', methods=['GET'])
 def get_config():
     """获取配置信息"""
@@ -101,6 +216,8 @@ def update_model():
             'status': 'success',
             'model': model_name
         })
+    except ComponentUnavailable:
+        raise
     except Exception as e:
         return jsonify({
             'status': 'error',
@@ -117,21 +234,15 @@ def chat_completions():
     system_prompt = data.get('system_prompt', '')
     
     try:
-        # 临时更新温度设置
-        original_temp = rag.config['ollama']['temperature']
-        rag.config['ollama']['temperature'] = temperature
-        
-        # 调用 LLM，传递系统提示
-        response = call_language_model(message, system_prompt=system_prompt)
-        
-        # 恢复原始温度设置
-        rag.config['ollama']['temperature'] = original_temp
+        # 温度与模型按请求传入，不修改全局配置（并发请求共用同一份配置）
+        response = call_language_model(message, system_prompt=system_prompt, model=model_name,
+                                       temperature=temperature)
 
         return jsonify({
             'status': 'success',
             'response': response,
             'model': model_name,
-            'latex': re.findall(r'\\(?:begin|end)\{[a-z]*\}|\\.|[{}]|\$', response)  # 公式检测
+            'latex': _latex_marks(response)  # 公式检测
         })
     except Exception as e:
         return jsonify({
@@ -139,6 +250,33 @@ def chat_completions():
             'message': str(e)
         }), 500
 
+@api.route('/chat_completions/stream', methods=['POST'])
+def chat_completions_stream():
+    """/chat_completions 的流式版本（Server-Sent-Events），<think> 段落在推送前移除"""
+    disabled = _streaming_disabled()
+    if disabled:
+        return disabled
+    data = request.get_json() or {}
+    message = data.get('message', '')
+    temperature = data.get('temperature', 0.7)
+    model_name = data.get('model', configs['ollama']['default_model'])
+    system_prompt = data.get('system_prompt', '')
+
+    def events():
+        response = ''
+        # 温度按请求传入，不修改全局配置（流式响应期间其他请求仍在使用）
+        for delta in stream_language_model(message, system_prompt=system_prompt, model=model_name,
+                                           temperature=temperature):
+            response += delta
+            yield _sse('delta', {'content': delta})
+        yield _sse('done', {
+            'status': 'success',
+            'response': response,
+            'model': model_name,
+            'latex': _latex_marks(response)  # 公式检测
+        })
+    return _sse_response(events())
+
 @api.route('/related_questions', methods=['POST'])
 def related_questions():
     """获取与用户提供的问题相关的问题列表"""
@@ -147,25 +285,9 @@ def related_questions():
     count = data.get('count', 3)  # 默认返回3个相关问题
     
     try:
-        # 使用 RAG 系统生成相关问题
-        # 这里使用一个特定的提示词来引导模型生成相关问题
-        system_prompt = f"""
-        请基于以下问题，生成{count}个相关的、用户可能会感兴趣的后续问题。
-        问题应该多样化，覆盖不同的角度和相关主题。
-        只返回问题列表，每个问题一行，前面加上数字编号。
-        问题内容要简洁，不要超过20个字。
-        """
-        # 调用语言模型，使用系统提示和问题内容
-        response = call_language_model(question, system_prompt=system_prompt)
-        
-        # 解析出单独的问题
-        questions = []
-        for line in response.strip().split('\n'):
-            line = line.strip()
-            # 匹配形如 "1. 问题内容" 的格式
-            match = re.match(r'^\d+\.?\s+(.+)$', line)
-            if match and match.group(1):
-                questions.append(match.group(1))
+        # 使用一个特定的提示词来引导模型生成相关问题
+        response = call_language_model(question, system_prompt=_related_questions_prompt(count))
+        questions = _parse_related_questions(response)
         
         # 如果没有提取到有效问题，或者提取的问题少于要求，返回一个错误
         if len(questions) < 1:
@@ -191,6 +313,13 @@ def reference_files():
     question_id = data.get('question_id')
     question = data.get('question', '')
     top_k = data.get('top_k', 3)
+    try:
+        filters = MetadataFilter.from_dict(data.get('filters'))
+    except ValueError as e:
+        return jsonify({
+            'status': 'error',
+            'message': f'无效的过滤条件: {str(e)}'
+        }), 400
     try:
         # 如果有问题ID但没有问题内容，尝试从某处获取问题内容
         if question_id and not question:
@@ -208,21 +337,18 @@ def reference_files():
         # 优先尝试获取最近一次检索的结果（使用新的last_retrieval机制）
         relevant_docs = []
         
-        # 检查是否可以重用最近一次的检索结果
-        if hasattr(rag, 'last_retrieval') and rag.last_retrieval:
-            last_query = rag.last_retrieval.get('query')
-            last_top_k = rag.last_retrieval.get('top_k')
-            
-            # 如果是相同的查询，并且之前的top_k不小于现在请求的top_k
-            if last_query == question and last_top_k >= top_k:
-                relevant_docs = rag.last_retrieval.get('results', [])[:top_k]
-                print(f"使用最近一次检索的缓存结果: {question[:30]}...")
+        # 检查是否可以重用最近一次的检索结果（相同查询、top_k 不小于本次且知识库未变化）
+        recent_docs = rag.get_recent_retrieval(question, top_k, filters)
+        if recent_docs:
+            relevant_docs = recent_docs
+            print(f"使用最近一次检索的缓存结果: {question[:30]}...")
         
         # 如果没有找到缓存结果，执行正常的检索流程
         if not relevant_docs:
             # 执行增强和检索 - 但避免重复执行
             enhanced_question = rag._query_enhance(question)
-            relevant_docs = rag.retrieve_documents(enhanced_question, top_k=top_k)
+            relevant_docs = rag.retrieve_documents(enhanced_question, top_k=top_k, cache_label='/reference_files',
+                                                   filters=filters)
         
         # 优化处理结果 - 使用集合更高效地跟踪已处理的文件
         reference_contents = []
@@ -273,9 +399,12 @@ def reference_files():
             'question': question,
             'question_id': question_id,
             'reference_files': reference_files_list,
-            'reference_contents': reference_contents
+            'reference_contents': reference_contents,
+            'filters': filters.to_dict() if filters is not None else None
         })
     
+    except ComponentUnavailable:
+        raise
     except Exception as e:
         print(f"获取参考文件失败: {e}")
         return jsonify({
@@ -356,6 +485,8 @@ def ocr_process():
                 os.remove(image_path)
             raise e
             
+    except ComponentUnavailable:
+        raise
     except Exception as e:
         print(f"OCR处理失败: {e}")
         return jsonify({
@@ -370,13 +501,21 @@ def get_rag_prompt():
     message = data.get('message', '')
     is_image = data.get('is_image', False)  # 从请求中获取是否为图片查询的标记
     top_k = data.get('top_k', 3)
+    try:
+        filters = MetadataFilter.from_dict(data.get('filters'))
+    except ValueError as e:
+        return jsonify({
+            'status': 'error',
+            'message': f'无效的过滤条件: {str(e)}'
+        }), 400
     try:
         # 生成 RAG 提示
         start_time = time.time()
         
         # 使用增强的缓存机制
         enhanced_question = rag._query_enhance(message)
-        prompt = rag.generate_prompt(enhanced_question, is_image=is_image, top_k=top_k)
+        prompt = rag.generate_prompt(enhanced_question, is_image=is_image, top_k=top_k, cache_label='/chat/rag/prompt',
+                                     filters=filters)
         
         end_time = time.time()
         processing_time = end_time - start_time
@@ -386,32 +525,165 @@ def get_rag_prompt():
             'context': prompt,
             'processing_time': processing_time  # 返回处理时间，用于监控性能
         })
+    except ComponentUnavailable:
+        raise
     except Exception as e:
         return jsonify({
             'status': 'error',
             'message': str(e)
         }), 500
 
+@api.route('/chat/rag/stream', methods=['POST'])
+def rag_chat_stream():
+    """
+    RAG 对话的流式版本（Server-Sent-Events）：检索并生成提示后先推送 context 事件，
+    再以提示作为系统提示流式调用 LLM
+    """
+    disabled = _streaming_disabled()
+    if disabled:
+        return disabled
+    data = request.get_json() or {}
+    message = data.get('message', '')
+    is_image = data.get('is_image', False)
+    top_k = data.get('top_k', 3)
+    temperature = data.get('temperature')
+    model_name = data.get('model')
+    try:
+        filters = MetadataFilter.from_dict(data.get('filters'))
+    except ValueError as e:
+        return jsonify({
+            'status': 'error',
+            'message': f'无效的过滤条件: {str(e)}'
+        }), 400
+
+    def events():
+        start_time = time.time()
+        enhanced_question = rag._query_enhance(message)
+        prompt = rag.generate_prompt(enhanced_question, is_image=is_image, top_k=top_k, cache_label='/chat/rag/stream',
+                                     filters=filters)
+        yield _sse('context', {
+            'context': prompt,
+            'processing_time': time.time() - start_time
+        })
+        response = ''
+        for delta in stream_language_model(message, system_prompt=prompt, model=model_name, temperature=temperature):
+            response += delta
+            yield _sse('delta', {'content': delta})
+        yield _sse('done', {
+            'status': 'success',
+            'response': response
+        })
+    return _sse_response(events())
+
+@api.route('/retrieve/batch', methods=['POST'])
+def retrieve_batch():
+    """批量检索：多个查询一次编码、一次打分、一次重排序（离线评测、多跳检索）"""
+    data = request.get_json() or {}
+    queries = data.get('queries')
+    max_queries = (configs['rag']['retrieval'].get('batch') or {}).get('max_queries', 64)
+    if not isinstance(queries, list) or not queries or not all(isinstance(q, str) and q for q in queries):
+        return jsonify({
+            'status': 'error',
+            'message': 'queries 必须是非空的查询字符串列表'
+        }), 400
+    if len(queries) > max_queries:
+        return jsonify({
+            'status': 'error',
+            'message': f'单次最多 {max_queries} 个查询'
+        }), 400
+    try:
+        filters = MetadataFilter.from_dict(data.get('filters'))
+    except ValueError as e:
+        return jsonify({
+            'status': 'error',
+            'message': f'无效的过滤条件: {str(e)}'
+        }), 400
+    try:
+        start_time = time.time()
+        # 查询增强需要逐个调用 LLM，默认关闭
+        if data.get('enhance', False):
+            queries = [rag._query_enhance(query) for query in queries]
+        results = rag.retrieve_documents_batch(
+            queries,
+            top_k=data.get('top_k'),
+            threshold=data.get('threshold'),
+            rerank_threshold=data.get('rerank_threshold'),
+            cache_label='/retrieve/batch',
+            filters=filters
+        )
+        return jsonify({
+            'status': 'success',
+            'results': [
+                {
+                    'query': query,
+                    'documents': [
+                        {
+                            'file_path': os.path.relpath(doc['file_path'], os.getcwd()) if doc.get('file_path') else '',
+                            'chunk_index': doc.get('chunk_index', 0),
+                            'score': float(doc.get('score', 0)),
+                            'initial_score': float(doc.get('initial_score', 0)),
+                            'summary': doc.get('chunk_summary', ''),
+                            'content': doc.get('chunk_content', '')
+                        }
+                        for doc in docs
+                    ]
+                }
+                for query, docs in zip(queries, results)
+            ],
+            'processing_time': time.time() - start_time
+        })
+    except ComponentUnavailable:
+        raise
+    except Exception as e:
+        return jsonify({
+            'status': 'error',
+            'message': str(e)
+        }), 500
+
+@api.route('/cache/stats', methods=['GET'])
+def get_cache_stats():
+    """获取检索缓存、语义缓存、向量缓存和摘要服务的统计信息"""
+    return jsonify({
+        'status': 'success',
+        'retrieval_cache': rag.cache.stats(),
+        'semantic_cache': rag.semantic_cache.stats() if rag.semantic_cache is not None else None,
+        'embedding_cache': rag.embedding_cache.stats() if rag.embedding_cache is not None else None,
+        'summary_service': rag.summary_service.stats(),
+        'filter_masks': rag.filter_index.stats()
+    })
+
+@api.route('/batching/stats', methods=['GET'])
+def get_batching_stats():
+    """获取查询编码与重排序微批调度的统计信息（队列深度、批大小分布）"""
+    return jsonify({
+        'status': 'success',
+        'embedding': rag.query_batcher.stats() if rag.query_batcher is not None else None,
+        'reranker': rag.rerank_batcher.stats() if rag.rerank_batcher is not None else None
+    })
+
+@api.route('/llm/stats', methods=['GET'])
+def get_llm_client_stats():
+    """获取各 LLM 服务地址的调用统计（延迟、重试、失败、token 数）"""
+    return jsonify({
+        'status': 'success',
+        'endpoints': get_llm_stats()
+    })
+
 @api.route('/documents', methods=['GET'])
 def get_documents():
     """获取已加载的文档列表"""
     try:
-        docs = rag.docs  # 假设 rag 实例有 docs 属性存储文档信息
-        # 转换为相对路径
         documents = []
-        for doc in docs:
-            file_path = doc.get('file_path', '')
+        for doc in rag.docs.list_files():
             # 将绝对路径转换为相对于项目根目录的路径
-            relative_path = os.path.relpath(file_path, os.getcwd())
-            
-            # 检查路径是否已经存在于列表中
-            if not any(doc['file_path'] == relative_path for doc in documents):
-                documents.append({
-                    'file_path': relative_path,
-                    'timestamp': doc.get('timestamp', '')
-                })
+            documents.append({
+                'file_path': os.path.relpath(doc['file_path'], os.getcwd()),
+                'timestamp': doc['timestamp']
+            })
         
         return jsonify(documents)
+    except ComponentUnavailable:
+        raise
     except Exception as e:
         return jsonify({
             'status': 'error',
@@ -498,13 +770,21 @@ def upload_files():
                 file.save(filepath)
                 uploaded_files.append(filepath)
         
-        # 加载文档到 RAG 系统
-        rag.load_documents(uploaded_files)
+        # 提交后台入库任务，立即返回任务 ID，通过 /jobs/<job_id> 查询进度
+        def ingest(job):
+            return rag.load_documents(uploaded_files, on_stage_progress=job.advance,
+                                      cancel_event=job.cancel_event)
+        
+        job = job_manager.submit('ingest', ingest, description={
+            'files': [os.path.basename(fp) for fp in uploaded_files]
+        })
         
         return jsonify({
             'status': 'success',
-            'message': f'成功上传 {len(uploaded_files)} 个文件'
-        })
+            'message': f'成功上传 {len(uploaded_files)} 个文件，正在后台入库',
+            'job_id': job.id,
+            'job': job.to_dict()
+        }), 202
         
     except Exception as e:
         return jsonify({
@@ -512,6 +792,45 @@ def upload_files():
             'message': f'上传文件失败: {str(e)}'
         }), 500
 
+@api.route('/jobs', methods=['GET'])
+def list_jobs():
+    """获取后台任务列表（从新到旧），可通过 status 参数过滤"""
+    jobs = job_manager.list(request.args.get('status'))
+    return jsonify({
+        'status': 'success',
+        'jobs': [job.to_dict() for job in jobs],
+        'stats': job_manager.stats()
+    })
+
+@api.route('/jobs/<job_id>', methods=['GET'])
+def get_job(job_id):
+    """获取后台任务的状态与分阶段进度（解析页数、OCR 图片数、摘要块数、向量化块数）"""
+    job = job_manager.get(job_id)
+    if job is None:
+        return jsonify({
+            'status': 'error',
+            'message': '任务不存在'
+        }), 404
+    return jsonify({
+        'status': 'success',
+        'job': job.to_dict()
+    })
+
+@api.route('/jobs/<job_id>/cancel', methods=['POST'])
+def cancel_job(job_id):
+    """取消后台任务：排队中的任务立即取消，运行中的任务在处理完当前文件块后退出（已入库的文件保留）"""
+    job = job_manager.cancel(job_id)
+    if job is None:
+        return jsonify({
+            'status': 'error',
+            'message': '任务不存在'
+        }), 404
+    return jsonify({
+        'status': 'success',
+        'message': '任务已结束' if job.finished and job.status != 'cancelled' else '已请求取消任务',
+        'job': job.to_dict()
+    })
+
 @api.route('/chunks', methods=['POST'])
 def get_document_chunks():
     """获取特定文档的分块内容"""
@@ -525,43 +844,25 @@ def get_document_chunks():
                 'message': '未提供文件路径'
             }), 400
         
-        # 读取元数据文件
-        metadata_path = rag._get_metadata_path()
-        if not metadata_path.exists():
-            return jsonify({
-                'status': 'error',
-                'message': '元数据文件不存在'
-            }), 404
-        
-        with open(metadata_path, "r", encoding="utf-8") as f:
-            metadata = json.load(f)
-        
-        # 获取指定文件的分块
+        # 按 file_path 索引查询指定文件的分块（已按块索引排序）
         file_chunks = []
-        for doc in metadata:
-            if doc.get('file_path') == file_path:
-                # 将文档转换为新的格式
-                chunk_info = {
-                    'file_path': doc.get('file_path', ''),
-                    'chunk_index': doc.get('chunk_index', 0),
-                    'chunk_content': doc.get('chunk_content', ''),
-                    'total_chunks': doc.get('total_chunks', '')  # 稍后更新
-                }
-                file_chunks.append(chunk_info)
-        
-        # # 计算总块数并更新
-        # total_chunks = len(file_chunks)
-        # for chunk in file_chunks:
-        #     chunk['total_chunks'] = total_chunks
-        
-        # 按块索引排序
-        file_chunks.sort(key=lambda x: int(x['chunk_index']) if x['chunk_index'] else 0)
+        for doc in rag.docs.get_file_chunks(file_path):
+            # 将文档转换为新的格式
+            chunk_info = {
+                'file_path': doc.get('file_path', ''),
+                'chunk_index': doc.get('chunk_index', 0),
+                'chunk_content': doc.get('chunk_content', ''),
+                'total_chunks': doc.get('total_chunks', '')
+            }
+            file_chunks.append(chunk_info)
         
         return jsonify({
             'status': 'success',
             'chunks': file_chunks
         })
     
+    except ComponentUnavailable:
+        raise
     except Exception as e:
         print(f"获取文档分块失败: {e}")
         return jsonify({
@@ -584,57 +885,20 @@ def update_chunk():
                 'message': '缺少必要参数'
             }), 400
         
-        # 确保文件路径是绝对路径
-        file_path = os.path.abspath(file_path)
-        
-        # 读取元数据文件
-        metadata_path = rag._get_metadata_path()
-        if not metadata_path.exists():
-            return jsonify({
-                'status': 'error',
-                'message': '元数据文件不存在'
-            }), 404
-        
-        with open(metadata_path, "r", encoding="utf-8") as f:
-            metadata = json.load(f)
-        
-        # 更新指定的分块内容
-        updated = False
-        for doc in metadata:
-            if doc.get('file_path') == file_path and str(doc.get('chunk_index')) == str(chunk_index):
-                doc['chunk_content'] = chunk_content
-                doc['chunk_summary'] = rag._generate_chunk_summary(chunk_content)
-                tmp_chunk_summary = doc['chunk_summary']
-                updated = True
-                break
-        
-        if not updated:
+        # 在写锁内定位并更新这一行，仅重建修改的分块向量（摘要生成失败时留空，由后台补充）
+        if not rag.update_chunk(file_path, int(chunk_index), chunk_content):
             return jsonify({
                 'status': 'error',
                 'message': '未找到指定的分块'
             }), 404
         
-        # 保存更新后的元数据文件
-        with open(metadata_path, "w", encoding="utf-8") as f:
-            json.dump(metadata, f, ensure_ascii=False, indent=4)
-        
-        # 确保内存中的数据与文件同步
-        for doc in rag.docs:
-            if doc.get('file_path') == file_path and str(doc.get('chunk_index')) == str(chunk_index):
-                doc['chunk_content'] = chunk_content
-                doc['chunk_summary'] = tmp_chunk_summary
-                break
-        
-        
-        # 仅重建修改的分块向量
-        chunk_index_int = int(chunk_index)
-        rag.rebuild_vector_db(file_path=file_path, chunk_indices=[chunk_index_int])
-        
         return jsonify({
             'status': 'success',
             'message': '分块内容已更新并重建向量库'
         })
     
+    except ComponentUnavailable:
+        raise
     except Exception as e:
         print(f"更新分块内容失败: {e}")
         return jsonify({
@@ -658,58 +922,14 @@ def delete_document():
         # 确保文件路径是绝对路径
         file_path = os.path.abspath(file_path)
         
-        # 读取元数据文件
-        metadata_path = rag._get_metadata_path()
-        if not metadata_path.exists():
-            return jsonify({
-                'status': 'error',
-                'message': '元数据文件不存在'
-            }), 404
-        
-        # 读取元数据
-        with open(metadata_path, "r", encoding="utf-8") as f:
-            metadata = json.load(f)
-        
-        # 从元数据中过滤掉要删除的文件
-        original_length = len(metadata)
-        filtered_metadata = [doc for doc in metadata if doc.get('file_path') != file_path]
-        removed_count = original_length - len(filtered_metadata)
-        
+        # 删除该文件的分块及对应向量
+        removed_count = rag.delete_document(file_path)
         if removed_count == 0:
             return jsonify({
                 'status': 'error',
                 'message': '未找到指定的文件'
             }), 404
         
-        # 保存更新后的元数据
-        with open(metadata_path, "w", encoding="utf-8") as f:
-            json.dump(filtered_metadata, f, ensure_ascii=False, indent=4)
-        
-        # 更新内存中的元数据和向量
-        # 找出要删除的文档索引
-        doc_indices_to_remove = []
-        for i, doc in enumerate(rag.docs):
-            if doc.get('file_path') == file_path:
-                doc_indices_to_remove.append(i)
-        
-        # 从内存中删除文档
-        rag.docs = [doc for i, doc in enumerate(rag.docs) if i not in doc_indices_to_remove]
-        
-        # 如果有向量数据，也需要更新
-        if rag.doc_vectors is not None and len(rag.doc_vectors) > 0:
-            # 转换为列表操作更容易
-            vectors_list = rag.doc_vectors.tolist()
-            vectors_list = [vec for i, vec in enumerate(vectors_list) if i not in doc_indices_to_remove]
-            # 如果没有剩余向量，设为None，否则转回numpy数组
-            if not vectors_list:
-                rag.doc_vectors = None
-            else:
-                rag.doc_vectors = np.array(vectors_list)
-            
-            # 保存更新后的向量
-            if rag._get_vector_path().exists():
-                np.save(rag._get_vector_path(), rag.doc_vectors)
-        
         # 删除原始文件
         if os.path.exists(file_path):
             os.remove(file_path)
@@ -720,6 +940,8 @@ def delete_document():
             'removed_chunks': removed_count
         })
         
+    except ComponentUnavailable:
+        raise
     except Exception as e:
         print(f"删除文档失败: {e}")
         return jsonify({
@@ -747,6 +969,8 @@ def open_documents_folder():
             'status': 'success',
             'message': f'已打开文件夹: {document_path}'
         })
+    except ComponentUnavailable:
+        raise
     except Exception as e:
         return jsonify({
             'status': 'error',
@@ -784,3 +1008,23 @@ def agent_chat():
             'status': 'error',
             'message': str(e)
         }), 500
+
+@api.route('/chat/agent/stream', methods=['POST'])
+def agent_chat_stream():
+    """Agent 对话的流式版本（Server-Sent-Events），工具调用在回复生成完毕后执行，结果随 done 事件返回"""
+    disabled = _streaming_disabled()
+    if disabled:
+        return disabled
+    data = request.get_json() or {}
+    message = data.get('message', '')
+
+    def events():
+        for event in agent.run_stream(message):
+            if event['type'] == 'delta':
+                yield _sse('delta', {'content': event['content']})
+            else:
+                yield _sse('done', {
+                    'status': 'success',
+                    'response': event['response']
+                })
+    return _sse_response(events())
@@ -0,0 +1,276 @@
+"""
+异步接口（Quart 蓝图）
+与 api_routes 中调用 LLM 的接口路径、参数与返回格式相同，由 ASGI 应用（utils/webui/asgi_app.py）挂载在 Flask 应用之前：
+- 等待 Ollama 响应（包括流式输出）时不占用线程，单个进程可以同时保持大量流式对话
+- 检索、重排序与 Agent 工具调用仍是同步代码，在有界线程池中执行，只在执行期间占用线程
+- 客户端断开时协程被取消，正在读取的 LLM 流式响应随之关闭并释放并发名额
+"""
+import asyncio
+import functools
+import time
+from concurrent.futures import ThreadPoolExecutor
+from quart import Blueprint, Response, jsonify, request
+from utils.base_func import acall_language_model, astream_language_model
+from utils.component_manager import ComponentUnavailable
+from utils.load_config import configs
+from utils.rag.filters import MetadataFilter
+from utils.rag.registry import rag_component
+from .api_routes import (agent, startup_config, _sse, _streaming_enabled, _latex_marks,
+                         _related_questions_prompt, _parse_related_questions)
+
+async_api = Blueprint('async_api', __name__)
+
+asgi_config = configs['webui'].get('asgi') or {}
+# 检索、重排序、工具调用等阻塞操作使用的线程池
+_blocking_executor = ThreadPoolExecutor(max_workers=asgi_config.get('blocking_threads', 16),
+                                        thread_name_prefix='asgi-blocking')
+
+
+async def run_blocking(func, *args, **kwargs):
+    """在线程池中执行阻塞函数并等待结果，不阻塞事件循环"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_blocking_executor, functools.partial(func, *args, **kwargs))
+
+
+async def _get_rag():
+    """获取共享的 Rag 实例；加载中时在线程池中等待（最多 wait_timeout 秒），不阻塞事件循环"""
+    if rag_component.ready:
+        return rag_component.get()
+    return await run_blocking(rag_component.get, startup_config.get('wait_timeout', 120))
+
+
+def _streaming_disabled():
+    """webui.features.enable_streaming 关闭时，流式接口返回错误响应"""
+    if _streaming_enabled():
+        return None
+    return jsonify({
+        'status': 'error',
+        'message': '流式响应未启用'
+    }), 403
+
+
+def _sse_response(events) -> Response:
+    """以 text/event-stream 返回异步事件流，格式与 api_routes._sse_response 相同"""
+    async def guarded():
+        try:
+            async for event in events:
+                yield event
+        except Exception as e:
+            yield _sse('error', {'status': 'error', 'message': str(e)})
+    response = Response(guarded(), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'  # 关闭 nginx 代理缓冲
+    })
+    # 流式对话可能持续数分钟
+    response.timeout = None
+    return response
+
+
+def _parse_filters(data):
+    """
+    解析请求中的元数据过滤条件
+    :return: (MetadataFilter 或 None, 错误响应或 None)
+    """
+    try:
+        return MetadataFilter.from_dict(data.get('filters')), None
+    except ValueError as e:
+        return None, (jsonify({
+            'status': 'error',
+            'message': f'无效的过滤条件: {str(e)}'
+        }), 400)
+
+
+@async_api.errorhandler(ComponentUnavailable)
+async def handle_component_unavailable(e):
+    """组件加载中或加载失败时返回 503，客户端可稍后重试"""
+    return jsonify({
+        'status': 'error',
+        'message': str(e)
+    }), 503
+
+
+@async_api.route('/chat_completions', methods=['POST'])
+async def chat_completions():
+    """与聊天模型进行交互（温度按请求传入，不修改全局配置）"""
+    data = await request.get_json() or {}
+    message = data.get('message', '')
+    temperature = data.get('temperature', 0.7)
+    model_name = data.get('model', configs['ollama']['default_model'])
+    system_prompt = data.get('system_prompt', '')
+
+    try:
+        response = await acall_language_model(message, system_prompt=system_prompt, model=model_name,
+                                              temperature=temperature)
+        return jsonify({
+            'status': 'success',
+            'response': response,
+            'model': model_name,
+            'latex': _latex_marks(response)  # 公式检测
+        })
+    except Exception as e:
+        return jsonify({
+            'status': 'error',
+            'message': str(e)
+        }), 500
+
+
+@async_api.route('/chat_completions/stream', methods=['POST'])
+async def chat_completions_stream():
+    """/chat_completions 的流式版本（Server-Sent-Events），<think> 段落在推送前移除"""
+    disabled = _streaming_disabled()
+    if disabled:
+        return disabled
+    data = await request.get_json() or {}
+    message = data.get('message', '')
+    temperature = data.get('temperature', 0.7)
+    model_name = data.get('model', configs['ollama']['default_model'])
+    system_prompt = data.get('system_prompt', '')
+
+    async def events():
+        response = ''
+        async for delta in astream_language_model(message, system_prompt=system_prompt, model=model_name,
+                                                   temperature=temperature):
+            response += delta
+            yield _sse('delta', {'content': delta})
+        yield _sse('done', {
+            'status': 'success',
+            'response': response,
+            'model': model_name,
+            'latex': _latex_marks(response)  # 公式检测
+        })
+    return _sse_response(events())
+
+
+@async_api.route('/related_questions', methods=['POST'])
+async def related_questions():
+    """获取与用户提供的问题相关的问题列表"""
+    data = await request.get_json() or {}
+    question = data.get('question', '')
+    count = data.get('count', 3)  # 默认返回3个相关问题
+
+    try:
+        response = await acall_language_model(question, system_prompt=_related_questions_prompt(count))
+        questions = _parse_related_questions(response)
+        if len(questions) < 1:
+            return jsonify({
+                'status': 'error',
+                'message': '无法生成相关问题'
+            }), 500
+        return jsonify({
+            'status': 'success',
+            'questions': questions
+        })
+    except Exception as e:
+        return jsonify({
+            'status': 'error',
+            'message': str(e)
+        }), 500
+
+
+@async_api.route('/chat/rag/prompt', methods=['POST'])
+async def get_rag_prompt():
+    """获取完整的 RAG prompt（查询增强调用 LLM 时等待不占用线程，检索与重排序在线程池中执行）"""
+    data = await request.get_json() or {}
+    message = data.get('message', '')
+    is_image = data.get('is_image', False)
+    top_k = data.get('top_k', 3)
+    filters, error = _parse_filters(data)
+    if error:
+        return error
+    rag = await _get_rag()
+    try:
+        start_time = time.time()
+        enhanced_question = await rag._aquery_enhance(message)
+        prompt = await run_blocking(rag.generate_prompt, enhanced_question, is_image=is_image, top_k=top_k,
+                                    cache_label='/chat/rag/prompt', filters=filters)
+        return jsonify({
+            'status': 'success',
+            'context': prompt,
+            'processing_time': time.time() - start_time  # 返回处理时间，用于监控性能
+        })
+    except Exception as e:
+        return jsonify({
+            'status': 'error',
+            'message': str(e)
+        }), 500
+
+
+@async_api.route('/chat/rag/stream', methods=['POST'])
+async def rag_chat_stream():
+    """
+    RAG 对话的流式版本（Server-Sent-Events）：检索并生成提示后先推送 context 事件，
+    再以提示作为系统提示流式调用 LLM
+    """
+    disabled = _streaming_disabled()
+    if disabled:
+        return disabled
+    data = await request.get_json() or {}
+    message = data.get('message', '')
+    is_image = data.get('is_image', False)
+    top_k = data.get('top_k', 3)
+    temperature = data.get('temperature')
+    model_name = data.get('model')
+    filters, error = _parse_filters(data)
+    if error:
+        return error
+    rag = await _get_rag()
+
+    async def events():
+        start_time = time.time()
+        enhanced_question = await rag._aquery_enhance(message)
+        prompt = await run_blocking(rag.generate_prompt, enhanced_question, is_image=is_image, top_k=top_k,
+                                    cache_label='/chat/rag/stream', filters=filters)
+        yield _sse('context', {
+            'context': prompt,
+            'processing_time': time.time() - start_time
+        })
+        response = ''
+        async for delta in astream_language_model(message, system_prompt=prompt, model=model_name,
+                                                   temperature=temperature):
+            response += delta
+            yield _sse('delta', {'content': delta})
+        yield _sse('done', {
+            'status': 'success',
+            'response': response
+        })
+    return _sse_response(events())
+
+
+@async_api.route('/chat/agent', methods=['POST'])
+async def agent_chat():
+    """Agent 对话接口"""
+    data = await request.get_json() or {}
+    message = data.get('message', '')
+
+    try:
+        response = await agent.arun(message)
+        return jsonify({
+            'status': 'success',
+            'response': response,
+        })
+    except Exception as e:
+        return jsonify({
+            'status': 'error',
+            'message': str(e)
+        }), 500
+
+
+@async_api.route('/chat/agent/stream', methods=['POST'])
+async def agent_chat_stream():
+    """Agent 对话的流式版本（Server-Sent-Events），工具调用在回复生成完毕后执行，结果随 done 事件返回"""
+    disabled = _streaming_disabled()
+    if disabled:
+        return disabled
+    data = await request.get_json() or {}
+    message = data.get('message', '')
+
+    async def events():
+        async for event in agent.arun_stream(message):
+            if event['type'] == 'delta':
+                yield _sse('delta', {'content': event['content']})
+            else:
+                yield _sse('done', {
+                    'status': 'success',
+                    'response': event['response']
+                })
+    return _sse_response(events())
@@ -39,8 +39,11 @@ function setupChunksManager() {
             
             const data = await response.json();
             if (data.status === 'success') {
-                addMessage('文件上传成功！', 'system');
-                loadDocuments();  // 重新加载文档列表
+                addMessage('文件上传成功，正在后台入库...', 'system');
+                if (data.job_id) {
+                    await waitForJob(data.job_id);
+                }
+                loadDocumentsList();  // 重新加载文档列表
             } else {
                 addMessage('文件上传失败：' + data.message, 'error');
             }
@@ -50,6 +53,37 @@ function setupChunksManager() {
         }
     }
 
+    // 轮询后台入库任务，直到任务结束
+    async function waitForJob(jobId) {
+        while (true) {
+            await new Promise(resolve => setTimeout(resolve, 2000));
+            let job;
+            try {
+                const response = await fetch(`/api/jobs/${jobId}`);
+                const data = await response.json();
+                if (data.status !== 'success') return;
+                job = data.job;
+            } catch (error) {
+                console.error('查询入库任务失败:', error);
+                return;
+            }
+            const progress = job.progress;
+            console.log(`入库进度: 文件 ${progress.files.done}/${progress.files.total}, ` +
+                `页 ${progress.parse.pages}/${progress.parse.pages_total}, 图片 ${progress.parse.images}, ` +
+                `摘要 ${progress.summary.summarised}, 向量化 ${progress.embed.embedded}`);
+            if (job.status === 'completed') {
+                addMessage(`入库完成：新增 ${job.result.added} 个，更新 ${job.result.updated} 个，失败 ${job.result.failed} 个文件`, 'system');
+                return;
+            } else if (job.status === 'failed') {
+                addMessage('入库失败：' + job.error, 'error');
+                return;
+            } else if (job.status === 'cancelled') {
+                addMessage('入库任务已取消', 'system');
+                return;
+            }
+        }
+    }
+
     // 加载文档列表
     loadDocumentsList();
     